@@ -5,12 +5,10 @@ Flask应用 - 微信机器人
 
 import os
 import sys
+import json
 import time
-import threading
 import logging
-import base64
-import hashlib
-import struct
+import hmac
 from pathlib import Path
 from datetime import datetime
 from typing import Optional
@@ -23,311 +21,157 @@ sys.path.insert(0, str(project_root))
 
 # 导入wxbot模块
 from src.wx_stockbot.config import WeChatConfig, DEFAULT_CONFIG
+from src.wx_stockbot.config_manager import ConfigSnapshot, RESTART_FIELDS, changed_fields, create_config_manager
 from src.wx_stockbot.bot import WeChatBot
+from src.wx_stockbot.scheduler import IntervalSchedule
 from src.wx_stockbot.client import WeChatClient
-
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+from src.wx_stockbot.dispatcher import DispatchQueueFull, DispatcherStopped
+from src.wx_stockbot.ingress import IngressPipeline, IngressQueueFull, IngressStopped, Envelope
+from src.wx_stockbot.crypto import WeChatCryptoError, generate_signature
+from src.wx_stockbot.callback_xml import parse_callback_xml, CallbackXMLError
+from src.wx_stockbot.reply import Reply, build_text_reply_xml
+from src.wx_stockbot.dedup import create_dedup_cache, dedup_key
+from src.wx_stockbot.metrics import REGISTRY, CALLBACKS, QUEUE_DEPTH, stage, default_metrics_dir
+from src.wx_stockbot.logs import PIPELINE as LOG_PIPELINE, setup_logging_from_env
+from src.wx_stockbot.startup import Startup
+
+# 配置日志（默认经队列由后台线程输出，见WECHAT_LOG_*环境变量）
+setup_logging_from_env()
 logger = logging.getLogger(__name__)
 
-# 尝试导入AES解密
-try:
-    # 使用pyaes进行AES解密
-    import pyaes
-    import base64
-    import struct
-    import hashlib
-    import hmac
-    WECHAT_CRYPTO_AVAILABLE = True
-    logger.info("pyaes AES模块可用")
-except ImportError as e:
-    WECHAT_CRYPTO_AVAILABLE = False
-    logger.error(f"pyaes AES模块导入失败: {e}")
-    logger.error("请确保pyaes已正确安装")
-
-def decrypt_echostr_simple(echostr, encoding_aes_key, corpid):
-    """使用pyaes解密企业微信的echostr"""
-    try:
-        logger.info("开始解密...")
-        
-        # 检查模块是否可用
-        if not WECHAT_CRYPTO_AVAILABLE:
-            logger.error("pyaes AES模块不可用")
-            return echostr
-        
-        # Base64解码
-        encrypted_data = base64.b64decode(echostr)
-        logger.info(f"Base64解码成功，数据长度: {len(encrypted_data)}")
-        
-        # 获取AES密钥
-        aes_key = base64.b64decode(encoding_aes_key + "=")
-        logger.info(f"AES密钥长度: {len(aes_key)}")
-        
-        # 使用前16字节作为IV（企业微信标准）
-        iv = encrypted_data[:16]
-        logger.info(f"IV: {iv.hex()}")
-        
-        # 提取加密数据（从第16字节开始）
-        ciphertext = encrypted_data[16:]
-        logger.info(f"加密数据长度: {len(ciphertext)}")
-        
-        # AES解密
-        def aes_decrypt(ciphertext, key, iv):
-            aes = pyaes.AESModeOfOperationCBC(key, iv=iv)
-            decrypted = b''
-            for i in range(0, len(ciphertext), 16):
-                block = ciphertext[i:i+16]
-                if len(block) == 16:
-                    decrypted += aes.decrypt(block)
-            return decrypted
-        
-        # PKCS7去填充
-        def pkcs7_unpad(data):
-            pad_len = data[-1]
-            if pad_len <= 16 and pad_len > 0:
-                # 验证填充
-                padding_bytes = data[-pad_len:]
-                if all(b == pad_len for b in padding_bytes):
-                    return data[:-pad_len]
-            return data
-        
-        # 执行解密
-        decrypted = aes_decrypt(ciphertext, aes_key, iv)
-        logger.info(f"AES解密成功，数据长度: {len(decrypted)}")
-        
-        # 去填充
-        unpadded = pkcs7_unpad(decrypted)
-        logger.info(f"去填充后数据长度: {len(unpadded)}")
-        
-        # 解析消息格式：跳过前16字节随机数，直接解析XML
-        if len(unpadded) < 16:
-            logger.error("解密数据长度不足")
-            return echostr
-        
-        # 跳过前16字节随机数，直接解析XML内容
-        xml_content = unpadded[16:].decode('utf-8')
-        logger.info(f"XML内容: {xml_content}")
-        
-        # 验证企业ID是否在XML中
-        if corpid in xml_content:
-            logger.info("企业ID验证成功")
-            return xml_content
-        else:
-            logger.error(f"企业ID验证失败: 期望='{corpid}'")
-            return echostr
-            
-    except Exception as e:
-        logger.error(f"解密异常: {e}")
-        import traceback
-        logger.error(f"详细错误: {traceback.format_exc()}")
-        return echostr
-
-
-def decrypt_message(encrypted_msg, msg_signature, timestamp, nonce, token, encoding_aes_key, corpid):
-    """解密企业微信消息"""
-    try:
-        # 验证签名
-        signature = generate_signature(token, timestamp, nonce, encrypted_msg)
-        if signature != msg_signature:
-            logger.error(f"签名验证失败: 期望={msg_signature}, 实际={signature}")
-            return None
-        
-        # 解密消息
-        aes_key = base64.b64decode(encoding_aes_key + "=")
-        encrypted_data = base64.b64decode(encrypted_msg)
-        
-        # 使用pyaes进行AES解密（CBC模式）
-        # 提取IV（前16字节）
-        iv = encrypted_data[:16]
-        ciphertext = encrypted_data[16:]
-        
-        # 创建AES解密器
-        cipher = pyaes.AESModeOfOperationCBC(aes_key, iv=iv)
-        
-        # 解密
-        decrypted_data = b''
-        for i in range(0, len(ciphertext), 16):
-            block = ciphertext[i:i+16]
-            if len(block) == 16:
-                decrypted_block = cipher.decrypt(block)
-                decrypted_data += decrypted_block
-        
-        # 去除PKCS7填充
-        padding_len = decrypted_data[-1]
-        if padding_len <= 16:
-            decrypted_data = decrypted_data[:-padding_len]
-        
-        # 提取XML内容
-        # 直接查找XML标签，避免消息长度解析问题
-        xml_start = decrypted_data.find(b'<xml>')
-        if xml_start != -1:
-            xml_end = decrypted_data.find(b'</xml>', xml_start)
-            if xml_end != -1:
-                xml_content = decrypted_data[xml_start:xml_end+6].decode('utf-8')
-                return xml_content
-        
-        # 如果找不到XML标签，尝试使用消息长度解析
-        if len(decrypted_data) >= 20:
-            msg_len = struct.unpack("!I", decrypted_data[16:20])[0]
-            if msg_len <= len(decrypted_data) - 20:
-                xml_content = decrypted_data[20:20+msg_len].decode('utf-8')
-                return xml_content
-        
-        logger.error("无法提取XML内容")
-        return None
-            
-    except Exception as e:
-        logger.error(f"解密消息异常: {e}")
-        return None
-
+# 配置快照：启动时解析一次，收到SIGHUP或WECHAT_CONFIG_FILE变化时整体替换
+config_manager = create_config_manager(fallback=DEFAULT_CONFIG)
+if not config_manager.current().valid:
+    logger.info("请设置以下环境变量:")
+    logger.info("WECHAT_CORPID - 企业ID")
+    logger.info("WECHAT_CORPSECRET - 应用Secret")
+    logger.info("WECHAT_AGENTID - 应用AgentId")
+    logger.info("WECHAT_USER_IDS - 用户ID列表（逗号分隔）")
 
-def generate_signature(token, timestamp, nonce, encrypted_msg):
-    """生成签名"""
-    try:
-        # 按字典序排序
-        params = [token, timestamp, nonce, encrypted_msg]
-        params.sort()
-        
-        # 拼接字符串
-        string_to_sign = ''.join(params)
-        
-        # SHA1哈希
-        import hashlib
-        signature = hashlib.sha1(string_to_sign.encode('utf-8')).hexdigest()
-        
-        return signature
-        
-    except Exception as e:
-        logger.error(f"生成签名异常: {e}")
-        return None
 
+# 回调处理各阶段的耗时直方图
+SIGNATURE_SECONDS = stage("signature")
+DECRYPT_SECONDS = stage("decrypt")
+XML_PARSE_SECONDS = stage("xml_parse")
+DISPATCH_SECONDS = stage("dispatch")
 
 # 创建Flask应用
 app = Flask(__name__)
 
 # 全局变量
 bot = None
-timer_thread = None
-running = False
 
-# 应用启动时初始化机器人
-def initialize_bot():
-    """初始化机器人"""
-    global bot
-    if bot is None:
-        logger.info("初始化微信机器人...")
-        if init_bot():
-            # 暂时关闭定时发送
-            # start_timer()
-            logger.info("机器人初始化成功，定时发送已关闭")
-        else:
-            logger.error("机器人初始化失败")
-
-# 在第一个请求时初始化
-_initialized = False
+# 每分钟发送"1"的定时任务ID
+APP_TIMER_JOB = "app_timer"
 
-@app.before_request
-def before_request():
-    """在每个请求前检查是否需要初始化"""
-    global _initialized
-    if not _initialized:
-        initialize_bot()
-        _initialized = True
+# 启动预热：worker导入应用时在后台初始化，请求不承担初始化；完成前 /ready 返回503
+startup = Startup()
+# 回调处理线程等待机器人创建的最长时间（秒）
+BOT_WAIT_SECONDS = 10
 
 
 def load_config() -> WeChatConfig:
-    """加载配置"""
-    # 尝试从环境变量加载
-    config = WeChatConfig.from_env()
-    
-    if config.validate():
-        logger.info("从环境变量加载配置成功")
-        return config
-    
-    # 使用默认配置
-    logger.warning("环境变量配置不完整，使用默认配置")
-    logger.info("请设置以下环境变量:")
-    logger.info("WECHAT_CORPID - 企业ID")
-    logger.info("WECHAT_CORPSECRET - 应用Secret")
-    logger.info("WECHAT_AGENTID - 应用AgentId")
-    logger.info("WECHAT_USER_IDS - 用户ID列表（逗号分隔）")
-    
-    return DEFAULT_CONFIG
+    """当前配置（配置不完整时为默认配置）"""
+    return config_manager.config
+
+
+def on_config_change(old: ConfigSnapshot, new: ConfigSnapshot):
+    """配置热加载：更新机器人配置；机器人因配置不完整未初始化时，配置补全后立即初始化"""
+    restart = [name for name in changed_fields(old.config, new.config) if name in RESTART_FIELDS]
+    if restart:
+        logger.warning(f"以下配置需要重启worker后生效: {', '.join(restart)}")
+    if bot:
+        bot.apply_config(new.config)
+    elif new.valid:
+        # 机器人因配置不完整未创建：立即重试启动步骤
+        startup.wake()
+
 
+config_manager.add_listener(on_config_change)
+config_manager.install_signal_handler()
+config_manager.start()
 
-def init_bot():
-    """初始化机器人"""
+
+def init_bot() -> WeChatBot:
+    """创建机器人（不访问企业微信接口），配置不完整时抛出异常由启动预热重试"""
     global bot
     
-    # 加载配置
     config = load_config()
-    
     if not config.validate():
-        logger.error("配置验证失败，请检查配置")
-        return False
+        raise RuntimeError("配置验证失败，请检查WECHAT_CORPID、WECHAT_CORPSECRET、WECHAT_AGENTID")
     
-    # 创建机器人
-    bot = WeChatBot(config)
-    
-    # 测试连接
-    logger.info("测试企业微信连接...")
-    test_success = bot.send_message("机器人启动测试")
-    if test_success:
-        logger.info("连接测试成功")
-        return True
-    else:
-        logger.error("连接测试失败，请检查配置")
+    logger.info("初始化微信机器人...")
+    new_bot = WeChatBot(config)
+    new_bot.register_job_type(
+        APP_TIMER_JOB,
+        lambda spec: (send_timer_message, IntervalSchedule(spec["interval"], spec.get("anchor")), {})
+    )
+    bot = new_bot
+    return bot
+
+
+def warm_token() -> dict:
+    """获取访问令牌（同时验证企业凭证），之后由后台线程在到期前刷新"""
+    expires_in = bot.client.warm_token()
+    bot.client.start_token_refresher()
+    logger.info("企业微信连接正常，访问令牌剩余 %d 秒", expires_in)
+    return {"expires_in": expires_in}
+
+
+def warm_crypto() -> bool:
+    """用当前快照的加解密器做一次加解密，提前完成加密后端的初始化；未配置加密时返回False"""
+    crypto = config_manager.current().crypto
+    if crypto is None:
         return False
+    if crypto.decrypt(crypto.encrypt("<xml></xml>")) != b"<xml></xml>":
+        raise RuntimeError("加解密自检失败")
+    return True
+
+
+def shutdown():
+    """worker退出前按依赖顺序停止：先处理完已入队的回调（回复会放入发送队列），
+    再停止调度线程和发送队列（提交发件箱中已完成的确认），最后释放主节点锁、停止令牌刷新并关闭连接池"""
+    ingress.stop()
+    if bot:
+        bot.scheduler.stop()
+        bot.dispatcher.stop()
+        bot.leader.stop()
+        bot.client.close()
+    config_manager.stop()
+    LOG_PIPELINE.stop()
+
+
+def timer_running() -> bool:
+    """定时发送是否已启动"""
+    return bot is not None and bot.scheduler.has_job(APP_TIMER_JOB)
 
 
 def start_timer():
     """启动定时发送功能"""
-    global timer_thread, running
+    if not bot:
+        logger.warning("机器人未初始化，无法启动定时发送")
+        return
     
-    if running:
+    if timer_running():
         logger.warning("定时发送已在运行中")
         return
     
-    running = True
-    timer_thread = threading.Thread(target=timer_loop, daemon=True)
-    timer_thread.start()
+    # 由机器人的调度器按固定节奏触发，多worker时只在主节点发送
+    bot.add_job(APP_TIMER_JOB, {"type": APP_TIMER_JOB, "interval": 60, "anchor": time.time()})
     logger.info("启动定时发送功能（每分钟发送'1'）")
 
 
 def stop_timer():
     """停止定时发送功能"""
-    global running
-    running = False
-    if timer_thread:
-        timer_thread.join(timeout=5)
+    if bot:
+        bot.remove_job(APP_TIMER_JOB)
     logger.info("停止定时发送")
 
 
-def timer_loop():
-    """定时发送循环"""
-    global running, bot
-    
-    while running:
-        try:
-            if bot:
-                # 发送定时消息
-                success = bot.send_message("1")
-                if success:
-                    logger.info(f"定时消息发送成功: {datetime.now()}")
-                else:
-                    logger.error("定时消息发送失败")
-            else:
-                logger.warning("机器人未初始化，跳过定时发送")
-            
-            # 等待下次发送
-            time.sleep(60)  # 60秒 = 1分钟
-            
-        except Exception as e:
-            logger.error(f"定时发送异常: {e}")
-            time.sleep(60)
+def send_timer_message():
+    """发送定时消息（经发件箱异步发送，失败时重试）"""
+    job = bot.send_message_async("1")
+    logger.debug("定时消息已提交: %s (%s)", datetime.now(), job.job_id)
 
 
 # Flask路由
@@ -343,12 +187,12 @@ def index():
         
         # 如果包含企业微信验证参数，则进行验证
         if all([msg_signature, timestamp, nonce, echostr]):
-            logger.info("根路径收到企业微信验证请求，转发到verify_url")
+            logger.debug("根路径收到企业微信验证请求，转发到verify_url")
             return verify_url(request)
     
     elif request.method == 'POST':
         # 处理企业微信POST消息
-        logger.info("根路径收到企业微信POST消息，转发到handle_message")
+        logger.debug("根路径收到企业微信POST消息，转发到handle_message")
         return handle_message(request)
     
     # 否则显示主页
@@ -407,7 +251,10 @@ def index():
                 <ul>
                     <li><strong>GET /</strong> - 主页（同时处理企业微信验证）</li>
                     <li><strong>GET /status</strong> - 获取机器人状态</li>
+                    <li><strong>GET /metrics</strong> - Prometheus指标</li>
                     <li><strong>POST /send</strong> - 发送消息</li>
+                    <li><strong>GET /send/&lt;job_id&gt;</strong> - 查询发送任务</li>
+                    <li><strong>POST /config/reload</strong> - 重新加载配置</li>
                     <li><strong>POST /webhook</strong> - 企业微信回调</li>
                 </ul>
             </div>
@@ -458,7 +305,7 @@ def index():
 def status():
     """获取机器人状态"""
     if bot:
-        return jsonify(bot.get_status())
+        return jsonify({**bot.get_status(), 'ingress': ingress.get_status(), 'dedup': dedup.get_status()})
     else:
         return jsonify({
             "running": False,
@@ -483,14 +330,35 @@ def send_message():
         if not bot:
             return jsonify({'error': '机器人未初始化'}), 500
         
-        success = bot.send_message(content, user_ids)
-        return jsonify({'success': success})
+        # 放入发送队列后立即返回任务ID；wait=true时等待发送结果
+        job = bot.send_message_async(content, user_ids, data.get('msgtype', 'text'))
+        if data.get('wait'):
+            success = job.future.result(timeout=float(data.get('timeout', 30)))
+            return jsonify({'success': success, 'job_id': job.job_id})
         
+        return jsonify({'success': True, 'job_id': job.job_id, 'status': job.status}), 202
+        
+    except (DispatchQueueFull, DispatcherStopped) as e:
+        logger.error(f"发送队列不可用: {e}")
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         logger.error(f"发送消息异常: {e}")
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/send/<job_id>', methods=['GET'])
+def send_status(job_id):
+    """查询发送任务状态"""
+    if not bot:
+        return jsonify({'error': '机器人未初始化'}), 500
+    
+    job = bot.dispatcher.get_job(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在或已过期'}), 404
+    
+    return jsonify(job.to_dict())
+
+
 @app.route('/timer/start', methods=['POST'])
 def start_timer_route():
     """启动定时发送"""
@@ -513,12 +381,20 @@ def stop_timer_route():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/config/reload', methods=['POST'])
+def reload_config_route():
+    """重新加载配置（与向worker发送SIGHUP相同，只作用于处理该请求的worker）"""
+    try:
+        changed = config_manager.reload()
+        return jsonify({'success': True, 'changed': changed, 'config': config_manager.get_status()})
+    except Exception as e:
+        logger.error(f"重新加载配置异常: {e}")
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/webhook', methods=['GET', 'POST'])
 def webhook():
-    """企业微信回调接口"""
-    if not bot:
-        return jsonify({'error': '机器人未初始化'}), 500
-    
+    """企业微信回调接口（启动预热期间照常应答，消息入队后由处理线程等待机器人创建）"""
     if request.method == 'GET':
         # 验证回调URL
         return verify_url(request)
@@ -583,27 +459,33 @@ def test_message():
         return jsonify({'error': str(e)}), 500
 
 
+def log_env_vars():
+    """调试：输出企业微信相关环境变量（隐藏敏感信息）"""
+    wechat_env_vars = [
+        'WECHAT_CORPID', 'WECHAT_CORPSECRET', 'WECHAT_AGENTID', 
+        'WECHAT_USER_IDS', 'WECHAT_TOKEN', 'WECHAT_ENCODING_AES_KEY'
+    ]
+    lines = []
+    for var in wechat_env_vars:
+        value = os.getenv(var)
+        if value:
+            # 隐藏敏感信息
+            if 'SECRET' in var or 'TOKEN' in var or 'KEY' in var:
+                display_value = value[:8] + '*' * (len(value) - 8)
+            else:
+                display_value = value
+            lines.append(f"  {var}: {display_value}")
+        else:
+            lines.append(f"  {var}: 未设置")
+    logger.debug("环境变量调试信息:\n" + "\n".join(lines))
+
+
 def verify_url(request):
     """验证回调URL - 企业微信验证接口"""
     try:
-        # 调试：检查所有环境变量
-        logger.info("=== 环境变量调试信息 ===")
-        wechat_env_vars = [
-            'WECHAT_CORPID', 'WECHAT_CORPSECRET', 'WECHAT_AGENTID', 
-            'WECHAT_USER_IDS', 'WECHAT_TOKEN', 'WECHAT_ENCODING_AES_KEY'
-        ]
-        for var in wechat_env_vars:
-            value = os.getenv(var)
-            if value:
-                # 隐藏敏感信息
-                if 'SECRET' in var or 'TOKEN' in var or 'KEY' in var:
-                    display_value = value[:8] + '*' * (len(value) - 8)
-                else:
-                    display_value = value
-                logger.info(f"  {var}: {display_value}")
-            else:
-                logger.info(f"  {var}: 未设置")
-        logger.info("=== 环境变量调试结束 ===")
+        # 调试信息只在DEBUG级别时生成
+        if logger.isEnabledFor(logging.DEBUG):
+            log_env_vars()
         
         # 获取企业微信验证参数
         msg_signature = request.args.get('msg_signature', '')
@@ -611,36 +493,24 @@ def verify_url(request):
         nonce = request.args.get('nonce', '')
         echostr = request.args.get('echostr', '')
         
-        logger.info(f"收到企业微信URL验证请求:")
-        logger.info(f"  msg_signature: {msg_signature}")
-        logger.info(f"  timestamp: {timestamp}")
-        logger.info(f"  nonce: {nonce}")
-        logger.info(f"  echostr: {echostr}")
+        logger.debug("收到企业微信URL验证请求: msg_signature=%s timestamp=%s nonce=%s echostr=%s",
+                     msg_signature, timestamp, nonce, echostr)
         
         # 检查必要参数
         if not all([msg_signature, timestamp, nonce, echostr]):
             logger.warning("URL验证失败：缺少必要参数")
             return "验证失败：参数不完整", 400
         
-        # 获取配置
-        config = load_config()
-        logger.info(f"配置检查:")
-        logger.info(f"  encoding_aes_key: {'已设置' if config.encoding_aes_key else '未设置'}")
-        logger.info(f"  corpid: {'已设置' if config.corpid else '未设置'}")
-        
         # 如果配置了EncodingAESKey，尝试解密echostr
-        if config.encoding_aes_key and config.corpid:
-            logger.info("尝试解密echostr")
-            logger.info(f"  encoding_aes_key: {config.encoding_aes_key[:10]}...")
-            logger.info(f"  corpid: {config.corpid}")
-            
-            # 使用pyaes解密
-            decrypted_echostr = decrypt_echostr_simple(echostr, config.encoding_aes_key, config.corpid)
-            if decrypted_echostr and decrypted_echostr != echostr:
-                logger.info(f"解密成功，返回: {decrypted_echostr}")
+        crypto = config_manager.current().crypto
+        if crypto:
+            try:
+                decrypted_echostr = crypto.decrypt(echostr).decode('utf-8')
+                logger.info("URL验证成功")
+                logger.debug("解密echostr: %s", decrypted_echostr)
                 return decrypted_echostr
-            else:
-                logger.warning("解密失败或返回原始值")
+            except WeChatCryptoError as e:
+                logger.warning(f"解密失败，返回原始值: {e}")
         else:
             logger.info("未配置EncodingAESKey或CorpID，跳过解密")
         
@@ -654,135 +524,242 @@ def verify_url(request):
 
 
 def handle_message(request):
-    """处理接收到的消息"""
+    """接收回调消息：只校验签名并入队，立即返回"""
     try:
-        # 诊断：记录原始请求数据
-        logger.info("=== 消息接收诊断 ===")
-        logger.info(f"请求方法: {request.method}")
         # 获取原始数据
-        raw_data = request.get_data(as_text=True)
+        raw_data = request.get_data()
+        args = {
+            'msg_signature': request.args.get('msg_signature', ''),
+            'timestamp': request.args.get('timestamp', ''),
+            'nonce': request.args.get('nonce', '')
+        }
+        encrypted_msg = None
+        data = None
+        config = config_manager.config
         
         # 检查是否是加密消息（XML格式）
-        if raw_data.strip().startswith('<xml>'):
-            
-            # 解析XML获取加密数据
+        if raw_data.strip().startswith(b'<xml>'):
+            started = time.perf_counter()
             try:
-                import xml.etree.ElementTree as ET
-                root = ET.fromstring(raw_data)
-                
-                # 获取加密消息
-                encrypt_elem = root.find('Encrypt')
-                if encrypt_elem is None:
-                    logger.error("XML中未找到Encrypt元素")
-                    return jsonify({'error': '无效的加密消息格式'}), 400
-                
-                encrypted_msg = encrypt_elem.text
-                
-                # 获取URL参数
-                msg_signature = request.args.get('msg_signature', '')
-                timestamp = request.args.get('timestamp', '')
-                nonce = request.args.get('nonce', '')
-                
-                # 解密消息
-                config = load_config()
-                decrypted_xml = decrypt_message(encrypted_msg, msg_signature, timestamp, nonce, config.token, config.encoding_aes_key, config.corpid)
-                
-                if decrypted_xml:
-                    # 直接解析解密后的XML内容
-                    try:
-                        # 检查XML是否完整，如果不完整则补充
-                        if not decrypted_xml.startswith('<xml>'):
-                            # 查找XML开始位置
-                            xml_start = decrypted_xml.find('<xml>')
-                            if xml_start == -1:
-                                xml_start = decrypted_xml.find('<ToUserName>')
-                                if xml_start != -1:
-                                    decrypted_xml = '<xml>' + decrypted_xml[xml_start:]
-                        
-                        # 移除末尾的企业ID和填充
-                        xml_end = decrypted_xml.find('</xml>')
-                        if xml_end != -1:
-                            decrypted_xml = decrypted_xml[:xml_end + 6]
-                        
-                        # 解析XML
-                        decrypted_root = ET.fromstring(decrypted_xml)
-                        
-                        # 提取消息内容
-                        data = {}
-                        for child in decrypted_root:
-                            data[child.tag] = child.text
-                        
-                    except Exception as e:
-                        logger.error(f"解析解密内容异常: {e}")
-                        return jsonify({'error': f'解析解密内容异常: {str(e)}'}), 400
-                else:
-                    logger.error("消息解密失败")
-                    return jsonify({'error': '消息解密失败'}), 400
-                    
-            except Exception as e:
-                logger.error(f"XML解析或解密异常: {e}")
+                fields = parse_callback_xml(raw_data)
+            except CallbackXMLError as e:
+                logger.error(f"XML解析异常: {e}")
+                CALLBACKS.labels('bad_request').inc()
                 return jsonify({'error': f'XML处理异常: {str(e)}'}), 400
-        else:
-            # 尝试解析JSON（非加密消息）
-            try:
-                data = request.get_json()
-            except Exception as e:
-                logger.error(f"JSON解析失败: {e}")
-                return jsonify({'error': '无效的JSON数据'}), 400
-        
-        if not data:
-            logger.error("消息数据为空")
-            return jsonify({'error': '无效的消息数据'}), 400
-        
-        # 解析消息
-        msg_type = data.get('MsgType', '')
-        
-        if msg_type == 'text':
-            content = data.get('Content', '')
-            user_id = data.get('FromUserName', '')
-            
-            logger.info(f"收到文本消息: {content}, 来自: {user_id}")
-            
-            # 处理消息
-            response = bot.handle_incoming_message(content, user_id)
+            XML_PARSE_SECONDS.observe(time.perf_counter() - started)
             
-            if response:
-                logger.info(f"生成回复: {response}")
-                # 使用与定时发送相同的方式发送回复
-                success = bot.send_message(response, [user_id])
-                if success:
-                    logger.info(f"回复消息发送成功: {response}")
-                else:
-                    logger.error(f"回复消息发送失败: {response}")
-                
-                # 返回成功响应
-                return jsonify({'errcode': 0, 'errmsg': 'ok'})
-            else:
-                # 如果没有回复，返回空字符串
-                return '', 200
-        
-        elif msg_type == 'event':
-            event = data.get('Event', '')
-            user_id = data.get('FromUserName', '')
-            
-            logger.info(f"收到事件: {event}, 来自: {user_id}")
+            # 获取加密消息
+            encrypted_msg = fields.get('Encrypt')
+            if not encrypted_msg:
+                logger.error("XML中未找到Encrypt元素")
+                CALLBACKS.labels('bad_request').inc()
+                return jsonify({'error': '无效的加密消息格式'}), 400
             
-            # 处理事件
-            if event == 'subscribe':
-                # 用户关注
-                bot.send_message("欢迎使用量化交易机器人！", [user_id])
-            
-            return jsonify({'errcode': 0, 'errmsg': 'ok'})
-        
+            # 验证签名
+            started = time.perf_counter()
+            signature = generate_signature(config.token, args['timestamp'], args['nonce'], encrypted_msg)
+            valid = hmac.compare_digest(signature, args['msg_signature'])
+            SIGNATURE_SECONDS.observe(time.perf_counter() - started)
+            if not valid:
+                logger.error(f"签名验证失败: 期望={args['msg_signature']}, 实际={signature}")
+                CALLBACKS.labels('bad_signature').inc()
+                return jsonify({'error': '签名验证失败'}), 403
         else:
-            logger.info(f"收到其他类型消息: {msg_type}")
-            return jsonify({'errcode': 0, 'errmsg': 'ok'})
-            
+            # 非加密消息（JSON）：既不是XML也不是JSON对象的请求体直接拒绝，不进入处理队列
+            try:
+                data = json.loads(raw_data)
+            except ValueError:
+                data = None
+            if not isinstance(data, dict):
+                logger.error(f"无法解析的回调消息（既不是XML也不是JSON对象）: {raw_data[:100]!r}")
+                CALLBACKS.labels('bad_request').inc()
+                return jsonify({'error': '无法解析的消息格式'}), 400
+        
+        # 入队后立即应答，避免企业微信因超时重试；
+        # 加密回调最多等待passive_reply_window秒，期间生成的短回复直接作为被动回复返回。
+        # 已有回调在排队或机器人尚未创建时，窗口内不会生成回复，等待只会占住请求线程，直接应答并主动发送回复
+        window = config.passive_reply_window if encrypted_msg and bot and not ingress.has_backlog() else 0
+        envelope = Envelope(body=raw_data, args=args, encrypted_msg=encrypted_msg, data=data,
+                            awaiting_reply=window > 0)
+        ingress.submit(envelope)
+        
+        if envelope.awaiting_reply:
+            reply_xml = envelope.wait_reply(window)
+            if reply_xml:
+                CALLBACKS.labels('passive_reply').inc()
+                return reply_xml, 200, {'Content-Type': 'application/xml'}
+        
+        CALLBACKS.labels('accepted').inc()
+        return jsonify({'errcode': 0, 'errmsg': 'ok'})
+        
+    except IngressQueueFull as e:
+        logger.error(f"回调队列已满: {e}")
+        CALLBACKS.labels('queue_full').inc()
+        return jsonify({'errcode': 1, 'errmsg': str(e)}), 503
+    except IngressStopped as e:
+        # worker正在退出：返回503，企业微信重试时由其他worker处理
+        logger.warning(f"回调处理管道已停止: {e}")
+        CALLBACKS.labels('stopped').inc()
+        return jsonify({'errcode': 1, 'errmsg': str(e)}), 503
     except Exception as e:
         logger.error(f"处理消息异常: {e}")
+        CALLBACKS.labels('error').inc()
         return jsonify({'errcode': 1, 'errmsg': str(e)}), 500
 
 
+def parse_envelope(envelope: Envelope) -> Optional[dict]:
+    """解密并解析回调消息，返回消息字段"""
+    if envelope.encrypted_msg is None:
+        # 非加密消息（JSON），接收时已解析
+        return envelope.data
+    
+    # 解密消息
+    crypto = config_manager.current().crypto
+    if crypto is None:
+        logger.error("未配置EncodingAESKey或CorpID，无法解密消息")
+        return None
+    
+    # 签名已在接收时校验，这里只解密，直接解析明文字节
+    started = time.perf_counter()
+    try:
+        decrypted_xml = crypto.decrypt(envelope.encrypted_msg)
+    except WeChatCryptoError as e:
+        logger.error(f"消息解密失败: {e}")
+        return None
+    DECRYPT_SECONDS.observe(time.perf_counter() - started)
+    
+    started = time.perf_counter()
+    try:
+        data = parse_callback_xml(decrypted_xml)
+    except CallbackXMLError as e:
+        logger.error(f"解析解密内容异常: {e}")
+        return None
+    XML_PARSE_SECONDS.observe(time.perf_counter() - started)
+    return data
+
+
+def deliver_reply(envelope: Envelope, data: dict, reply: Reply):
+    """投递回复：回调请求仍在等待且内容允许时被动回复，否则放入发送队列主动发送"""
+    user_id = data.get('FromUserName', '')
+    
+    if envelope.awaiting_reply and reply.allows_passive():
+        crypto = config_manager.current().crypto
+        if crypto:
+            reply_xml = build_text_reply_xml(user_id, data.get('ToUserName', ''), reply.content)
+            if envelope.offer_reply(crypto.encrypt_reply(reply_xml)):
+                logger.debug("回复已通过被动回复返回: %.50s", reply.content)
+                return
+    
+    # 放入发送队列，回调响应不等待企业微信API
+    job = bot.send_message_async(reply.content, [user_id])
+    logger.debug("回复消息已加入发送队列: %s", job.job_id)
+
+
+def process_envelope(envelope: Envelope):
+    """后台处理回调：解密、分发、回复"""
+    # worker刚启动时机器人可能还在创建，处理线程稍等（回调请求本身已经应答）
+    if not bot and not startup.wait('bot', timeout=BOT_WAIT_SECONDS):
+        logger.error("机器人未初始化，丢弃回调消息")
+        return
+    
+    data = parse_envelope(envelope)
+    if not data:
+        logger.error("消息数据为空")
+        return
+    
+    # 企业微信重试的重复回调直接应答，不再交给机器人处理；处理成功后才记为已处理，
+    # 处理失败时释放，企业微信的重试会重新处理
+    key = dedup_key(data)
+    if key and not dedup.claim(key):
+        logger.info("忽略重复回调: %s", key, extra={'category': 'callback'})
+        return
+    try:
+        dispatch_message(envelope, data)
+    except Exception:
+        if key:
+            dedup.release(key)
+        raise
+    if key:
+        dedup.complete(key)
+
+
+def dispatch_message(envelope: Envelope, data: dict):
+    """按消息类型分发给机器人并投递回复"""
+    msg_type = data.get('MsgType', '')
+    
+    if msg_type == 'text':
+        content = data.get('Content', '')
+        user_id = data.get('FromUserName', '')
+        
+        logger.info("收到文本消息", extra={'category': 'callback',
+                                          'fields': {'user': user_id, 'length': len(content)}})
+        logger.debug("消息内容: %s", content)
+        
+        # 处理消息
+        started = time.perf_counter()
+        response = bot.handle_incoming_message(content, user_id)
+        DISPATCH_SECONDS.observe(time.perf_counter() - started)
+        
+        reply = Reply.coerce(response, bot.config.reply_mode)
+        if reply:
+            logger.debug("生成回复: %s", reply)
+            deliver_reply(envelope, data, reply)
+    
+    elif msg_type == 'event':
+        event = data.get('Event', '')
+        user_id = data.get('FromUserName', '')
+        
+        logger.info("收到事件", extra={'category': 'callback', 'fields': {'user': user_id, 'event': event}})
+        
+        # 处理事件
+        if event == 'subscribe':
+            # 用户关注
+            deliver_reply(envelope, data, Reply("欢迎使用量化交易机器人！", bot.config.reply_mode))
+    
+    else:
+        logger.info("收到其他类型消息", extra={'category': 'callback', 'fields': {'msg_type': msg_type}})
+
+
+# 回调去重（设置WECHAT_DEDUP_PATH时多个worker共享去重表）
+dedup = create_dedup_cache(
+    config_manager.config.dedup_path,
+    ttl=config_manager.config.dedup_ttl,
+    lease=config_manager.config.dedup_lease
+)
+
+# 回调处理管道
+ingress = IngressPipeline(
+    process_envelope,
+    workers=config_manager.config.ingress_workers,
+    maxsize=config_manager.config.ingress_queue_size
+)
+
+
+# 队列深度在采集时读取；设置WECHAT_METRICS_DIR为"memory"时只输出当前worker的指标
+QUEUE_DEPTH.set_function(lambda: {
+    'ingress': ingress.get_status()['queue_depth'],
+    'log': LOG_PIPELINE.queue_depth(),
+    'send': bot.dispatcher.get_status()['queue_size'] if bot else 0
+})
+metrics_dir = os.getenv('WECHAT_METRICS_DIR') or default_metrics_dir()
+if metrics_dir != 'memory':
+    REGISTRY.enable_multiprocess(metrics_dir)
+
+# 启动步骤：创建机器人，预热加解密和报告缓存，获取访问令牌（同时验证企业凭证）
+startup.add_step('bot', init_bot)
+startup.add_step('ingress', ingress.start)
+startup.add_step('crypto', warm_crypto)
+startup.add_step('reports', lambda: bot.warm_reports(), required=False)
+startup.add_step('token', warm_token)
+startup.start()
+
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus指标（汇总所有worker）"""
+    return REGISTRY.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
 @app.route('/health')
 def health():
     """健康检查接口"""
@@ -790,15 +767,27 @@ def health():
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
         'bot_initialized': bot is not None,
-        'timer_running': running
+        'timer_running': timer_running(),
+        'ready': startup.ready,
+        'leader': bot.leader.get_status() if bot else None,
+        'outbox': bot.outbox.get_status() if bot and bot.outbox else None,
+        'ingress': ingress.get_status(),
+        'config': config_manager.get_status(),
+        'logging': LOG_PIPELINE.get_status(),
+        'startup': startup.get_status()
     })
 
 
+@app.route('/ready')
+def ready():
+    """就绪检查：启动预热完成前返回503（存活检查用 /health）"""
+    status = startup.get_status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+
 if __name__ == '__main__':
-    # 初始化机器人
-    logger.info("初始化微信机器人...")
-    if init_bot():
-        # 启动定时发送
+    # 本地运行：机器人创建后启动定时发送
+    if startup.wait('bot', timeout=BOT_WAIT_SECONDS):
         start_timer()
         logger.info("机器人初始化成功，定时发送已启动")
     else:
@@ -806,4 +795,4 @@ if __name__ == '__main__':
     
     # 启动Flask应用
     port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=False) 
\ No newline at end of file
+    app.run(host='0.0.0.0', port=port, debug=False) 
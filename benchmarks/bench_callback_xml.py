@@ -0,0 +1,121 @@
+"""
+回调XML解析基准
+1. 一致性：各种形式的回调（扁平CDATA、文本值、空元素、XML声明、实体、嵌套元素、\\r\\n、末尾多余内容）
+   与原先ElementTree + 字符串修补的解析结果相同
+2. 速度：外层加密包 + 解密后的消息体，原先两次构建元素树 vs 快速路径
+3. 恶意输入：大量 "]]>" 的外层包在签名校验前解析，耗时应与长度成线性
+
+用法: python benchmarks/bench_callback_xml.py
+"""
+
+import sys
+import time
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.wx_stockbot.callback_xml import parse_callback_xml, CallbackXMLError, MAX_XML_BYTES
+
+ENCRYPT = "A" * 1000 + "=="
+
+
+def legacy_envelope(raw: str) -> dict:
+    """原先的外层包解析：构建元素树后取Encrypt"""
+    root = ET.fromstring(raw)
+    return {"Encrypt": root.find("Encrypt").text}
+
+
+def legacy_body(decrypted_xml: str) -> dict:
+    """原先的消息体解析：字符串修补后构建元素树"""
+    if not decrypted_xml.startswith('<xml>'):
+        xml_start = decrypted_xml.find('<xml>')
+        if xml_start == -1:
+            xml_start = decrypted_xml.find('<ToUserName>')
+            if xml_start != -1:
+                decrypted_xml = '<xml>' + decrypted_xml[xml_start:]
+    xml_end = decrypted_xml.find('</xml>')
+    if xml_end != -1:
+        decrypted_xml = decrypted_xml[:xml_end + 6]
+    root = ET.fromstring(decrypted_xml)
+    return {child.tag: child.text for child in root}
+
+
+def text_message(content: str) -> str:
+    return ("<xml><ToUserName><![CDATA[ww_corp]]></ToUserName><FromUserName><![CDATA[user1]]></FromUserName>"
+            "<CreateTime>1700000000</CreateTime><MsgType><![CDATA[text]]></MsgType>"
+            f"<Content><![CDATA[{content}]]></Content><MsgId>7291234567890</MsgId><AgentID>1000001</AgentID></xml>")
+
+
+ENVELOPE = f"<xml><ToUserName><![CDATA[ww_corp]]></ToUserName><Encrypt><![CDATA[{ENCRYPT}]]></Encrypt><AgentID><![CDATA[1000001]]></AgentID></xml>"
+
+CASES = {
+    "外层包": ENVELOPE,
+    "文本消息": text_message("信息更新 NVDA"),
+    "长文本": text_message("行情" * 1000),
+    "关注事件": ("<xml><ToUserName><![CDATA[ww_corp]]></ToUserName><FromUserName><![CDATA[user1]]></FromUserName>"
+                 "<CreateTime>1700000000</CreateTime><MsgType><![CDATA[event]]></MsgType>"
+                 "<Event><![CDATA[subscribe]]></Event><EventKey><![CDATA[]]></EventKey><AgentID>1</AgentID></xml>"),
+    "空元素": "<xml><ToUserName>ww</ToUserName><Content></Content><EventKey/></xml>",
+    "格式化": "<?xml version=\"1.0\"?>\n<xml>\n  <ToUserName><![CDATA[ww]]></ToUserName>\n  <MsgType>text</MsgType>\n</xml>\n",
+    "实体": "<xml><ToUserName>ww</ToUserName><Content>a &amp; b &lt; c</Content></xml>",
+    "嵌套元素": ("<xml><ToUserName>ww</ToUserName><MsgType>event</MsgType><SendPicsInfo><Count>1</Count>"
+                 "<PicList><item><PicMd5Sum>abc</PicMd5Sum></item></PicList></SendPicsInfo></xml>"),
+    "换行符": "<xml><ToUserName>ww</ToUserName><Content><![CDATA[第一行\r\n第二行]]></Content></xml>",
+    "CDATA拆分": "<xml><Content><![CDATA[a]]]]><![CDATA[>b]]></Content></xml>",
+    "末尾多余内容": text_message("hi") + "ww_corp",
+    "缺少根开始标签": text_message("hi")[5:],
+    "属性": "<xml><Content type=\"x\">hi</Content></xml>",
+}
+
+
+def bench(func, arg, min_time: float = 0.3) -> float:
+    count, elapsed = 0, 0.0
+    start = time.perf_counter()
+    while elapsed < min_time:
+        for _ in range(200):
+            func(arg)
+        count += 200
+        elapsed = time.perf_counter() - start
+    return elapsed / count
+
+
+def main():
+    for name, xml in CASES.items():
+        expected = legacy_body(xml)
+        actual = parse_callback_xml(xml.encode("utf-8"))
+        assert actual == expected, f"{name}: {actual} != {expected}"
+    print(f"一致性: {len(CASES)} 种形式的解析结果与原实现相同")
+    
+    print(f"{'消息':<8} {'原实现(µs)':>12} {'快速路径(µs)':>14} {'加速':>6}")
+    for name in ("外层包", "文本消息", "长文本", "关注事件"):
+        raw = CASES[name]
+        legacy = legacy_envelope if name == "外层包" else legacy_body
+        old = bench(legacy, raw)
+        new = bench(parse_callback_xml, raw.encode("utf-8"))
+        print(f"{name:<8} {old * 1e6:>12.2f} {new * 1e6:>14.2f} {old / new:>5.1f}x")
+    
+    # 每次回调：外层包 + 消息体
+    body = CASES["文本消息"]
+    old = bench(lambda _: (legacy_envelope(ENVELOPE), legacy_body(body)), None)
+    raw_envelope, raw_body = ENVELOPE.encode("utf-8"), body.encode("utf-8")
+    new = bench(lambda _: (parse_callback_xml(raw_envelope), parse_callback_xml(raw_body)), None)
+    print(f"{'每次回调':<8} {old * 1e6:>12.2f} {new * 1e6:>14.2f} {old / new:>5.1f}x")
+    
+    for size in (MAX_XML_BYTES // 4, MAX_XML_BYTES):
+        hostile = b"<xml><Encrypt><![CDATA[" + b"]]>" * ((size - 40) // 3) + b"</xml>"
+        start = time.perf_counter()
+        try:
+            parse_callback_xml(hostile)
+        except CallbackXMLError:
+            pass
+        print(f"恶意输入 {len(hostile) // 1024} KB: {(time.perf_counter() - start) * 1e3:.2f} ms")
+    try:
+        parse_callback_xml(b"<xml>" + b" " * MAX_XML_BYTES + b"</xml>")
+        raise AssertionError("超过大小限制的XML应被拒绝")
+    except CallbackXMLError:
+        print(f"超过 {MAX_XML_BYTES // 1024} KB 的XML被拒绝")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+配置快照基准
+1. 每次请求取得配置和加解密器的耗时：原先每次 WeChatConfig.from_env() + 查找加解密器，现在读取快照引用
+2. 热加载：修改配置文件、发送SIGHUP后新配置生效的时间
+3. 一致性：热加载期间多个读线程看到的快照中，配置与加解密器始终属于同一版本
+
+用法: python benchmarks/bench_config.py [每种方式的调用次数]
+"""
+
+import os
+import sys
+import time
+import signal
+import tempfile
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.wx_stockbot.config import WeChatConfig
+from src.wx_stockbot.config_manager import ConfigManager
+from src.wx_stockbot.crypto import get_crypto
+
+AES_KEY = "abcdefghijklmnopqrstuvwxyz0123456789ABCDEFG"
+ENV = {
+    "WECHAT_CORPID": "ww_bench_corp", "WECHAT_CORPSECRET": "secret", "WECHAT_AGENTID": "1000001",
+    "WECHAT_USER_IDS": "user1,user2,user3", "WECHAT_DEPT_IDS": "1,2", "WECHAT_TAG_IDS": "1",
+    "WECHAT_ENCODING_AES_KEY": AES_KEY, "WECHAT_MARKET_HOLIDAYS": "2025-12-25,2026-01-01"
+}
+
+
+def legacy_load():
+    """原先每次回调的做法"""
+    config = WeChatConfig.from_env()
+    config.validate()
+    if config.encoding_aes_key and config.corpid:
+        return config, get_crypto(config.token, config.encoding_aes_key, config.corpid)
+    return config, None
+
+
+def per_call(func, count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    return (time.perf_counter() - start) / count
+
+
+def write_config(path: str, token: str):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"# 测试配置\nWECHAT_TOKEN={token}\n")
+
+
+def wait_for(manager: ConfigManager, token: str, timeout: float = 5) -> float:
+    start = time.perf_counter()
+    while manager.current().config.token != token:
+        if time.perf_counter() - start > timeout:
+            raise TimeoutError(f"配置未在{timeout}秒内生效")
+        time.sleep(0.001)
+    return time.perf_counter() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    os.environ.update(ENV)
+    path = os.path.join(tempfile.mkdtemp(), "wx_stockbot.env")
+    write_config(path, "token-0")
+    
+    manager = ConfigManager(path, poll_interval=0.1)
+    legacy = per_call(legacy_load, count)
+    snapshot = per_call(lambda: manager.current().crypto, count)
+    print(f"取得配置: 原先 {legacy * 1e6:.1f} µs/次，快照 {snapshot * 1e9:.0f} ns/次（{legacy / snapshot:.0f}倍）")
+    
+    # 读线程持续检查快照内部一致：加解密器的token与配置一致
+    stop = threading.Event()
+    errors, reads = [], [0]
+    
+    def reader():
+        while not stop.is_set():
+            current = manager.current()
+            if current.crypto.token != (current.config.token or ""):
+                errors.append(current.version)
+            reads[0] += 1
+    
+    readers = [threading.Thread(target=reader) for _ in range(4)]
+    for thread in readers:
+        thread.start()
+    
+    manager.start()
+    manager.install_signal_handler()
+    try:
+        delays = []
+        for i in range(1, 11):
+            # 同一秒内多次写入时mtime可能不变，文件大小或inode变化也会触发
+            write_config(path, f"token-{i}")
+            delays.append(wait_for(manager, f"token-{i}"))
+        print(f"修改配置文件: 平均 {sum(delays) / len(delays) * 1e3:.0f} ms 后生效（轮询间隔 {manager.poll_interval * 1e3:.0f} ms）")
+        
+        stop.set()
+        for thread in readers:
+            thread.join()
+        assert not errors, f"读到不一致的快照: {errors[:5]}"
+        print(f"热加载期间 {len(readers)} 个读线程读取 {reads[0]} 次，未读到不一致的快照")
+        
+        # 写入后立刻发送信号，不等轮询
+        manager.poll_interval = 3600
+        time.sleep(0.2)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write("WECHAT_TOKEN=token-signal\n")
+        os.kill(os.getpid(), signal.SIGHUP)
+        print(f"SIGHUP: {wait_for(manager, 'token-signal') * 1e3:.1f} ms 后生效，当前版本 {manager.current().version}")
+    finally:
+        stop.set()
+        manager.stop()
+
+
+if __name__ == "__main__":
+    main()
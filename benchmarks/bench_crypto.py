@@ -0,0 +1,78 @@
+"""
+消息解密微基准
+对比原先逐块拼接的pyaes解密与 WeChatCrypto（缓存密钥 + 预分配缓冲区 / OpenSSL后端）；
+纯Python后端的耗时由AES分组运算决定，与原实现相当
+
+用法: python benchmarks/bench_crypto.py
+"""
+
+import sys
+import time
+import base64
+from pathlib import Path
+
+import pyaes
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.wx_stockbot.crypto import WeChatCrypto, CRYPTO_BACKEND
+
+TOKEN = "bench_token"
+AES_KEY = "abcdefghijklmnopqrstuvwxyz0123456789ABCDEFG"
+CORPID = "ww_bench_corp"
+SIZES = [100, 1024, 4096, 16384, 65536]
+
+
+def legacy_decrypt(encrypted_msg: str, encoding_aes_key: str) -> bytes:
+    """原实现：每次解码密钥、新建CBC对象并逐块拼接bytes"""
+    aes_key = base64.b64decode(encoding_aes_key + "=")
+    encrypted_data = base64.b64decode(encrypted_msg)
+    iv = encrypted_data[:16]
+    ciphertext = encrypted_data[16:]
+    cipher = pyaes.AESModeOfOperationCBC(aes_key, iv=iv)
+    decrypted_data = b''
+    for i in range(0, len(ciphertext), 16):
+        block = ciphertext[i:i+16]
+        if len(block) == 16:
+            decrypted_data += cipher.decrypt(block)
+    return decrypted_data
+
+
+def bench(func, arg, min_time: float = 0.2, rounds: int = 5) -> float:
+    """返回单次调用的耗时（微秒）：每轮至少运行min_time秒取平均，取各轮中最快的一轮"""
+    best = float("inf")
+    for _ in range(rounds):
+        runs = 0
+        start = time.perf_counter()
+        while True:
+            func(arg)
+            runs += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time:
+                break
+        best = min(best, elapsed / runs * 1e6)
+    return best
+
+
+def main():
+    crypto_pyaes = WeChatCrypto(TOKEN, AES_KEY, CORPID, backend="pyaes")
+    backends = [("WeChatCrypto[pyaes]", crypto_pyaes)]
+    if CRYPTO_BACKEND == "cryptography":
+        backends.append(("WeChatCrypto[openssl]", WeChatCrypto(TOKEN, AES_KEY, CORPID)))
+    
+    header = f"{'大小':>8} {'原实现(us)':>14}" + "".join(f" {name + '(us)':>26}" for name, _ in backends)
+    print(header)
+    for size in SIZES:
+        payload = ("<xml>" + "x" * max(0, size - 11) + "</xml>")[:size]
+        encrypted = crypto_pyaes.encrypt(payload)
+        legacy = bench(lambda e: legacy_decrypt(e, AES_KEY), encrypted)
+        row = f"{size:>8} {legacy:>14.1f}"
+        for name, crypto in backends:
+            assert crypto.decrypt(encrypted).decode("utf-8") == payload
+            t = bench(crypto.decrypt, encrypted)
+            row += f" {t:>18.1f} ({legacy / t:4.1f}x)"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
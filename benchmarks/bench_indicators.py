@@ -0,0 +1,118 @@
+"""
+技术指标计算基准测试
+计算 5000 只股票 × 10 年日线的全部指标（WR14/WR21、KDJ、SAR、MA5/10/20/60），
+按股票分块以控制内存；先在少量股票上与逐根K线循环的参考实现核对结果，并估算其耗时
+
+用法: python benchmarks/bench_indicators.py [股票数] [交易日数] [每块股票数]
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.wx_stockbot.indicators import compute_indicators
+
+
+def generate(symbols: int, days: int, seed: int):
+    """随机游走生成日线"""
+    rng = np.random.default_rng(seed)
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, (symbols, days)), axis=1))
+    high = close * (1 + rng.uniform(0, 0.02, (symbols, days)))
+    low = close * (1 - rng.uniform(0, 0.02, (symbols, days)))
+    return high, low, close
+
+
+def reference(high, low, close):
+    """逐根K线循环的参考实现（单只股票）"""
+    n = len(close)
+    result = {}
+    for window in (14, 21):
+        wr = []
+        for t in range(n):
+            hh = max(high[max(0, t - window + 1):t + 1])
+            ll = min(low[max(0, t - window + 1):t + 1])
+            wr.append(100 * (hh - close[t]) / (hh - ll) if hh > ll else float("nan"))
+        result[f"wr{window}"] = wr
+    
+    k, d, ks, ds, js = 50.0, 50.0, [], [], []
+    for t in range(n):
+        hh = max(high[max(0, t - 8):t + 1])
+        ll = min(low[max(0, t - 8):t + 1])
+        rsv = 100 * (close[t] - ll) / (hh - ll) if hh > ll else 50.0
+        k = (2 * k + rsv) / 3
+        d = (2 * d + k) / 3
+        ks.append(k)
+        ds.append(d)
+        js.append(3 * k - 2 * d)
+    result["k"], result["d"], result["j"] = ks, ds, js
+    
+    up = high[1] + low[1] >= high[0] + low[0]
+    sar = low[0] if up else high[0]
+    ep = high[0] if up else low[0]
+    af = 0.02
+    sars = [sar]
+    for t in range(1, n):
+        sar = sar + af * (ep - sar)
+        if up:
+            sar = min(sar, low[t - 1], low[t - 2] if t >= 2 else low[t - 1])
+            if low[t] < sar:
+                up, sar, ep, af = False, ep, low[t], 0.02
+            elif high[t] > ep:
+                ep, af = high[t], min(af + 0.02, 0.2)
+        else:
+            sar = max(sar, high[t - 1], high[t - 2] if t >= 2 else high[t - 1])
+            if high[t] > sar:
+                up, sar, ep, af = True, ep, high[t], 0.02
+            elif low[t] < ep:
+                ep, af = low[t], min(af + 0.02, 0.2)
+        sars.append(sar)
+    result["sar"] = sars
+    
+    for window in (5, 10, 20, 60):
+        result[f"ma{window}"] = [sum(close[t - window + 1:t + 1]) / window if t >= window - 1 else float("nan")
+                                 for t in range(n)]
+    return result
+
+
+def verify(days: int, count: int = 5) -> float:
+    """与参考实现核对，返回参考实现每只股票的耗时"""
+    high, low, close = generate(count, days, seed=7)
+    vectorized = compute_indicators(high, low, close)
+    start = time.perf_counter()
+    for i in range(count):
+        expected = reference(high[i].tolist(), low[i].tolist(), close[i].tolist())
+        for name, values in expected.items():
+            np.testing.assert_allclose(vectorized[name][i], values, rtol=1e-9, atol=1e-9, equal_nan=True,
+                                       err_msg=f"{name} 与参考实现不一致")
+    return (time.perf_counter() - start) / count
+
+
+def main():
+    symbols = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 2520
+    chunk = int(sys.argv[3]) if len(sys.argv) > 3 else 500
+    
+    per_symbol = verify(days)
+    print(f"结果与逐根循环实现一致；循环实现 {per_symbol * 1000:.1f} ms/只，"
+          f"{symbols} 只估计 {per_symbol * symbols:.0f}s")
+    
+    generate_time = compute_time = 0.0
+    for start in range(0, symbols, chunk):
+        size = min(chunk, symbols - start)
+        t0 = time.perf_counter()
+        high, low, close = generate(size, days, seed=start)
+        t1 = time.perf_counter()
+        compute_indicators(high, low, close)
+        t2 = time.perf_counter()
+        generate_time += t1 - t0
+        compute_time += t2 - t1
+    print(f"向量化: {symbols} 只 × {days} 日, 每块 {chunk} 只, 指标计算 {compute_time:.2f}s "
+          f"({symbols * days / compute_time / 1e6:.1f}M 根K线/s), 数据生成 {generate_time:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+关键词分发基准
+10k 个关键词下，对比逐个 `keyword in message` 与 Aho-Corasick 索引的单条消息匹配耗时
+
+用法: python benchmarks/bench_keyword_index.py [关键词数]
+"""
+
+import sys
+import time
+import random
+import string
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.wx_stockbot.keyword_index import KeywordIndex
+
+
+def make_keywords(count: int) -> list[str]:
+    """生成股票代码、指令和别名混合的关键词"""
+    rng = random.Random(42)
+    keywords = set()
+    while len(keywords) < count:
+        kind = rng.random()
+        if kind < 0.6:
+            keywords.add("".join(rng.choices(string.ascii_uppercase, k=rng.randint(2, 5))))
+        elif kind < 0.9:
+            keywords.add("".join(rng.choices("信息更新打开关闭推送状态行情分析指标报告", k=rng.randint(2, 6))))
+        else:
+            keywords.add(str(rng.randint(600000, 699999)))
+    return list(keywords)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    keywords = make_keywords(count)
+    rng = random.Random(7)
+    messages = [f"请给我 {rng.choice(keywords)} 的信息更新，顺便看看 {rng.choice(keywords)}" for _ in range(500)]
+    
+    handlers = {kw: kw for kw in keywords}
+    start = time.perf_counter()
+    index = KeywordIndex()
+    for kw in keywords:
+        index.add(kw, kw)
+    index.match("")
+    build_ms = (time.perf_counter() - start) * 1000
+    
+    def naive(message):
+        return [kw for kw in handlers if kw in message]
+    
+    for label, func in [("逐个匹配", naive), ("Aho-Corasick", index.match)]:
+        start = time.perf_counter()
+        for message in messages:
+            func(message)
+        per_msg = (time.perf_counter() - start) / len(messages) * 1e6
+        print(f"{label:<14} {count} 个关键词: {per_msg:10.1f} us/消息")
+    
+    for message in messages[:50]:
+        found = {m.entry.keyword for m in index.match(message)}
+        assert found == set(naive(message)), (message, found ^ set(naive(message)))
+    print(f"索引构建耗时: {build_ms:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
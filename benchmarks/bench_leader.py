@@ -0,0 +1,98 @@
+"""
+主节点选举测试
+启动多个进程（模拟gunicorn worker），统计测试桩收到的定时消息：
+不选举时每个进程都启动了定时推送，各发一份；选举时只由最后启动的进程（从节点）发出"打开推送"，
+任务定义同步到所有进程，只由主节点发送；
+运行中强制杀死主节点（SIGKILL，内核释放锁）或挂起主节点（SIGSTOP，锁不释放、心跳租约过期），
+测量其他进程接管前的推送间隔
+
+用法: python benchmarks/bench_leader.py [进程数] [推送间隔秒数]
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import logging
+import tempfile
+import multiprocessing
+from pathlib import Path
+from typing import Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.wechat_stub import start_stub_server
+from src.wx_stockbot.bot import WeChatBot
+from src.wx_stockbot.config import WeChatConfig
+
+
+def worker(config: WeChatConfig, starter: bool, interval: float):
+    logging.basicConfig(level=logging.ERROR)
+    bot = WeChatBot(config)
+    if starter:
+        bot.start_timer(interval)
+    while True:
+        time.sleep(1)
+
+
+def run(label: str, server, config: WeChatConfig, processes: int, interval: float, leader_signal: Optional[int]):
+    server.stats.update(send=0)
+    every = config.leader_lock_path == "memory"
+    procs = [multiprocessing.Process(target=worker, args=(config, every or i == processes - 1, interval), daemon=True)
+             for i in range(processes)]
+    for proc in procs:
+        proc.start()
+        time.sleep(0.05)
+    
+    # 采样测试桩的发送计数，记录每次发送的大致时间
+    sends, last = [], 0
+    start = time.monotonic()
+    signaled_at = None
+    while time.monotonic() - start < interval * 16:
+        count = server.stats["send"]
+        sends.extend([time.monotonic()] * (count - last))
+        last = count
+        if leader_signal and signaled_at is None and time.monotonic() - start > interval * 6:
+            with open(config.leader_lock_path + ".json", encoding="utf-8") as f:
+                os.kill(json.load(f)["pid"], leader_signal)
+            signaled_at = time.monotonic()
+        time.sleep(0.01)
+    
+    for proc in procs:
+        proc.kill()
+        proc.join()
+    
+    print(f"{label:<14} {processes} 个进程, 间隔 {interval:g}s, 运行约16个周期: 收到 {len(sends)} 条定时消息")
+    if signaled_at is not None:
+        before = max(t for t in sends if t <= signaled_at)
+        after = min(t for t in sends if t > signaled_at)
+        print(f"{'':<14} {label}后 {after - signaled_at:.2f}s 恢复推送，最长间隔 {after - before:.2f}s")
+
+
+def main():
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    interval = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    
+    multiprocessing.set_start_method("fork")
+    server, base_url = start_stub_server()
+    # 杀死主节点时正在发送的请求会断开，忽略测试桩的断连报错
+    server.handle_error = lambda request, client_address: None
+    
+    try:
+        for label, elect, leader_signal in (("不选举", False, None), ("文件锁选举", True, None),
+                                            ("杀死主节点", True, signal.SIGKILL), ("挂起主节点", True, signal.SIGSTOP)):
+            root = tempfile.mkdtemp()
+            config = WeChatConfig("corp", "secret", "1000001", ["user1"], [], [],
+                                  api_base=base_url, token_cache_path="memory", rate_limit_path="memory",
+                                  leader_lock_path=os.path.join(root, "leader.lock") if elect else "memory",
+                                  leader_heartbeat=0.2, job_store_path=os.path.join(root, "jobs.json"),
+                                  outbox_path="memory")
+            run(label, server, config, processes, interval, leader_signal)
+            time.sleep(0.5)
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
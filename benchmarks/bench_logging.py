@@ -0,0 +1,146 @@
+"""
+日志开销基准
+通过Flask测试客户端发送加密回调（"定时推送状态"，被动回复），测量请求延迟；
+日志写到一个模拟慢速采集端的输出流（每次写入等待固定时间，类似日志管道反压）。
+对比的配置：
+1. 同步 + DEBUG：改动前每条消息的日志都是INFO级别，现在降为DEBUG，打开DEBUG即相当于改动前的日志量
+2. 同步 + INFO：每条回调只保留一行结构化日志和一行指令日志
+3. 异步 + INFO：日志经队列由后台线程写出
+4. 异步 + JSON + 按类别采样（callback=0.1）
+另外对比URL验证请求（改动前每次都输出全部环境变量）
+
+用法: python benchmarks/bench_logging.py [请求数] [每次写入延迟毫秒]
+"""
+
+import os
+import sys
+import time
+import tempfile
+import statistics
+from pathlib import Path
+from urllib.parse import urlencode
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.wechat_stub import start_stub_server
+
+TOKEN = "bench_token"
+AES_KEY = "abcdefghijklmnopqrstuvwxyz0123456789ABCDEFG"
+CORPID = "ww_bench_corp"
+
+
+class SlowStream:
+    """每次写入等待固定时间的输出流（StreamHandler每条日志写入一次）"""
+    
+    def __init__(self, path: str, delay: float):
+        self.file = open(path, "a", encoding="utf-8")
+        self.delay = delay
+        self.writes = 0
+    
+    def write(self, text: str):
+        time.sleep(self.delay)
+        self.writes += 1
+        self.file.write(text)
+    
+    def flush(self):
+        self.file.flush()
+
+
+def configure_env(base_url: str):
+    os.environ.update({
+        "WECHAT_CORPID": CORPID, "WECHAT_CORPSECRET": "secret", "WECHAT_AGENTID": "1000001",
+        "WECHAT_USER_IDS": "user1", "WECHAT_TOKEN": TOKEN, "WECHAT_ENCODING_AES_KEY": AES_KEY,
+        "WECHAT_API_BASE": base_url, "WECHAT_TOKEN_CACHE": "memory", "WECHAT_RATE_LIMIT_PATH": "memory",
+        "WECHAT_LEADER_LOCK": "memory", "WECHAT_JOB_STORE": "memory", "WECHAT_METRICS_DIR": "memory",
+        "WECHAT_LOG_LEVEL": "WARNING"
+    })
+
+
+def callback_request(crypto, msg_id: int) -> tuple[str, str]:
+    """生成一条加密的文本消息回调，返回 (查询字符串, 请求体)"""
+    from src.wx_stockbot.crypto import generate_signature
+    plain = (f"<xml><ToUserName><![CDATA[{CORPID}]]></ToUserName><FromUserName><![CDATA[user1]]></FromUserName>"
+             f"<CreateTime>{int(time.time())}</CreateTime><MsgType><![CDATA[text]]></MsgType>"
+             f"<Content><![CDATA[定时推送状态]]></Content><MsgId>{msg_id}</MsgId><AgentID>1000001</AgentID></xml>")
+    encrypted = crypto.encrypt(plain)
+    timestamp, nonce = str(int(time.time())), str(msg_id)
+    query = urlencode({"msg_signature": generate_signature(TOKEN, timestamp, nonce, encrypted),
+                       "timestamp": timestamp, "nonce": nonce})
+    body = f"<xml><ToUserName><![CDATA[{CORPID}]]></ToUserName><Encrypt><![CDATA[{encrypted}]]></Encrypt></xml>"
+    return query, body
+
+
+def verify_request(crypto) -> str:
+    from src.wx_stockbot.crypto import generate_signature
+    echostr = crypto.encrypt("echo")
+    timestamp, nonce = str(int(time.time())), "1"
+    return urlencode({"msg_signature": generate_signature(TOKEN, timestamp, nonce, echostr),
+                      "timestamp": timestamp, "nonce": nonce, "echostr": echostr})
+
+
+def measure(client, requests: list, method: str) -> list[float]:
+    latencies = []
+    for query, body in requests:
+        started = time.perf_counter()
+        if method == "POST":
+            response = client.post("/?" + query, data=body)
+        else:
+            response = client.get("/?" + query)
+        latencies.append(time.perf_counter() - started)
+        assert response.status_code == 200, response.status_code
+    return latencies
+
+
+def summary(latencies: list[float]) -> str:
+    ordered = sorted(latencies)
+    p99 = ordered[int(len(ordered) * 0.99) - 1]
+    return f"中位数 {statistics.median(ordered) * 1e3:6.2f} ms  p99 {p99 * 1e3:6.2f} ms"
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    delay = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.5 / 1000
+    
+    server, base_url = start_stub_server()
+    configure_env(base_url)
+    import app as flask_app
+    from src.wx_stockbot.crypto import get_crypto
+    from src.wx_stockbot.logs import PIPELINE, setup_logging
+    
+    assert flask_app.init_bot()
+    client = flask_app.app.test_client()
+    crypto = get_crypto(TOKEN, AES_KEY, CORPID)
+    log_path = os.path.join(tempfile.mkdtemp(), "bench.log")
+    
+    modes = [
+        ("同步 DEBUG（改动前）", dict(level="DEBUG", async_output=False)),
+        ("同步 INFO", dict(level="INFO", async_output=False)),
+        ("异步 INFO", dict(level="INFO", async_output=True)),
+        ("异步 JSON 采样", dict(level="INFO", async_output=True, fmt="json", sample={"callback": 0.1}))
+    ]
+    
+    print(f"{count} 次请求，每次写日志延迟 {delay * 1e3:g} ms")
+    msg_id = 0
+    try:
+        for kind, method in (("回调", "POST"), ("URL验证", "GET")):
+            for label, options in modes:
+                stream = SlowStream(log_path, delay)
+                setup_logging(stream=stream, **options)
+                if method == "POST":
+                    requests = []
+                    for _ in range(count):
+                        msg_id += 1
+                        requests.append(callback_request(crypto, msg_id))
+                else:
+                    requests = [(verify_request(crypto), None) for _ in range(count)]
+                measure(client, requests[:20], method)
+                latencies = measure(client, requests[20:], method)
+                # 停止后台线程前写出剩余日志，统计的写入次数才完整
+                PIPELINE.stop()
+                print(f"{kind:<6} {label:<18} {summary(latencies)}  写出日志 {stream.writes} 行")
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+列式行情库基准测试
+对比每次请求解析CSV与从内存映射列式库读取（整段 / 最近60个交易日）的耗时，
+以及追加和压缩的耗时
+
+用法: python benchmarks/bench_market_store.py [股票数] [交易日数]
+"""
+
+import os
+import sys
+import time
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.bench_indicators import generate
+from src.wx_stockbot.market_data import Bars, load_bars
+from src.wx_stockbot.market_store import MarketStore
+
+
+def write_csv(path: str, bars: Bars):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("date,open,high,low,close,volume\n")
+        for row in zip(bars.dates.astype(str), bars.open, bars.high, bars.low, bars.close, bars.volume):
+            f.write(f"{row[0]},{row[1]:.4f},{row[2]:.4f},{row[3]:.4f},{row[4]:.4f},{row[5]:.0f}\n")
+
+
+def timed(label: str, func, symbols: list[str]):
+    start = time.perf_counter()
+    for symbol in symbols:
+        func(symbol)
+    elapsed = (time.perf_counter() - start) / len(symbols)
+    print(f"{label:<24} {elapsed * 1e6:>10,.0f} µs/次")
+    return elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 2520
+    
+    root = tempfile.mkdtemp()
+    csv_dir = os.path.join(root, "csv")
+    os.makedirs(csv_dir)
+    store = MarketStore(os.path.join(root, "store"))
+    high, low, close = generate(count, days, seed=5)
+    dates = np.datetime64("2015-01-01") + np.arange(days)
+    symbols = [f"S{i:04d}" for i in range(count)]
+    for i, symbol in enumerate(symbols):
+        bars = Bars(symbol, dates, close[i], high[i], low[i], close[i], np.full(days, 1e6))
+        write_csv(os.path.join(csv_dir, symbol + ".csv"), bars)
+        store.append(bars)
+    print(f"{count} 只股票 × {days} 日")
+    
+    csv_time = timed("CSV解析(整段)", lambda s: load_bars(csv_dir, s), symbols)
+    # 新建实例，模拟worker冷启动后的第一次读取（需要重新映射）
+    cold = MarketStore(store.root)
+    timed("列式库首次读取(整段)", lambda s: cold.read(s).close.sum(), symbols)
+    warm_time = timed("列式库读取(整段)", lambda s: cold.read(s).close.sum(), symbols)
+    tail_time = timed("列式库读取(最近60日)",
+                      lambda s: cold.read(s, start=dates[-60]).close.sum(), symbols)
+    print(f"整段读取比CSV快 {csv_time / warm_time:.0f} 倍，最近60日快 {csv_time / tail_time:.0f} 倍")
+    
+    new_dates = dates[-1] + np.arange(1, 6)
+    timed("追加5根K线", lambda s: store.append(Bars(s, new_dates, *(np.full(5, 50.0) for _ in range(5)))), symbols)
+    timed("压缩", lambda s: store.compact(s), symbols[:50])
+
+
+if __name__ == "__main__":
+    main()
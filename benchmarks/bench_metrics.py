@@ -0,0 +1,105 @@
+"""
+运行指标基准测试
+1. 直方图记录的单次耗时（单线程 / 多线程并发），含两次 perf_counter
+2. 多进程汇总：多个进程（模拟gunicorn worker）各自记录后，从其中一个进程输出的总数正确
+3. 输出 /metrics 文本的耗时
+
+用法: python benchmarks/bench_metrics.py [每线程记录次数] [线程数] [进程数]
+"""
+
+import os
+import sys
+import time
+import tempfile
+import threading
+import multiprocessing
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.wx_stockbot.metrics import REGISTRY, API_ERRORS, stage
+
+CHILD = stage("bench")
+
+
+def record(count: int) -> float:
+    perf_counter = time.perf_counter
+    start = perf_counter()
+    for _ in range(count):
+        t = perf_counter()
+        CHILD.observe(perf_counter() - t)
+    return perf_counter() - start
+
+
+def baseline(count: int) -> float:
+    """只有两次 perf_counter 的循环，作为对照"""
+    perf_counter = time.perf_counter
+    start = perf_counter()
+    for _ in range(count):
+        t = perf_counter()
+        _ = perf_counter() - t
+    return perf_counter() - start
+
+
+def worker(directory: str, count: int, barrier, results, render: bool):
+    REGISTRY.enable_multiprocess(directory, flush_interval=60)
+    record(count)
+    API_ERRORS.labels("/cgi-bin/message/send", 45009).inc(3)
+    REGISTRY.flush()
+    barrier.wait()
+    if render:
+        text = REGISTRY.render()
+        count_line = next(line for line in text.splitlines() if line.startswith('wxbot_stage_seconds_count{stage="bench"}'))
+        error_line = next(line for line in text.splitlines() if line.startswith("wxbot_api_errors_total"))
+        results.put((int(count_line.split()[-1]), float(error_line.split()[-1])))
+    barrier.wait()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    processes = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    
+    single = record(count)
+    overhead = (single - baseline(count)) / count
+    print(f"单线程: 每次记录 {single / count * 1e9:.0f} ns（含两次perf_counter），"
+          f"记录本身 {overhead * 1e9:.0f} ns")
+    
+    pool = [threading.Thread(target=record, args=(count,)) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    total = CHILD.totals()
+    expected = count * (threads + 1)
+    assert sum(total[:-1]) == expected, f"并发记录丢失: {sum(total[:-1])} != {expected}"
+    print(f"{threads} 线程并发: 共 {expected} 次无丢失，合计吞吐 {elapsed / (count * threads) * 1e9:.0f} ns/次")
+    
+    start = time.perf_counter()
+    for _ in range(100):
+        REGISTRY.render()
+    print(f"输出指标文本: {(time.perf_counter() - start) / 100 * 1e3:.2f} ms/次")
+    
+    multiprocessing.set_start_method("fork")
+    directory = tempfile.mkdtemp()
+    barrier = multiprocessing.Barrier(processes)
+    results = multiprocessing.Queue()
+    # 在同一个父进程下fork，汇总时与gunicorn的worker一样按父进程pid识别同组快照
+    procs = [multiprocessing.Process(target=worker, args=(directory, count, barrier, results, i == 0))
+             for i in range(processes)]
+    for proc in procs:
+        proc.start()
+    observed, errors = results.get(timeout=60)
+    for proc in procs:
+        proc.join()
+    # 每个子进程继承了父进程已记录的次数
+    inherited = sum(total[:-1])
+    assert observed == processes * (count + inherited), observed
+    assert errors == processes * 3, errors
+    print(f"{processes} 个进程汇总: 记录次数与错误码计数正确")
+
+
+if __name__ == "__main__":
+    main()
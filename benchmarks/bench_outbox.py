@@ -0,0 +1,205 @@
+"""
+发件箱基准
+1. 写入：多个线程同时提交消息，每条消息一个事务 vs 组提交 vs 每次提交一批，synchronous=NORMAL/FULL
+2. 重启后投递：子进程写入一批消息后直接退出（模拟worker被杀），新的发送器回收并发送到测试桩，统计投递速率
+3. 重试：接口不可用时按退避重试，恢复后全部投递；次数用尽后标记为失败
+
+用法: python benchmarks/bench_outbox.py [消息数] [提交线程数]
+"""
+
+import os
+import sys
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+import tempfile
+import threading
+import dataclasses
+import multiprocessing
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.wechat_stub import start_stub_server
+from src.wx_stockbot.client import WeChatClient
+from src.wx_stockbot.config import WeChatConfig
+from src.wx_stockbot.dispatcher import SendDispatcher
+from src.wx_stockbot.outbox import Outbox, _SCHEMA
+
+CONTENT = "📈 NVDA 行情报告\n" + "指标 " * 40
+
+
+def run_threads(threads: int, per_thread: int, func) -> float:
+    workers = [threading.Thread(target=lambda: [func() for _ in range(per_thread)]) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def bench_enqueue(root: str, count: int, threads: int):
+    per_thread = count // threads
+    print(f"写入 {per_thread * threads} 条（{threads} 个线程，每次提交等待事务完成）:")
+    for synchronous in ("NORMAL", "FULL"):
+        # 原始做法：共享一个连接，每条消息一个事务
+        conn = sqlite3.connect(os.path.join(root, f"baseline_{synchronous}.db"), isolation_level=None,
+                               check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={synchronous}")
+        conn.executescript(_SCHEMA)
+        lock = threading.Lock()
+        
+        def insert_one():
+            now = time.time()
+            with lock:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute("INSERT INTO outbox (job_id, msgtype, content, user_ids, status, attempts, next_attempt,"
+                             " created_at, updated_at) VALUES (?, 'text', ?, '[\"user1\"]', 'pending', 0, ?, ?, ?)",
+                             (uuid.uuid4().hex, CONTENT, now, now, now))
+                conn.execute("COMMIT")
+        
+        elapsed = run_threads(threads, per_thread, insert_one)
+        conn.close()
+        print(f"  synchronous={synchronous}")
+        print(f"    每条一个事务        {per_thread * threads / elapsed:>9.0f} 条/秒")
+        
+        # 逐条提交（组提交合并并发的写入）；一次提交一批（如群发、定时推送）
+        for label, batch in (("组提交", 1), ("每次提交100条", 100)):
+            outbox = Outbox(os.path.join(root, f"outbox_{synchronous}_{batch}.db"), synchronous=synchronous)
+            outbox.start()
+            calls = per_thread // batch
+            elapsed = run_threads(threads, calls, lambda: outbox.add(
+                [(uuid.uuid4().hex, "text", CONTENT, ["user1"]) for _ in range(batch)]))
+            stats = dict(outbox.stats)
+            outbox.stop()
+            print(f"    {label:<14}{stats['added'] / elapsed:>9.0f} 条/秒，"
+                  f"平均每个事务 {stats['added'] / stats['transactions']:.1f} 条")
+
+
+def write_and_die(path: str, count: int):
+    """子进程：写入消息后不发送直接退出"""
+    outbox = Outbox(path)
+    outbox.start()
+    for i in range(0, count, 500):
+        outbox.add([(uuid.uuid4().hex, "text", f"{CONTENT} #{n}", [f"user{n % 50}"]) for n in range(i, min(count, i + 500))])
+    os._exit(0)
+
+
+def wait_for(predicate, timeout: float = 120, interval: float = 0.01) -> float:
+    start = time.perf_counter()
+    while not predicate():
+        if time.perf_counter() - start > timeout:
+            raise TimeoutError(f"{timeout}秒内未完成")
+        time.sleep(interval)
+    return time.perf_counter() - start
+
+
+def bench_memory_drain(count: int, server, config: WeChatConfig) -> float:
+    """参照：不持久化时发送器的投递速率（测试桩本身的上限）"""
+    dispatcher = SendDispatcher(WeChatClient(config), workers=8, maxsize=count)
+    dispatcher.start()
+    try:
+        start = time.perf_counter()
+        jobs = [dispatcher.submit(f"{CONTENT} #{n}", [f"user{n % 50}"]) for n in range(count)]
+        for job in jobs:
+            job.future.result()
+        return count / (time.perf_counter() - start)
+    finally:
+        dispatcher.stop()
+
+
+def bench_replay(root: str, count: int, server, config: WeChatConfig):
+    memory_rate = bench_memory_drain(count, server, config)
+    path = os.path.join(root, "replay.db")
+    child = multiprocessing.get_context("spawn").Process(target=write_and_die, args=(path, count))
+    child.start()
+    child.join()
+    
+    outbox = Outbox(path)
+    dispatcher = SendDispatcher(WeChatClient(config), workers=8, maxsize=1000, outbox=outbox, poll_interval=0.02)
+    server.stats.update(send=0)
+    dispatcher.start()
+    try:
+        elapsed = wait_for(lambda: outbox.counts().get("delivered", 0) == count)
+        status = dispatcher.get_status()
+    finally:
+        dispatcher.stop()
+    assert server.stats["send"] == count, f"测试桩收到 {server.stats['send']} 条，应为 {count} 条"
+    print(f"重启后投递: 子进程写入 {count} 条后退出，{elapsed:.2f}s 内全部发送（{count / elapsed:.0f} 条/秒，"
+          f"不持久化时 {memory_rate:.0f} 条/秒），恢复 {status['replayed']} 条，测试桩收到 {server.stats['send']} 条，"
+          f"认领和确认共 {outbox.stats['transactions']} 个事务")
+
+
+def closed_port_url() -> str:
+    """一个没有监听的本地端口，连接会被拒绝"""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return f"http://127.0.0.1:{port}"
+
+
+def bench_retry(root: str, server, config: WeChatConfig):
+    down = dataclasses.replace(config, api_base=closed_port_url())
+    client = WeChatClient(down)
+    outbox = Outbox(os.path.join(root, "retry.db"))
+    dispatcher = SendDispatcher(client, workers=4, outbox=outbox, retry_base=0.2, poll_interval=0.02)
+    dispatcher.start()
+    try:
+        # 连接被拒绝时传输层自身会重试，每次发送约0.6秒
+        jobs = [dispatcher.submit(f"重试 #{i}", ["user1"]) for i in range(8)]
+        wait_for(lambda: all(job.attempts >= 3 for job in jobs), timeout=30)
+        statuses = {job.status for job in jobs}
+        # 接口恢复
+        server.stats.update(send=0)
+        recovered = time.perf_counter()
+        client.config = config
+        results = [job.future.result(timeout=10) for job in jobs]
+        elapsed = time.perf_counter() - recovered
+    finally:
+        dispatcher.stop()
+    assert all(results) and server.stats["send"] == len(jobs)
+    attempts = sorted(job.attempts for job in jobs)
+    print(f"重试: 接口不可用时任务状态 {sorted(statuses)}；恢复后 {elapsed:.2f}s 内全部投递，"
+          f"发送次数 {attempts[0]}~{attempts[-1]}，重试 {dispatcher.get_status()['retried']} 次")
+    
+    client = WeChatClient(down)
+    outbox = Outbox(os.path.join(root, "give_up.db"))
+    dispatcher = SendDispatcher(client, workers=1, outbox=outbox, max_attempts=3, retry_base=0.05, poll_interval=0.02)
+    dispatcher.start()
+    try:
+        job = dispatcher.submit("放弃", ["user1"])
+        result = job.future.result(timeout=10)
+        counts = outbox.counts()
+    finally:
+        dispatcher.stop()
+    assert result is False and counts == {"failed": 1}
+    print(f"放弃: 发送 {job.attempts} 次均失败后任务状态 {job.status}，发件箱 {counts}，原因: {job.last_error}")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    # 重试和放弃的日志是预期的
+    logging.basicConfig(level=logging.CRITICAL)
+    root = tempfile.mkdtemp()
+    
+    bench_enqueue(root, count, threads)
+    
+    server, base_url = start_stub_server()
+    config = WeChatConfig("corp", "secret", "1000001", ["user1"], [], [],
+                          api_base=base_url, token_cache_path="memory", rate_limit_path="memory",
+                          api_rate_per_minute=0, recipient_rate_per_minute=0, outbox_path="memory")
+    try:
+        bench_replay(root, count, server, config)
+        bench_retry(root, server, config)
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
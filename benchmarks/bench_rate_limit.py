@@ -0,0 +1,81 @@
+"""
+接口限速基准测试
+多个进程（模拟gunicorn worker）同时突发发送，测试桩按固定频率限流（超限返回45009），
+对比不限速与共享文件令牌桶限速时的失败数、耗时与排队等待
+
+用法: python benchmarks/bench_rate_limit.py [每进程消息数] [进程数] [每秒上限]
+"""
+
+import os
+import sys
+import time
+import tempfile
+import multiprocessing
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.wechat_stub import start_stub_server
+from src.wx_stockbot.config import WeChatConfig
+from src.wx_stockbot.client import WeChatClient
+from src.wx_stockbot.rate_limit import BucketSpec, RateLimiter, FileRateLimiter
+
+
+def worker(base_url: str, count: int, limit_path: str, rate: float, results):
+    config = WeChatConfig("corp", "secret", "1000001", ["user1"], [], [],
+                          api_base=base_url, token_cache_path="memory")
+    if limit_path:
+        # 突发容量取较小值，保证多个进程合计也不超过测试桩的突发上限
+        limiter = FileRateLimiter(limit_path, endpoint=BucketSpec(rate, 5), max_wait=60)
+    else:
+        limiter = RateLimiter()
+    client = WeChatClient(config, rate_limiter=limiter)
+    ok = 0
+    for i in range(count):
+        # 每条消息发给不同成员，只测试接口级限速
+        if client.send_text_message(f"bench {i}", [f"user{os.getpid()}_{i}"]):
+            ok += 1
+    stats = limiter.get_status()
+    results.put((ok, stats["total_wait"], stats["penalties"]))
+    client.close()
+
+
+def run(label: str, base_url: str, server, count: int, processes: int, rate: float, limit_path: str = ""):
+    server.stats.update(send=0, throttled=0)
+    results = multiprocessing.Queue()
+    start = time.perf_counter()
+    procs = [multiprocessing.Process(target=worker, args=(base_url, count, limit_path, rate, results))
+             for _ in range(processes)]
+    for proc in procs:
+        proc.start()
+    outcomes = [results.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+    elapsed = time.perf_counter() - start
+    ok = sum(o[0] for o in outcomes)
+    wait = sum(o[1] for o in outcomes)
+    penalties = sum(o[2] for o in outcomes)
+    print(f"{label:<10} 成功 {ok}/{count * processes}, 服务端限流 {server.stats['throttled']} 次, "
+          f"降速 {penalties} 次, 耗时 {elapsed:.2f}s, 累计排队 {wait:.2f}s")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    rate = float(sys.argv[3]) if len(sys.argv) > 3 else 50
+    
+    multiprocessing.set_start_method("fork")
+    server, base_url = start_stub_server()
+    server.send_quota = (rate, 10)
+    limit_path = os.path.join(tempfile.mkdtemp(), "ratelimit.json")
+    
+    try:
+        run("不限速", base_url, server, count, processes, rate)
+        time.sleep(1)
+        run("共享令牌桶", base_url, server, count, processes, rate, limit_path)
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+定时调度器基准测试
+1. cron / 交易日历的下一次触发时间与逐分钟枚举的结果一致
+2. 周期漂移：sleep循环（发送后再sleep）与调度器在发送耗时下的累计偏移
+3. 慢任务不推迟其他任务；上一次未完成时跳过而不是堆积
+4. 大量任务时的触发延迟
+
+用法: python benchmarks/bench_scheduler.py [任务数] [运行秒数]
+"""
+
+import sys
+import time
+import random
+import logging
+import threading
+from pathlib import Path
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.wx_stockbot.scheduler import (
+    Scheduler, IntervalSchedule, CronSchedule, MarketSchedule, TradingCalendar
+)
+
+
+def brute_next(schedule, after: datetime) -> datetime:
+    """逐分钟枚举"""
+    t = after.astimezone(schedule.tz).replace(second=0, microsecond=0) + timedelta(minutes=1)
+    while True:
+        day = t.date()
+        if schedule._day_matches(day) and t.hour in schedule.hours and t.minute in schedule.minutes:
+            return t
+        t += timedelta(minutes=1)
+
+
+def verify_calendars():
+    calendar = TradingCalendar("America/New_York", ["2025-07-04", "2025-12-25"])
+    rng = random.Random(1)
+    exprs = ["*/15 * * * *", "5 16 * * 1-5", "0 9-17/2 * * *", "30 3 1,15 * *", "0 12 * * 0", "10 16 * * *"]
+    start = datetime(2025, 3, 1, tzinfo=timezone.utc)
+    for expr in exprs:
+        for cal in (None, calendar):
+            schedule = CronSchedule(expr, "America/New_York", calendar=cal)
+            if cal and expr.endswith(" 0"):
+                # 只在周日触发，交易日历下永远不会触发
+                try:
+                    schedule.next_time(start)
+                    raise AssertionError("应当报错")
+                except ValueError:
+                    continue
+            for _ in range(30):
+                after = start + timedelta(minutes=rng.randrange(0, 400 * 24 * 60))
+                assert schedule.next_time(after) == brute_next(schedule, after), (expr, after)
+    
+    market = MarketSchedule(["09:35", "16:05"], calendar)
+    # 7月3日周四16:05之后的下一次是7月7日周一（7月4日休市，周末不交易）
+    after = datetime(2025, 7, 3, 16, 5, tzinfo=calendar.tz)
+    assert market.next_time(after) == datetime(2025, 7, 7, 9, 35, tzinfo=calendar.tz)
+    assert market.next_time(after - timedelta(seconds=1)) == after
+
+
+def drift(interval: float, latency: float, ticks: int):
+    """第ticks次发送相对理想节奏的偏移：返回 (sleep循环, 调度器)，单位秒"""
+    times = []
+    while len(times) < ticks:
+        times.append(time.monotonic())
+        time.sleep(latency)  # 模拟发送耗时
+        time.sleep(interval)
+    loop_drift = times[-1] - (times[0] + (ticks - 1) * interval)
+    
+    scheduler = Scheduler(workers=2)
+    fired = []
+    done = threading.Event()
+    
+    def send():
+        fired.append(time.monotonic())
+        time.sleep(latency)
+        if len(fired) >= ticks:
+            done.set()
+    
+    job = scheduler.add_job("drift", send, IntervalSchedule(interval))
+    first_deadline = job.deadline
+    done.wait(ticks * interval * 3)
+    scheduler.stop()
+    sched_drift = fired[ticks - 1] - (first_deadline + (ticks - 1) * interval)
+    return loop_drift, sched_drift
+
+
+def overlap(interval: float, ticks: int):
+    """慢任务（耗时为间隔的3倍）与快任务同时运行"""
+    scheduler = Scheduler(workers=4)
+    lags = []
+    
+    def fast():
+        lags.append(time.monotonic() - expected[0])
+        expected[0] += interval
+    
+    expected = [0.0]
+    slow_job = scheduler.add_job("slow", lambda: time.sleep(interval * 3), IntervalSchedule(interval))
+    fast_job = scheduler.add_job("fast", fast, IntervalSchedule(interval))
+    expected[0] = fast_job.deadline
+    time.sleep(interval * (ticks + 0.5))
+    scheduler.stop()
+    return slow_job, lags
+
+
+def load(count: int, seconds: float):
+    scheduler = Scheduler(workers=8)
+    lags = []
+    lock = threading.Lock()
+    rng = random.Random(2)
+    
+    def make(job_id: str):
+        def run():
+            job = scheduler.get_job(job_id)
+            with lock:
+                lags.append(time.monotonic() - (job.deadline - job.schedule.seconds))
+        return run
+    
+    for i in range(count):
+        scheduler.add_job(f"j{i}", make(f"j{i}"), IntervalSchedule(rng.uniform(0.2, 1.0)))
+    time.sleep(seconds)
+    scheduler.stop()
+    return scheduler.stats, sorted(lags)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    
+    # 慢任务测试会产生大量"跳过本次"的警告
+    logging.basicConfig(level=logging.ERROR)
+    verify_calendars()
+    print("cron / 交易日历的下一次触发时间与逐分钟枚举一致")
+    
+    interval, latency, ticks = 0.1, 0.03, 30
+    loop_drift, sched_drift = drift(interval, latency, ticks)
+    print(f"周期漂移（间隔{interval * 1000:.0f}ms，发送耗时{latency * 1000:.0f}ms，{ticks}次）: "
+          f"sleep循环 {loop_drift * 1000:.0f} ms，调度器 {sched_drift * 1000:.1f} ms")
+    
+    slow_job, lags = overlap(0.1, 20)
+    print(f"慢任务: 执行 {slow_job.runs} 次，跳过 {slow_job.overlap_skipped} 次；"
+          f"同时运行的快任务最大延迟 {max(lags) * 1000:.1f} ms")
+    
+    stats, lags = load(count, seconds)
+    p50, p99 = lags[len(lags) // 2], lags[int(len(lags) * 0.99)]
+    print(f"{count} 个任务运行 {seconds:g}s: 触发 {stats['fired']} 次 ({stats['fired'] / seconds:,.0f} 次/s)，"
+          f"延迟 p50 {p50 * 1000:.1f} ms / p99 {p99 * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
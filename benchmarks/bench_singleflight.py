@@ -0,0 +1,79 @@
+"""
+并发请求合并基准测试
+多个线程同时发送同一条"信息更新"指令（模拟一个gunicorn worker的线程池收到的突发），
+对比不合并与合并时的报告计算次数和总耗时，并核对所有线程拿到的报告相同
+
+用法: python benchmarks/bench_singleflight.py [线程数] [轮数]
+"""
+
+import sys
+import time
+import tempfile
+import threading
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.bench_indicators import generate
+from src.wx_stockbot.bot import WeChatBot
+from src.wx_stockbot.config import WeChatConfig
+from src.wx_stockbot.market_data import Bars
+from src.wx_stockbot.market_store import MarketStore
+
+
+def burst(bot: WeChatBot, threads: int, message: str) -> tuple[float, set]:
+    """所有线程在同一时刻发送同一条指令"""
+    barrier = threading.Barrier(threads)
+    replies = [None] * threads
+    
+    def run(i: int):
+        barrier.wait()
+        replies[i] = bot.handle_incoming_message(message, f"user{i}")
+    
+    workers = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start, set(replies)
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    days = 2520
+    
+    root = tempfile.mkdtemp()
+    store = MarketStore(root)
+    high, low, close = generate(1, days, seed=7)
+    dates = np.datetime64("2015-01-01") + np.arange(days)
+    store.append(Bars("NVDA", dates, close[0], high[0], low[0], close[0], np.full(days, 1e6)))
+    config = WeChatConfig("corp", "secret", "1000001", ["user1"], [], [],
+                          token_cache_path="memory", market_store_dir=root, report_cache_size=0,
+                          leader_lock_path="memory", job_store_path="memory", outbox_path="memory")
+    
+    for coalesce in (False, True):
+        bot = WeChatBot(config)
+        if not coalesce:
+            bot.register_message_handler("信息更新", bot._handle_info_update)
+        total = 0.0
+        for i in range(rounds):
+            # 报告缓存已关闭，每轮都要重新计算；大小写和空白不同的指令也会合并
+            elapsed, replies = burst(bot, threads, "信息更新 " + ("nvda" if i % 2 else " NVDA "))
+            assert len(replies) == 1 and None not in replies, "并发请求得到的报告不一致"
+            total += elapsed
+        computed = bot.report_cache.stats["misses"]
+        label = "合并" if coalesce else "不合并"
+        print(f"{label:<4} {threads} 线程 × {rounds} 轮: 报告计算 {computed} 次, "
+              f"平均每轮 {total / rounds * 1000:.1f} ms")
+        if coalesce:
+            print(f"合并统计: {bot.singleflight.get_status()}")
+        bot.dispatcher.stop()
+        bot.client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+启动预热基准
+测试桩的每个接口调用增加固定延迟（模拟到企业微信的网络往返），比较worker启动后第一个回调的等待时间：
+原先第一个请求在before_request中创建机器人、获取令牌、发送"机器人启动测试"后才应答，
+"信息更新"的回复还要再计算一次报告；现在这些都在worker加载应用后由后台线程完成，/ready 变为200后接收流量
+
+用法: python benchmarks/bench_startup.py [接口延迟毫秒]
+"""
+
+import os
+import sys
+import json
+import time
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.bench_indicators import generate
+from benchmarks.wechat_stub import start_stub_server
+from src.wx_stockbot.market_data import Bars
+from src.wx_stockbot.market_store import MarketStore
+
+
+def prepare_store(root: str, days: int = 2520):
+    store = MarketStore(root)
+    high, low, close = generate(1, days, seed=7)
+    dates = np.datetime64("2015-01-01") + np.arange(days)
+    store.append(Bars("NVDA", dates, close[0], high[0], low[0], close[0], np.full(days, 1e6)))
+
+
+def wait_for(predicate, timeout: float = 30) -> float:
+    start = time.perf_counter()
+    while not predicate():
+        if time.perf_counter() - start > timeout:
+            raise TimeoutError(f"{timeout}秒内未完成")
+        time.sleep(0.001)
+    return time.perf_counter() - start
+
+
+def legacy_first_request(config) -> tuple[float, float]:
+    """原先的第一个"信息更新"回调：请求先等待创建机器人、获取令牌、发送启动测试消息，
+    应答后再计算报告并回复；返回 (请求等待, 回复送达) 耗时"""
+    from src.wx_stockbot.bot import WeChatBot
+    started = time.perf_counter()
+    bot = WeChatBot(config)
+    bot.client.start_token_refresher()
+    bot.send_message("机器人启动测试")
+    answered = time.perf_counter() - started
+    report = bot.handle_incoming_message("信息更新", "user1")
+    bot.client.send_text_message(report, ["user1"])
+    replied = time.perf_counter() - started
+    bot.client.stop_token_refresher()
+    bot.leader.stop()
+    return answered, replied
+
+
+def main():
+    latency = (float(sys.argv[1]) if len(sys.argv) > 1 else 150) / 1000
+    root = tempfile.mkdtemp()
+    prepare_store(os.path.join(root, "store"))
+    
+    server, base_url = start_stub_server(latency=latency)
+    os.environ.update({
+        "WECHAT_CORPID": "ww_bench", "WECHAT_CORPSECRET": "secret", "WECHAT_AGENTID": "1000001",
+        "WECHAT_USER_IDS": "user1", "WECHAT_TOKEN": "bench_token",
+        "WECHAT_ENCODING_AES_KEY": "abcdefghijklmnopqrstuvwxyz0123456789ABCDEFG",
+        "WECHAT_API_BASE": base_url, "WECHAT_TOKEN_CACHE": "memory",
+        "WECHAT_RATE_LIMIT_PATH": "memory", "WECHAT_LEADER_LOCK": "memory", "WECHAT_JOB_STORE": "memory",
+        "WECHAT_OUTBOX": "memory", "WECHAT_MARKET_STORE": os.path.join(root, "store"),
+        "WECHAT_METRICS_DIR": "memory", "WECHAT_LOG_LEVEL": "WARNING"
+    })
+    
+    # worker加载应用：启动预热在后台进行
+    started = time.perf_counter()
+    import app
+    loaded = time.perf_counter() - started
+    client = app.app.test_client()
+    not_ready = client.get("/ready").status_code
+    ready_after = loaded + wait_for(lambda: client.get("/ready").status_code == 200)
+    status = client.get("/ready").get_json()
+    steps = ", ".join(f"{name} {step['duration_ms']:.0f}ms" for name, step in status["steps"].items())
+    print(f"接口延迟 {latency * 1000:.0f} ms")
+    print(f"加载应用 {loaded * 1000:.0f} ms（/ready: {not_ready}），{ready_after * 1000:.0f} ms 后就绪: {steps}")
+    
+    # 就绪后的第一个回调：请求立即应答，回复由后台发送
+    server.stats.update(send=0)
+    message = json.dumps({"MsgType": "text", "Content": "信息更新", "FromUserName": "user1"})
+    started = time.perf_counter()
+    response = client.post("/webhook", data=message, content_type="application/json")
+    answered = time.perf_counter() - started
+    replied = answered + wait_for(lambda: server.stats["send"] >= 1)
+    assert response.status_code == 200
+    print(f"预热后第一个回调: 请求 {answered * 1000:.1f} ms 应答，{replied * 1000:.0f} ms 后回复送达")
+    
+    answered, replied = legacy_first_request(app.load_config())
+    print(f"原先第一个回调: 请求 {answered * 1000:.0f} ms 应答，{replied * 1000:.0f} ms 后回复送达")
+    app.shutdown()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
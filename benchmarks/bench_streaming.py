@@ -0,0 +1,96 @@
+"""
+增量指标基准测试
+先核对增量结果与整段重算（compute_indicators）一致，包括盘中peek和快照/恢复，
+再测试多只股票逐根K线更新的吞吐量，并与每根K线都整段重算对比
+
+用法: python benchmarks/bench_streaming.py [股票数] [历史交易日数] [更新K线数]
+"""
+
+import sys
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.bench_indicators import generate
+from src.wx_stockbot.indicators import compute_indicators
+from src.wx_stockbot.market_data import Bars
+from src.wx_stockbot.streaming import IndicatorState, IndicatorStreams
+
+
+def make_bars(symbol: str, high, low, close) -> Bars:
+    dates = np.datetime64("2015-01-01") + np.arange(len(close))
+    return Bars(symbol, dates, close.copy(), high, low, close, np.ones(len(close)))
+
+
+def verify(days: int = 600, symbols: int = 5):
+    """逐根K线核对增量结果、peek结果和快照恢复后的结果"""
+    high, low, close = generate(symbols, days, seed=3)
+    # 加入价格持平的区间，覆盖最高价等于最低价的分支
+    high[:, 100:120] = low[:, 100:120] = close[:, 100:120] = close[:, 100:101]
+    expected = compute_indicators(high, low, close)
+    for i in range(symbols):
+        state = IndicatorState(f"S{i}")
+        for t in range(days):
+            peeked = state.peek(high[i, t], low[i, t], close[i, t])
+            values = state.update(high[i, t], low[i, t], close[i, t])
+            np.testing.assert_allclose([peeked[k] for k in values], list(values.values()), rtol=1e-12,
+                                       equal_nan=True, err_msg=f"peek 与 update 不一致: t={t}")
+            for name, value in values.items():
+                # SAR第一根K线要等第二根到达才能确定
+                if t == 0 and name.startswith("sar"):
+                    continue
+                np.testing.assert_allclose(value, expected[name][i, t], rtol=1e-9, atol=1e-9,
+                                           err_msg=f"{name} t={t} 与整段重算不一致")
+            if t == days // 2:
+                # 快照经JSON往返后继续更新
+                state = IndicatorState.restore(json.loads(json.dumps(state.snapshot())))
+    
+    # 与行情文件同步：只加入新K线
+    streams = IndicatorStreams()
+    bars = make_bars("SYNC", high[0], low[0], close[0])
+    streams.sync(make_bars("SYNC", high[0, :-5], low[0, :-5], close[0, :-5]))
+    state = streams.sync(bars)
+    assert streams.stats["full_builds"] == 1 and streams.stats["incremental"] == 1
+    for name, value in state.current.items():
+        np.testing.assert_allclose(value, expected[name][0, -1], rtol=1e-9, atol=1e-9)
+
+
+def main():
+    symbols = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    history = int(sys.argv[2]) if len(sys.argv) > 2 else 250
+    updates = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    
+    verify()
+    print("增量结果与整段重算一致（含peek、快照恢复、文件同步）")
+    
+    high, low, close = generate(symbols, history + updates, seed=11)
+    streams = IndicatorStreams()
+    start = time.perf_counter()
+    for i in range(symbols):
+        streams.sync(make_bars(f"S{i}", high[i, :history], low[i, :history], close[i, :history]))
+    warmup = time.perf_counter() - start
+    
+    h, l, c = high[:, history:].tolist(), low[:, history:].tolist(), close[:, history:].tolist()
+    start = time.perf_counter()
+    for t in range(updates):
+        for i in range(symbols):
+            streams.update(f"S{i}", h[i][t], l[i][t], c[i][t])
+    elapsed = time.perf_counter() - start
+    total = symbols * updates
+    print(f"增量更新: {symbols} 只 × {updates} 根K线, {elapsed:.2f}s, {total / elapsed:,.0f} 次/s "
+          f"({elapsed / total * 1e6:.1f} µs/次); 预热 {history} 根历史 {warmup:.2f}s")
+    
+    sample = min(symbols, 200)
+    start = time.perf_counter()
+    for i in range(sample):
+        compute_indicators(high[i, :history + 1], low[i, :history + 1], close[i, :history + 1])
+    recompute = (time.perf_counter() - start) / sample
+    print(f"整段重算({history + 1} 根): {recompute * 1e6:.0f} µs/次, 增量更新快 {recompute / (elapsed / total):.0f} 倍")
+
+
+if __name__ == "__main__":
+    main()
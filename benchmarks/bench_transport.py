@@ -0,0 +1,55 @@
+"""
+HTTP传输层基准测试
+对比每次调用新建连接（requests.post）与连接池长连接（HttpTransport）的吞吐量
+
+用法: python benchmarks/bench_transport.py [请求数] [并发数]
+"""
+
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.wechat_stub import start_stub_server
+from src.wx_stockbot.transport import HttpTransport, TransportConfig
+
+
+def run(label: str, send, total: int, concurrency: int):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda _: send(), range(total)))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<16} {total} 次请求, 并发 {concurrency}: {elapsed:.3f}s, {total / elapsed:,.0f} req/s")
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    
+    server, base_url = start_stub_server()
+    url = f"{base_url}/cgi-bin/message/send"
+    payload = {"touser": "user1", "msgtype": "text", "agentid": "1000001", "text": {"content": "bench"}}
+    params = {"access_token": "stub_token"}
+    
+    def without_pool():
+        requests.post(url, params=params, json=payload, timeout=10).json()
+    
+    transport = HttpTransport(TransportConfig(pool_maxsize=concurrency))
+    
+    def with_pool():
+        transport.post(url, params=params, json=payload).json()
+    
+    try:
+        run("无连接池", without_pool, total, concurrency)
+        run("连接池", with_pool, total, concurrency)
+    finally:
+        transport.close()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
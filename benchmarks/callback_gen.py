@@ -0,0 +1,90 @@
+"""
+企业微信回调生成器
+生成与企业微信相同格式、签名正确的加密回调（外层 <xml><Encrypt>...</Encrypt></xml> + URL参数），
+以及URL验证请求，供压测和离线调试使用；每条消息的MsgId不同，不会被回调去重丢弃
+
+用法: python benchmarks/callback_gen.py <Token> <EncodingAESKey> <CorpID> [消息内容]
+      输出一条回调的curl命令（目标地址 http://127.0.0.1:5000/webhook）
+"""
+
+import sys
+import time
+import random
+import itertools
+from dataclasses import dataclass
+from pathlib import Path
+from urllib.parse import urlencode
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.wx_stockbot.crypto import WeChatCrypto
+
+
+@dataclass
+class SignedCallback:
+    """一个回调请求"""
+    # URL参数：msg_signature、timestamp、nonce（URL验证另有echostr）
+    params: dict
+    # 请求体（URL验证为空）
+    body: bytes
+    # 明文消息（用于核对）
+    plaintext: str
+    
+    @property
+    def query(self) -> str:
+        return urlencode(self.params)
+
+
+class CallbackGenerator:
+    """按应用的Token、EncodingAESKey和企业ID生成加密回调"""
+    
+    def __init__(self, token: str, encoding_aes_key: str, corpid: str, agentid: str = "1000001"):
+        self.corpid = corpid
+        self.agentid = agentid
+        self.crypto = WeChatCrypto(token, encoding_aes_key, corpid)
+        # MsgId从当前时间开始递增，多次运行之间也不重复
+        self._msg_ids = itertools.count(time.time_ns() // 1000)
+    
+    def _envelope(self, plaintext: str) -> SignedCallback:
+        encrypted = self.crypto.encrypt(plaintext)
+        timestamp, nonce = str(int(time.time())), str(random.randrange(10 ** 9, 10 ** 10))
+        body = (f"<xml><ToUserName><![CDATA[{self.corpid}]]></ToUserName>"
+                f"<Encrypt><![CDATA[{encrypted}]]></Encrypt>"
+                f"<AgentID><![CDATA[{self.agentid}]]></AgentID></xml>").encode("utf-8")
+        params = {"msg_signature": self.crypto.sign(timestamp, nonce, encrypted), "timestamp": timestamp, "nonce": nonce}
+        return SignedCallback(params, body, plaintext)
+    
+    def text(self, content: str, user_id: str = "user1") -> SignedCallback:
+        """文本消息回调"""
+        plaintext = (f"<xml><ToUserName><![CDATA[{self.corpid}]]></ToUserName>"
+                     f"<FromUserName><![CDATA[{user_id}]]></FromUserName>"
+                     f"<CreateTime>{int(time.time())}</CreateTime><MsgType><![CDATA[text]]></MsgType>"
+                     f"<Content><![CDATA[{content}]]></Content><MsgId>{next(self._msg_ids)}</MsgId>"
+                     f"<AgentID>{self.agentid}</AgentID></xml>")
+        return self._envelope(plaintext)
+    
+    def event(self, event: str, user_id: str = "user1") -> SignedCallback:
+        """事件回调（如subscribe），按FromUserName+CreateTime去重"""
+        plaintext = (f"<xml><ToUserName><![CDATA[{self.corpid}]]></ToUserName>"
+                     f"<FromUserName><![CDATA[{user_id}]]></FromUserName>"
+                     f"<CreateTime>{int(time.time())}</CreateTime><MsgType><![CDATA[event]]></MsgType>"
+                     f"<Event><![CDATA[{event}]]></Event><AgentID>{self.agentid}</AgentID></xml>")
+        return self._envelope(plaintext)
+    
+    def url_verification(self) -> SignedCallback:
+        """URL验证请求（GET），应用应原样返回解密后的echostr"""
+        echo = str(random.randrange(10 ** 15, 10 ** 16))
+        encrypted = self.crypto.encrypt(echo)
+        timestamp, nonce = str(int(time.time())), str(random.randrange(10 ** 9, 10 ** 10))
+        params = {"msg_signature": self.crypto.sign(timestamp, nonce, encrypted), "timestamp": timestamp,
+                  "nonce": nonce, "echostr": encrypted}
+        return SignedCallback(params, b"", echo)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print(__doc__)
+        sys.exit(1)
+    callback = CallbackGenerator(*sys.argv[1:4]).text(sys.argv[4] if len(sys.argv) > 4 else "信息更新")
+    print(f"curl -X POST 'http://127.0.0.1:5000/webhook?{callback.query}' "
+          f"-H 'Content-Type: text/xml' --data-binary '{callback.body.decode()}'")
@@ -0,0 +1,309 @@
+"""
+离线压测
+在本机启动企业微信API测试桩和gunicorn运行的真实app，用多个客户端进程持续发送请求，
+统计 /webhook（签名正确的加密回调）和 /send 的吞吐量与p50/p90/p99延迟，结果保存为JSON，
+可用 --compare 与之前的结果对比，跟踪性能回退。不需要网络连接
+
+用法: python benchmarks/loadtest.py [--workers 2] [--threads 8] [--concurrency 32] [--duration 10]
+                                    [--scenarios webhook,send] [--latency-ms 50] [--error-rate 0]
+                                    [--output 结果.json] [--compare 之前的结果.json]
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import argparse
+import platform
+import tempfile
+import subprocess
+import threading
+import http.client
+import multiprocessing
+import urllib.request
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from benchmarks.bench_startup import prepare_store
+from benchmarks.callback_gen import CallbackGenerator
+
+HOST = "127.0.0.1"
+TOKEN = "loadtest_token"
+AES_KEY = "abcdefghijklmnopqrstuvwxyz0123456789ABCDEFG"
+CORPID = "ww_loadtest"
+AGENTID = "1000001"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+def get_json(url: str, timeout: float = 2) -> tuple[int, dict]:
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, {}
+    except OSError:
+        return 0, {}
+
+
+def wait_until(predicate, timeout: float, what: str):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"{timeout}秒内{what}")
+        time.sleep(0.1)
+
+
+def start_stub(args, log) -> tuple[subprocess.Popen, str]:
+    port = free_port()
+    proc = subprocess.Popen(
+        [sys.executable, str(ROOT / "benchmarks" / "wechat_stub.py"), "--port", str(port),
+         "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+         "--error-rate", str(args.error_rate), "--http-error-rate", str(args.http_error_rate)],
+        stdout=log, stderr=subprocess.STDOUT
+    )
+    base_url = f"http://{HOST}:{port}"
+    wait_until(lambda: get_json(f"{base_url}/stats")[0] == 200, 10, "测试桩未启动")
+    return proc, base_url
+
+
+def app_env(args, run_dir: str, api_base: str) -> dict:
+    """app的环境变量：共享文件都放在本次运行的临时目录中，不受之前运行的影响"""
+    env = dict(os.environ)
+    env.update({
+        "WECHAT_CORPID": CORPID, "WECHAT_CORPSECRET": "secret", "WECHAT_AGENTID": AGENTID,
+        "WECHAT_USER_IDS": "user1", "WECHAT_TOKEN": TOKEN, "WECHAT_ENCODING_AES_KEY": AES_KEY,
+        "WECHAT_API_BASE": api_base, "WECHAT_MARKET_STORE": os.path.join(run_dir, "store"),
+        "WECHAT_TOKEN_CACHE": os.path.join(run_dir, "token.json"),
+        "WECHAT_RATE_LIMIT_PATH": os.path.join(run_dir, "rate_limit"),
+        "WECHAT_LEADER_LOCK": os.path.join(run_dir, "leader.lock"),
+        "WECHAT_JOB_STORE": os.path.join(run_dir, "jobs.json"),
+        "WECHAT_OUTBOX": os.path.join(run_dir, "outbox.db"),
+        "WECHAT_DEDUP_PATH": os.path.join(run_dir, "dedup"),
+        "WECHAT_METRICS_DIR": os.path.join(run_dir, "metrics"),
+        "WECHAT_LOG_LEVEL": args.log_level,
+        "WECHAT_PASSIVE_REPLY_WINDOW": str(args.passive_reply_window),
+    })
+    if not args.keep_rate_limits:
+        # 测试app本身的处理能力，不让企业微信的频率限制成为瓶颈
+        env.update({"WECHAT_API_RATE_PER_MINUTE": "0", "WECHAT_RECIPIENT_RATE_PER_MINUTE": "0"})
+    return env
+
+
+def start_app(args, env: dict, log) -> tuple[subprocess.Popen, int]:
+    port = free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "app:app", "--workers", str(args.workers), "--threads", str(args.threads),
+         "--bind", f"{HOST}:{port}", "--log-level", "warning"],
+        cwd=str(ROOT), env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    # 请求会分到不同worker，连续多次就绪才认为所有worker都已预热
+    streak = [0]
+    
+    def all_ready() -> bool:
+        if proc.poll() is not None:
+            raise RuntimeError(f"gunicorn已退出（{proc.returncode}），见日志")
+        streak[0] = streak[0] + 1 if get_json(f"http://{HOST}:{port}/ready")[0] == 200 else 0
+        return streak[0] >= args.workers * 3
+    
+    wait_until(all_ready, 60, "app未就绪")
+    return proc, port
+
+
+def build_request(scenario: str, generator: CallbackGenerator, message: str, seq: int):
+    """返回 (方法, 路径, 请求体, 请求头)"""
+    if scenario == "webhook":
+        callback = generator.text(message, f"user{seq % 100}")
+        return "POST", f"/webhook?{callback.query}", callback.body, {"Content-Type": "text/xml"}
+    body = json.dumps({"content": f"{message} #{seq}", "user_ids": ["user1"]}).encode("utf-8")
+    return "POST", "/send", body, {"Content-Type": "application/json"}
+
+
+def client_process(port: int, scenario: str, threads: int, message: str,
+                   start_at: float, warmup: float, duration: float, results):
+    """一个客户端进程：threads个保持连接的线程循环发送，返回测量窗口内每个请求的 (延迟, 状态码)"""
+    records, lock = [], threading.Lock()
+    measure_from, end = start_at + warmup, start_at + warmup + duration
+    
+    def loop(index: int):
+        generator = CallbackGenerator(TOKEN, AES_KEY, CORPID, AGENTID)
+        conn = http.client.HTTPConnection(HOST, port, timeout=30)
+        local, seq = [], index * 10 ** 7
+        while time.time() < start_at:
+            time.sleep(0.001)
+        while True:
+            method, path, body, headers = build_request(scenario, generator, message, seq)
+            seq += 1
+            sent_at = time.time()
+            if sent_at >= end:
+                break
+            started = time.perf_counter()
+            try:
+                conn.request(method, path, body, headers)
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                status = 0
+                conn.close()
+                conn = http.client.HTTPConnection(HOST, port, timeout=30)
+            latency = time.perf_counter() - started
+            if sent_at >= measure_from:
+                local.append((latency, status))
+        conn.close()
+        with lock:
+            records.extend(local)
+    
+    workers = [threading.Thread(target=loop, args=(os.getpid() * 100 + i,)) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    results.put(records)
+
+
+def summarize(records: list, duration: float) -> dict:
+    latencies = np.array([latency for latency, _ in records]) * 1000
+    statuses: dict[str, int] = {}
+    for _, status in records:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    ok = sum(count for status, count in statuses.items() if status.startswith("2"))
+    summary = {"requests": len(records), "ok": ok, "errors": len(records) - ok,
+               "throughput_rps": round(len(records) / duration, 1), "status": statuses}
+    if len(latencies):
+        summary["latency_ms"] = {
+            "mean": round(float(latencies.mean()), 2),
+            **{f"p{q}": round(float(np.percentile(latencies, q)), 2) for q in (50, 90, 99)},
+            "max": round(float(latencies.max()), 2)
+        }
+    return summary
+
+
+def run_scenario(args, port: int, stub_url: str, scenario: str) -> dict:
+    processes = max(1, min(args.processes, args.concurrency))
+    per_process = [args.concurrency // processes + (i < args.concurrency % processes) for i in range(processes)]
+    results = multiprocessing.Queue()
+    stub_before = get_json(f"{stub_url}/stats")[1]
+    start_at = time.time() + 1.0
+    clients = [multiprocessing.Process(target=client_process, args=(
+        port, scenario, threads, args.message, start_at, args.warmup, args.duration, results))
+        for threads in per_process]
+    for proc in clients:
+        proc.start()
+    records = []
+    for _ in clients:
+        records.extend(results.get())
+    for proc in clients:
+        proc.join()
+    stub_after = get_json(f"{stub_url}/stats")[1]
+    summary = summarize(records, args.duration)
+    summary["stub_calls"] = {key: stub_after.get(key, 0) - stub_before.get(key, 0) for key in stub_after}
+    return summary
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=str(ROOT), capture_output=True,
+                              text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def print_summary(results: dict):
+    print(f"{'场景':<8} {'请求数':>8} {'错误':>6} {'吞吐(次/秒)':>12} {'p50(ms)':>9} {'p90(ms)':>9} {'p99(ms)':>9} {'max(ms)':>9}")
+    for name, summary in results["scenarios"].items():
+        latency = summary.get("latency_ms", {})
+        print(f"{name:<8} {summary['requests']:>8} {summary['errors']:>6} {summary['throughput_rps']:>12.1f} "
+              f"{latency.get('p50', 0):>9.2f} {latency.get('p90', 0):>9.2f} {latency.get('p99', 0):>9.2f} "
+              f"{latency.get('max', 0):>9.2f}")
+
+
+def compare(results: dict, path: str):
+    """与之前的结果对比：吞吐下降或p99上升超过10%时标出"""
+    with open(path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"对比 {path}（{baseline.get('git_commit') or '未知提交'}，{baseline.get('timestamp', '')}）:")
+    for name, summary in results["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if not old or "latency_ms" not in old or "latency_ms" not in summary:
+            continue
+        throughput = summary["throughput_rps"] / old["throughput_rps"] - 1 if old["throughput_rps"] else 0
+        p99 = summary["latency_ms"]["p99"] / old["latency_ms"]["p99"] - 1 if old["latency_ms"]["p99"] else 0
+        flag = "  <- 回退" if throughput < -0.1 or p99 > 0.1 else ""
+        print(f"  {name:<8} 吞吐 {throughput:+.1%}  p99 {p99:+.1%}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线压测 /webhook 与 /send")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker数")
+    parser.add_argument("--threads", type=int, default=8, help="每个worker的线程数")
+    parser.add_argument("--concurrency", type=int, default=32, help="并发连接数")
+    parser.add_argument("--processes", type=int, default=min(4, os.cpu_count() or 1), help="客户端进程数")
+    parser.add_argument("--duration", type=float, default=10, help="每个场景的测量时间（秒）")
+    parser.add_argument("--warmup", type=float, default=2, help="测量前的预热时间（秒）")
+    parser.add_argument("--scenarios", default="webhook,send", help="逗号分隔: webhook,send")
+    parser.add_argument("--message", default="信息更新", help="回调和发送的消息内容")
+    parser.add_argument("--latency-ms", type=float, default=50, help="测试桩每次调用的延迟")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="测试桩延迟的随机抖动上限")
+    parser.add_argument("--error-rate", type=float, default=0, help="测试桩发送接口返回errcode=-1的概率")
+    parser.add_argument("--http-error-rate", type=float, default=0, help="测试桩发送接口返回HTTP 502的概率")
+    parser.add_argument("--passive-reply-window", type=float, default=3,
+                        help="被动回复等待时间，0表示回调的回复都经发送接口异步发出")
+    parser.add_argument("--keep-rate-limits", action="store_true", help="保留app默认的接口和成员限速")
+    parser.add_argument("--log-level", default="WARNING", help="app日志级别")
+    parser.add_argument("--output", help="结果文件，默认 benchmarks/results/loadtest-<时间>.json")
+    parser.add_argument("--compare", help="之前的结果文件")
+    args = parser.parse_args()
+    
+    run_dir = tempfile.mkdtemp(prefix="wx_stockbot_loadtest_")
+    prepare_store(os.path.join(run_dir, "store"))
+    log_path = os.path.join(run_dir, "server.log")
+    results = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "host": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "scenarios": {}
+    }
+    
+    with open(log_path, "w") as log:
+        stub, stub_url = start_stub(args, log)
+        app = None
+        try:
+            app, port = start_app(args, app_env(args, run_dir, stub_url), log)
+            print(f"gunicorn {args.workers} worker × {args.threads} 线程，并发 {args.concurrency}，"
+                  f"测试桩延迟 {args.latency_ms:g} ms，日志 {log_path}")
+            for scenario in args.scenarios.split(","):
+                results["scenarios"][scenario] = run_scenario(args, port, stub_url, scenario)
+            results["stub"] = get_json(f"{stub_url}/stats")[1]
+        finally:
+            if app is not None:
+                app.send_signal(signal.SIGTERM)
+                app.wait(timeout=30)
+            stub.terminate()
+            stub.wait(timeout=10)
+    
+    print_summary(results)
+    output = args.output or str(ROOT / "benchmarks" / "results" /
+                                f"loadtest-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存: {output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+企业微信API本地测试桩
+模拟 /cgi-bin/gettoken 与 /cgi-bin/message/send，供基准测试离线使用。
+可注入固定延迟加随机抖动（模拟网络往返）和错误（errcode=-1 系统繁忙、HTTP 502），
+GET /stats 返回调用计数，供另一个进程中的压测脚本读取
+
+用法: python benchmarks/wechat_stub.py [--port 18080] [--latency-ms 0] [--jitter-ms 0]
+                                       [--error-rate 0] [--http-error-rate 0]
+"""
+
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """测试桩请求处理器（HTTP/1.1，支持keep-alive）"""
+    
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def _reply(self, payload: dict, status: int = 200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _delay(self):
+        """模拟网络往返和服务端处理时间"""
+        latency = self.server.latency + random.uniform(0, self.server.jitter)
+        if latency > 0:
+            time.sleep(latency)
+    
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/stats":
+            self._reply(dict(self.server.stats))
+            return
+        self._delay()
+        if path == "/cgi-bin/gettoken":
+            self.server.stats["gettoken"] += 1
+            token = f"stub_token_{self.server.stats['gettoken']}"
+            self._reply({"errcode": 0, "errmsg": "ok", "access_token": token, "expires_in": 7200})
+        else:
+            self._reply({"errcode": 404, "errmsg": "not found"})
+    
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        path = urlparse(self.path).path
+        self._delay()
+        if path == "/cgi-bin/message/send":
+            self.server.stats["send"] += 1
+            token = parse_qs(urlparse(self.path).query).get("access_token", [""])[0]
+            if token in self.server.revoked_tokens:
+                self._reply({"errcode": 40014, "errmsg": "invalid access_token"})
+                return
+            if not self.server.take_quota():
+                self.server.stats["throttled"] += 1
+                self._reply({"errcode": 45009, "errmsg": "api freq out of limit"})
+                return
+            # 注入的错误：先按HTTP错误率返回502，再按业务错误率返回系统繁忙
+            roll = random.random()
+            if roll < self.server.http_error_rate:
+                self.server.stats["http_errors"] += 1
+                self._reply({"errmsg": "bad gateway"}, status=502)
+                return
+            if roll < self.server.http_error_rate + self.server.error_rate:
+                self.server.stats["errors"] += 1
+                self._reply({"errcode": -1, "errmsg": "system busy"})
+                return
+            self.server.stats["delivered"] += 1
+            self._reply({"errcode": 0, "errmsg": "ok", "invaliduser": ""})
+        else:
+            self._reply({"errcode": 404, "errmsg": "not found"})
+
+
+def start_stub_server(host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                      error_rate: float = 0.0, http_error_rate: float = 0.0):
+    """在后台线程中启动测试桩，返回 (server, base_url)
+    
+    latency/jitter为每次调用的固定延迟和随机抖动上限（秒），error_rate/http_error_rate为发送接口
+    返回errcode=-1和HTTP 502的概率；启动后也可直接修改server上的同名属性
+    """
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.stats = {"gettoken": 0, "send": 0, "delivered": 0, "throttled": 0, "errors": 0, "http_errors": 0}
+    server.latency = latency
+    server.jitter = jitter
+    server.error_rate = error_rate
+    server.http_error_rate = http_error_rate
+    # 已吊销的令牌，使用时返回40014
+    server.revoked_tokens = set()
+    # 模拟服务端频率限制：(每秒次数, 突发容量)，None表示不限制；超限时返回45009
+    server.send_quota = None
+    quota_state = {"tokens": 0.0, "updated_at": time.monotonic()}
+    quota_lock = threading.Lock()
+    
+    def take_quota() -> bool:
+        if server.send_quota is None:
+            return True
+        rate, burst = server.send_quota
+        with quota_lock:
+            now = time.monotonic()
+            tokens = min(burst, quota_state["tokens"] + (now - quota_state["updated_at"]) * rate)
+            quota_state["updated_at"] = now
+            quota_state["tokens"] = tokens - 1 if tokens >= 1 else tokens
+            return tokens >= 1
+    
+    server.take_quota = take_quota
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="企业微信API本地测试桩")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--latency-ms", type=float, default=0, help="每次调用的固定延迟")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="在固定延迟上增加的随机延迟上限")
+    parser.add_argument("--error-rate", type=float, default=0, help="发送接口返回errcode=-1的概率")
+    parser.add_argument("--http-error-rate", type=float, default=0, help="发送接口返回HTTP 502的概率")
+    args = parser.parse_args()
+    
+    server, base_url = start_stub_server(args.host, args.port, args.latency_ms / 1000, args.jitter_ms / 1000,
+                                         args.error_rate, args.http_error_rate)
+    print(f"测试桩已启动: {base_url}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,33 @@
+"""
+gunicorn配置（gunicorn默认读取当前目录下的gunicorn.conf.py，Procfile无需指定）
+每个worker导入应用时在后台开始启动预热，预热完成前 /ready 返回503
+"""
+
+import os
+
+# 每个worker的请求线程数（大于1时使用gthread worker）。加密回调的请求线程最多等待
+# WECHAT_PASSIVE_REPLY_WINDOW秒返回被动回复，只有一个线程时并发回调会排队，超过企业微信的5秒超时
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+
+# 每个worker自己导入应用并初始化；预加载时机器人和后台线程会在主进程中创建，fork后无法使用
+preload_app = False
+
+
+def post_worker_init(worker):
+    """worker加载应用后：确认启动预热已开始，并安装SIGHUP处理（重新加载配置）
+    
+    worker启动时会把SIGHUP恢复为默认处理（终止进程），因此在worker主线程中重新安装
+    """
+    import app
+    app.startup.start()
+    app.config_manager.install_signal_handler()
+    worker.log.info("worker %s 已加载应用，启动预热进行中", worker.pid)
+
+
+def worker_exit(server, worker):
+    """worker退出前停止发送队列和后台线程，释放主节点锁，其他worker立即接管；
+    删除本worker的指标快照，/metrics 不再汇总已退出的worker"""
+    import app
+    from src.wx_stockbot.metrics import REGISTRY
+    app.shutdown()
+    REGISTRY.close()
@@ -3,17 +3,45 @@
 实现定时发送和消息响应功能
 """
 
+import os
+import re
 import time
-import threading
 import logging
-from typing import Optional, Callable
+import threading
+from typing import Optional, Callable, Hashable, Union
 from datetime import datetime
 
+import numpy as np
+
 from .client import WeChatClient
+from .dispatcher import SendDispatcher, SendJob
+from .reply import Reply
+from .keyword_index import KeywordIndex
+from .market_data import Bars, MarketDataError, find_data_file, load_bars
+from .market_store import MarketStore
+from .report import REPORT_TEMPLATE_VERSION, render_report
+from .report_cache import ReportCache
+from .singleflight import SingleFlight
+from .scheduler import Scheduler, IntervalSchedule, MarketSchedule, TradingCalendar
+from .leader import FileLeaderElection, create_leader_election
+from .job_store import FileJobStore, create_job_store
+from .outbox import create_outbox
+from .streaming import IndicatorStreams
 from .config import WeChatConfig
 
 logger = logging.getLogger(__name__)
 
+# 消息中的股票代码（美股字母代码或A股/港股数字代码）
+SYMBOL_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9.\-]{0,11}")
+
+# 定时推送任务ID
+TIMER_JOB = "timer"
+
+
+def normalize_command(message: str) -> str:
+    """指令的规范形式：合并空白并统一大写，作为默认的合并键"""
+    return " ".join(message.split()).upper()
+
 
 class WeChatBot:
     """微信机器人"""
@@ -21,80 +49,234 @@ class WeChatBot:
     def __init__(self, config: WeChatConfig):
         self.config = config
         self.client = WeChatClient(config)
-        self.running = False
-        self.timer_thread = None
+        # 发件箱：异步发送的消息先持久化，失败重试，重启后继续投递
+        self.outbox = create_outbox(config)
+        self.dispatcher = SendDispatcher(
+            self.client,
+            workers=config.send_workers,
+            maxsize=config.send_queue_size,
+            outbox=self.outbox,
+            max_attempts=config.outbox_max_attempts
+        )
+        if self.outbox is not None:
+            self.dispatcher.start()
+        # 定时推送和个人订阅都由同一个调度器触发；多worker时只有主节点执行，
+        # 任务定义保存在共享存储中，每个worker按心跳同步
+        self.leader = create_leader_election(config)
+        self.job_store = create_job_store(config)
+        # 调度线程至少每个心跳周期循环一次；错过3个周期说明调度线程卡住，主节点让出
+        self.scheduler = Scheduler(workers=config.scheduler_workers, max_wait=config.leader_heartbeat,
+                                   gate=lambda: self.leader.is_leader)
+        self.leader.add_health_check(lambda: self.scheduler.heartbeat_age() < config.leader_heartbeat * 3)
+        if isinstance(self.leader, FileLeaderElection) and not isinstance(self.job_store, FileJobStore):
+            logger.warning("多worker部署未配置共享的任务定义文件（WECHAT_JOB_STORE），其他worker收到的订阅不会由主节点推送")
+        self.calendar = TradingCalendar(config.market_timezone, config.market_holidays)
+        # 任务类型 -> 由任务定义生成 (执行函数, 调度, 调度参数) 的工厂
+        self._job_types: dict[str, Callable[[dict], tuple]] = {}
+        self._job_specs: dict[str, dict] = {}
+        self._jobs_lock = threading.Lock()
         self.message_handlers: dict[str, Callable] = {}
+        self.keyword_index = KeywordIndex()
+        # 可合并的处理器: 关键词 -> 由消息生成合并键的函数
+        self._coalesce_keys: dict[str, Callable[[str], Hashable]] = {}
+        self.singleflight = SingleFlight()
+        # 每只股票的增量指标状态，行情文件追加新K线时只计算新增部分
+        self.indicator_streams = IndicatorStreams()
+        self.market_store = MarketStore(config.market_store_dir or os.path.join(config.data_dir, "store"))
+        self._store_revisions: dict[str, tuple[int, int]] = {}
+        # CSV行情: 代码 -> ((路径, 修改时间), 最新日期)
+        self._csv_versions: dict[str, tuple] = {}
+        self._latest_seen: dict[str, str] = {}
+        # 回调处理线程和调度线程都会生成报告，上面三个表的读写都在锁内进行
+        self._versions_lock = threading.Lock()
+        # 报告缓存，键为 (代码, 最新K线日期, 模板版本)
+        self.report_cache = ReportCache(
+            max_entries=config.report_cache_size,
+            max_bytes=config.report_cache_bytes,
+            ttl=config.report_cache_ttl
+        )
         
         # 注册默认消息处理器
-        self.register_message_handler("信息更新", self._handle_info_update)
+        self.register_message_handler("信息更新", self._handle_info_update,
+                                      coalesce=self._parse_symbol)
         self.register_message_handler("打开推送", self._handle_start_timer)
         self.register_message_handler("关闭推送", self._handle_stop_timer)
         self.register_message_handler("定时推送状态", self._handle_timer_status)
+        self.register_message_handler("订阅", self._handle_subscribe)
+        self.register_message_handler("取消订阅", self._handle_unsubscribe)
+        self.register_message_handler("我的订阅", self._handle_list_subscriptions)
+        
+        # 注册内置任务类型，加载已保存的任务并开始竞选主节点
+        self.register_job_type("timer", lambda spec: (
+            self._send_timer_message, IntervalSchedule(spec["interval"], spec.get("anchor")), {}
+        ))
+        self.register_job_type("subscription", self._subscription_job)
+        self.leader.add_tick_listener(self.sync_jobs)
+        self.leader.start()
     
-    def register_message_handler(self, keyword: str, handler: Callable):
-        """注册消息处理器"""
+    @property
+    def running(self) -> bool:
+        """定时推送是否已打开"""
+        return self.scheduler.has_job(TIMER_JOB)
+    
+    def register_message_handler(self, keyword: str, handler: Callable, priority: int = 0,
+                                 coalesce: Union[bool, Callable[[str], Hashable]] = False):
+        """注册消息处理器
+        
+        消息中包含多个关键词时，priority 大者优先，相同优先级时较长的关键词优先。
+        处理器返回文本时按配置的默认方式回复；返回 Reply(content, mode) 可逐条指定
+        被动回复（passive）或主动发送（active）。
+        
+        coalesce 为True时，同一时刻规范化后相同的消息（去掉多余空白、不区分大小写）只执行一次，
+        所有请求共享结果；也可传入由消息生成合并键的函数。只适用于结果与发送者无关的处理器。
+        """
         self.message_handlers[keyword] = handler
+        self.keyword_index.add(keyword, handler, priority)
+        if coalesce:
+            self._coalesce_keys[keyword] = coalesce if callable(coalesce) else normalize_command
+        else:
+            self._coalesce_keys.pop(keyword, None)
         logger.info(f"注册消息处理器: {keyword}")
     
+    def register_job_type(self, kind: str, factory: Callable[[dict], tuple]):
+        """注册定时任务类型
+        
+        factory(spec) 返回 (执行函数, 调度, 调度参数)，spec 为保存的任务定义（可JSON序列化）。
+        注册后立即同步已保存的该类型任务。
+        """
+        self._job_types[kind] = factory
+        self.sync_jobs()
+    
+    def add_job(self, job_id: str, spec: dict):
+        """保存任务定义并加入本进程的调度器，其他worker在下一次心跳时同步"""
+        self.job_store.put(job_id, spec)
+        self._apply_job(job_id, spec)
+    
+    def remove_job(self, job_id: str) -> bool:
+        """删除任务定义"""
+        removed = self.job_store.remove(job_id)
+        with self._jobs_lock:
+            self._job_specs.pop(job_id, None)
+        return self.scheduler.remove_job(job_id) or removed
+    
+    def sync_jobs(self):
+        """按共享存储同步本进程调度器中的任务：新增、删除和修改过的任务，未变化的保持原有节奏"""
+        specs = self.job_store.load()
+        with self._jobs_lock:
+            current = dict(self._job_specs)
+        for job_id in current.keys() - specs.keys():
+            with self._jobs_lock:
+                self._job_specs.pop(job_id, None)
+            self.scheduler.remove_job(job_id)
+        for job_id, spec in specs.items():
+            if current.get(job_id) != spec:
+                self._apply_job(job_id, spec)
+    
+    def _apply_job(self, job_id: str, spec: dict):
+        factory = self._job_types.get(spec.get("type"))
+        if factory is None:
+            # 类型尚未注册（如应用层的任务），注册时再同步
+            return
+        with self._jobs_lock:
+            self._job_specs[job_id] = spec
+        try:
+            func, schedule, options = factory(spec)
+            self.scheduler.add_job(job_id, func, schedule, **options)
+        except Exception as e:
+            logger.error(f"加载定时任务 {job_id} 失败: {e}")
+    
     def _handle_info_update(self, message: str, user_id: str) -> str:
-        """处理信息更新指令"""
-        logger.info(f"收到信息更新指令，来自用户: {user_id}")
-        return """📊 股票技术分析报告
-
-🔍 **NVDA 技术指标分析**
-
-**📈 价格走势**
-- 当前价格: $875.42 (+2.3%)
-- 日内高点: $881.15
-- 日内低点: $868.92
-- 成交量: 2.8M (较昨日+15%)
-
-**📊 技术指标**
-
-**WR指标 (威廉指标)**
-- WR(14): 23.5 (超买区域)
-- WR(21): 18.2 (强烈超买)
-- 信号: 短期回调风险增加
-
-**SAR指标 (抛物线转向)**
-- 当前SAR: $872.30
-- 趋势: 上升趋势持续
-- 止损位: $870.50
-
-**KDJ指标**
-- K值: 78.5 (高位)
-- D值: 72.3 (高位)
-- J值: 90.8 (超买)
-- 信号: 短期可能回调
-
-**📋 综合分析**
-
-**优势因素:**
-✅ AI芯片需求持续强劲
-✅ 数据中心业务增长稳定
-✅ 新产品线市场反应积极
-
-**风险提示:**
-⚠️ 技术指标显示超买
-⚠️ 短期回调压力增大
-⚠️ 市场情绪过于乐观
-
-**🎯 操作建议**
-- 短期: 谨慎观望，等待回调
-- 中期: 逢低布局，目标$900
-- 长期: 基本面支撑，继续看好
-
-**📅 重要日期**
-- 下周三: 财报发布
-- 下周五: 期权到期日
-
----
-*数据更新时间: 2025-01-22 15:30 EST*
-*仅供参考，投资有风险*"""
+        """处理信息更新指令，消息中可带股票代码（如"信息更新 AAPL"），默认使用配置的代码"""
+        logger.info("收到信息更新指令，来自用户: %s", user_id, extra={"category": "command"})
+        return self.build_report(self._parse_symbol(message))
+    
+    def build_report(self, symbol: str) -> str:
+        """生成股票报告（命中缓存时直接返回）"""
+        try:
+            latest = self._latest_bar_date(symbol)
+            report = self.report_cache.get((symbol, latest, REPORT_TEMPLATE_VERSION))
+            if report is not None:
+                return report
+            bars = self._load_bars(symbol)
+        except MarketDataError as e:
+            logger.warning(f"加载行情失败: {e}")
+            return f"⚠️ {e}"
+        
+        last_date, arrays = self.indicator_streams.sync_arrays(bars)
+        report = render_report(bars, arrays)
+        self.report_cache.put((symbol, last_date, REPORT_TEMPLATE_VERSION), report)
+        return report
+    
+    def warm_reports(self) -> dict[str, bool]:
+        """预热报告缓存：默认股票和已订阅的股票，返回 代码 -> 是否生成成功"""
+        symbols = [self.config.default_symbol]
+        for spec in self.job_store.load().values():
+            if spec.get("type") == "subscription" and spec["symbol"] not in symbols:
+                symbols.append(spec["symbol"])
+        return {symbol: not self.build_report(symbol).startswith("⚠️") for symbol in symbols}
+    
+    def _parse_symbol(self, message: str) -> str:
+        """消息中的股票代码，未带代码时使用配置的默认代码"""
+        match = SYMBOL_PATTERN.search(message.replace("信息更新", " "))
+        return match.group(0).upper() if match else self.config.default_symbol
+    
+    def _latest_bar_date(self, symbol: str) -> Optional[str]:
+        """不加载行情，取得最新K线日期作为报告缓存的键；新数据到达、历史被改写或最后一根K线被覆盖时作废该股票的缓存
+        
+        CSV文件在修改时间不变时沿用上次解析出的最新日期，未解析过时返回None。
+        """
+        if symbol in self.market_store:
+            revision = (self.market_store.revision(symbol), self.market_store.amendments(symbol))
+            with self._versions_lock:
+                if self._store_revisions.get(symbol, revision) != revision:
+                    # 历史数据被改写或最后一根K线被覆盖：增量状态和缓存的报告都要重建
+                    self.indicator_streams.discard(symbol)
+                    self.report_cache.invalidate(symbol)
+                self._store_revisions[symbol] = revision
+            latest = self.market_store.last_date(symbol)
+        else:
+            path = find_data_file(self.config.data_dir, symbol)
+            if path is None:
+                raise MarketDataError(f"未找到 {symbol} 的行情数据（目录: {self.config.data_dir}）")
+            mtime = os.stat(path).st_mtime_ns
+            with self._versions_lock:
+                version, latest = self._csv_versions.get(symbol, (None, None))
+            if version != (path, mtime):
+                latest = None
+        
+        if latest is not None:
+            with self._versions_lock:
+                if self._latest_seen.get(symbol, latest) != latest:
+                    self.report_cache.invalidate(symbol)
+                self._latest_seen[symbol] = latest
+        return latest
+    
+    def _load_bars(self, symbol: str) -> Bars:
+        """优先从列式行情库读取：已有增量指标状态时只读取上次之后的K线（多取一根供报告对比），
+        历史数据被改写后整段重读；库中没有该股票时读取CSV/Parquet文件"""
+        if symbol in self.market_store:
+            last_date = self.indicator_streams.last_date(symbol)
+            if last_date:
+                bars = self.market_store.read(symbol, start=last_date, lookback=1)
+                if np.datetime64(last_date) in bars.dates:
+                    return bars
+            # 首次读取，或历史数据已被改写需要整段重算
+            return self.market_store.read(symbol)
+        
+        path = find_data_file(self.config.data_dir, symbol)
+        version = (path, os.stat(path).st_mtime_ns) if path else None
+        bars = load_bars(self.config.data_dir, symbol)
+        with self._versions_lock:
+            if self._csv_versions.get(symbol, (version,))[0] != version:
+                # 文件被修改过，可能改写了历史
+                self.indicator_streams.discard(symbol)
+            self._csv_versions[symbol] = (version, str(bars.dates[-1]))
+        return bars
     
     def _handle_start_timer(self, message: str, user_id: str) -> str:
         """处理打开推送指令"""
         logger.info(f"收到打开推送指令，来自用户: {user_id}")
+        self.sync_jobs()
         if not self.running:
             self.start_timer(60)  # 每分钟推送
             return "✅ 定时推送已打开"
@@ -104,6 +286,7 @@ class WeChatBot:
     def _handle_stop_timer(self, message: str, user_id: str) -> str:
         """处理关闭推送指令"""
         logger.info(f"收到关闭推送指令，来自用户: {user_id}")
+        self.sync_jobs()
         if self.running:
             self.stop_timer()
             return "🛑 定时推送已关闭"
@@ -113,51 +296,85 @@ class WeChatBot:
     def _handle_timer_status(self, message: str, user_id: str) -> str:
         """处理定时推送状态查询指令"""
         logger.info(f"收到定时推送状态查询，来自用户: {user_id}")
+        self.sync_jobs()
         if self.running:
             return "🟢 定时推送状态：正在运行中"
         else:
             return "🔴 定时推送状态：已关闭"
     
+    def _handle_subscribe(self, message: str, user_id: str) -> str:
+        """处理订阅指令（如"订阅 AAPL"）：交易日的推送时刻把报告发给该成员"""
+        symbol = self._parse_symbol(message)
+        logger.info(f"收到订阅指令: {symbol}，来自用户: {user_id}")
+        self.add_job(f"sub:{user_id}:{symbol}", {"type": "subscription", "user_id": user_id, "symbol": symbol})
+        return f"✅ 已订阅 {symbol}，交易日 {'、'.join(self.config.push_times)}（{self.config.market_timezone}）推送"
+    
+    def _handle_unsubscribe(self, message: str, user_id: str) -> str:
+        """处理取消订阅指令，不带代码时取消该成员的全部订阅"""
+        match = SYMBOL_PATTERN.search(message)
+        self.sync_jobs()
+        jobs = self.scheduler.jobs(user_id)
+        if match:
+            jobs = [job for job in jobs if job.job_id == f"sub:{user_id}:{match.group(0).upper()}"]
+        for job in jobs:
+            self.remove_job(job.job_id)
+        logger.info(f"取消订阅 {len(jobs)} 项，来自用户: {user_id}")
+        return f"🛑 已取消 {len(jobs)} 项订阅" if jobs else "⚠️ 没有找到对应的订阅"
+    
+    def _handle_list_subscriptions(self, message: str, user_id: str) -> str:
+        """列出该成员的订阅"""
+        self.sync_jobs()
+        jobs = self.scheduler.jobs(user_id)
+        if not jobs:
+            return "暂无订阅"
+        lines = [f"{job.job_id.rsplit(':', 1)[-1]}  下次推送 {job.due:%Y-%m-%d %H:%M}" for job in jobs]
+        return "📋 我的订阅\n" + "\n".join(lines)
+    
+    def _subscription_job(self, spec: dict) -> tuple:
+        """订阅任务：交易日的推送时刻发送报告，错过5分钟以上不再补发"""
+        symbol, user_id = spec["symbol"], spec["user_id"]
+        schedule = MarketSchedule(self.config.push_times, self.calendar)
+        options = {"misfire": "skip", "misfire_grace": 300, "user_id": user_id}
+        return lambda: self._push_report(symbol, user_id), schedule, options
+    
+    def _push_report(self, symbol: str, user_id: str):
+        """订阅推送：生成报告并发送给订阅的成员
+        
+        与成员的"信息更新"消息使用同一个合并键（见handle_incoming_message），推送时刻同时到达的
+        消息和其他订阅共享同一次计算
+        """
+        report, _ = self.singleflight.do(("信息更新", symbol), lambda: self.build_report(symbol))
+        self.send_message_async(report, [user_id])
+    
+    def apply_config(self, config: WeChatConfig):
+        """热加载配置：接收者、回复方式、行情目录、推送时刻等在下次使用时生效；
+        企业凭证或API地址变化时作废缓存的令牌（连接池、线程数等需要重启才生效）"""
+        old, self.config = self.config, config
+        self.client.config = config
+        if (old.corpid, old.corpsecret, old.api_base) != (config.corpid, config.corpsecret, config.api_base):
+            self.client.token_store.invalidate()
+            logger.info("企业凭证或API地址已变化，重新获取访问令牌")
+    
     def start_timer(self, interval: int = 60):
         """启动定时发送功能"""
         if self.running:
             logger.warning("机器人已在运行中")
             return
         
-        self.running = True
-        self.timer_thread = threading.Thread(
-            target=self._timer_loop,
-            args=(interval,),
-            daemon=True
-        )
-        self.timer_thread.start()
+        # 各worker按同一个起点对齐节奏，主节点切换时不会错开
+        self.add_job(TIMER_JOB, {"type": "timer", "interval": interval, "anchor": time.time()})
         logger.info(f"启动定时发送，间隔: {interval}秒")
     
     def stop_timer(self):
         """停止定时发送功能"""
-        self.running = False
-        if self.timer_thread:
-            self.timer_thread.join(timeout=5)
+        self.remove_job(TIMER_JOB)
         logger.info("停止定时发送")
     
-    def _timer_loop(self, interval: int):
-        """定时发送循环"""
-        while self.running:
-            try:
-                # 发送当前时间戳
-                current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                success = self.client.send_text_message(f"⏰ 定时推送时间: {current_time}")
-                if success:
-                    logger.info(f"定时消息发送成功: {current_time}")
-                else:
-                    logger.error("定时消息发送失败")
-                
-                # 等待下次发送
-                time.sleep(interval)
-                
-            except Exception as e:
-                logger.error(f"定时发送异常: {e}")
-                time.sleep(interval)
+    def _send_timer_message(self):
+        """发送当前时间戳（由调度器按固定节奏触发，发送耗时不影响周期）"""
+        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        job = self.send_message_async(f"⏰ 定时推送时间: {current_time}")
+        logger.debug("定时消息已提交: %s (%s)", current_time, job.job_id)
     
     def send_message(self, content: str, user_ids: Optional[list] = None) -> bool:
         """发送消息"""
@@ -167,23 +384,38 @@ class WeChatBot:
         """发送Markdown消息"""
         return self.client.send_markdown_message(content, user_ids)
     
-    def handle_incoming_message(self, message: str, user_id: str) -> Optional[str]:
-        """处理接收到的消息"""
-        logger.info(f"收到消息: {message}, 来自用户: {user_id}")
+    def send_message_async(self, content: str, user_ids: Optional[list] = None,
+                           msgtype: str = "text") -> SendJob:
+        """异步发送消息，立即返回发送任务（队列满时抛出DispatchQueueFull）"""
+        return self.dispatcher.submit(content, user_ids, msgtype)
+    
+    def handle_incoming_message(self, message: str, user_id: str) -> Optional[Union[str, Reply]]:
+        """处理接收到的消息，处理器可返回文本或指定回复方式的Reply"""
+        logger.debug("收到消息: %s, 来自用户: %s", message, user_id)
         
-        # 检查是否有匹配的处理器
-        for keyword, handler in self.message_handlers.items():
-            if keyword in message:
-                try:
+        # 按优先级依次尝试命中的处理器
+        for match in self.keyword_index.match(message):
+            handler = match.entry.value
+            try:
+                key_func = self._coalesce_keys.get(match.entry.keyword)
+                if key_func is not None:
+                    # 并发的相同指令共享同一次计算
+                    response, shared = self.singleflight.do(
+                        (match.entry.keyword, key_func(message)),
+                        lambda: handler(message, user_id)
+                    )
+                    if shared:
+                        logger.debug("合并并发请求: %s，来自用户: %s", match.entry.keyword, user_id)
+                else:
                     response = handler(message, user_id)
-                    if response:
-                        logger.info(f"生成回复: {response}")
-                        return response
-                except Exception as e:
-                    logger.error(f"处理消息异常: {e}")
-                    return None
+                if response:
+                    logger.debug("生成回复: %s", response)
+                    return response
+            except Exception as e:
+                logger.error(f"处理消息异常: {e}")
+                return None
         
-        logger.info("没有匹配的消息处理器")
+        logger.debug("没有匹配的消息处理器")
         return None
     
     def get_status(self) -> dict:
@@ -192,5 +424,16 @@ class WeChatBot:
             "running": self.running,
             "config_valid": self.config.validate(),
             "handlers_count": len(self.message_handlers),
+            "send_queue": self.dispatcher.get_status(),
+            "outbox": self.outbox.get_status() if self.outbox is not None else None,
+            "token": self.client.get_token_status(),
+            "rate_limit": self.client.rate_limiter.get_status(),
+            "indicator_streams": {"symbols": len(self.indicator_streams), **self.indicator_streams.stats},
+            "market_store": self.market_store.get_status(),
+            "report_cache": self.report_cache.get_status(),
+            "scheduler": self.scheduler.get_status(),
+            "jobs": self.job_store.get_status(),
+            "leader": self.leader.get_status(),
+            "singleflight": self.singleflight.get_status(),
             "timestamp": datetime.now().isoformat()
         } 
\ No newline at end of file
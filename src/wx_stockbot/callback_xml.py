@@ -0,0 +1,104 @@
+"""
+回调XML解析
+企业微信的回调外层包和解密后的消息体都是一层扁平的 <xml><字段>值</字段>...</xml>，
+值为CDATA或不含实体的文本。快速路径按字节逐个匹配字段，不构建元素树；
+遇到嵌套元素、属性、实体、换行符归一化等其他形式时回退到ElementTree，结果与原解析方式一致
+"""
+
+import re
+import logging
+import xml.etree.ElementTree as ET
+from typing import Optional, Union
+
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# 单个回调XML的最大字节数（文本消息最长2048字节，加密后约为4/3倍，留足余量）
+MAX_XML_BYTES = 128 * 1024
+# 最多字段数
+MAX_FIELDS = 64
+
+_XML_PARSES = REGISTRY.counter(
+    "wxbot_xml_parse_total", "回调XML解析次数（fast为快速路径，fallback为回退到ElementTree）", ("path",)
+)
+_FAST = _XML_PARSES.labels("fast")
+_FALLBACK = _XML_PARSES.labels("fallback")
+
+# 一个字段：不带属性的开始标签，值为CDATA或不含 < 和 & 的文本。
+# CDATA按"非]字符 / 后面不是]>的]"展开匹配，每个字符只有一种匹配方式，失败时不会指数回溯
+_FIELD_PATTERN = (
+    rb"\s*<(?P<tag>[A-Za-z_][A-Za-z0-9_.-]*)>"
+    rb"(?:<!\[CDATA\[(?P<cdata>[^\]]*(?:\](?!\]>)[^\]]*)*)\]\]>|(?P<text>[^<&]*))"
+    rb"</(?P=tag)>"
+)
+_FIELD = re.compile(_FIELD_PATTERN)
+# 整个文档：可选的XML声明，根元素下只有扁平字段
+_DOCUMENT = re.compile(
+    rb"\s*(?:<\?xml[^>]*\?>\s*)?<xml>(?P<fields>(?:" + _FIELD_PATTERN.replace(b"tag", b"t") + rb")*)\s*</xml>\s*"
+)
+
+
+class CallbackXMLError(ValueError):
+    """回调XML无效或超过大小限制"""
+
+
+def _parse_fast(data: bytes) -> Optional[dict]:
+    """快速路径：先整体校验结构，再一次取出所有字段；形式不符时返回None"""
+    # XML会把\r\n归一化为\n，含\r时交给ElementTree处理
+    if b"\r" in data:
+        return None
+    document = _DOCUMENT.fullmatch(data)
+    if document is None:
+        return None
+    found = _FIELD.findall(data, document.start("fields"), document.end("fields"))
+    if len(found) > MAX_FIELDS:
+        raise CallbackXMLError(f"字段数超过上限: {MAX_FIELDS}")
+    # 与ElementTree一致：空元素的文本为None
+    return {tag.decode("ascii"): (cdata or text).decode("utf-8") or None for tag, cdata, text in found}
+
+
+def _parse_elementtree(data: bytes) -> dict:
+    """通用解析：截取 <xml>...</xml> 后用ElementTree解析，取根元素下一层字段的文本"""
+    if b"<!DOCTYPE" in data or b"<!ENTITY" in data:
+        raise CallbackXMLError("回调XML不允许DOCTYPE或实体声明")
+    
+    # 兼容缺少根元素开始标签或末尾带有多余内容的消息
+    start = data.find(b"<xml>")
+    if start == -1:
+        start = data.find(b"<ToUserName>")
+        if start != -1:
+            data = b"<xml>" + data[start:]
+    else:
+        data = data[start:]
+    end = data.find(b"</xml>")
+    if end != -1:
+        data = data[:end + 6]
+    
+    try:
+        root = ET.fromstring(data)
+    except ET.ParseError as e:
+        raise CallbackXMLError(f"XML解析失败: {e}")
+    if len(root) > MAX_FIELDS:
+        raise CallbackXMLError(f"字段数超过上限: {MAX_FIELDS}")
+    return {child.tag: child.text for child in root}
+
+
+def parse_callback_xml(data: Union[bytes, str], max_bytes: int = MAX_XML_BYTES) -> dict:
+    """解析回调XML（外层加密包或解密后的消息），返回 字段名 -> 文本"""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    if len(data) > max_bytes:
+        raise CallbackXMLError(f"XML长度 {len(data)} 超过上限 {max_bytes}")
+    
+    try:
+        fields = _parse_fast(data)
+    except UnicodeDecodeError:
+        fields = None
+    if fields is not None:
+        _FAST.inc()
+        return fields
+    
+    _FALLBACK.inc()
+    logger.debug("回调XML不是扁平结构，使用ElementTree解析")
+    return _parse_elementtree(data)
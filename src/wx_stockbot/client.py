@@ -5,126 +5,236 @@
 import time
 import json
 import logging
-from typing import Optional, Dict, Any
-import requests
+import threading
+from typing import Optional, Dict, Any, Iterable
 
 from .config import WeChatConfig
+from .transport import HttpTransport, TransportConfig
+from .token_store import TokenStore, TokenRefresher, CachedToken, create_token_store
+from .fanout import Batch, DeliveryReport, FanoutSender, plan_batches
+from .rate_limit import RateLimiter, RATE_LIMIT_ERRCODES, create_rate_limiter
+from .metrics import API_ERRORS, stage
 
 logger = logging.getLogger(__name__)
 
+# 接口调用与令牌刷新耗时
+_SEND_SECONDS = stage("send")
+_TOKEN_SECONDS = stage("token_refresh")
+
 
 class WeChatClient:
     """企业微信API客户端"""
     
-    def __init__(self, config: WeChatConfig):
+    # 令牌无效/过期的错误码：作废缓存令牌后重试一次
+    TOKEN_INVALID_ERRCODES = (40001, 40014, 42001)
+    
+    def __init__(self, config: WeChatConfig, transport: Optional[HttpTransport] = None,
+                 token_store: Optional[TokenStore] = None, rate_limiter: Optional[RateLimiter] = None):
         self.config = config
-        self.access_token = None
-        self.token_expires_at = 0
-        
+        self.token_store = token_store or create_token_store(config)
+        # 按接口和接收成员限速，超限时排队等待
+        self.rate_limiter = rate_limiter or create_rate_limiter(config)
+        self.token_refresher: Optional[TokenRefresher] = None
+        # 扇出时多个线程同时调用_post_api，计数需加锁
+        self.token_stats = {"invalidations": 0, "retries": 0, "retry_success": 0, "retry_failed": 0}
+        self._stats_lock = threading.Lock()
+        # 大批量接收者拆批后并发发送
+        self.fanout = FanoutSender(max_workers=config.fanout_workers)
+        # 所有API调用共享同一个连接池
+        self.transport = transport or HttpTransport(TransportConfig(
+            pool_maxsize=config.http_pool_size,
+            read_timeout=config.http_timeout
+        ))
+    
+    def _url(self, path: str) -> str:
+        """拼接API地址"""
+        return f"{self.config.api_base}{path}"
+    
     def _get_access_token(self) -> str:
-        """获取访问令牌"""
+        """获取访问令牌（跨worker共享缓存，过期时单飞刷新）"""
+        return self.token_store.get_or_refresh(self._fetch_access_token)
+    
+    def _fetch_access_token(self) -> CachedToken:
+        """调用gettoken接口获取新令牌"""
         now = time.time()
-        
-        # 如果令牌未过期，直接返回
-        if self.access_token and now < self.token_expires_at:
-            return self.access_token
-        
-        # 获取新令牌
-        url = "https://qyapi.weixin.qq.com/cgi-bin/gettoken"
+        started = time.perf_counter()
+        url = self._url("/cgi-bin/gettoken")
         params = {
             "corpid": self.config.corpid,
             "corpsecret": self.config.corpsecret
         }
         
         try:
-            response = requests.get(url, params=params, timeout=10)
+            response = self.transport.get(url, params=params)
             response.raise_for_status()
             data = response.json()
             
+            _TOKEN_SECONDS.observe(time.perf_counter() - started)
+            
             if data.get("errcode") == 0:
-                self.access_token = data.get("access_token")
                 # 令牌有效期7200秒，提前5分钟刷新
-                self.token_expires_at = now + data.get("expires_in", 7200) - 300
+                token = CachedToken(data.get("access_token"), now + data.get("expires_in", 7200) - 300)
                 logger.info("成功获取访问令牌")
-                return self.access_token
+                return token
             else:
+                API_ERRORS.labels("/cgi-bin/gettoken", data.get("errcode")).inc()
                 logger.error(f"获取访问令牌失败: {data}")
                 raise Exception(f"获取访问令牌失败: {data}")
-                
+        
         except Exception as e:
             logger.error(f"获取访问令牌异常: {e}")
             raise
     
-    def send_text_message(self, content: str, user_ids: Optional[list] = None) -> bool:
-        """发送文本消息"""
+    def warm_token(self) -> int:
+        """预先获取访问令牌（其他worker已获取时直接复用），返回剩余有效秒数"""
+        self._get_access_token()
+        return self.get_token_status()["expires_in"]
+    
+    def start_token_refresher(self, refresh_ahead: Optional[float] = None):
+        """启动令牌后台刷新"""
+        if self.token_refresher is None:
+            self.token_refresher = TokenRefresher(
+                self.token_store,
+                self._fetch_access_token,
+                refresh_ahead=self.config.token_refresh_ahead if refresh_ahead is None else refresh_ahead
+            )
+        self.token_refresher.start()
+    
+    def stop_token_refresher(self):
+        """停止令牌后台刷新"""
+        if self.token_refresher:
+            self.token_refresher.stop()
+    
+    def get_token_status(self) -> dict:
+        """令牌刷新、作废与重试统计"""
+        token = self.token_store.get()
+        with self._stats_lock:
+            token_stats = dict(self.token_stats)
+        return {
+            "cached": token is not None and token.is_valid(),
+            "expires_in": max(0, int(token.expires_at - time.time())) if token else 0,
+            "background_refresh": self.token_refresher is not None,
+            **self.token_store.stats,
+            **token_stats,
+            **(self.token_refresher.stats if self.token_refresher else {})
+        }
+    
+    def _count(self, *keys: str):
+        """令牌统计计数加1"""
+        with self._stats_lock:
+            for key in keys:
+                self.token_stats[key] += 1
+    
+    def _post_api(self, path: str, data: Dict[str, Any], recipients: Iterable[str] = ()) -> Dict[str, Any]:
+        """调用需要access_token的POST接口
+        
+        调用前按接口和接收成员限速；令牌失效时作废并重试一次，
+        服务端返回频率超限时暂停该接口并在排队后重试一次。
+        """
+        url = self._url(path)
+        recipients = list(recipients)
+        self.rate_limiter.acquire(path, recipients)
+        access_token = self._get_access_token()
+        result = self._post(path, url, access_token, data)
+        
+        if result.get("errcode") in RATE_LIMIT_ERRCODES and self.rate_limiter.penalize(path):
+            self.rate_limiter.acquire(path)
+            result = self._post(path, url, access_token, data)
+        
+        if result.get("errcode") not in self.TOKEN_INVALID_ERRCODES:
+            return result
+        
+        # 令牌被提前吊销或已过期：作废后用新令牌重试一次
+        logger.warning(f"访问令牌失效(errcode={result.get('errcode')})，刷新后重试")
+        self._count("invalidations", "retries")
+        self.token_store.invalidate(access_token)
         try:
-            url = "https://qyapi.weixin.qq.com/cgi-bin/message/send"
             access_token = self._get_access_token()
-            
-            # 确定接收者
-            if user_ids is None:
-                user_ids = self.config.user_ids
-            
-            touser = "|".join(user_ids) if user_ids else "@all"
-            
-            data = {
-                "touser": touser,
-                "msgtype": "text",
-                "agentid": self.config.agentid,
-                "text": {
-                    "content": content
-                }
-            }
-            
-            params = {"access_token": access_token}
-            response = requests.post(url, params=params, json=data, timeout=10)
+            result = self._post(path, url, access_token, data)
+        except Exception:
+            self._count("retry_failed")
+            raise
+        self._count("retry_success" if result.get("errcode") == 0 else "retry_failed")
+        return result
+    
+    def _post(self, path: str, url: str, access_token: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        """发送一次POST请求，记录耗时和非0错误码"""
+        started = time.perf_counter()
+        try:
+            response = self.transport.post(url, params={"access_token": access_token}, json=data)
             response.raise_for_status()
             result = response.json()
+        finally:
+            _SEND_SECONDS.observe(time.perf_counter() - started)
+        if result.get("errcode"):
+            API_ERRORS.labels(path, result.get("errcode")).inc()
+        return result
+    
+    def _send_batch(self, msgtype: str, body: Dict[str, Any], batch: Batch) -> Dict[str, Any]:
+        """发送一个批次，返回接口响应"""
+        data = {
+            **batch.to_params(),
+            "msgtype": msgtype,
+            "agentid": self.config.agentid,
+            msgtype: body
+        }
+        return self._post_api("/cgi-bin/message/send", data, recipients=batch.user_ids)
+    
+    def send_message(self, msgtype: str, body: Dict[str, Any], user_ids: Optional[list] = None,
+                     dept_ids: Optional[list] = None, tag_ids: Optional[list] = None) -> DeliveryReport:
+        """发送消息并返回合并后的投递报告
+        
+        未指定任何接收者时使用配置中的用户、部门和标签；接收者超过单次上限时
+        拆成最少的批次并发发送。
+        """
+        # 确定接收者
+        if user_ids is None and dept_ids is None and tag_ids is None:
+            user_ids, dept_ids, tag_ids = self.config.user_ids, self.config.dept_ids, self.config.tag_ids
+        
+        batches = plan_batches(user_ids, dept_ids, tag_ids)
+        report = self.fanout.send(batches, lambda batch: self._send_batch(msgtype, body, batch))
+        
+        if report.invalid_users or report.invalid_parties or report.invalid_tags:
+            logger.warning(
+                f"部分接收者无效: 用户={report.invalid_users[:20]}, "
+                f"部门={report.invalid_parties[:20]}, 标签={report.invalid_tags[:20]}"
+            )
+        return report
+    
+    def send_text_message(self, content: str, user_ids: Optional[list] = None, **recipients) -> bool:
+        """发送文本消息"""
+        try:
+            report = self.send_message("text", {"content": content}, user_ids, **recipients)
             
-            if result.get("errcode") == 0:
-                logger.info(f"消息发送成功: {content[:50]}...")
+            if report.success:
+                logger.info("消息发送成功: %.50s...", content, extra={"category": "send"})
                 return True
             else:
-                logger.error(f"消息发送失败: {result}")
+                logger.error(f"消息发送失败: {report.errors}")
                 return False
-                
+        
         except Exception as e:
             logger.error(f"发送消息异常: {e}")
             return False
     
-    def send_markdown_message(self, content: str, user_ids: Optional[list] = None) -> bool:
+    def send_markdown_message(self, content: str, user_ids: Optional[list] = None, **recipients) -> bool:
         """发送Markdown消息"""
         try:
-            url = "https://qyapi.weixin.qq.com/cgi-bin/message/send"
-            access_token = self._get_access_token()
-            
-            # 确定接收者
-            if user_ids is None:
-                user_ids = self.config.user_ids
-            
-            touser = "|".join(user_ids) if user_ids else "@all"
-            
-            data = {
-                "touser": touser,
-                "msgtype": "markdown",
-                "agentid": self.config.agentid,
-                "markdown": {
-                    "content": content
-                }
-            }
+            report = self.send_message("markdown", {"content": content}, user_ids, **recipients)
             
-            params = {"access_token": access_token}
-            response = requests.post(url, params=params, json=data, timeout=10)
-            response.raise_for_status()
-            result = response.json()
-            
-            if result.get("errcode") == 0:
-                logger.info(f"Markdown消息发送成功: {content[:50]}...")
+            if report.success:
+                logger.info("Markdown消息发送成功: %.50s...", content, extra={"category": "send"})
                 return True
             else:
-                logger.error(f"Markdown消息发送失败: {result}")
+                logger.error(f"Markdown消息发送失败: {report.errors}")
                 return False
-                
+        
         except Exception as e:
             logger.error(f"发送Markdown消息异常: {e}")
-            return False 
\ No newline at end of file
+            return False
+    
+    def close(self):
+        """停止后台刷新并释放连接池"""
+        self.stop_token_refresher()
+        self.fanout.close()
+        self.transport.close()
@@ -3,8 +3,8 @@
 """
 
 import os
-from typing import Optional
-from dataclasses import dataclass
+from typing import Mapping, Optional
+from dataclasses import dataclass, field
 
 
 @dataclass
@@ -26,19 +26,118 @@ class WeChatConfig:
     token: Optional[str] = None
     # 自定义EncodingAESKey（用于消息加解密）
     encoding_aes_key: Optional[str] = None
+    # 企业微信API地址（可替换为本地代理或测试桩）
+    api_base: str = 'https://qyapi.weixin.qq.com'
+    # HTTP连接池大小（每个主机）
+    http_pool_size: int = 16
+    # HTTP读取超时（秒）
+    http_timeout: float = 10.0
+    # 异步发送工作线程数
+    send_workers: int = 4
+    # 异步发送队列容量
+    send_queue_size: int = 1000
+    # 群发时并发发送的批次数
+    fanout_workers: int = 4
+    # 访问令牌缓存文件路径（多worker共享），"memory"表示仅进程内缓存
+    token_cache_path: Optional[str] = None
+    # 令牌到期前多少秒开始后台刷新
+    token_refresh_ahead: float = 600
+    # 默认回复方式: auto（能被动回复则被动回复）/ active（总是主动发送）
+    reply_mode: str = 'auto'
+    # 回调请求等待被动回复的最长时间（秒），0表示不等待
+    passive_reply_window: float = 3.0
+    # 每个接口每分钟最多调用次数（所有worker合计），0表示不限速
+    api_rate_per_minute: float = 1200
+    # 每个成员每分钟最多接收的消息数（企业微信限制同一成员30次/分钟），0表示不限速
+    recipient_rate_per_minute: float = 30
+    # 超限时排队等待的最长时间（秒），超过后放弃发送
+    rate_limit_wait: float = 10.0
+    # 限速状态文件路径（多worker共享），"memory"表示仅进程内限速
+    rate_limit_path: Optional[str] = None
+    # 行情数据目录（<代码>.csv 或 <代码>.parquet）
+    data_dir: str = 'data'
+    # "信息更新"未指定代码时使用的股票
+    default_symbol: str = 'NVDA'
+    # 列式行情库目录，默认为 data_dir/store
+    market_store_dir: Optional[str] = None
+    # 报告缓存：最多条目数、内存上限（字节）、过期时间（秒）
+    report_cache_size: int = 256
+    report_cache_bytes: int = 4 * 1024 * 1024
+    report_cache_ttl: float = 300
+    # 定时任务执行线程数
+    scheduler_workers: int = 4
+    # 交易日历：交易所时区和休市日（YYYY-MM-DD）
+    market_timezone: str = 'America/New_York'
+    market_holidays: list[str] = field(default_factory=list)
+    # 订阅推送的时刻（交易所时区，交易日触发）
+    push_times: list[str] = field(default_factory=lambda: ['16:05'])
+    # 主节点锁文件路径（多worker中只有主节点执行定时任务），"memory"表示每个进程都执行
+    leader_lock_path: Optional[str] = None
+    # 主节点心跳间隔（秒），主节点退出后其他worker在一个间隔内接管
+    leader_heartbeat: float = 2.0
+    # 定时任务定义文件路径（多worker共享），未设置或"memory"表示仅进程内保存
+    job_store_path: Optional[str] = None
+    # 发件箱文件路径（多worker共享，重启后继续投递），"memory"表示不持久化
+    outbox_path: Optional[str] = None
+    # 每条消息最多发送次数，用尽后标记为失败
+    outbox_max_attempts: int = 8
+    # 回调去重表文件路径（多worker共享），未设置时仅进程内去重
+    dedup_path: Optional[str] = None
+    # 已处理回调的去重时间（秒）
+    dedup_ttl: float = 300
+    # 回调处理中的占用时间（秒），进程在处理中退出时到期后重试的回调重新处理
+    dedup_lease: float = 30
+    # 回调处理线程数与队列容量
+    ingress_workers: int = 4
+    ingress_queue_size: int = 1000
     
     @classmethod
-    def from_env(cls) -> 'WeChatConfig':
-        """从环境变量加载配置"""
+    def from_env(cls, environ: Optional[Mapping[str, str]] = None) -> 'WeChatConfig':
+        """从环境变量加载配置（environ默认为os.environ）"""
+        env = os.environ if environ is None else environ
         return cls(
-            corpid=os.getenv('WECHAT_CORPID', ''),
-            corpsecret=os.getenv('WECHAT_CORPSECRET', ''),
-            agentid=os.getenv('WECHAT_AGENTID', ''),
-            user_ids=os.getenv('WECHAT_USER_IDS', '').split(',') if os.getenv('WECHAT_USER_IDS') else [],
-            dept_ids=os.getenv('WECHAT_DEPT_IDS', '').split(',') if os.getenv('WECHAT_DEPT_IDS') else [],
-            tag_ids=os.getenv('WECHAT_TAG_IDS', '').split(',') if os.getenv('WECHAT_TAG_IDS') else [],
-            token=os.getenv('WECHAT_TOKEN'),
-            encoding_aes_key=os.getenv('WECHAT_ENCODING_AES_KEY')
+            corpid=env.get('WECHAT_CORPID', ''),
+            corpsecret=env.get('WECHAT_CORPSECRET', ''),
+            agentid=env.get('WECHAT_AGENTID', ''),
+            user_ids=env.get('WECHAT_USER_IDS', '').split(',') if env.get('WECHAT_USER_IDS') else [],
+            dept_ids=env.get('WECHAT_DEPT_IDS', '').split(',') if env.get('WECHAT_DEPT_IDS') else [],
+            tag_ids=env.get('WECHAT_TAG_IDS', '').split(',') if env.get('WECHAT_TAG_IDS') else [],
+            token=env.get('WECHAT_TOKEN'),
+            encoding_aes_key=env.get('WECHAT_ENCODING_AES_KEY'),
+            api_base=env.get('WECHAT_API_BASE', 'https://qyapi.weixin.qq.com').rstrip('/'),
+            http_pool_size=int(env.get('WECHAT_HTTP_POOL_SIZE', '16')),
+            http_timeout=float(env.get('WECHAT_HTTP_TIMEOUT', '10')),
+            send_workers=int(env.get('WECHAT_SEND_WORKERS', '4')),
+            send_queue_size=int(env.get('WECHAT_SEND_QUEUE_SIZE', '1000')),
+            fanout_workers=int(env.get('WECHAT_FANOUT_WORKERS', '4')),
+            token_cache_path=env.get('WECHAT_TOKEN_CACHE'),
+            token_refresh_ahead=float(env.get('WECHAT_TOKEN_REFRESH_AHEAD', '600')),
+            reply_mode=env.get('WECHAT_REPLY_MODE', 'auto'),
+            passive_reply_window=float(env.get('WECHAT_PASSIVE_REPLY_WINDOW', '3')),
+            api_rate_per_minute=float(env.get('WECHAT_API_RATE_PER_MINUTE', '1200')),
+            recipient_rate_per_minute=float(env.get('WECHAT_RECIPIENT_RATE_PER_MINUTE', '30')),
+            rate_limit_wait=float(env.get('WECHAT_RATE_LIMIT_WAIT', '10')),
+            rate_limit_path=env.get('WECHAT_RATE_LIMIT_PATH'),
+            data_dir=env.get('WECHAT_DATA_DIR', 'data'),
+            default_symbol=env.get('WECHAT_DEFAULT_SYMBOL', 'NVDA'),
+            market_store_dir=env.get('WECHAT_MARKET_STORE'),
+            report_cache_size=int(env.get('WECHAT_REPORT_CACHE_SIZE', '256')),
+            report_cache_bytes=int(env.get('WECHAT_REPORT_CACHE_BYTES', str(4 * 1024 * 1024))),
+            report_cache_ttl=float(env.get('WECHAT_REPORT_CACHE_TTL', '300')),
+            scheduler_workers=int(env.get('WECHAT_SCHEDULER_WORKERS', '4')),
+            market_timezone=env.get('WECHAT_MARKET_TIMEZONE', 'America/New_York'),
+            market_holidays=env.get('WECHAT_MARKET_HOLIDAYS', '').split(',') if env.get('WECHAT_MARKET_HOLIDAYS') else [],
+            push_times=env.get('WECHAT_PUSH_TIMES', '16:05').split(','),
+            leader_lock_path=env.get('WECHAT_LEADER_LOCK'),
+            leader_heartbeat=float(env.get('WECHAT_LEADER_HEARTBEAT', '2')),
+            job_store_path=env.get('WECHAT_JOB_STORE'),
+            outbox_path=env.get('WECHAT_OUTBOX'),
+            outbox_max_attempts=int(env.get('WECHAT_OUTBOX_MAX_ATTEMPTS', '8')),
+            dedup_path=env.get('WECHAT_DEDUP_PATH'),
+            dedup_ttl=float(env.get('WECHAT_DEDUP_TTL', '300')),
+            dedup_lease=float(env.get('WECHAT_DEDUP_LEASE', '30')),
+            ingress_workers=int(env.get('WECHAT_INGRESS_WORKERS', '4')),
+            ingress_queue_size=int(env.get('WECHAT_INGRESS_QUEUE_SIZE', '1000'))
         )
     
     def validate(self) -> bool:
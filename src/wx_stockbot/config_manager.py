@@ -0,0 +1,262 @@
+"""
+配置快照与热加载
+配置只在启动和重新加载时解析一次，连同解码后的AES密钥、拆分好的接收者列表和加解密器
+组成不可变的快照；请求线程读取当前快照的引用，重新加载时整体替换引用，不会读到一半新一半旧的配置。
+收到SIGHUP或配置文件（WECHAT_CONFIG_FILE，格式同 env_app_example.txt）变化时重新加载，不需要重启worker
+"""
+
+import os
+import copy
+import signal
+import logging
+import threading
+from dataclasses import dataclass, fields
+from datetime import datetime
+from typing import Callable, Optional
+
+from .config import WeChatConfig, DEFAULT_CONFIG
+from .crypto import WeChatCrypto, WeChatCryptoError, get_crypto
+
+logger = logging.getLogger(__name__)
+
+# 只在启动时生效的配置项（线程池、连接池、缓存容量、共享文件路径等），修改后需要重启worker
+RESTART_FIELDS = (
+    "http_pool_size", "send_workers", "send_queue_size", "fanout_workers", "token_cache_path",
+    "api_rate_per_minute", "recipient_rate_per_minute", "rate_limit_wait", "rate_limit_path",
+    "market_store_dir", "report_cache_size", "report_cache_bytes", "report_cache_ttl",
+    "scheduler_workers", "market_timezone", "market_holidays", "leader_lock_path",
+    "leader_heartbeat", "job_store_path", "outbox_path", "outbox_max_attempts", "dedup_path", "dedup_ttl",
+    "dedup_lease", "ingress_workers", "ingress_queue_size"
+)
+
+
+def read_config_file(path: str) -> dict[str, str]:
+    """读取 KEY=VALUE 格式的配置文件，忽略空行和#注释"""
+    values = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("export "):
+                line = line[len("export "):]
+            key, sep, value = line.partition("=")
+            if not sep:
+                continue
+            value = value.strip()
+            if len(value) >= 2 and value[0] == value[-1] and value[0] in "'\"":
+                value = value[1:-1]
+            values[key.strip()] = value
+    return values
+
+
+def changed_fields(old: WeChatConfig, new: WeChatConfig) -> list[str]:
+    """两份配置中取值不同的字段名"""
+    return [f.name for f in fields(WeChatConfig) if getattr(old, f.name) != getattr(new, f.name)]
+
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    """某一版本的配置及其派生数据，发布后不再修改"""
+    # 配置（快照私有的副本，使用方不应修改）
+    config: WeChatConfig
+    # 版本号，每次内容变化加1
+    version: int
+    # 加载时间
+    loaded_at: str
+    # 配置文件路径（只使用环境变量时为None）
+    source: Optional[str]
+    # 配置是否完整（corpid/corpsecret/agentid）
+    valid: bool
+    # 加解密器（未配置EncodingAESKey或CorpID时为None），密钥已解码
+    crypto: Optional[WeChatCrypto]
+    # 默认接收者
+    user_ids: tuple
+    dept_ids: tuple
+    tag_ids: tuple
+    
+    @property
+    def aes_key(self) -> Optional[bytes]:
+        return self.crypto.key if self.crypto else None
+    
+    def to_dict(self) -> dict:
+        return {
+            "version": self.version,
+            "loaded_at": self.loaded_at,
+            "source": self.source or "env",
+            "valid": self.valid,
+            "crypto": self.crypto is not None,
+            "recipients": {"users": len(self.user_ids), "depts": len(self.dept_ids), "tags": len(self.tag_ids)}
+        }
+
+
+def build_snapshot(config: WeChatConfig, version: int, source: Optional[str] = None) -> ConfigSnapshot:
+    """由配置生成快照，预先解码密钥、创建加解密器（密钥无效时抛出WeChatCryptoError）"""
+    config = copy.deepcopy(config)
+    crypto = None
+    if config.encoding_aes_key and config.corpid:
+        crypto = get_crypto(config.token, config.encoding_aes_key, config.corpid)
+        if len(crypto.key) != 32:
+            raise WeChatCryptoError(f"EncodingAESKey长度无效: 解码后 {len(crypto.key)} 字节")
+    return ConfigSnapshot(
+        config=config,
+        version=version,
+        loaded_at=datetime.now().isoformat(),
+        source=source,
+        valid=config.validate(),
+        crypto=crypto,
+        user_ids=tuple(u for u in config.user_ids if u),
+        dept_ids=tuple(d for d in config.dept_ids if d),
+        tag_ids=tuple(t for t in config.tag_ids if t)
+    )
+
+
+class ConfigManager:
+    """发布配置快照并在配置变化时热加载
+    
+    current() 只读取一个引用，请求路径上没有锁和解析开销；
+    reload() 解析失败时保留当前快照，内容变化时依次通知监听器 func(old, new)；
+    配置不完整时发布fallback（未指定时照常发布不完整的配置）
+    """
+    
+    def __init__(self, path: Optional[str] = None, poll_interval: float = 2.0,
+                 fallback: Optional[WeChatConfig] = None):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.fallback = fallback
+        self._listeners: list[Callable[[ConfigSnapshot, ConfigSnapshot], None]] = []
+        self._reload_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._file_state = self._stat()
+        self.stats = {"reloads": 0, "unchanged": 0, "failures": 0, "signals": 0}
+        # 最近一次读取到的配置（未替换为fallback），用于判断内容是否变化
+        self._loaded: Optional[WeChatConfig] = None
+        try:
+            self._loaded = self._load()
+            self._snapshot = self._build(self._loaded, 1)
+        except Exception as e:
+            logger.error(f"加载配置失败: {e}")
+            self._snapshot = build_snapshot(fallback or DEFAULT_CONFIG, 1, path)
+    
+    def current(self) -> ConfigSnapshot:
+        """当前配置快照"""
+        return self._snapshot
+    
+    @property
+    def config(self) -> WeChatConfig:
+        return self._snapshot.config
+    
+    def add_listener(self, func: Callable[[ConfigSnapshot, ConfigSnapshot], None]):
+        """配置内容变化时回调 func(旧快照, 新快照)"""
+        self._listeners.append(func)
+    
+    def _load(self) -> WeChatConfig:
+        # 配置文件中的值覆盖同名环境变量
+        environ = dict(os.environ)
+        if self.path:
+            environ.update(read_config_file(self.path))
+        return WeChatConfig.from_env(environ)
+    
+    def _build(self, config: WeChatConfig, version: int) -> ConfigSnapshot:
+        if not config.validate() and self.fallback is not None:
+            logger.warning("配置不完整（需要WECHAT_CORPID、WECHAT_CORPSECRET、WECHAT_AGENTID），使用默认配置")
+            config = self.fallback
+        return build_snapshot(config, version, self.path)
+    
+    def _stat(self) -> Optional[tuple]:
+        if not self.path:
+            return None
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+    
+    def reload(self) -> bool:
+        """重新加载配置，内容变化并发布新快照时返回True"""
+        with self._reload_lock:
+            self._file_state = self._stat()
+            old = self._snapshot
+            try:
+                config = self._load()
+                if config == self._loaded:
+                    self.stats["unchanged"] += 1
+                    return False
+                snapshot = self._build(config, old.version + 1)
+            except Exception as e:
+                self.stats["failures"] += 1
+                logger.error(f"重新加载配置失败，继续使用版本 {old.version}: {e}")
+                return False
+            
+            self._loaded = config
+            self._snapshot = snapshot
+            self.stats["reloads"] += 1
+            logger.info(f"配置已更新到版本 {snapshot.version}，"
+                        f"变化: {', '.join(changed_fields(old.config, snapshot.config)) or '无'}")
+        
+        for func in self._listeners:
+            try:
+                func(old, snapshot)
+            except Exception as e:
+                logger.error(f"配置变化回调异常: {e}")
+        return True
+    
+    def start(self):
+        """启动监视线程：配置文件变化或收到SIGHUP时重新加载"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="config-watcher", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=self.poll_interval * 2)
+    
+    def _loop(self):
+        while not self._stop.is_set():
+            woken = self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            if woken or self._stat() != self._file_state:
+                self.reload()
+    
+    def request_reload(self):
+        """请求监视线程重新加载（可在信号处理函数中调用）"""
+        self.stats["signals"] += 1
+        self._wake.set()
+    
+    def install_signal_handler(self, signum: int = getattr(signal, "SIGHUP", 0)) -> bool:
+        """收到信号时重新加载；只能在主线程安装，gunicorn下需要在worker进程中安装"""
+        if not signum or threading.current_thread() is not threading.main_thread():
+            return False
+        signal.signal(signum, lambda signum, frame: self.request_reload())
+        return True
+    
+    def _after_fork(self):
+        # 监视线程不会随fork复制，子进程中重新启动
+        if self._thread is not None and not self._stop.is_set():
+            self._wake = threading.Event()
+            self._reload_lock = threading.Lock()
+            self._thread = None
+            self.start()
+    
+    def get_status(self) -> dict:
+        return {**self._snapshot.to_dict(), "path": self.path, **self.stats}
+
+
+def create_config_manager(fallback: Optional[WeChatConfig] = None) -> ConfigManager:
+    """按环境变量创建配置管理器：WECHAT_CONFIG_FILE、WECHAT_CONFIG_POLL_INTERVAL"""
+    manager = ConfigManager(
+        os.getenv('WECHAT_CONFIG_FILE') or None,
+        poll_interval=float(os.getenv('WECHAT_CONFIG_POLL_INTERVAL', '2')),
+        fallback=fallback
+    )
+    if hasattr(os, "register_at_fork"):
+        os.register_at_fork(after_in_child=manager._after_fork)
+    return manager
@@ -0,0 +1,204 @@
+"""
+企业微信消息加解密
+AES-256-CBC + PKCS7(32字节块) + SHA1签名，密钥按配置缓存复用
+"""
+
+import os
+import time
+import base64
+import hmac
+import struct
+import hashlib
+import logging
+from functools import lru_cache
+from typing import Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# 优先使用cryptography（OpenSSL实现），不可用时退化为纯Python的pyaes
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    OPENSSL_AVAILABLE = True
+except ImportError:
+    OPENSSL_AVAILABLE = False
+
+try:
+    import pyaes
+    PYAES_AVAILABLE = True
+except ImportError:
+    PYAES_AVAILABLE = False
+
+CRYPTO_BACKEND = "cryptography" if OPENSSL_AVAILABLE else ("pyaes" if PYAES_AVAILABLE else None)
+
+# 企业微信的PKCS7填充按32字节对齐
+PAD_BLOCK_SIZE = 32
+AES_BLOCK_SIZE = 16
+
+
+class WeChatCryptoError(Exception):
+    """加解密失败"""
+
+
+def pkcs7_pad(data: bytes, block_size: int = PAD_BLOCK_SIZE) -> bytes:
+    """PKCS7填充"""
+    pad_len = block_size - len(data) % block_size
+    return data + bytes([pad_len]) * pad_len
+
+
+def pkcs7_unpad(data: Union[bytes, bytearray], block_size: int = PAD_BLOCK_SIZE) -> int:
+    """返回去除PKCS7填充后的有效长度（所有填充字节都必须等于填充长度）"""
+    if not data:
+        raise WeChatCryptoError("解密数据为空")
+    pad_len = data[-1]
+    if (pad_len < 1 or pad_len > block_size or pad_len > len(data)
+            or data[-pad_len:] != bytes([pad_len]) * pad_len):
+        raise WeChatCryptoError(f"无效的填充长度: {pad_len}")
+    return len(data) - pad_len
+
+
+def generate_signature(token: str, timestamp: str, nonce: str, encrypted: str) -> str:
+    """生成签名：四个参数按字典序排序后拼接做SHA1"""
+    params = sorted([token or "", timestamp or "", nonce or "", encrypted or ""])
+    return hashlib.sha1("".join(params).encode("utf-8")).hexdigest()
+
+
+class _PyaesCBC:
+    """基于pyaes分组函数的CBC实现
+    
+    pyaes.AES 的轮密钥只在构造时计算一次；每个分组与前一个密文分组异或后写入预分配的bytearray，
+    不再逐块拼接bytes。耗时仍由纯Python的AES分组运算决定，与原实现相当，需要性能时安装cryptography。
+    """
+    
+    def __init__(self, key: bytes):
+        self._aes = pyaes.AES(key)
+    
+    def decrypt(self, iv: bytes, ciphertext: bytes) -> bytes:
+        out = bytearray(len(ciphertext))
+        decrypt_block = self._aes.decrypt
+        prev = int.from_bytes(iv, "big")
+        for i in range(0, len(ciphertext), AES_BLOCK_SIZE):
+            block = ciphertext[i:i + AES_BLOCK_SIZE]
+            plain = int.from_bytes(bytes(decrypt_block(block)), "big") ^ prev
+            out[i:i + AES_BLOCK_SIZE] = plain.to_bytes(AES_BLOCK_SIZE, "big")
+            prev = int.from_bytes(block, "big")
+        return bytes(out)
+    
+    def encrypt(self, iv: bytes, plaintext: bytes) -> bytes:
+        out = bytearray(len(plaintext))
+        encrypt_block = self._aes.encrypt
+        prev = int.from_bytes(iv, "big")
+        for i in range(0, len(plaintext), AES_BLOCK_SIZE):
+            block = (int.from_bytes(plaintext[i:i + AES_BLOCK_SIZE], "big") ^ prev).to_bytes(AES_BLOCK_SIZE, "big")
+            cipher_block = bytes(encrypt_block(block))
+            out[i:i + AES_BLOCK_SIZE] = cipher_block
+            prev = int.from_bytes(cipher_block, "big")
+        return bytes(out)
+
+
+class _OpenSSLCBC:
+    """基于cryptography的CBC实现"""
+    
+    def __init__(self, key: bytes):
+        self._algorithm = algorithms.AES(key)
+    
+    def decrypt(self, iv: bytes, ciphertext: bytes) -> bytes:
+        decryptor = Cipher(self._algorithm, modes.CBC(iv)).decryptor()
+        return decryptor.update(ciphertext) + decryptor.finalize()
+    
+    def encrypt(self, iv: bytes, plaintext: bytes) -> bytes:
+        encryptor = Cipher(self._algorithm, modes.CBC(iv)).encryptor()
+        return encryptor.update(plaintext) + encryptor.finalize()
+
+
+class WeChatCrypto:
+    """企业微信消息加解密器
+    
+    明文帧格式: random(16) + msg_len(4, 网络字节序) + msg + receive_id
+    """
+    
+    def __init__(self, token: str, encoding_aes_key: str, receive_id: str, backend: Optional[str] = None):
+        if len(encoding_aes_key or "") != 43:
+            raise WeChatCryptoError("EncodingAESKey长度必须为43")
+        backend = backend or CRYPTO_BACKEND
+        if not {"cryptography": OPENSSL_AVAILABLE, "pyaes": PYAES_AVAILABLE}.get(backend):
+            raise WeChatCryptoError(f"AES实现不可用: {backend}，请安装cryptography或pyaes")
+        
+        self.token = token or ""
+        self.receive_id = receive_id or ""
+        self._receive_id_bytes = self.receive_id.encode("utf-8")
+        self.key = base64.b64decode(encoding_aes_key + "=")
+        self.iv = self.key[:AES_BLOCK_SIZE]
+        self.backend = backend
+        self._cipher = _OpenSSLCBC(self.key) if backend == "cryptography" else _PyaesCBC(self.key)
+    
+    def sign(self, timestamp: str, nonce: str, encrypted: str) -> str:
+        """生成签名"""
+        return generate_signature(self.token, timestamp, nonce, encrypted)
+    
+    def verify_signature(self, msg_signature: str, timestamp: str, nonce: str, encrypted: str) -> bool:
+        """校验签名（常量时间比较）"""
+        return hmac.compare_digest(self.sign(timestamp, nonce, encrypted), msg_signature or "")
+    
+    def decrypt(self, encrypted: Union[str, bytes]) -> bytes:
+        """解密并解析明文帧，返回消息体"""
+        try:
+            ciphertext = base64.b64decode(encrypted)
+        except Exception as e:
+            raise WeChatCryptoError(f"Base64解码失败: {e}")
+        if not ciphertext or len(ciphertext) % AES_BLOCK_SIZE:
+            raise WeChatCryptoError(f"密文长度无效: {len(ciphertext)}")
+        
+        plain = self._cipher.decrypt(self.iv, ciphertext)
+        end = pkcs7_unpad(plain)
+        if end < 20:
+            raise WeChatCryptoError("解密数据长度不足")
+        
+        msg_len = struct.unpack_from("!I", plain, 16)[0]
+        msg_end = 20 + msg_len
+        if msg_end > end:
+            raise WeChatCryptoError(f"消息长度无效: {msg_len}")
+        
+        receive_id = bytes(plain[msg_end:end])
+        if self._receive_id_bytes and receive_id != self._receive_id_bytes:
+            raise WeChatCryptoError(f"ReceiveId校验失败: {receive_id!r}")
+        return bytes(plain[20:msg_end])
+    
+    def encrypt(self, message: Union[str, bytes], random_bytes: Optional[bytes] = None) -> str:
+        """加密消息，返回Base64密文"""
+        if isinstance(message, str):
+            message = message.encode("utf-8")
+        frame = b"".join([
+            random_bytes or os.urandom(16),
+            struct.pack("!I", len(message)),
+            message,
+            self._receive_id_bytes
+        ])
+        ciphertext = self._cipher.encrypt(self.iv, pkcs7_pad(frame))
+        return base64.b64encode(ciphertext).decode("ascii")
+    
+    def decrypt_message(self, encrypted: str, msg_signature: str, timestamp: str, nonce: str) -> str:
+        """校验签名并解密回调消息"""
+        if not self.verify_signature(msg_signature, timestamp, nonce, encrypted):
+            raise WeChatCryptoError("签名验证失败")
+        return self.decrypt(encrypted).decode("utf-8")
+    
+    def encrypt_reply(self, reply_xml: str, nonce: Optional[str] = None, timestamp: Optional[str] = None) -> str:
+        """加密被动回复：明文XML -> 加密 -> 签名 -> 回复包XML"""
+        nonce = nonce or os.urandom(8).hex()
+        timestamp = timestamp or str(int(time.time()))
+        encrypted = self.encrypt(reply_xml)
+        signature = self.sign(timestamp, nonce, encrypted)
+        return (
+            "<xml>"
+            f"<Encrypt><![CDATA[{encrypted}]]></Encrypt>"
+            f"<MsgSignature><![CDATA[{signature}]]></MsgSignature>"
+            f"<TimeStamp>{timestamp}</TimeStamp>"
+            f"<Nonce><![CDATA[{nonce}]]></Nonce>"
+            "</xml>"
+        )
+
+
+@lru_cache(maxsize=8)
+def get_crypto(token: str, encoding_aes_key: str, receive_id: str) -> WeChatCrypto:
+    """按配置复用加解密器，避免每次请求重复解码密钥和计算轮密钥"""
+    return WeChatCrypto(token, encoding_aes_key, receive_id)
@@ -0,0 +1,236 @@
+"""
+回调消息去重
+企业微信在回调超时时会重发同一条消息，按MsgId（事件按FromUserName+CreateTime）去重。
+处理前先以较短的租约占用（claim），处理成功后才记为已处理（complete）；处理失败时释放（release），
+进程在处理中退出时租约到期，企业微信之后的重试仍会被处理
+"""
+
+import os
+import mmap
+import time
+import struct
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# fcntl仅在类Unix系统可用，不可用时只能使用进程内去重
+try:
+    import fcntl
+    FILE_LOCK_AVAILABLE = True
+except ImportError:
+    FILE_LOCK_AVAILABLE = False
+
+
+def dedup_key(data: dict) -> Optional[str]:
+    """生成去重键：普通消息用MsgId，事件用FromUserName+CreateTime(+Event)"""
+    msg_id = data.get('MsgId')
+    if msg_id:
+        return f"msg:{msg_id}"
+    user_id = data.get('FromUserName')
+    create_time = data.get('CreateTime')
+    if user_id and create_time:
+        return f"event:{user_id}:{create_time}:{data.get('Event', '')}"
+    return None
+
+
+def _digest(key: str) -> int:
+    """64位摘要作为紧凑存储的键（0保留为空槽）"""
+    value = int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+    return value or 1
+
+
+class DedupCache:
+    """进程内TTL去重缓存
+    
+    只保存64位摘要和过期时间。处理中的租约和已处理的条目分两个OrderedDict保存，
+    各自的过期时长固定，插入（更新时移到末尾）顺序即过期顺序：
+    过期和超出容量时只需比较两个头部、弹出较早过期的一个，O(1)。
+    """
+    
+    def __init__(self, ttl: float = 300, max_entries: int = 100000, lease: float = 30):
+        self.ttl = ttl
+        self.lease = lease
+        self.max_entries = max_entries
+        self._entries: OrderedDict[int, float] = OrderedDict()
+        self._leases: OrderedDict[int, float] = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"checks": 0, "duplicates": 0, "released": 0}
+    
+    def seen(self, key: str) -> bool:
+        """检查并记录为已处理：已见过（且未过期）返回True，否则记录后返回False"""
+        return self._check_and_set(key, self.ttl)
+    
+    def claim(self, key: str) -> bool:
+        """开始处理前占用：已处理或正在处理返回False，否则占用一个租约并返回True"""
+        return not self._check_and_set(key, self.lease, leased=True)
+    
+    def complete(self, key: str):
+        """处理成功，记为已处理（TTL内的重复回调都被忽略）"""
+        self._set(key, self.ttl)
+    
+    def release(self, key: str):
+        """处理失败，释放占用，企业微信重试时重新处理"""
+        self._set(key, None)
+    
+    def _evict(self, now: float, room: int = 1):
+        """弹出已过期的条目，为新条目腾出room个位置时再弹出最早过期的（调用方持有锁）"""
+        tables = (self._entries, self._leases)
+        while True:
+            heads = [(next(iter(table.values())), table) for table in tables if table]
+            if not heads:
+                return
+            expires_at, table = min(heads, key=lambda head: head[0])
+            if expires_at > now and len(self._entries) + len(self._leases) + room <= self.max_entries:
+                return
+            table.popitem(last=False)
+    
+    def _check_and_set(self, key: str, ttl: float, leased: bool = False) -> bool:
+        digest = _digest(key)
+        now = time.monotonic()
+        with self._lock:
+            self.stats["checks"] += 1
+            for table in (self._entries, self._leases):
+                expires_at = table.get(digest)
+                if expires_at is not None and expires_at > now:
+                    self.stats["duplicates"] += 1
+                    return True
+            self._evict(now)
+            self._store(digest, now + ttl, self._leases if leased else self._entries)
+            return False
+    
+    def _store(self, digest: int, expires_at: float, table: OrderedDict):
+        """写入一张表并从另一张表移除（调用方持有锁）"""
+        other = self._leases if table is self._entries else self._entries
+        other.pop(digest, None)
+        table[digest] = expires_at
+        table.move_to_end(digest)
+    
+    def _set(self, key: str, ttl: Optional[float]):
+        """记为已处理（过期时间为ttl后），ttl为None时删除"""
+        digest = _digest(key)
+        with self._lock:
+            if ttl is None:
+                self.stats["released"] += 1
+                self._entries.pop(digest, None)
+                self._leases.pop(digest, None)
+            else:
+                self._store(digest, time.monotonic() + ttl, self._entries)
+    
+    def get_status(self) -> dict:
+        """去重统计"""
+        return {"backend": "memory", "entries": len(self._entries), "leases": len(self._leases),
+                "ttl": self.ttl, "lease": self.lease, **self.stats}
+
+
+class FileDedupCache(DedupCache):
+    """多worker共享的文件去重表
+    
+    内存映射的开放寻址哈希表，每个槽16字节（64位摘要 + 过期时间）；
+    过期槽原地复用，探测窗口内无可用槽时覆盖最早过期的槽，因此内存占用固定。
+    读写时持有文件锁。
+    """
+    
+    SLOT = struct.Struct("<Qd")
+    MAX_PROBE = 16
+    
+    def __init__(self, path: str, ttl: float = 300, capacity: int = 65536, lease: float = 30):
+        super().__init__(ttl=ttl, lease=lease)
+        # 容量取2的幂，便于用掩码取模
+        self.capacity = 1 << max(capacity - 1, 1).bit_length()
+        self.path = path
+        size = self.capacity * self.SLOT.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size != size:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(self._fd).st_size != size:
+                    os.ftruncate(self._fd, 0)
+                    os.ftruncate(self._fd, size)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, size)
+    
+    def _check_and_set(self, key: str, ttl: float, leased: bool = False) -> bool:
+        """检查并记录（跨进程）；租约和已处理条目在同一张表中，各槽按自己的过期时间复用"""
+        digest = _digest(key)
+        # 过期时间需要跨进程比较，使用墙钟时间
+        now = time.time()
+        mask = self.capacity - 1
+        slot_size = self.SLOT.size
+        unpack_from, pack_into = self.SLOT.unpack_from, self.SLOT.pack_into
+        
+        with self._lock:
+            self.stats["checks"] += 1
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                free_slot = None
+                oldest_slot, oldest_expiry = None, None
+                start = digest & mask
+                for i in range(self.MAX_PROBE):
+                    slot = (start + i) & mask
+                    stored, expires_at = unpack_from(self._map, slot * slot_size)
+                    if stored == digest and expires_at > now:
+                        self.stats["duplicates"] += 1
+                        return True
+                    if stored == 0:
+                        # 从未使用过的槽：后面不会再有该键
+                        if free_slot is None:
+                            free_slot = slot
+                        break
+                    if expires_at <= now and free_slot is None:
+                        free_slot = slot
+                    if oldest_expiry is None or expires_at < oldest_expiry:
+                        oldest_slot, oldest_expiry = slot, expires_at
+                
+                target = free_slot if free_slot is not None else oldest_slot
+                pack_into(self._map, target * slot_size, digest, now + ttl)
+                return False
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+    
+    def _set(self, key: str, ttl: Optional[float]):
+        """更新已占用条目的过期时间；ttl为None时置为已过期（槽保留摘要，探测不会在此中断）"""
+        digest = _digest(key)
+        mask = self.capacity - 1
+        slot_size = self.SLOT.size
+        with self._lock:
+            if ttl is None:
+                self.stats["released"] += 1
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                start = digest & mask
+                for i in range(self.MAX_PROBE):
+                    slot = (start + i) & mask
+                    stored, _ = self.SLOT.unpack_from(self._map, slot * slot_size)
+                    if stored == digest:
+                        self.SLOT.pack_into(self._map, slot * slot_size, digest,
+                                            0.0 if ttl is None else time.time() + ttl)
+                        return
+                    if stored == 0:
+                        break
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        # 占用的槽已被覆盖（表已满时），重新记录
+        if ttl is not None:
+            self._check_and_set(key, ttl)
+    
+    def get_status(self) -> dict:
+        """去重统计"""
+        return {"backend": "file", "path": self.path, "capacity": self.capacity, "ttl": self.ttl, "lease": self.lease,
+                **self.stats}
+    
+    def close(self):
+        """释放映射"""
+        self._map.close()
+        os.close(self._fd)
+
+
+def create_dedup_cache(path: Optional[str] = None, ttl: float = 300, lease: float = 30) -> DedupCache:
+    """配置了共享文件路径时创建跨worker去重表，否则使用进程内缓存"""
+    if path and FILE_LOCK_AVAILABLE:
+        return FileDedupCache(path, ttl=ttl, lease=lease)
+    return DedupCache(ttl=ttl, lease=lease)
@@ -0,0 +1,331 @@
+"""
+异步消息发送队列
+有界队列 + 固定数量的工作线程，调用方拿到任务ID/Future后立即返回。
+配置了发件箱时，任务提交前先持久化，发送失败按指数退避重试，进程重启后继续投递；
+群发时只重试因暂时性错误失败的批次，不可重试的错误（接收者无效、无权限等）直接放弃
+"""
+
+import time
+import uuid
+import queue
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Optional
+
+from .client import WeChatClient
+from .fanout import DeliveryReport, merge_recipients
+from .outbox import Outbox
+
+logger = logging.getLogger(__name__)
+
+
+class DispatchQueueFull(Exception):
+    """发送队列已满"""
+
+
+class DispatcherStopped(Exception):
+    """发送队列已停止（worker正在退出）"""
+
+
+@dataclass
+class SendJob:
+    """发送任务"""
+    content: str
+    user_ids: Optional[list] = None
+    msgtype: str = "text"
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    created_at: float = field(default_factory=time.time)
+    future: Future = field(default_factory=Future, repr=False)
+    # 已发送次数（含当前这次）和最近一次失败原因
+    attempts: int = 0
+    last_error: Optional[str] = None
+    # 发送失败，等待重试
+    retrying: bool = False
+    # 部分批次失败后尚未送达的接收者（user_ids/dept_ids/tag_ids），None表示全部接收者
+    recipients: Optional[dict] = None
+    
+    @classmethod
+    def from_row(cls, row: dict) -> 'SendJob':
+        """由发件箱中的记录恢复任务（重启前提交的消息）"""
+        return cls(content=row["content"], user_ids=row["user_ids"], msgtype=row["msgtype"],
+                   job_id=row["job_id"], created_at=row["created_at"], attempts=row["attempts"],
+                   recipients=row.get("recipients"))
+    
+    def targets(self) -> dict:
+        """本次发送的接收者参数：未指定时使用配置中的接收者"""
+        if self.recipients is not None:
+            return self.recipients
+        return {} if self.user_ids is None else {"user_ids": self.user_ids}
+    
+    @property
+    def status(self) -> str:
+        """任务状态: queued / running / retrying / done / failed"""
+        if not self.future.done():
+            if self.retrying:
+                return "retrying"
+            return "running" if self.future.running() else "queued"
+        if self.future.exception() is not None or not self.future.result():
+            return "failed"
+        return "done"
+    
+    def to_dict(self) -> dict:
+        """任务概要"""
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "msgtype": self.msgtype,
+            "created_at": self.created_at,
+            "attempts": self.attempts,
+            "last_error": self.last_error
+        }
+
+
+class SendDispatcher:
+    """异步消息发送器
+    
+    outbox为None时任务只在内存中排队，失败不重试；
+    否则提交时先写入发件箱，轮询线程认领到期的重试和其他进程遗留的消息
+    """
+    
+    def __init__(self, client: WeChatClient, workers: int = 4, maxsize: int = 1000,
+                 submit_timeout: float = 0.5, history_size: int = 1000,
+                 outbox: Optional[Outbox] = None, max_attempts: int = 8,
+                 retry_base: float = 2.0, retry_max: float = 300.0, poll_interval: float = 1.0):
+        self.client = client
+        self.workers = workers
+        self.submit_timeout = submit_timeout
+        self.history_size = history_size
+        self.outbox = outbox
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.poll_interval = poll_interval
+        self._queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        self._threads: list[threading.Thread] = []
+        self._poller: Optional[threading.Thread] = None
+        self._stop_polling = threading.Event()
+        self._jobs: OrderedDict[str, SendJob] = OrderedDict()
+        self._jobs_lock = threading.Lock()
+        # 已在本进程队列中或正在发送的任务，轮询时不重复入队
+        self._inflight: set[str] = set()
+        self._running = False
+        # 调用过stop()后不再接收任务，也不再重新启动（客户端可能已关闭）
+        self._stopped = False
+        self._stats = {"submitted": 0, "sent": 0, "failed": 0, "rejected": 0,
+                       "deferred": 0, "retried": 0, "replayed": 0}
+    
+    def start(self):
+        """启动工作线程；有发件箱时同时启动轮询线程，投递重启前未完成的消息（停止后不再启动）"""
+        if self._running or self._stopped:
+            return
+        self._running = True
+        if self.outbox is not None:
+            self.outbox.start()
+            self._stop_polling.clear()
+            self._poller = threading.Thread(target=self._poll_loop, name="outbox-poller", daemon=True)
+            self._poller.start()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"send-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"启动消息发送队列，工作线程数: {self.workers}")
+    
+    def stop(self, timeout: float = 5):
+        """停止工作线程，已入队的任务会先发送完；之后提交的任务抛出DispatcherStopped"""
+        self._stopped = True
+        if not self._running:
+            return
+        self._running = False
+        if self._poller is not None:
+            self._stop_polling.set()
+            self._poller.join(timeout=timeout)
+            self._poller = None
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+        self._threads = []
+        if self.outbox is not None:
+            self.outbox.stop(timeout=timeout)
+        logger.info("停止消息发送队列")
+    
+    def submit(self, content: str, user_ids: Optional[list] = None, msgtype: str = "text",
+               timeout: Optional[float] = None) -> SendJob:
+        """提交发送任务，队列满时最多等待timeout秒，仍满则抛出DispatchQueueFull，已停止时抛出DispatcherStopped；
+        有发件箱时写入后立即返回，队列满的任务留在发件箱中由轮询线程稍后入队"""
+        if self._stopped:
+            raise DispatcherStopped("发送队列已停止")
+        if not self._running:
+            self.start()
+        
+        job = SendJob(content=content, user_ids=user_ids, msgtype=msgtype)
+        if self.outbox is not None and self._persist(job):
+            self._remember(job)
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                self._inflight.discard(job.job_id)
+                self.outbox.release(job.job_id)
+                self._stats["deferred"] += 1
+            self._stats["submitted"] += 1
+            return job
+        
+        try:
+            self._queue.put(job, timeout=self.submit_timeout if timeout is None else timeout)
+        except queue.Full:
+            self._stats["rejected"] += 1
+            logger.error(f"发送队列已满，拒绝任务: {content[:50]}...")
+            raise DispatchQueueFull(f"发送队列已满（容量 {self._queue.maxsize}）")
+        
+        self._stats["submitted"] += 1
+        self._remember(job)
+        return job
+    
+    def _persist(self, job: SendJob) -> bool:
+        """写入发件箱并等待提交，失败时退回内存队列"""
+        try:
+            self.outbox.add([(job.job_id, job.msgtype, job.content, job.user_ids)])
+        except Exception as e:
+            logger.error(f"写入发件箱失败，任务只在内存中排队: {e}")
+            return False
+        job.attempts = 1
+        return True
+    
+    def _remember(self, job: SendJob):
+        with self._jobs_lock:
+            self._jobs[job.job_id] = job
+            self._inflight.add(job.job_id)
+            while len(self._jobs) > self.history_size:
+                self._jobs.popitem(last=False)
+    
+    def get_job(self, job_id: str) -> Optional[SendJob]:
+        """查询最近的任务"""
+        with self._jobs_lock:
+            return self._jobs.get(job_id)
+    
+    def _worker_loop(self):
+        """工作线程循环"""
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                # 重试的任务在第一次发送时已进入running状态
+                if not job.future.running() and not job.future.set_running_or_notify_cancel():
+                    if self.outbox is not None:
+                        self.outbox.fail(job.job_id, "已取消")
+                    continue
+                job.retrying = False
+                report, error = None, None
+                try:
+                    report = self.client.send_message(job.msgtype, {"content": job.content}, **job.targets())
+                except Exception as e:
+                    logger.error(f"发送任务异常: {e}")
+                    error = e
+                self._finish(job, report, error)
+            finally:
+                if job is not None:
+                    self._inflight.discard(job.job_id)
+                self._queue.task_done()
+    
+    def _finish(self, job: SendJob, report: Optional[DeliveryReport], error: Optional[Exception]):
+        """记录一次发送的结果：成功确认；失败时只要有批次因暂时性错误失败且次数未用尽，
+        就退避后只重试这些批次，其余失败的批次重试也不会成功，直接放弃"""
+        if report is not None and report.success:
+            if self.outbox is not None:
+                self.outbox.ack(job.job_id)
+            self._stats["sent"] += 1
+            logger.info("消息发送成功: %.50s...", job.content, extra={"category": "send"})
+            job.future.set_result(True)
+            return
+        
+        remaining = None
+        if report is not None:
+            job.last_error = "; ".join(f"{e['errcode']} {e['errmsg']}" for e in report.errors) or "发送失败"
+            retryable = report.retryable_batches
+            if len(retryable) < report.failed:
+                logger.error(f"任务 {job.job_id} 有 {report.failed - len(retryable)} 个批次的错误不可重试，放弃这些接收者")
+            if retryable and len(retryable) < report.batches:
+                # 已送达和不可重试的批次不再重发
+                remaining = merge_recipients(retryable)
+        else:
+            job.last_error = str(error)
+            retryable = True
+        
+        if self.outbox is not None and retryable and job.attempts < self.max_attempts:
+            delay = min(self.retry_max, self.retry_base * 2 ** (job.attempts - 1))
+            if remaining is not None:
+                job.recipients = remaining
+            self.outbox.retry(job.job_id, delay, job.last_error, remaining)
+            job.retrying = True
+            self._stats["retried"] += 1
+            scope = f"（只重试{len(retryable)}/{report.batches}个批次）" if remaining is not None else ""
+            logger.warning(f"任务 {job.job_id} 第{job.attempts}次发送失败，{delay:.0f}秒后重试{scope}: {job.last_error}")
+            return
+        
+        logger.error(f"消息发送失败: {job.last_error}")
+        if self.outbox is not None:
+            self.outbox.fail(job.job_id, job.last_error)
+            reason = f"发送{job.attempts}次均失败" if retryable else "错误不可重试"
+            logger.error(f"任务 {job.job_id} {reason}，放弃: {job.last_error}")
+        self._stats["failed"] += 1
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(False)
+    
+    def _poll_loop(self):
+        """轮询发件箱：先放回已退出进程认领的消息，再认领到期的消息放入队列"""
+        try:
+            released = self.outbox.reclaim_dead()
+            if released:
+                logger.info(f"发件箱中 {released} 条消息的发送进程已退出，重新投递")
+        except Exception as e:
+            logger.error(f"回收发件箱消息失败: {e}")
+        
+        while not self._stop_polling.is_set():
+            try:
+                self._poll_once()
+            except Exception as e:
+                logger.error(f"轮询发件箱失败: {e}")
+            self._stop_polling.wait(self.poll_interval)
+    
+    def _poll_once(self) -> int:
+        """认领不超过队列空位数的到期消息，返回入队数"""
+        free = self._queue.maxsize - self._queue.qsize()
+        if free <= 0:
+            return 0
+        queued = 0
+        for row in self.outbox.claim(free):
+            with self._jobs_lock:
+                job = self._jobs.get(row["job_id"])
+                # 仍在本进程队列中（租约到期被重新认领），不重复发送
+                if row["job_id"] in self._inflight:
+                    continue
+            if job is None or job.future.done():
+                job = SendJob.from_row(row)
+                self._stats["replayed"] += 1
+            job.attempts = row["attempts"]
+            job.recipients = row["recipients"]
+            self._remember(job)
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                self._inflight.discard(job.job_id)
+                self.outbox.release(job.job_id)
+                break
+            queued += 1
+        return queued
+    
+    def get_status(self) -> dict:
+        """队列状态"""
+        return {
+            "running": self._running,
+            "workers": self.workers,
+            "queue_size": self._queue.qsize(),
+            "queue_capacity": self._queue.maxsize,
+            **self._stats
+        }
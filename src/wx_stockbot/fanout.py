@@ -0,0 +1,192 @@
+"""
+消息群发拆分
+按接口上限把接收者拆成尽量少的批次，并发发送后合并各批次的无效接收者
+"""
+
+import math
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# message/send 单次调用的接收者上限
+MAX_USERS_PER_CALL = 1000
+MAX_PARTIES_PER_CALL = 100
+MAX_TAGS_PER_CALL = 100
+
+# 重试可能成功的错误码：系统繁忙（网络异常和HTTP错误也记为-1）、数据版本冲突、频率超限、
+# 令牌失效（客户端已刷新重试过一次）。其他错误（接收者无效、无权限、消息内容不合法等）重试也不会成功
+TRANSIENT_ERRCODES = frozenset({-1, 6000, 40001, 40014, 42001, 45009, 45033})
+
+
+def is_transient_errcode(errcode) -> bool:
+    """错误码是否值得重试"""
+    return errcode in TRANSIENT_ERRCODES
+
+
+@dataclass
+class Batch:
+    """一次接口调用的接收者"""
+    user_ids: list[str] = field(default_factory=list)
+    dept_ids: list[str] = field(default_factory=list)
+    tag_ids: list[str] = field(default_factory=list)
+    
+    def to_params(self) -> dict:
+        """转换为touser/toparty/totag字段"""
+        params = {}
+        if self.user_ids:
+            params["touser"] = "|".join(self.user_ids)
+        if self.dept_ids:
+            params["toparty"] = "|".join(self.dept_ids)
+        if self.tag_ids:
+            params["totag"] = "|".join(self.tag_ids)
+        return params
+    
+    @property
+    def size(self) -> int:
+        return len(self.user_ids) + len(self.dept_ids) + len(self.tag_ids)
+
+
+def _unique(ids: Optional[list]) -> list[str]:
+    """去重并去掉空值，保持原有顺序"""
+    return list(dict.fromkeys(str(i).strip() for i in (ids or []) if str(i).strip()))
+
+
+def _chunk(ids: list[str], size: int, index: int) -> list[str]:
+    return ids[index * size:(index + 1) * size]
+
+
+def merge_recipients(batches: list[Batch]) -> dict[str, list[str]]:
+    """多个批次的接收者合并为 send_message 的 user_ids/dept_ids/tag_ids 参数"""
+    return {
+        "user_ids": [i for batch in batches for i in batch.user_ids],
+        "dept_ids": [i for batch in batches for i in batch.dept_ids],
+        "tag_ids": [i for batch in batches for i in batch.tag_ids]
+    }
+
+
+def plan_batches(user_ids: Optional[list] = None, dept_ids: Optional[list] = None,
+                 tag_ids: Optional[list] = None) -> list[Batch]:
+    """把接收者拆成最少的批次
+    
+    一次调用可同时携带 touser/toparty/totag，因此批次数取三者各自所需批次数的最大值，
+    每个批次尽量装满。没有任何接收者或包含 @all 时只发一次 @all。
+    """
+    users, parties, tags = _unique(user_ids), _unique(dept_ids), _unique(tag_ids)
+    if "@all" in users or not (users or parties or tags):
+        return [Batch(user_ids=["@all"])]
+    
+    count = max(
+        math.ceil(len(users) / MAX_USERS_PER_CALL),
+        math.ceil(len(parties) / MAX_PARTIES_PER_CALL),
+        math.ceil(len(tags) / MAX_TAGS_PER_CALL)
+    )
+    return [
+        Batch(
+            user_ids=_chunk(users, MAX_USERS_PER_CALL, i),
+            dept_ids=_chunk(parties, MAX_PARTIES_PER_CALL, i),
+            tag_ids=_chunk(tags, MAX_TAGS_PER_CALL, i)
+        )
+        for i in range(count)
+    ]
+
+
+@dataclass
+class DeliveryReport:
+    """群发结果"""
+    batches: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    invalid_users: list[str] = field(default_factory=list)
+    invalid_parties: list[str] = field(default_factory=list)
+    invalid_tags: list[str] = field(default_factory=list)
+    errors: list[dict] = field(default_factory=list)
+    # 失败的批次及其错误码
+    failed_batches: list[tuple[Batch, object]] = field(default_factory=list, repr=False)
+    
+    @property
+    def success(self) -> bool:
+        """所有批次都发送成功"""
+        return self.batches > 0 and self.failed == 0
+    
+    @property
+    def retryable_batches(self) -> list[Batch]:
+        """因暂时性错误失败、值得重试的批次"""
+        return [batch for batch, errcode in self.failed_batches if is_transient_errcode(errcode)]
+    
+    def add_result(self, batch: Batch, result: dict):
+        """合并一个批次的接口响应"""
+        self.batches += 1
+        if result.get("errcode") == 0:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+            self.failed_batches.append((batch, result.get("errcode")))
+            self.errors.append({"errcode": result.get("errcode"), "errmsg": result.get("errmsg"), "recipients": batch.size})
+        for key, target in (("invaliduser", self.invalid_users),
+                            ("invalidparty", self.invalid_parties),
+                            ("invalidtag", self.invalid_tags)):
+            if result.get(key):
+                target.extend(i for i in str(result[key]).split("|") if i)
+    
+    def add_error(self, batch: Batch, error: Exception):
+        """合并一个批次的异常"""
+        self.add_result(batch, {"errcode": -1, "errmsg": str(error)})
+    
+    def to_dict(self) -> dict:
+        return {
+            "success": self.success,
+            "batches": self.batches,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "invalid_users": self.invalid_users,
+            "invalid_parties": self.invalid_parties,
+            "invalid_tags": self.invalid_tags,
+            "errors": self.errors
+        }
+
+
+class FanoutSender:
+    """并发发送多个批次"""
+    
+    def __init__(self, max_workers: int = 4):
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+    
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="fanout")
+        return self._executor
+    
+    @staticmethod
+    def _send_one(send_batch: Callable[[Batch], dict], batch: Batch) -> tuple[Batch, Optional[dict], Optional[Exception]]:
+        try:
+            return batch, send_batch(batch), None
+        except Exception as e:
+            return batch, None, e
+    
+    def send(self, batches: list[Batch], send_batch: Callable[[Batch], dict]) -> DeliveryReport:
+        """发送所有批次并合并结果；单个批次直接在调用线程发送"""
+        report = DeliveryReport()
+        if len(batches) == 1:
+            outcomes = [self._send_one(send_batch, batches[0])]
+        else:
+            outcomes = list(self._get_executor().map(lambda batch: self._send_one(send_batch, batch), batches))
+        
+        for batch, result, error in outcomes:
+            if error is not None:
+                logger.error(f"批次发送异常({batch.size}个接收者): {error}")
+                report.add_error(batch, error)
+            else:
+                report.add_result(batch, result)
+        
+        if len(batches) > 1:
+            logger.info(f"群发完成: {report.succeeded}/{report.batches} 个批次成功")
+        return report
+    
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -0,0 +1,197 @@
+"""
+技术指标计算
+基于NumPy整列计算，输入可以是单只股票的一维序列，也可以是 (股票数, 交易日数) 的二维数组，
+沿最后一维（时间）计算；二维输入要求各股票按日期对齐且没有缺失值
+"""
+
+import logging
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 递推平滑（KDJ）每次处理的时间步数：块内用闭式解整体计算，块间只循环 T/块大小 次
+RECURSIVE_BLOCK = 64
+
+
+def _pad_edge(x: np.ndarray, n: int) -> np.ndarray:
+    """在时间维前面补 n-1 个首值；滚动最高/最低价对部分窗口的结果因此与只取已有数据一致"""
+    pad = [(0, 0)] * (x.ndim - 1) + [(n - 1, 0)]
+    return np.pad(x, pad, mode="edge")
+
+
+def _rolling_extreme(x: np.ndarray, n: int, op: np.ufunc) -> np.ndarray:
+    """van Herk/Gil-Werman 滚动极值，与窗口长度无关，每个元素只做三次比较
+    
+    按长度 N 分块，分别求块内前缀极值和后缀极值；以 i 结尾的窗口横跨至多两个块，
+    结果为 op(起点所在块的后缀极值, 终点所在块的前缀极值)。
+    """
+    x = np.asarray(x, dtype=np.float64)
+    if n <= 1:
+        return x.copy()
+    padded = _pad_edge(x, n)
+    length = padded.shape[-1]
+    tail = -length % n
+    if tail:
+        padded = np.pad(padded, [(0, 0)] * (x.ndim - 1) + [(0, tail)], mode="edge")
+    blocks = padded.reshape(padded.shape[:-1] + (-1, n))
+    prefix = op.accumulate(blocks, axis=-1).reshape(padded.shape)
+    suffix = op.accumulate(blocks[..., ::-1], axis=-1)[..., ::-1].reshape(padded.shape)
+    size = x.shape[-1]
+    return op(suffix[..., :size], prefix[..., n - 1:n - 1 + size])
+
+
+def rolling_max(x: np.ndarray, n: int) -> np.ndarray:
+    """N周期最高值（HHV），前 N-1 期取已有数据的最高值"""
+    return _rolling_extreme(x, n, np.maximum)
+
+
+def rolling_min(x: np.ndarray, n: int) -> np.ndarray:
+    """N周期最低值（LLV），前 N-1 期取已有数据的最低值"""
+    return _rolling_extreme(x, n, np.minimum)
+
+
+def moving_average(x: np.ndarray, n: int) -> np.ndarray:
+    """简单移动平均（前缀和相减），窗口内数据不足 N 个时为NaN"""
+    x = np.asarray(x, dtype=np.float64)
+    valid = np.isfinite(x)
+    pad = [(0, 0)] * (x.ndim - 1) + [(1, 0)]
+    total = np.pad(np.cumsum(np.where(valid, x, 0.0), axis=-1), pad)
+    count = np.pad(np.cumsum(valid, axis=-1), pad)
+    window_sum = total[..., n:] - total[..., :-n]
+    window_count = count[..., n:] - count[..., :-n]
+    result = np.full(x.shape, np.nan)
+    result[..., n - 1:] = np.where(window_count == n, window_sum / n, np.nan)
+    return result
+
+
+def recursive_smooth(x: np.ndarray, weight: int, init: float = 50.0) -> np.ndarray:
+    """通达信 SMA(X, N, 1) 递推平滑: Y = (X + (N-1)*Y') / N，Y的初值为init
+    
+    Y_t = a*Y_{t-1} + (1-a)*X_t 是线性递推，块内展开为
+    Y_t = a^(t+1)*Y_-1 + (1-a) * Σ a^(t-i) X_i，用前缀和一次算出整块，
+    块长度有限，a^(-i) 不会溢出。
+    """
+    x = np.asarray(x, dtype=np.float64)
+    a = (weight - 1) / weight
+    length = x.shape[-1]
+    block = min(RECURSIVE_BLOCK, max(length, 1))
+    steps = np.arange(block, dtype=np.float64)
+    decay = a ** (steps + 1)
+    growth = a ** -steps
+    result = np.empty_like(x)
+    prev = np.full(x.shape[:-1], init, dtype=np.float64)
+    for start in range(0, length, block):
+        chunk = x[..., start:start + block]
+        size = chunk.shape[-1]
+        scaled = np.cumsum(chunk * growth[:size], axis=-1) * (a ** steps[:size])
+        out = decay[:size] * prev[..., None] + (1 - a) * scaled
+        result[..., start:start + size] = out
+        prev = out[..., -1]
+    return result
+
+
+def williams_r(high: np.ndarray, low: np.ndarray, close: np.ndarray, n: int = 14) -> np.ndarray:
+    """威廉指标（国内行情软件口径）: WR = 100 * (HHV(H,N) - C) / (HHV(H,N) - LLV(L,N))
+    
+    取值0~100，数值越低越接近N日最高价（超买），越高越接近最低价（超卖）；
+    N日内最高价等于最低价时为NaN。
+    """
+    hhv = rolling_max(high, n)
+    llv = rolling_min(low, n)
+    span = hhv - llv
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(span > 0, 100.0 * (hhv - close) / span, np.nan)
+
+
+def kdj(high: np.ndarray, low: np.ndarray, close: np.ndarray,
+        n: int = 9, m1: int = 3, m2: int = 3) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """KDJ(9,3,3)
+    
+    RSV = (C - LLV(L,N)) / (HHV(H,N) - LLV(L,N)) * 100，K = SMA(RSV,M1,1)，D = SMA(K,M2,1)，
+    J = 3K - 2D，K、D初值50；N日内最高价等于最低价时RSV取50。
+    """
+    hhv = rolling_max(high, n)
+    llv = rolling_min(low, n)
+    span = hhv - llv
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rsv = np.where(span > 0, 100.0 * (close - llv) / span, 50.0)
+    k = recursive_smooth(rsv, m1)
+    d = recursive_smooth(k, m2)
+    return k, d, 3 * k - 2 * d
+
+
+def parabolic_sar(high: np.ndarray, low: np.ndarray, step: float = 0.02,
+                  max_step: float = 0.2) -> tuple[np.ndarray, np.ndarray]:
+    """抛物线转向指标（Wilder），返回 (SAR, 趋势)，趋势1为上涨、-1为下跌
+    
+    SAR的每一步都依赖前一步是否反转，时间维无法展开成整列运算，
+    这里按交易日循环、每一步在所有股票上同时计算。
+    """
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    squeeze = high.ndim == 1
+    if squeeze:
+        high, low = high[None, :], low[None, :]
+    symbols, length = high.shape
+    sar = np.full((symbols, length), np.nan)
+    trend = np.zeros((symbols, length), dtype=np.int8)
+    if length < 2:
+        return (sar[0], trend[0]) if squeeze else (sar, trend)
+    
+    # 以前两根K线的走向确定初始趋势
+    up = high[:, 1] + low[:, 1] >= high[:, 0] + low[:, 0]
+    cur = np.where(up, low[:, 0], high[:, 0])
+    ep = np.where(up, high[:, 0], low[:, 0])
+    af = np.full(symbols, step)
+    sar[:, 0] = cur
+    trend[:, 0] = np.where(up, 1, -1)
+    
+    for t in range(1, length):
+        h, l = high[:, t], low[:, t]
+        prev_low = low[:, t - 1] if t < 2 else np.minimum(low[:, t - 1], low[:, t - 2])
+        prev_high = high[:, t - 1] if t < 2 else np.maximum(high[:, t - 1], high[:, t - 2])
+        cur = cur + af * (ep - cur)
+        # SAR不能进入前两根K线的价格区间
+        cur = np.where(up, np.minimum(cur, prev_low), np.maximum(cur, prev_high))
+        
+        reverse = np.where(up, l < cur, h > cur)
+        # 反转：SAR取上一段的极值点，极值点与加速因子重置
+        cur = np.where(reverse, ep, cur)
+        up = up ^ reverse
+        new_ep = np.where(up, np.maximum(ep, h), np.minimum(ep, l))
+        extended = ~reverse & (new_ep != ep)
+        ep = np.where(reverse, np.where(up, h, l), new_ep)
+        af = np.where(reverse, step, np.where(extended, np.minimum(af + step, max_step), af))
+        
+        sar[:, t] = cur
+        trend[:, t] = np.where(up, 1, -1)
+    
+    return (sar[0], trend[0]) if squeeze else (sar, trend)
+
+
+def compute_indicators(high: np.ndarray, low: np.ndarray, close: np.ndarray,
+                       ma_windows: tuple[int, ...] = (5, 10, 20, 60),
+                       wr_windows: tuple[int, ...] = (14, 21)) -> dict[str, np.ndarray]:
+    """一次计算报告用到的全部指标，返回 名称 -> 与输入同形状的数组"""
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    close = np.asarray(close, dtype=np.float64)
+    
+    result: dict[str, np.ndarray] = {}
+    for n in wr_windows:
+        result[f"wr{n}"] = williams_r(high, low, close, n)
+    result["k"], result["d"], result["j"] = kdj(high, low, close)
+    result["sar"], result["sar_trend"] = parabolic_sar(high, low)
+    for n in ma_windows:
+        result[f"ma{n}"] = moving_average(close, n)
+    return result
+
+
+def latest(values: np.ndarray, index: int = -1) -> Optional[float]:
+    """取一维序列中的某个值，NaN返回None"""
+    if values.size == 0:
+        return None
+    value = float(values[index])
+    return None if np.isnan(value) else value
@@ -0,0 +1,184 @@
+"""
+回调消息接入管道
+回调接口只校验签名并入队，解密、分发和回复由后台处理线程完成
+"""
+
+import time
+import uuid
+import queue
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from .metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# 回调在队列中等待处理的时间
+_QUEUE_WAIT_SECONDS = stage("queue_wait")
+
+
+class IngressQueueFull(Exception):
+    """接入队列已满"""
+
+
+class IngressStopped(Exception):
+    """接入管道已停止（worker正在退出）"""
+
+
+@dataclass
+class Envelope:
+    """待处理的原始回调"""
+    # 原始请求体
+    body: bytes
+    # URL参数（msg_signature/timestamp/nonce）
+    args: dict
+    # 回调中的加密消息（已完成签名校验）
+    encrypted_msg: Optional[str] = None
+    # 明文（JSON）回调在接收时已解析出的字段
+    data: Optional[dict] = None
+    # 回调请求是否在等待被动回复
+    awaiting_reply: bool = False
+    envelope_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    received_at: float = field(default_factory=time.monotonic)
+    _reply: Optional[str] = field(default=None, repr=False)
+    _reply_event: threading.Event = field(default_factory=threading.Event, repr=False)
+    _reply_lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+    
+    def offer_reply(self, payload: str) -> bool:
+        """交付被动回复；回调请求已不再等待（超时或无需等待）时返回False"""
+        with self._reply_lock:
+            if not self.awaiting_reply or self._reply_event.is_set():
+                return False
+            self._reply = payload
+            self._reply_event.set()
+            return True
+    
+    def finish(self):
+        """处理完成，唤醒仍在等待的回调请求"""
+        self._reply_event.set()
+    
+    def wait_reply(self, timeout: float) -> Optional[str]:
+        """等待被动回复，超时后放弃（之后的回复改为主动发送）"""
+        self._reply_event.wait(timeout)
+        with self._reply_lock:
+            self.awaiting_reply = False
+            self._reply_event.set()
+            return self._reply
+
+
+class IngressPipeline:
+    """回调消息接入管道"""
+    
+    def __init__(self, processor: Callable[[Envelope], None], workers: int = 4, maxsize: int = 1000):
+        self.processor = processor
+        self.workers = workers
+        self._queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        self._threads: list[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._running = False
+        # 调用过stop()后不再接收回调，也不再重新启动
+        self._stopped = False
+        self._stats = {"accepted": 0, "processed": 0, "failed": 0, "rejected": 0}
+        # 排队延迟（入队到开始处理）与处理耗时，单位秒
+        self._last_lag = 0.0
+        self._max_lag = 0.0
+        self._avg_lag = 0.0
+        self._avg_process_time = 0.0
+    
+    def start(self):
+        """启动处理线程（停止后不再启动）"""
+        with self._lock:
+            self._start_locked()
+    
+    def _start_locked(self):
+        if self._running or self._stopped:
+            return
+        self._running = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"ingress-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"启动回调处理管道，处理线程数: {self.workers}")
+    
+    def stop(self, timeout: float = 5):
+        """停止处理线程，已入队的回调会先处理完；之后提交的回调抛出IngressStopped"""
+        with self._lock:
+            self._stopped = True
+            if not self._running:
+                return
+            self._running = False
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join(timeout=timeout)
+        logger.info("停止回调处理管道")
+    
+    def submit(self, envelope: Envelope):
+        """入队，不阻塞；队列满时抛出IngressQueueFull，已停止时抛出IngressStopped"""
+        # 与stop()互斥，停止后不会有回调排在结束标记之后无人处理
+        with self._lock:
+            if self._stopped:
+                raise IngressStopped("回调处理管道已停止")
+            self._start_locked()
+            try:
+                self._queue.put_nowait(envelope)
+            except queue.Full:
+                self._stats["rejected"] += 1
+                raise IngressQueueFull(f"回调队列已满（容量 {self._queue.maxsize}）")
+        self._stats["accepted"] += 1
+    
+    def has_backlog(self) -> bool:
+        """是否有回调在排队等待处理"""
+        return self._queue.qsize() > 0
+    
+    def _worker_loop(self):
+        """处理线程循环"""
+        while True:
+            envelope = self._queue.get()
+            try:
+                if envelope is None:
+                    return
+                started = time.monotonic()
+                self._record_lag(started - envelope.received_at)
+                try:
+                    self.processor(envelope)
+                    self._stats["processed"] += 1
+                except Exception as e:
+                    logger.error(f"处理回调异常: {e}")
+                    self._stats["failed"] += 1
+                finally:
+                    envelope.finish()
+                elapsed = time.monotonic() - started
+                self._avg_process_time = self._avg_process_time * 0.9 + elapsed * 0.1
+            finally:
+                self._queue.task_done()
+    
+    def _record_lag(self, lag: float):
+        """记录排队延迟（指数滑动平均）"""
+        _QUEUE_WAIT_SECONDS.observe(lag)
+        self._last_lag = lag
+        self._max_lag = max(self._max_lag, lag)
+        self._avg_lag = self._avg_lag * 0.9 + lag * 0.1
+    
+    def get_status(self) -> dict:
+        """管道状态"""
+        # 队首回调已等待的时间，反映当前积压程度
+        oldest_wait = 0.0
+        with self._queue.mutex:
+            if self._queue.queue and self._queue.queue[0] is not None:
+                oldest_wait = time.monotonic() - self._queue.queue[0].received_at
+        return {
+            "running": self._running,
+            "workers": self.workers,
+            "queue_depth": self._queue.qsize(),
+            "queue_capacity": self._queue.maxsize,
+            "oldest_wait_ms": round(oldest_wait * 1000, 2),
+            "last_lag_ms": round(self._last_lag * 1000, 2),
+            "avg_lag_ms": round(self._avg_lag * 1000, 2),
+            "max_lag_ms": round(self._max_lag * 1000, 2),
+            "avg_process_ms": round(self._avg_process_time * 1000, 2),
+            **self._stats
+        }
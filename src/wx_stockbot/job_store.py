@@ -0,0 +1,109 @@
+"""
+定时任务定义存储
+任务定义（类型和参数）保存在多个worker共享的JSON文件中，每个worker按心跳同步到自己的调度器，
+由主节点执行；任何worker收到"打开推送"或"订阅"指令后写入这里。
+共享文件需要显式配置路径，未配置时只在进程内保存
+"""
+
+import os
+import json
+import logging
+import threading
+
+from .config import WeChatConfig
+
+logger = logging.getLogger(__name__)
+
+# fcntl仅在类Unix系统可用，不可用时只能使用进程内存储
+try:
+    import fcntl
+    FILE_LOCK_AVAILABLE = True
+except ImportError:
+    FILE_LOCK_AVAILABLE = False
+
+
+class JobStore:
+    """进程内任务定义: 任务ID -> {"type": 类型, ...参数}"""
+    
+    def __init__(self):
+        self._specs: dict[str, dict] = {}
+        self._lock = threading.Lock()
+    
+    def put(self, job_id: str, spec: dict):
+        with self._lock:
+            self._specs[job_id] = spec
+    
+    def remove(self, job_id: str) -> bool:
+        with self._lock:
+            return self._specs.pop(job_id, None) is not None
+    
+    def load(self) -> dict[str, dict]:
+        with self._lock:
+            return dict(self._specs)
+    
+    def get_status(self) -> dict:
+        return {"backend": "memory", "jobs": len(self._specs)}
+
+
+class FileJobStore(JobStore):
+    """多worker共享的任务定义，读写都持有文件锁"""
+    
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+    
+    def _update(self, func):
+        with self._lock:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                specs = self._read(fd)
+                result = func(specs)
+                data = json.dumps(specs, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+                os.ftruncate(fd, 0)
+                os.pwrite(fd, data, 0)
+                self._specs = specs
+                return result
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+    
+    @staticmethod
+    def _read(fd: int) -> dict:
+        data = os.pread(fd, os.fstat(fd).st_size, 0)
+        if not data:
+            return {}
+        try:
+            return json.loads(data)
+        except Exception as e:
+            logger.warning(f"读取任务定义文件失败: {e}")
+            return {}
+    
+    def put(self, job_id: str, spec: dict):
+        self._update(lambda specs: specs.__setitem__(job_id, spec))
+    
+    def remove(self, job_id: str) -> bool:
+        return self._update(lambda specs: specs.pop(job_id, None) is not None)
+    
+    def load(self) -> dict[str, dict]:
+        fd = os.open(self.path, os.O_RDONLY | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            specs = self._read(fd)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+        with self._lock:
+            self._specs = specs
+        return dict(specs)
+    
+    def get_status(self) -> dict:
+        return {"backend": "file", "path": self.path, "jobs": len(self._specs)}
+
+
+def create_job_store(config: WeChatConfig) -> JobStore:
+    """根据配置创建任务定义存储：指定了job_store_path时多worker共享该文件，
+    未指定或为"memory"时只在进程内保存（重启后丢失，多worker时其他worker收到的指令不会同步到主节点）"""
+    if not config.job_store_path or config.job_store_path == "memory" or not FILE_LOCK_AVAILABLE:
+        return JobStore()
+    return FileJobStore(config.job_store_path)
@@ -0,0 +1,141 @@
+"""
+关键词分发索引
+Aho-Corasick 多模式匹配，一次扫描消息即可找出所有命中的关键词
+"""
+
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class KeywordEntry:
+    """已注册的关键词"""
+    keyword: str
+    value: Any
+    priority: int = 0
+    # 注册顺序，用于最后的平局裁决
+    seq: int = 0
+
+
+@dataclass
+class KeywordMatch:
+    """一次命中"""
+    entry: KeywordEntry
+    # 关键词在消息中第一次出现的位置
+    position: int
+    
+    @property
+    def sort_key(self) -> tuple:
+        """排序规则：优先级高者优先，其次关键词更长者，其次出现更早者，最后先注册者"""
+        return (-self.entry.priority, -len(self.entry.keyword), self.position, self.entry.seq)
+
+
+class KeywordIndex:
+    """Aho-Corasick 关键词索引
+    
+    注册时只把关键词插入字典树（O(关键词长度)），失败链接在下一次匹配前
+    按需统一重建，批量注册时只重建一次。匹配耗时与消息长度和命中数成正比，
+    与关键词数量无关。
+    """
+    
+    def __init__(self):
+        # 每个节点: 子节点表、失败链接、该节点结束的关键词、输出链接（最近的有关键词的后缀节点）
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._terminal: list[Optional[KeywordEntry]] = [None]
+        self._output: list[int] = [-1]
+        self._entries: dict[str, KeywordEntry] = {}
+        self._seq = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def __contains__(self, keyword: str) -> bool:
+        return keyword in self._entries
+    
+    def add(self, keyword: str, value: Any, priority: int = 0):
+        """注册关键词；重复注册时更新处理值和优先级"""
+        if not keyword:
+            raise ValueError("关键词不能为空")
+        with self._lock:
+            existing = self._entries.get(keyword)
+            if existing is not None:
+                existing.value = value
+                existing.priority = priority
+                return
+            
+            self._seq += 1
+            entry = KeywordEntry(keyword, value, priority, self._seq)
+            self._entries[keyword] = entry
+            
+            node = 0
+            for char in keyword:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._terminal.append(None)
+                    self._output.append(-1)
+                    self._goto[node][char] = next_node
+                node = next_node
+            self._terminal[node] = entry
+            self._dirty = True
+    
+    def _build(self):
+        """广度优先重建失败链接和输出链接"""
+        with self._lock:
+            if not self._dirty:
+                return
+            goto, fail, terminal, output = self._goto, self._fail, self._terminal, self._output
+            queue = deque()
+            for child in goto[0].values():
+                fail[child] = 0
+                output[child] = -1
+                queue.append(child)
+            while queue:
+                node = queue.popleft()
+                for char, child in goto[node].items():
+                    state = fail[node]
+                    while state and char not in goto[state]:
+                        state = fail[state]
+                    target = goto[state].get(char, 0)
+                    fail[child] = target if target != child else 0
+                    output[child] = fail[child] if terminal[fail[child]] is not None else output[fail[child]]
+                    queue.append(child)
+            self._dirty = False
+            logger.debug(f"重建关键词索引: {len(self._entries)} 个关键词, {len(goto)} 个节点")
+    
+    def match(self, text: str) -> list[KeywordMatch]:
+        """返回消息中命中的所有关键词，已按优先级/长度/位置/注册顺序排序"""
+        if self._dirty:
+            self._build()
+        
+        goto, fail, terminal, output = self._goto, self._fail, self._terminal, self._output
+        found: dict[str, KeywordMatch] = {}
+        node = 0
+        for index, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            
+            hit = node if terminal[node] is not None else output[node]
+            while hit > 0:
+                entry = terminal[hit]
+                if entry.keyword not in found:
+                    found[entry.keyword] = KeywordMatch(entry, index - len(entry.keyword) + 1)
+                hit = output[hit]
+        
+        return sorted(found.values(), key=lambda m: m.sort_key)
+    
+    def best(self, text: str) -> Optional[KeywordMatch]:
+        """返回最优的一个命中"""
+        matches = self.match(text)
+        return matches[0] if matches else None
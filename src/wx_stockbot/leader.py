@@ -0,0 +1,283 @@
+"""
+主节点选举
+多个gunicorn worker竞争同一个文件锁，持有锁的worker负责执行定时任务；
+进程退出（包括崩溃）时内核自动释放锁，其他worker在一个心跳周期内接管。
+主节点卡住（进程仍在、锁未释放）时靠心跳租约接管：租约过期后其他worker换掉锁文件
+"""
+
+import os
+import json
+import time
+import socket
+import hashlib
+import logging
+import tempfile
+import threading
+from datetime import datetime
+from typing import Callable, Optional
+
+from .config import WeChatConfig
+
+logger = logging.getLogger(__name__)
+
+# fcntl仅在类Unix系统可用，不可用时每个进程都视为主节点
+try:
+    import fcntl
+    FILE_LOCK_AVAILABLE = True
+except ImportError:
+    FILE_LOCK_AVAILABLE = False
+
+
+class LeaderElection:
+    """单进程部署：当前进程始终是主节点"""
+    
+    def __init__(self):
+        self.identity = f"{socket.gethostname()}:{os.getpid()}"
+        self.since = datetime.now().isoformat()
+        self._listeners: list[Callable[[bool], None]] = []
+        self._tick_listeners: list[Callable[[], None]] = []
+        self._health_checks: list[Callable[[], bool]] = []
+    
+    @property
+    def is_leader(self) -> bool:
+        return True
+    
+    def add_listener(self, func: Callable[[bool], None]):
+        """主节点身份变化时回调 func(is_leader)"""
+        self._listeners.append(func)
+    
+    def add_tick_listener(self, func: Callable[[], None]):
+        """每个心跳周期回调一次（主节点和从节点都会回调）"""
+        self._tick_listeners.append(func)
+    
+    def add_health_check(self, func: Callable[[], bool]):
+        """主节点健康检查（如调度线程是否按时运行），任一返回False时主节点让出并暂不参选"""
+        self._health_checks.append(func)
+    
+    def _healthy(self) -> bool:
+        for func in self._health_checks:
+            try:
+                if not func():
+                    return False
+            except Exception as e:
+                logger.error(f"主节点健康检查异常: {e}")
+                return False
+        return True
+    
+    def start(self):
+        pass
+    
+    def stop(self):
+        pass
+    
+    def get_status(self) -> dict:
+        return {"backend": "memory", "is_leader": True, "identity": self.identity,
+                "leader": {"identity": self.identity, "since": self.since}}
+
+
+class FileLeaderElection(LeaderElection):
+    """基于文件锁的主节点租约
+    
+    后台线程每个心跳周期尝试非阻塞地获取独占锁，拿到后一直持有直到进程退出、stop()或让出。
+    锁由内核保证互斥；主节点每个心跳周期续约（写入心跳时间和锁文件的inode），
+    租约为3个心跳周期：
+    
+    - 主节点只在租约有效期内视为主节点，卡住恢复后不会在发现被接管之前执行任务；
+    - 健康检查失败（如调度线程错过心跳）时主节点释放锁，恢复健康前不再参选；
+    - 其他worker发现当前锁文件的租约过期时，在接管锁（.takeover）内删除旧锁文件并锁定新文件，
+      旧主节点下次心跳发现锁文件已被替换后让出。
+    
+    需要在fork之后启动：fork出的子进程会继承同一把锁。
+    """
+    
+    def __init__(self, path: str, heartbeat: float = 2.0):
+        super().__init__()
+        self.path = path
+        self.info_path = path + ".json"
+        self.heartbeat = heartbeat
+        self.lease = heartbeat * 3
+        self._fd: Optional[int] = None
+        # 最近一次续约的单调时钟时间
+        self._renewed = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"elections": 0, "heartbeats": 0, "step_downs": 0, "takeovers": 0}
+    
+    @property
+    def is_leader(self) -> bool:
+        return self._fd is not None and time.monotonic() - self._renewed < self.lease
+    
+    def start(self):
+        """启动选举线程，立即尝试一次"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._tick()
+        self._thread = threading.Thread(target=self._loop, name="leader-election", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """停止选举并释放锁，其他worker在下一个心跳周期接管"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.heartbeat * 2)
+        if self._fd is not None:
+            if self._owns_lock():
+                self._remove_info()
+            self._release()
+            logger.info(f"释放主节点: {self.identity}")
+    
+    def _loop(self):
+        while not self._stop.wait(self.heartbeat):
+            self._tick()
+    
+    def _tick(self):
+        if self._fd is not None:
+            self._check_lease()
+        if self._fd is None and self._healthy():
+            self._try_acquire()
+        if self._fd is not None:
+            self._renewed = time.monotonic()
+            self._write_info()
+        for func in self._tick_listeners:
+            try:
+                func()
+            except Exception as e:
+                logger.error(f"主节点心跳回调异常: {e}")
+    
+    def _owns_lock(self) -> bool:
+        """持有的锁是否仍是当前的锁文件（未被接管）"""
+        try:
+            return os.stat(self.path).st_ino == os.fstat(self._fd).st_ino
+        except FileNotFoundError:
+            return False
+    
+    def _remove_info(self):
+        try:
+            os.unlink(self.info_path)
+        except OSError:
+            pass
+    
+    def _check_lease(self):
+        """主节点续约前检查：锁文件被其他worker替换（租约过期被接管）或健康检查失败时让出"""
+        if not self._owns_lock():
+            logger.warning(f"主节点租约已被其他worker接管，让出: {self.identity}")
+        elif not self._healthy():
+            logger.warning(f"主节点健康检查失败，让出: {self.identity}")
+            self._remove_info()
+        else:
+            return
+        self.stats["step_downs"] += 1
+        self._release()
+    
+    def _try_acquire(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            fd = self._take_over(fd)
+            if fd is None:
+                return
+        self._fd, self._renewed = fd, time.monotonic()
+        self.since = datetime.now().isoformat()
+        self.stats["elections"] += 1
+        logger.info(f"当选主节点: {self.identity}")
+        self._notify(True)
+    
+    def _take_over(self, fd: int) -> Optional[int]:
+        """锁被占用时检查租约：当前锁文件的租约已过期则换成新的锁文件并锁定，返回新文件描述符
+        
+        只接管心跳记录的inode与当前锁文件相同的租约，旧主节点恢复后写入的过期信息不会触发接管；
+        接管锁保证同一时刻只有一个worker替换锁文件，接管后立即写入新的心跳。
+        """
+        guard = os.open(self.path + ".takeover", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            try:
+                fcntl.flock(guard, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            info = self.leader_info()
+            if info is None or not info["stale"] or info.get("inode") != os.fstat(fd).st_ino:
+                return None
+            try:
+                if os.stat(self.path).st_ino != info["inode"]:
+                    return None
+                os.unlink(self.path)
+            except FileNotFoundError:
+                return None
+            new_fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(new_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(new_fd)
+                return None
+            self.stats["takeovers"] += 1
+            self._fd, self._renewed = new_fd, time.monotonic()
+            self.since = datetime.now().isoformat()
+            self._write_info()
+            logger.warning(f"主节点 {info['identity']} 心跳已 {info['heartbeat_age']:.1f}s 未更新，接管: {self.identity}")
+            return new_fd
+        finally:
+            fcntl.flock(guard, fcntl.LOCK_UN)
+            os.close(guard)
+            os.close(fd)
+    
+    def _release(self):
+        fd, self._fd = self._fd, None
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+        self._notify(False)
+    
+    def _notify(self, is_leader: bool):
+        for func in self._listeners:
+            try:
+                func(is_leader)
+            except Exception as e:
+                logger.error(f"主节点变化回调异常: {e}")
+    
+    def _write_info(self):
+        """原子替换主节点信息文件，供其他worker读取"""
+        info = {"identity": self.identity, "pid": os.getpid(), "since": self.since,
+                "inode": os.fstat(self._fd).st_ino, "heartbeat": time.time()}
+        try:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.info_path) or ".", prefix=".leader-")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(info, f)
+            os.replace(tmp, self.info_path)
+            self.stats["heartbeats"] += 1
+        except Exception as e:
+            logger.error(f"写入主节点信息失败: {e}")
+    
+    def leader_info(self) -> Optional[dict]:
+        """当前主节点信息，没有主节点时返回None"""
+        try:
+            with open(self.info_path, "r", encoding="utf-8") as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return None
+        age = time.time() - info.pop("heartbeat", 0)
+        return {**info, "heartbeat_age": round(age, 3), "stale": age > self.lease}
+    
+    def get_status(self) -> dict:
+        return {
+            "backend": "file",
+            "path": self.path,
+            "is_leader": self.is_leader,
+            "identity": self.identity,
+            "leader": self.leader_info(),
+            **self.stats
+        }
+
+
+def default_leader_lock_path(config: WeChatConfig) -> str:
+    """按企业ID/应用生成默认的主节点锁文件路径"""
+    key = hashlib.sha1(f"{config.corpid}:{config.agentid}".encode("utf-8")).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), f"wx_stockbot_leader_{key}.lock")
+
+
+def create_leader_election(config: WeChatConfig) -> LeaderElection:
+    """根据配置创建主节点选举，leader_lock_path为"memory"时当前进程始终是主节点"""
+    if config.leader_lock_path == "memory" or not FILE_LOCK_AVAILABLE:
+        return LeaderElection()
+    return FileLeaderElection(config.leader_lock_path or default_leader_lock_path(config),
+                              heartbeat=config.leader_heartbeat)
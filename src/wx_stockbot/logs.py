@@ -0,0 +1,235 @@
+"""
+日志输出
+请求线程只把日志记录放入内存队列，由后台线程格式化并写出；
+支持JSON结构化输出，以及按类别采样和限速（类别取记录的 category 字段，没有时取logger名），
+避免高频回调的日志拖慢请求
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from .metrics import LOG_DROPPED
+
+# 字符串形式的按类别配置中，匹配其他所有类别的键
+ANY_CATEGORY = "*"
+
+# LogRecord自带的属性，结构化输出时不当作附加字段
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "category", "fields"}
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+def parse_category_values(spec: Optional[str]) -> dict[str, float]:
+    """解析 "callback=0.1,send=0.5" 形式的按类别配置，"*"匹配其他类别"""
+    values = {}
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        name, _, value = item.partition("=")
+        values[name.strip()] = float(value)
+    return values
+
+
+def record_category(record: logging.LogRecord) -> str:
+    return getattr(record, "category", None) or record.name
+
+
+def record_fields(record: logging.LogRecord) -> dict:
+    """结构化字段：extra={"fields": {...}} 以及extra中的其他自定义键"""
+    fields = dict(getattr(record, "fields", None) or {})
+    for key, value in record.__dict__.items():
+        if key not in _RECORD_ATTRS:
+            fields[key] = value
+    return fields
+
+
+class TextFormatter(logging.Formatter):
+    """文本格式，结构化字段以 key=value 追加在消息后"""
+    
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+    
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = record_fields(record)
+        if fields:
+            text += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出一行JSON"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "category": record_category(record),
+            "msg": record.getMessage(),
+            "pid": record.process,
+            "thread": record.threadName
+        }
+        entry.update(record_fields(record))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """按类别采样和限速，WARNING及以上的日志总是保留
+    
+    sample: 类别 -> 保留比例（0~1）
+    rate: 类别 -> 每秒最多条数（令牌桶，允许一秒的突发）
+    被丢弃的条数计入 wxbot_log_dropped_total{category,reason}
+    """
+    
+    def __init__(self, sample: Optional[dict[str, float]] = None, rate: Optional[dict[str, float]] = None):
+        super().__init__()
+        self.sample = dict(sample or {})
+        self.rate = dict(rate or {})
+        self._buckets: dict[str, list] = {}
+        self._lock = threading.Lock()
+    
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not (self.sample or self.rate):
+            return True
+        category = record_category(record)
+        
+        ratio = self.sample.get(category, self.sample.get(ANY_CATEGORY))
+        if ratio is not None and random.random() >= ratio:
+            LOG_DROPPED.labels(category, "sampled").inc()
+            return False
+        
+        limit = self.rate.get(category, self.rate.get(ANY_CATEGORY))
+        if limit is not None and not self._take(category, limit):
+            LOG_DROPPED.labels(category, "rate_limited").inc()
+            return False
+        return True
+    
+    def _take(self, category: str, limit: float) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(category)
+            if bucket is None:
+                bucket = self._buckets[category] = [limit, now]
+            bucket[0] = min(limit, bucket[0] + (now - bucket[1]) * limit)
+            bucket[1] = now
+            if bucket[0] < 1:
+                return False
+            bucket[0] -= 1
+            return True
+
+
+class AsyncQueueHandler(QueueHandler):
+    """把日志记录放入进程内队列，格式化和写出都在后台线程完成
+    
+    队列只在本进程内使用，记录不需要序列化，因此不在请求线程里拼接消息；
+    队列满时丢弃记录并计数，不阻塞请求
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+    
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.labels(record_category(record), "queue_full").inc()
+
+
+class LogPipeline:
+    """根logger的输出配置：同步输出，或经队列由后台线程输出"""
+    
+    def __init__(self):
+        self.handler: Optional[logging.Handler] = None
+        self.listener: Optional[QueueListener] = None
+        self.options: dict = {}
+        self._lock = threading.Lock()
+    
+    def configure(self, level: str = "INFO", fmt: str = "text", async_output: bool = True,
+                  sample: Optional[dict[str, float]] = None, rate: Optional[dict[str, float]] = None,
+                  queue_size: int = 10000, stream=None):
+        """替换根logger的handler，重复调用时先停止原来的后台线程"""
+        with self._lock:
+            self._shutdown()
+            output = logging.StreamHandler(stream or sys.stderr)
+            output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+            
+            if async_output:
+                handler = AsyncQueueHandler(queue.Queue(maxsize=queue_size))
+                self.listener = QueueListener(handler.queue, output, respect_handler_level=True)
+                self.listener.start()
+            else:
+                handler = output
+            handler.addFilter(SamplingFilter(sample, rate))
+            
+            root = logging.getLogger()
+            for old in list(root.handlers):
+                root.removeHandler(old)
+            root.addHandler(handler)
+            root.setLevel(level.upper())
+            self.handler = handler
+            self.options = {"level": level.upper(), "format": fmt, "async": async_output,
+                            "sample": dict(sample or {}), "rate": dict(rate or {}), "queue_size": queue_size}
+    
+    def _shutdown(self):
+        if self.listener:
+            self.listener.stop()
+            self.listener = None
+    
+    def stop(self):
+        """写出队列中剩余的日志并停止后台线程"""
+        with self._lock:
+            self._shutdown()
+    
+    def _after_fork(self):
+        # 父进程的后台线程不会随fork复制，队列的锁也可能处于持有状态：子进程换一个新队列重新启动
+        if self.listener is None:
+            return
+        handler = self.handler
+        handler.queue = queue.Queue(maxsize=self.options["queue_size"])
+        self.listener = QueueListener(handler.queue, *self.listener.handlers, respect_handler_level=True)
+        self.listener.start()
+    
+    def queue_depth(self) -> int:
+        return self.listener.queue.qsize() if self.listener else 0
+    
+    def get_status(self) -> dict:
+        return {**self.options, "queue_depth": self.queue_depth()}
+
+
+PIPELINE = LogPipeline()
+atexit.register(PIPELINE.stop)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=PIPELINE._after_fork)
+
+
+def setup_logging(**options):
+    """配置日志输出，参数见 LogPipeline.configure"""
+    PIPELINE.configure(**options)
+
+
+def setup_logging_from_env():
+    """按环境变量配置日志：
+    WECHAT_LOG_LEVEL、WECHAT_LOG_FORMAT（text/json）、WECHAT_LOG_ASYNC（0表示同步输出）、
+    WECHAT_LOG_SAMPLE、WECHAT_LOG_RATE（按类别，如 "callback=0.1"）、WECHAT_LOG_QUEUE_SIZE
+    """
+    setup_logging(
+        level=os.getenv('WECHAT_LOG_LEVEL', 'INFO'),
+        fmt=os.getenv('WECHAT_LOG_FORMAT', 'text'),
+        async_output=os.getenv('WECHAT_LOG_ASYNC', '1') != '0',
+        sample=parse_category_values(os.getenv('WECHAT_LOG_SAMPLE')),
+        rate=parse_category_values(os.getenv('WECHAT_LOG_RATE')),
+        queue_size=int(os.getenv('WECHAT_LOG_QUEUE_SIZE', '10000'))
+    )
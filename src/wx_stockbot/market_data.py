@@ -0,0 +1,112 @@
+"""
+行情数据加载
+从本地CSV/Parquet文件读取日线OHLCV，文件名为 <代码>.csv 或 <代码>.parquet
+"""
+
+import os
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Parquet需要pyarrow，未安装时只支持CSV
+try:
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+FIELDS = ("open", "high", "low", "close", "volume")
+
+
+class MarketDataError(Exception):
+    """行情数据不存在或格式错误"""
+
+
+@dataclass
+class Bars:
+    """一只股票的日线序列，按日期升序"""
+    symbol: str
+    dates: np.ndarray
+    open: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
+    volume: np.ndarray
+    
+    def __len__(self) -> int:
+        return len(self.dates)
+    
+    @classmethod
+    def from_columns(cls, symbol: str, columns: dict) -> "Bars":
+        """由列数据创建，统一类型并按日期排序、去掉重复日期"""
+        missing = [name for name in ("date",) + FIELDS if name not in columns]
+        if missing:
+            raise MarketDataError(f"{symbol} 缺少字段: {', '.join(missing)}")
+        dates = np.asarray(columns["date"]).astype("datetime64[D]")
+        # 按日期排序，同一日期保留最后一条
+        order = np.argsort(dates, kind="stable")
+        dates = dates[order]
+        keep = np.append(dates[1:] != dates[:-1], True)
+        index = order[keep]
+        return cls(
+            symbol=symbol,
+            dates=dates[keep],
+            **{name: np.asarray(columns[name], dtype=np.float64)[index] for name in FIELDS}
+        )
+
+
+def _normalize(name: str) -> str:
+    name = name.strip().lower()
+    return {"datetime": "date", "time": "date", "trade_date": "date", "vol": "volume"}.get(name, name)
+
+
+def read_csv(path: str, symbol: str) -> Bars:
+    """读取CSV，首行为列名（date/open/high/low/close/volume，不区分大小写）"""
+    table = np.genfromtxt(path, delimiter=",", names=True, dtype=None, encoding="utf-8",
+                          deletechars="", autostrip=True)
+    if table.size == 0:
+        raise MarketDataError(f"{symbol} 行情文件为空: {path}")
+    table = np.atleast_1d(table)
+    columns = {_normalize(name): table[name] for name in table.dtype.names}
+    return Bars.from_columns(symbol, columns)
+
+
+def read_parquet(path: str, symbol: str) -> Bars:
+    """读取Parquet"""
+    if not PARQUET_AVAILABLE:
+        raise MarketDataError("读取Parquet需要安装pyarrow")
+    table = pq.read_table(path)
+    columns = {_normalize(name): table.column(name).to_numpy() for name in table.column_names}
+    return Bars.from_columns(symbol, columns)
+
+
+def find_data_file(data_dir: str, symbol: str) -> Optional[str]:
+    """查找股票的行情文件，Parquet优先"""
+    extensions = (".parquet", ".csv") if PARQUET_AVAILABLE else (".csv",)
+    for name in (symbol, symbol.upper(), symbol.lower()):
+        for ext in extensions:
+            path = os.path.join(data_dir, name + ext)
+            if os.path.isfile(path):
+                return path
+    return None
+
+
+def load_bars(data_dir: str, symbol: str) -> Bars:
+    """加载股票日线"""
+    path = find_data_file(data_dir, symbol)
+    if path is None:
+        raise MarketDataError(f"未找到 {symbol} 的行情数据（目录: {data_dir}）")
+    try:
+        bars = read_parquet(path, symbol) if path.endswith(".parquet") else read_csv(path, symbol)
+    except MarketDataError:
+        raise
+    except Exception as e:
+        raise MarketDataError(f"读取 {path} 失败: {e}")
+    if len(bars) == 0:
+        raise MarketDataError(f"{symbol} 没有行情数据")
+    logger.debug(f"加载 {symbol} 行情: {len(bars)} 条, {path}")
+    return bars
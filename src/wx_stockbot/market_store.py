@@ -0,0 +1,336 @@
+"""
+列式行情存储
+每只股票一个目录，每个字段一个定长数组文件（按行追加），通过内存映射零拷贝读取：
+
+    <root>/<代码>/meta.json          行数、是否有序、代次、改写次数
+    <root>/<代码>/timestamp.<代次>.i8  日期（自1970-01-01的天数，int64）
+    <root>/<代码>/open.<代次>.f8 ...   open/high/low/close/volume（float64）
+
+读取时只在时间列上二分查找日期范围，各字段返回该范围的NumPy视图，
+只有实际访问到的页会从磁盘载入。
+"""
+
+import os
+import sys
+import json
+import logging
+import tempfile
+import threading
+from typing import Optional, Union
+
+import numpy as np
+
+from .market_data import Bars, FIELDS, MarketDataError, load_bars
+
+logger = logging.getLogger(__name__)
+
+# fcntl仅在类Unix系统可用，不可用时不对写入加锁（只应有一个写入方）
+try:
+    import fcntl
+    FILE_LOCK_AVAILABLE = True
+except ImportError:
+    FILE_LOCK_AVAILABLE = False
+
+TIMESTAMP = "timestamp"
+COLUMNS = {TIMESTAMP: np.dtype("<i8"), **{name: np.dtype("<f8") for name in FIELDS}}
+SUFFIX = {TIMESTAMP: ".i8", **{name: ".f8" for name in FIELDS}}
+META_FILE = "meta.json"
+
+DateLike = Union[str, np.datetime64, None]
+
+
+def _column_path(directory: str, name: str, generation: int) -> str:
+    return os.path.join(directory, f"{name}.{generation}{SUFFIX[name]}")
+
+
+def _day(value: DateLike) -> Optional[int]:
+    """日期转为天数"""
+    if value is None:
+        return None
+    return int(np.datetime64(value, "D").astype(np.int64))
+
+
+class _Mapping:
+    """一只股票当前代次的内存映射"""
+    
+    def __init__(self, directory: str, meta: dict):
+        self.meta = meta
+        rows = meta["rows"]
+        self.columns = {}
+        for name, dtype in COLUMNS.items():
+            path = _column_path(directory, name, meta.get("generation", 0))
+            # 长度为0的文件不能映射
+            self.columns[name] = np.memmap(path, dtype=dtype, mode="r", shape=(rows,)) if rows else np.empty(0, dtype)
+
+
+class MarketStore:
+    """内存映射的列式行情存储
+    
+    追加写入：先把新行追加到各字段文件末尾，再原子替换meta.json中的行数，
+    读者只映射meta记录的行数，因此不会读到写了一半的数据。
+    重新追加最后一天（盘中更新当天K线）时原地覆盖最后一行，数据仍然有序，只增加meta中的amended计数；
+    覆盖期间读者可能读到新旧字段混合的最后一行，下次读取即为新值。
+    追加的日期早于已有最后日期（修正数据）时标记为无序，读取时按日期排序并以后写入的为准，
+    compact() 把数据重写为有序且无重复的下一代文件，切换meta后删除旧文件，
+    已映射旧文件的读者不受影响。
+    """
+    
+    def __init__(self, root: str):
+        self.root = root
+        self._mappings: dict[str, _Mapping] = {}
+        self._lock = threading.Lock()
+        self.stats = {"reads": 0, "rows_read": 0, "remaps": 0, "appends": 0, "rows_appended": 0, "compactions": 0}
+    
+    def _dir(self, symbol: str) -> str:
+        return os.path.join(self.root, symbol.upper())
+    
+    def symbols(self) -> list[str]:
+        """已存储的股票代码"""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(name for name in os.listdir(self.root)
+                      if os.path.isfile(os.path.join(self.root, name, META_FILE)))
+    
+    def __contains__(self, symbol: str) -> bool:
+        return os.path.isfile(os.path.join(self._dir(symbol), META_FILE))
+    
+    def _read_meta(self, directory: str) -> dict:
+        with open(os.path.join(directory, META_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    
+    def _write_meta(self, directory: str, meta: dict):
+        """原子替换meta.json"""
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".meta-")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, os.path.join(directory, META_FILE))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+    
+    def _mapping(self, symbol: str) -> _Mapping:
+        """当前映射；行数或代次变化（追加或压缩）后重新映射
+        
+        每次都重新读取meta.json（很小），不依赖文件修改时间，追加再快也不会用到过期的映射。
+        """
+        directory = self._dir(symbol)
+        try:
+            meta = self._read_meta(directory)
+        except FileNotFoundError:
+            raise MarketDataError(f"行情库中没有 {symbol}")
+        with self._lock:
+            mapping = self._mappings.get(symbol.upper())
+            if mapping is None or mapping.meta != meta:
+                try:
+                    mapping = _Mapping(directory, meta)
+                except FileNotFoundError:
+                    # 读取meta后数据文件被压缩替换：重新读取一次即可拿到新代次
+                    mapping = _Mapping(directory, self._read_meta(directory))
+                self._mappings[symbol.upper()] = mapping
+                self.stats["remaps"] += 1
+            return mapping
+    
+    def info(self, symbol: str) -> dict:
+        """行数、日期范围等元数据"""
+        mapping = self._mapping(symbol)
+        timestamps = mapping.columns[TIMESTAMP]
+        first = last = None
+        if len(timestamps):
+            if mapping.meta.get("sorted", True):
+                first, last = timestamps[0], timestamps[-1]
+            else:
+                first, last = timestamps.min(), timestamps.max()
+        return {
+            **mapping.meta,
+            "first_date": None if first is None else str(np.datetime64(int(first), "D")),
+            "last_date": None if last is None else str(np.datetime64(int(last), "D"))
+        }
+    
+    def last_date(self, symbol: str) -> Optional[str]:
+        """最新K线日期（读meta，不访问数据）"""
+        last_day = self._mapping(symbol).meta.get("last_day")
+        return None if last_day is None else str(np.datetime64(int(last_day), "D"))
+    
+    def revision(self, symbol: str) -> int:
+        """历史数据被改写（追加了非末尾日期）的次数"""
+        return self._mapping(symbol).meta.get("revision", 0)
+    
+    def amendments(self, symbol: str) -> int:
+        """最后一行被原地覆盖（重新追加最后一天）的次数"""
+        return self._mapping(symbol).meta.get("amended", 0)
+    
+    def read(self, symbol: str, start: DateLike = None, end: DateLike = None, lookback: int = 0) -> Bars:
+        """读取 [start, end] 日期范围的日线，lookback 表示再向前多取若干行
+        
+        数据有序时返回内存映射上的视图（零拷贝，只读）；有待压缩的无序数据时返回排序去重后的副本。
+        """
+        mapping = self._mapping(symbol)
+        columns = mapping.columns
+        timestamps = columns[TIMESTAMP]
+        if not mapping.meta.get("sorted", True):
+            columns = self._sorted_columns(columns)
+            timestamps = columns[TIMESTAMP]
+        
+        lo = 0 if start is None else int(np.searchsorted(timestamps, _day(start), side="left"))
+        hi = len(timestamps) if end is None else int(np.searchsorted(timestamps, _day(end), side="right"))
+        lo = max(0, min(lo, hi) - lookback)
+        self.stats["reads"] += 1
+        self.stats["rows_read"] += hi - lo
+        return Bars(
+            symbol=symbol.upper(),
+            dates=timestamps[lo:hi].view("datetime64[D]"),
+            **{name: columns[name][lo:hi] for name in FIELDS}
+        )
+    
+    @staticmethod
+    def _sorted_columns(columns: dict) -> dict:
+        """按日期排序，同一日期保留最后写入的一行"""
+        timestamps = np.asarray(columns[TIMESTAMP])
+        # 倒序后稳定排序，每个日期的第一个即最后写入的
+        reversed_order = np.argsort(timestamps[::-1], kind="stable")
+        order = len(timestamps) - 1 - reversed_order
+        sorted_ts = timestamps[order]
+        keep = np.ones(len(order), dtype=bool)
+        keep[1:] = sorted_ts[1:] != sorted_ts[:-1]
+        index = order[keep]
+        return {name: np.asarray(values)[index] for name, values in columns.items()}
+    
+    def _locked(self, directory: str):
+        """写入锁（多个进程追加同一只股票时串行化）"""
+        fd = os.open(os.path.join(directory, ".lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        if FILE_LOCK_AVAILABLE:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        return fd
+    
+    @staticmethod
+    def _unlock(fd: int):
+        if FILE_LOCK_AVAILABLE:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+    
+    def append(self, bars: Bars) -> int:
+        """追加日线，返回追加的行数
+        
+        第一天与最后日期相同时覆盖最后一行（数据保持有序）；其他与已有数据重叠的日期也会写入，
+        读取时以新写入的为准，日期不在末尾之后时需要压缩。
+        """
+        if len(bars) == 0:
+            return 0
+        directory = self._dir(bars.symbol)
+        os.makedirs(directory, exist_ok=True)
+        fd = self._locked(directory)
+        try:
+            try:
+                meta = self._read_meta(directory)
+            except FileNotFoundError:
+                meta = {"symbol": bars.symbol.upper(), "rows": 0, "sorted": True, "generation": 0,
+                        "revision": 0, "last_day": None}
+            rows = meta["rows"]
+            
+            new = {TIMESTAMP: np.asarray(bars.dates, dtype="datetime64[D]").astype("<i8")}
+            new.update({name: np.asarray(getattr(bars, name), dtype="<f8") for name in FIELDS})
+            days = new[TIMESTAMP]
+            increasing = bool(np.all(days[1:] > days[:-1]))
+            # 有序数据的最后一行就是last_day：重新追加这一天时原地覆盖
+            amend = increasing and meta["sorted"] and rows > 0 and int(days[0]) == meta["last_day"]
+            in_order = increasing and (meta["last_day"] is None or amend or bool(days[0] > meta["last_day"]))
+            offset = rows - 1 if amend else rows
+            
+            for name, values in new.items():
+                path = _column_path(directory, name, meta["generation"])
+                with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+                    # 丢弃上次中断的追加留下的多余字节（不截短到映射的行数以内，读者的映射仍然有效）
+                    f.truncate(rows * COLUMNS[name].itemsize)
+                    f.seek(offset * COLUMNS[name].itemsize)
+                    f.write(values.tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+            
+            meta["rows"] = offset + len(days)
+            if amend:
+                meta["amended"] = meta.get("amended", 0) + 1
+            meta["sorted"] = meta["sorted"] and in_order
+            if not in_order:
+                # 改写了历史数据，依赖历史的增量状态需要重建
+                meta["revision"] = meta.get("revision", 0) + 1
+            meta["last_day"] = int(days.max()) if meta["last_day"] is None else max(meta["last_day"], int(days.max()))
+            self._write_meta(directory, meta)
+        finally:
+            self._unlock(fd)
+        
+        self.stats["appends"] += 1
+        self.stats["rows_appended"] += len(days)
+        if not in_order:
+            logger.info(f"{bars.symbol} 追加了乱序或重复日期的数据，建议压缩")
+        return len(days)
+    
+    def compact(self, symbol: str) -> dict:
+        """重写为按日期有序、无重复的下一代文件"""
+        directory = self._dir(symbol)
+        fd = self._locked(directory)
+        try:
+            meta = self._read_meta(directory)
+            mapping = _Mapping(directory, meta)
+            columns = self._sorted_columns(mapping.columns)
+            rows = len(columns[TIMESTAMP])
+            generation = meta.get("generation", 0) + 1
+            
+            for name, values in columns.items():
+                with open(_column_path(directory, name, generation), "wb") as f:
+                    f.write(np.ascontiguousarray(values).tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+            new_meta = {**meta, "rows": rows, "sorted": True, "generation": generation,
+                        "last_day": int(columns[TIMESTAMP][-1]) if rows else None}
+            self._write_meta(directory, new_meta)
+            del mapping, columns
+            for name in COLUMNS:
+                os.unlink(_column_path(directory, name, generation - 1))
+        finally:
+            self._unlock(fd)
+        
+        self.stats["compactions"] += 1
+        logger.info(f"压缩 {symbol}: {meta['rows']} 行 -> {rows} 行")
+        return new_meta
+    
+    def import_bars(self, bars: Bars) -> int:
+        """导入一段日线，只追加比已有最后日期更新的部分"""
+        if bars.symbol in self:
+            last = self.info(bars.symbol)["last_date"]
+            if last is not None:
+                start = int(np.searchsorted(bars.dates, np.datetime64(last), side="right"))
+                bars = Bars(bars.symbol, bars.dates[start:], *(getattr(bars, name)[start:] for name in FIELDS))
+        return self.append(bars)
+    
+    def get_status(self) -> dict:
+        return {"root": self.root, "symbols": len(self._mappings), **self.stats}
+
+
+def main(argv: list[str]) -> int:
+    """命令行: python -m src.wx_stockbot.market_store <库目录> ingest <CSV目录> | compact [代码...]"""
+    if len(argv) < 2 or argv[1] not in ("ingest", "compact"):
+        print(main.__doc__)
+        return 2
+    store = MarketStore(argv[0])
+    if argv[1] == "ingest":
+        source = argv[2] if len(argv) > 2 else "data"
+        for name in sorted(os.listdir(source)):
+            symbol, ext = os.path.splitext(name)
+            if ext not in (".csv", ".parquet"):
+                continue
+            try:
+                rows = store.import_bars(load_bars(source, symbol))
+                print(f"{symbol}: 追加 {rows} 行")
+            except MarketDataError as e:
+                print(f"{symbol}: {e}")
+    else:
+        for symbol in argv[2:] or store.symbols():
+            meta = store.compact(symbol)
+            print(f"{symbol}: {meta['rows']} 行")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
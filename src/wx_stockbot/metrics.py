@@ -0,0 +1,423 @@
+"""
+运行指标
+计数器、仪表和直方图，按Prometheus文本格式输出；
+多个gunicorn worker各自定期把快照写入共享目录，/metrics 汇总同一主进程下所有worker的数据
+"""
+
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_right
+from typing import Callable, Iterable, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# 默认的延迟分桶（秒）：50µs ~ 10s，大致按 1-2.5-5 递增
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 快照中标签值的分隔符
+LABEL_SEP = "\x1f"
+
+
+def _label_key(values: Iterable) -> str:
+    return LABEL_SEP.join(str(v) for v in values)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, key: str, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, key.split(LABEL_SEP))] if names else []
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric(ABC):
+    """指标基类"""
+    
+    kind = ""
+    
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+    
+    @abstractmethod
+    def snapshot(self) -> dict:
+        """{标签值键: 当前值}，写入快照并在汇总时合并"""
+
+
+class _LabeledMetric(_Metric):
+    """按标签值缓存子指标的指标，热路径上应预先取得子指标"""
+    
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._children: dict[str, object] = {}
+        self._lock = threading.Lock()
+    
+    def labels(self, *values):
+        """按标签值取得子指标"""
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} 需要标签 {self.labelnames}")
+        key = _label_key(values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+    
+    @abstractmethod
+    def _new_child(self):
+        """创建一组标签值对应的子指标"""
+    
+    def _default(self):
+        """无标签指标直接使用的子指标"""
+        return self.labels()
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+    
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+    
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_LabeledMetric):
+    """只增不减的计数器（多worker时求和）"""
+    
+    kind = "counter"
+    
+    def _new_child(self):
+        return _CounterChild()
+    
+    def inc(self, amount: float = 1):
+        self._default().inc(amount)
+    
+    def snapshot(self) -> dict:
+        return {key: child.value for key, child in list(self._children.items())}
+
+
+class Gauge(_Metric):
+    """仪表：采集时调用回调取得当前值（如队列深度），多worker时按worker分别输出"""
+    
+    kind = "gauge"
+    
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        super().__init__(name, documentation, labelnames)
+        self._callbacks: list[Callable[[], Union[float, dict]]] = []
+    
+    def set_function(self, func: Callable[[], Union[float, dict]]):
+        """注册取值回调：返回数值，或 {标签值元组: 数值}"""
+        self._callbacks.append(func)
+    
+    def snapshot(self) -> dict:
+        values = {}
+        for func in self._callbacks:
+            try:
+                result = func()
+            except Exception as e:
+                logger.warning(f"采集指标 {self.name} 失败: {e}")
+                continue
+            if isinstance(result, dict):
+                values.update({_label_key(k if isinstance(k, tuple) else (k,)): v for k, v in result.items()})
+            else:
+                values[_label_key(())] = result
+        return values
+
+
+class _HistogramChild:
+    """直方图子指标
+    
+    每个线程写自己的分片（最后一个元素是累计和），记录时不加锁；采集时把所有分片相加。
+    """
+    
+    __slots__ = ("_bounds", "_local", "_shards", "_lock")
+    
+    def __init__(self, bounds: tuple):
+        self._bounds = bounds
+        self._local = threading.local()
+        self._shards: list[list] = []
+        self._lock = threading.Lock()
+    
+    def _new_shard(self) -> list:
+        shard = [0] * (len(self._bounds) + 1) + [0.0]
+        with self._lock:
+            self._shards.append(shard)
+        self._local.shard = shard
+        return shard
+    
+    def observe(self, value: float):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._new_shard()
+        shard[bisect_right(self._bounds, value)] += 1
+        shard[-1] += value
+    
+    def time(self) -> "_Timer":
+        """计时上下文管理器（比手动 perf_counter 多约0.3µs，热路径上建议手动计时）"""
+        return _Timer(self)
+    
+    def totals(self) -> list:
+        with self._lock:
+            shards = list(self._shards)
+        totals = [0] * (len(self._bounds) + 1) + [0.0]
+        for shard in shards:
+            for i, value in enumerate(shard):
+                totals[i] += value
+        return totals
+
+
+class _Timer:
+    __slots__ = ("_child", "_start")
+    
+    def __init__(self, child: _HistogramChild):
+        self._child = child
+    
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        self._child.observe(time.perf_counter() - self._start)
+
+
+class Histogram(_LabeledMetric):
+    """直方图（多worker时各分桶求和）"""
+    
+    kind = "histogram"
+    
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+    
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+    
+    def observe(self, value: float):
+        self._default().observe(value)
+    
+    def snapshot(self) -> dict:
+        return {key: child.totals() for key, child in list(self._children.items())}
+
+
+class MetricsRegistry:
+    """指标注册表
+    
+    启用共享目录后，后台线程每隔 flush_interval 秒把本进程的快照原子写入
+    <目录>/<主进程pid>_<pid>.json；汇总时只读取同一个主进程（gunicorn master）下存活worker的文件，
+    重启后的旧文件不会混入。worker退出时 close() 删除自己的快照（gunicorn的worker_exit钩子），
+    崩溃的worker留下的快照在汇总时跳过并删除；因此worker退出后计数器和直方图的总数会下降，
+    Prometheus按计数器重置处理。
+    """
+    
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+        self.directory: Optional[str] = None
+        self.flush_interval = 5.0
+        self._flush_thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+    
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+    
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+    
+    def gauge(self, name: str, documentation: str, labelnames: tuple = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+    
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (),
+                  buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+    
+    def snapshot(self) -> dict:
+        """本进程所有指标的当前值"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+    
+    def enable_multiprocess(self, directory: str, flush_interval: float = 5.0):
+        """启用多worker汇总（在worker进程中调用）"""
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._stop.clear()
+        if self._flush_thread is None or not self._flush_thread.is_alive():
+            self._flush_thread = threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True)
+            self._flush_thread.start()
+    
+    def _snapshot_path(self, pid: Optional[int] = None) -> str:
+        return os.path.join(self.directory, f"{os.getppid()}_{pid or os.getpid()}.json")
+    
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+    
+    def close(self):
+        """worker退出时停止写入快照并删除自己的快照文件，汇总不再计入本进程"""
+        self._stop.set()
+        if self._flush_thread is not None:
+            self._flush_thread.join(timeout=1)
+            self._flush_thread = None
+        directory, self.directory = self.directory, None
+        if directory:
+            self._remove_snapshot(os.path.join(directory, f"{os.getppid()}_{os.getpid()}.json"))
+    
+    @staticmethod
+    def _remove_snapshot(path: str):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"删除指标快照失败: {e}")
+    
+    def flush(self):
+        """把本进程快照写入共享目录"""
+        if not self.directory:
+            return
+        try:
+            fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".metrics-")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(self.snapshot(), f, separators=(",", ":"))
+            os.replace(tmp, self._snapshot_path())
+        except Exception as e:
+            logger.error(f"写入指标快照失败: {e}")
+    
+    def _collect(self) -> list[tuple[int, dict]]:
+        """存活worker的快照: (pid, 快照)，本进程使用实时数据"""
+        own = os.getpid()
+        snapshots = [(own, self.snapshot())]
+        if not self.directory:
+            return snapshots
+        self.flush()
+        prefix = f"{os.getppid()}_"
+        for name in os.listdir(self.directory):
+            if not (name.startswith(prefix) and name.endswith(".json")):
+                continue
+            pid = int(name[len(prefix):-5])
+            if pid == own:
+                continue
+            path = os.path.join(self.directory, name)
+            if not _pid_alive(pid):
+                # 未经worker_exit退出（崩溃、被杀死）的worker
+                self._remove_snapshot(path)
+                continue
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            snapshots.append((pid, snapshot))
+        return snapshots
+    
+    def render(self) -> str:
+        """Prometheus文本格式（0.0.4）"""
+        snapshots = self._collect()
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            if isinstance(metric, Gauge):
+                # 多个worker时加上pid标签分别输出
+                per_worker = len(snapshots) > 1
+                names = metric.labelnames + ("pid",) if per_worker else metric.labelnames
+                for pid, snapshot in snapshots:
+                    for key, value in snapshot.get(metric.name, {}).items():
+                        if per_worker:
+                            key = f"{key}{LABEL_SEP}{pid}" if metric.labelnames else str(pid)
+                        lines.append(f"{metric.name}{_format_labels(names, key)} {_format_value(value)}")
+                continue
+            
+            merged: dict[str, Union[float, list]] = {}
+            for _, snapshot in snapshots:
+                for key, value in snapshot.get(metric.name, {}).items():
+                    if isinstance(value, list):
+                        total = merged.setdefault(key, [0] * len(value))
+                        for i, v in enumerate(value):
+                            total[i] += v
+                    else:
+                        merged[key] = merged.get(key, 0) + value
+            for key, value in sorted(merged.items()):
+                if isinstance(metric, Counter):
+                    lines.append(f"{metric.name}{_format_labels(metric.labelnames, key)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float("inf"),), value[:-1]):
+                    cumulative += count
+                    le = f'le="{_format_value(bound)}"'
+                    lines.append(f"{metric.name}_bucket{_format_labels(metric.labelnames, key, le)} {cumulative}")
+                labels = _format_labels(metric.labelnames, key)
+                lines.append(f"{metric.name}_sum{labels} {_format_value(value[-1])}")
+                lines.append(f"{metric.name}_count{labels} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+REGISTRY = MetricsRegistry()
+
+# 回调处理各阶段耗时
+STAGE_SECONDS = REGISTRY.histogram(
+    "wxbot_stage_seconds", "回调处理各阶段耗时（秒）", ("stage",)
+)
+# 企业微信接口返回的错误码
+API_ERRORS = REGISTRY.counter(
+    "wxbot_api_errors_total", "企业微信接口返回的非0错误码次数", ("path", "errcode")
+)
+# 回调处理结果
+CALLBACKS = REGISTRY.counter(
+    "wxbot_callbacks_total", "回调请求数（按结果）", ("outcome",)
+)
+# 队列深度
+QUEUE_DEPTH = REGISTRY.gauge(
+    "wxbot_queue_depth", "队列中等待处理的任务数", ("queue",)
+)
+# 采样、限速或队列满时丢弃的日志
+LOG_DROPPED = REGISTRY.counter(
+    "wxbot_log_dropped_total", "未输出的日志条数（按类别和原因）", ("category", "reason")
+)
+
+
+def stage(name: str) -> _HistogramChild:
+    """某个阶段的耗时直方图（模块级预先取得，热路径上直接 observe）"""
+    return STAGE_SECONDS.labels(name)
+
+
+def default_metrics_dir() -> str:
+    return os.path.join(tempfile.gettempdir(), "wx_stockbot_metrics")
@@ -0,0 +1,367 @@
+"""
+持久化发件箱
+待发送的消息先写入本地SQLite（WAL模式），发送成功后标记为已投递；
+worker重启或企业微信接口不可用时消息不会丢失，启动后重新投递，失败按退避重试。
+写入采用组提交：调用线程提交事务时顺带提交其他线程排队的操作，等待中的线程拿到锁时
+发现自己的操作已提交就直接返回；确认、重试等不需要等待的操作由后台线程批量提交。
+多个gunicorn worker共享同一个文件，认领时加租约，同一条消息同时只由一个进程发送
+"""
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import hashlib
+import logging
+import tempfile
+import threading
+from concurrent.futures import Future
+from typing import Optional
+
+from .config import WeChatConfig
+
+logger = logging.getLogger(__name__)
+
+# 消息状态：pending 等待发送 / claimed 已被某个进程认领 / delivered 已投递 / failed 重试次数用尽
+PENDING, CLAIMED, DELIVERED, FAILED = "pending", "claimed", "delivered", "failed"
+
+# 事务失败（如共享文件上的SQLITE_BUSY）时操作重新排队，最多提交的次数
+MAX_OP_ATTEMPTS = 5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL UNIQUE,
+    msgtype TEXT NOT NULL,
+    content TEXT NOT NULL,
+    user_ids TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    -- pending: 下次可发送的时间；claimed: 租约到期时间
+    next_attempt REAL NOT NULL,
+    claimed_by TEXT,
+    last_error TEXT,
+    -- 部分批次失败后尚未送达的接收者（JSON），NULL表示全部接收者
+    recipients TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt);
+"""
+
+
+class _Op:
+    """排队等待提交的操作"""
+    __slots__ = ("kind", "args", "future", "attempts")
+    
+    def __init__(self, kind: str, args: tuple):
+        self.kind = kind
+        self.args = args
+        self.future: Future = Future()
+        self.attempts = 0
+
+
+class Outbox:
+    """SQLite发件箱
+    
+    add() 写入并认领消息（等待所在事务提交）；claim() 认领到期的消息；
+    ack()/retry()/fail()/release() 不等待，由后台线程随下一个事务提交。
+    synchronous为NORMAL时进程崩溃不丢失已提交的消息，断电可能丢失最后几个事务；
+    为FULL时每个事务都落盘，磁盘同步越慢，组提交合并的消息越多
+    """
+    
+    def __init__(self, path: str, lease: float = 120.0, retain: float = 86400.0,
+                 purge_interval: float = 60.0, flush_interval: float = 0.05, synchronous: str = "NORMAL",
+                 retry_delay: float = 1.0):
+        self.path = path
+        self.synchronous = synchronous
+        self.lease = lease
+        self.retain = retain
+        self.purge_interval = purge_interval
+        self.flush_interval = flush_interval
+        # 事务失败后后台线程等待多久再提交重新排队的操作
+        self.retry_delay = retry_delay
+        self.identity = f"{socket.gethostname()}:{os.getpid()}"
+        self._conn: Optional[sqlite3.Connection] = None
+        # _pending_lock保护排队的操作，_commit_lock保证同一时间只有一个线程使用连接
+        self._pending: list[_Op] = []
+        self._pending_lock = threading.Lock()
+        self._commit_lock = threading.Lock()
+        self._flush_wanted = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._last_purge = time.monotonic()
+        self.stats = {"transactions": 0, "operations": 0, "added": 0, "claimed": 0,
+                      "delivered": 0, "retried": 0, "failed": 0, "purged": 0,
+                      "transaction_errors": 0, "requeued_ops": 0, "dropped_ops": 0}
+    
+    # ---- 提交 ----
+    
+    def start(self):
+        """打开数据库（路径不可写等错误在这里抛出）并启动后台提交线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        with self._commit_lock:
+            if self._conn is None:
+                self._conn = self._connect()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._flush_loop, name="outbox-flusher", daemon=True)
+        self._thread.start()
+    
+    def stop(self, timeout: float = 5):
+        """提交剩余的操作后关闭数据库"""
+        self._stopping = True
+        self._flush_wanted.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+        with self._commit_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+    
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.executescript(_SCHEMA)
+        # 旧版本创建的文件没有recipients列
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(outbox)")}
+        if "recipients" not in columns:
+            conn.execute("ALTER TABLE outbox ADD COLUMN recipients TEXT")
+        return conn
+    
+    def _flush_loop(self):
+        """后台提交不需要等待的操作，每隔flush_interval最多一个事务；事务失败时等待retry_delay后重试"""
+        while True:
+            self._flush_wanted.wait(self.purge_interval)
+            self._flush_wanted.clear()
+            stopping = self._stopping
+            ok = self._flush()
+            # 退出前把重新排队的操作提交完（每个操作最多提交MAX_OP_ATTEMPTS次，循环必然结束）
+            while stopping and self._pending:
+                time.sleep(self.retry_delay)
+                self._flush()
+            if stopping:
+                return
+            if ok:
+                time.sleep(self.flush_interval)
+            else:
+                time.sleep(self.retry_delay)
+                self._flush_wanted.set()
+    
+    def _flush(self) -> bool:
+        """提交所有排队的操作；等锁期间到达的操作会一起提交。事务失败时返回False"""
+        with self._commit_lock:
+            with self._pending_lock:
+                ops, self._pending = self._pending, []
+            if self._conn is not None:
+                return self._apply(self._conn, ops)
+            for op in ops:
+                op.future.set_exception(RuntimeError("发件箱未启动"))
+            return True
+    
+    def _apply(self, conn: sqlite3.Connection, ops: list[_Op]) -> bool:
+        now = time.time()
+        purge = time.monotonic() - self._last_purge >= self.purge_interval
+        if not ops and not purge:
+            return True
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            results = self._execute(conn, ops, now)
+            if purge:
+                self._purge(conn, now)
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            self._requeue(ops, e)
+            return False
+        
+        self.stats["transactions"] += 1
+        self.stats["operations"] += len(ops)
+        for op, result in zip(ops, results):
+            op.future.set_result(result)
+        return True
+    
+    def _requeue(self, ops: list[_Op], error: Exception):
+        """事务失败：操作放回队首（保持先后顺序）由后台线程重试，多次失败后才把错误交给调用方。
+        ack/retry/fail没有调用方等待，直接丢弃会让已投递的消息在租约到期后被重复发送"""
+        self.stats["transaction_errors"] += 1
+        retry, dropped = [], []
+        for op in ops:
+            op.attempts += 1
+            (retry if op.attempts < MAX_OP_ATTEMPTS else dropped).append(op)
+        if retry:
+            with self._pending_lock:
+                self._pending[:0] = retry
+            self.stats["requeued_ops"] += len(retry)
+        logger.error(f"发件箱事务失败，{len(retry)} 个操作稍后重试，{len(dropped)} 个操作放弃: {error}")
+        for op in dropped:
+            self.stats["dropped_ops"] += 1
+            op.future.set_exception(error)
+    
+    def _execute(self, conn: sqlite3.Connection, ops: list[_Op], now: float) -> list:
+        """同类操作合并为一次executemany，认领放在最后以便看到本事务中的变化"""
+        by_kind: dict[str, list] = {}
+        for op in ops:
+            by_kind.setdefault(op.kind, []).append(op)
+        
+        if "add" in by_kind:
+            rows = [args + (CLAIMED, 1, now + self.lease, self.identity, now, now)
+                    for op in by_kind["add"] for args in op.args]
+            conn.executemany(
+                "INSERT OR IGNORE INTO outbox (job_id, msgtype, content, user_ids, status, attempts,"
+                " next_attempt, claimed_by, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.stats["added"] += len(rows)
+        if "ack" in by_kind:
+            conn.executemany("UPDATE outbox SET status = ?, updated_at = ? WHERE job_id = ?",
+                             [(DELIVERED, now, op.args[0]) for op in by_kind["ack"]])
+            self.stats["delivered"] += len(by_kind["ack"])
+        if "retry" in by_kind:
+            conn.executemany(
+                "UPDATE outbox SET status = ?, next_attempt = ?, claimed_by = NULL, last_error = ?,"
+                " recipients = COALESCE(?, recipients), updated_at = ? WHERE job_id = ?",
+                [(PENDING, now + op.args[1], op.args[2], op.args[3], now, op.args[0]) for op in by_kind["retry"]])
+            self.stats["retried"] += len(by_kind["retry"])
+        if "fail" in by_kind:
+            conn.executemany("UPDATE outbox SET status = ?, last_error = ?, updated_at = ? WHERE job_id = ?",
+                             [(FAILED, op.args[1], now, op.args[0]) for op in by_kind["fail"]])
+            self.stats["failed"] += len(by_kind["fail"])
+        if "release" in by_kind:
+            # 放回的消息没有发送过，不计入发送次数
+            conn.executemany("UPDATE outbox SET status = ?, attempts = MAX(attempts - 1, 0), next_attempt = ?,"
+                             " claimed_by = NULL, updated_at = ? WHERE job_id = ? AND status = ?",
+                             [(PENDING, now, now, op.args[0], CLAIMED) for op in by_kind["release"]])
+        
+        results = {}
+        for op in by_kind.get("reclaim", []):
+            results[id(op)] = self._reclaim_dead(conn, now)
+        for op in by_kind.get("claim", []):
+            results[id(op)] = self._claim(conn, op.args[0], now)
+        for op in by_kind.get("counts", []):
+            results[id(op)] = dict(conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+        return [results.get(id(op)) for op in ops]
+    
+    def _claim(self, conn: sqlite3.Connection, limit: int, now: float) -> list[dict]:
+        # 等待发送且已到重试时间的消息，以及租约已过期（认领的进程未完成）的消息
+        rows = conn.execute(
+            "SELECT id, job_id, msgtype, content, user_ids, recipients, attempts, created_at FROM outbox"
+            " WHERE status IN (?, ?) AND next_attempt <= ? ORDER BY next_attempt LIMIT ?",
+            (PENDING, CLAIMED, now, limit)
+        ).fetchall()
+        if not rows:
+            return []
+        conn.executemany(
+            "UPDATE outbox SET status = ?, attempts = attempts + 1, next_attempt = ?, claimed_by = ?, updated_at = ?"
+            " WHERE id = ?",
+            [(CLAIMED, now + self.lease, self.identity, now, row[0]) for row in rows]
+        )
+        self.stats["claimed"] += len(rows)
+        return [{"job_id": job_id, "msgtype": msgtype, "content": content,
+                 "user_ids": json.loads(user_ids) if user_ids else None,
+                 "recipients": json.loads(recipients) if recipients else None,
+                 "attempts": attempts + 1, "created_at": created_at}
+                for _, job_id, msgtype, content, user_ids, recipients, attempts, created_at in rows]
+    
+    def _reclaim_dead(self, conn: sqlite3.Connection, now: float) -> int:
+        """本机已退出的进程认领的消息立即放回，不必等租约过期"""
+        host = socket.gethostname()
+        released = 0
+        for (claimed_by,) in conn.execute("SELECT DISTINCT claimed_by FROM outbox WHERE status = ?",
+                                          (CLAIMED,)).fetchall():
+            owner_host, _, pid = (claimed_by or "").rpartition(":")
+            if owner_host != host or not pid.isdigit() or claimed_by == self.identity or _pid_alive(int(pid)):
+                continue
+            released += conn.execute(
+                "UPDATE outbox SET status = ?, next_attempt = ?, claimed_by = NULL, updated_at = ?"
+                " WHERE status = ? AND claimed_by = ?", (PENDING, now, now, CLAIMED, claimed_by)
+            ).rowcount
+        return released
+    
+    def _purge(self, conn: sqlite3.Connection, now: float):
+        """删除保留期以前已投递或已放弃的消息"""
+        self._last_purge = time.monotonic()
+        deleted = conn.execute("DELETE FROM outbox WHERE status IN (?, ?) AND updated_at < ?",
+                               (DELIVERED, FAILED, now - self.retain)).rowcount
+        self.stats["purged"] += deleted
+    
+    def _submit(self, kind: str, args: tuple, wait: bool = False) -> Future:
+        if self._conn is None:
+            raise RuntimeError("发件箱未启动")
+        op = _Op(kind, args)
+        with self._pending_lock:
+            self._pending.append(op)
+        if wait:
+            # 拿到锁时本操作可能已被前一个提交者带走，此时_flush只提交之后排队的操作
+            if not op.future.done() and not self._flush():
+                # 事务失败，操作已重新排队，由后台线程重试
+                self._flush_wanted.set()
+        else:
+            self._flush_wanted.set()
+        return op.future
+    
+    # ---- 对外接口 ----
+    
+    def add(self, messages: list[tuple], timeout: Optional[float] = 10) -> None:
+        """写入消息 (job_id, msgtype, content, user_ids) 并由当前进程认领，等待事务提交"""
+        args = tuple((job_id, msgtype, content, json.dumps(user_ids) if user_ids is not None else None)
+                     for job_id, msgtype, content, user_ids in messages)
+        self._submit("add", args, wait=True).result(timeout)
+    
+    def claim(self, limit: int, timeout: Optional[float] = 10) -> list[dict]:
+        """认领最多limit条到期的消息，认领后attempts加1"""
+        return self._submit("claim", (limit,), wait=True).result(timeout)
+    
+    def reclaim_dead(self, timeout: Optional[float] = 10) -> int:
+        return self._submit("reclaim", (), wait=True).result(timeout)
+    
+    def ack(self, job_id: str):
+        """标记为已投递"""
+        self._submit("ack", (job_id,))
+    
+    def retry(self, job_id: str, delay: float, error: str = "", recipients: Optional[dict] = None):
+        """delay秒后重新发送；recipients为尚未送达的接收者（部分批次失败时），None表示不变"""
+        self._submit("retry", (job_id, delay, error, json.dumps(recipients) if recipients is not None else None))
+    
+    def fail(self, job_id: str, error: str = ""):
+        """放弃发送，保留到保留期结束以便排查"""
+        self._submit("fail", (job_id, error))
+    
+    def release(self, job_id: str):
+        """放回等待发送（本进程暂时无法处理）"""
+        self._submit("release", (job_id,))
+    
+    def counts(self, timeout: Optional[float] = 10) -> dict[str, int]:
+        """各状态的消息数"""
+        return self._submit("counts", (), wait=True).result(timeout)
+    
+    def get_status(self) -> dict:
+        try:
+            counts = self.counts(timeout=2)
+        except Exception as e:
+            counts = {"error": str(e)}
+        return {"path": self.path, "lease": self.lease, "counts": counts, **self.stats}
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def default_outbox_path(config: WeChatConfig) -> str:
+    """按企业ID/应用生成默认的发件箱路径"""
+    key = hashlib.sha1(f"{config.corpid}:{config.agentid}".encode("utf-8")).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), f"wx_stockbot_outbox_{key}.db")
+
+
+def create_outbox(config: WeChatConfig) -> Optional[Outbox]:
+    """根据配置创建发件箱，outbox_path为"memory"时不持久化（消息只在进程内排队）"""
+    if config.outbox_path == "memory":
+        return None
+    return Outbox(config.outbox_path or default_outbox_path(config))
@@ -0,0 +1,290 @@
+"""
+接口调用限速
+按接口和按接收成员的令牌桶，超限的调用在截止时间内排队等待，多个worker通过加锁文件共享按接口的桶
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+from .config import WeChatConfig
+
+logger = logging.getLogger(__name__)
+
+# fcntl仅在类Unix系统可用，不可用时退化为进程内限速
+try:
+    import fcntl
+    FILE_LOCK_AVAILABLE = True
+except ImportError:
+    FILE_LOCK_AVAILABLE = False
+
+# 接口调用频率超限的错误码
+RATE_LIMIT_ERRCODES = (45009, 45033)
+
+RECIPIENT_PREFIX = "user:"
+
+
+class RateLimitExceeded(Exception):
+    """在截止时间内无法获得调用配额"""
+
+
+@dataclass
+class BucketSpec:
+    """令牌桶参数"""
+    # 每秒补充的令牌数
+    rate: float
+    # 桶容量（允许的突发调用数）
+    capacity: float
+    
+    @classmethod
+    def per_minute(cls, limit: float, burst: Optional[float] = None) -> Optional["BucketSpec"]:
+        """按每分钟次数创建，limit<=0表示不限速"""
+        if not limit or limit <= 0:
+            return None
+        return cls(limit / 60.0, float(burst or limit))
+
+
+class RateLimiter:
+    """进程内令牌桶限速器
+    
+    桶状态为 key -> [令牌数, 更新时间]。获取配额时一次性为所有相关的桶预留令牌，
+    令牌数可以为负，表示已被排队中的调用预订，后来者据此计算出更长的等待时间，
+    因此排队按到达顺序进行。需要等待的时间超过截止时间时不预留、直接拒绝。
+    """
+    
+    def __init__(self, endpoint: Optional[BucketSpec] = None, recipient: Optional[BucketSpec] = None,
+                 max_wait: float = 10.0, penalty: float = 5.0):
+        self.endpoint = endpoint
+        self.recipient = recipient
+        self.max_wait = max_wait
+        self.penalty = penalty
+        self._buckets: dict[str, list[float]] = {}
+        self._lock = threading.Lock()
+        self.stats = {"acquired": 0, "delayed": 0, "rejected": 0, "penalties": 0,
+                      "total_wait": 0.0, "longest_wait": 0.0}
+    
+    def _spec(self, key: str) -> Optional[BucketSpec]:
+        return self.recipient if key.startswith(RECIPIENT_PREFIX) else self.endpoint
+    
+    def _keys(self, endpoint: str, recipients: Iterable[str]) -> list[str]:
+        """需要扣减的桶"""
+        keys = [endpoint] if self.endpoint else []
+        if self.recipient:
+            keys.extend(RECIPIENT_PREFIX + r for r in recipients if r and r != "@all")
+        return keys
+    
+    def _level(self, buckets: dict, key: str, now: float) -> float:
+        """桶在now时刻的令牌数"""
+        spec = self._spec(key)
+        tokens, updated_at = buckets.get(key, (spec.capacity, now))
+        return min(spec.capacity, tokens + max(0.0, now - updated_at) * spec.rate)
+    
+    def _reserve(self, buckets: dict, keys: list[str], now: float, max_wait: float) -> Optional[float]:
+        """为所有桶各预留一个令牌，返回需要等待的秒数；超过max_wait时不预留并返回None"""
+        levels = {key: self._level(buckets, key, now) for key in keys}
+        wait = 0.0
+        for key, tokens in levels.items():
+            if tokens < 1:
+                wait = max(wait, (1 - tokens) / self._spec(key).rate)
+        if wait > max_wait:
+            return None
+        for key, tokens in levels.items():
+            buckets[key] = [tokens - 1, now]
+        return wait
+    
+    def _penalize(self, buckets: dict, key: str, now: float, seconds: float):
+        """清空桶并欠下seconds秒的令牌"""
+        spec = self._spec(key)
+        buckets[key] = [min(self._level(buckets, key, now), -spec.rate * seconds), now]
+    
+    def _prune(self, buckets: dict, now: float):
+        """删除已回满的桶（与不存在等价）"""
+        for key in [k for k in buckets if self._level(buckets, k, now) >= self._spec(k).capacity]:
+            del buckets[key]
+    
+    def _update(self, func, shared: bool = True):
+        """在锁内修改桶状态（shared表示涉及按接口的桶，进程内限速时不区分）"""
+        with self._lock:
+            result = func(self._buckets, time.time())
+            self._prune_local()
+            return result
+    
+    def _prune_local(self):
+        """进程内的桶过多时删除已回满的桶（调用方持有锁）"""
+        if len(self._buckets) > 10000:
+            self._prune(self._buckets, time.time())
+    
+    def acquire(self, endpoint: str, recipients: Iterable[str] = (), timeout: Optional[float] = None) -> float:
+        """获取一次调用配额，必要时阻塞等待，返回等待的秒数
+        
+        在timeout（默认max_wait）秒内无法获得配额时抛出RateLimitExceeded。
+        """
+        keys = self._keys(endpoint, recipients)
+        if not keys:
+            return 0.0
+        max_wait = self.max_wait if timeout is None else timeout
+        wait = self._update(lambda buckets, now: self._reserve(buckets, keys, now, max_wait),
+                            shared=self.endpoint is not None)
+        
+        with self._lock:
+            if wait is None:
+                self.stats["rejected"] += 1
+            else:
+                self.stats["acquired"] += 1
+                if wait > 0:
+                    self.stats["delayed"] += 1
+                    self.stats["total_wait"] += wait
+                    self.stats["longest_wait"] = max(self.stats["longest_wait"], wait)
+        if wait is None:
+            raise RateLimitExceeded(f"{endpoint} 调用频率超限，{max_wait}秒内无法获得配额")
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+    
+    def penalize(self, endpoint: str, seconds: Optional[float] = None) -> bool:
+        """服务端返回频率超限时暂停该接口的调用，未对接口限速时返回False"""
+        if not self.endpoint:
+            return False
+        seconds = self.penalty if seconds is None else seconds
+        with self._lock:
+            self.stats["penalties"] += 1
+        logger.warning(f"{endpoint} 调用频率超限，暂停 {seconds} 秒")
+        self._update(lambda buckets, now: self._penalize(buckets, endpoint, now, seconds))
+        return True
+    
+    def _snapshot(self) -> tuple[dict, float]:
+        with self._lock:
+            return dict(self._buckets), time.time()
+    
+    def get_status(self) -> dict:
+        """各接口桶的剩余令牌、被限速的成员数与等待/拒绝统计"""
+        buckets, now = self._snapshot()
+        with self._lock:
+            stats = dict(self.stats)
+        endpoints, limited_recipients = {}, 0
+        for key in buckets:
+            level = self._level(buckets, key, now)
+            if key.startswith(RECIPIENT_PREFIX):
+                limited_recipients += level < 1
+            else:
+                endpoints[key] = {"tokens": round(level, 2), "fill": round(max(level, 0) / self._spec(key).capacity, 3)}
+        acquired = stats["acquired"]
+        return {
+            "backend": "memory",
+            "endpoint_per_minute": self.endpoint.rate * 60 if self.endpoint else 0,
+            "recipient_per_minute": self.recipient.rate * 60 if self.recipient else 0,
+            "endpoints": endpoints,
+            "limited_recipients": limited_recipients,
+            **stats,
+            "avg_wait": stats["total_wait"] / acquired if acquired else 0.0
+        }
+
+
+class _SplitBuckets:
+    """按键前缀把按接口的桶和按成员的桶分到两个字典，供 _reserve/_penalize 统一读写"""
+    
+    def __init__(self, shared: dict, local: dict):
+        self.shared = shared
+        self.local = local
+    
+    def _target(self, key: str) -> dict:
+        return self.local if key.startswith(RECIPIENT_PREFIX) else self.shared
+    
+    def get(self, key: str, default=None):
+        return self._target(key).get(key, default)
+    
+    def __setitem__(self, key: str, value):
+        self._target(key)[key] = value
+
+
+class FileRateLimiter(RateLimiter):
+    """多worker共享按接口限速的令牌桶
+    
+    按接口的桶保存在JSON文件中，每次读-改-写都持有独占文件锁，已回满的桶写回前删除，
+    文件只包含少数几个接口。按成员的桶在进程内维护（群发一次涉及上千个成员，
+    放进共享文件会让每次调用的读写量随见过的成员数增长），多worker时每个worker各自按成员限速。
+    """
+    
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+    
+    def _update(self, func, shared: bool = True):
+        with self._lock:
+            if not shared:
+                result = func(self._buckets, time.time())
+                self._prune_local()
+                return result
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                buckets = self._read(fd)
+                now = time.time()
+                result = func(_SplitBuckets(buckets, self._buckets), now)
+                self._prune(buckets, now)
+                data = json.dumps(buckets, separators=(",", ":")).encode("utf-8")
+                os.ftruncate(fd, 0)
+                os.pwrite(fd, data, 0)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+            self._prune_local()
+            return result
+    
+    @staticmethod
+    def _read(fd: int) -> dict:
+        """读取共享桶状态，文件为空或损坏时从满桶开始"""
+        chunks = []
+        offset = 0
+        while True:
+            chunk = os.pread(fd, 65536, offset)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            offset += len(chunk)
+        if not chunks:
+            return {}
+        try:
+            return json.loads(b"".join(chunks))
+        except Exception as e:
+            logger.warning(f"读取限速状态文件失败: {e}")
+            return {}
+    
+    def _snapshot(self) -> tuple[dict, float]:
+        fd = os.open(self.path, os.O_RDONLY | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            buckets = self._read(fd)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+        with self._lock:
+            buckets.update(self._buckets)
+        return buckets, time.time()
+    
+    def get_status(self) -> dict:
+        return {**super().get_status(), "backend": "file", "path": self.path}
+
+
+def default_rate_limit_path(config: WeChatConfig) -> str:
+    """按企业ID/应用生成默认的限速状态文件路径"""
+    key = hashlib.sha1(f"{config.corpid}:{config.agentid}".encode("utf-8")).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), f"wx_stockbot_ratelimit_{key}.json")
+
+
+def create_rate_limiter(config: WeChatConfig) -> RateLimiter:
+    """根据配置创建限速器，rate_limit_path为"memory"时只在进程内限速"""
+    kwargs = dict(
+        endpoint=BucketSpec.per_minute(config.api_rate_per_minute),
+        recipient=BucketSpec.per_minute(config.recipient_rate_per_minute),
+        max_wait=config.rate_limit_wait
+    )
+    if config.rate_limit_path == "memory" or not FILE_LOCK_AVAILABLE:
+        return RateLimiter(**kwargs)
+    return FileRateLimiter(config.rate_limit_path or default_rate_limit_path(config), **kwargs)
@@ -0,0 +1,62 @@
+"""
+消息回复
+被动回复（加密XML直接作为回调响应）与主动发送（调用message/send）的选择
+"""
+
+import time
+from dataclasses import dataclass
+from typing import Optional, Union
+
+# 回复方式
+REPLY_AUTO = "auto"
+REPLY_PASSIVE = "passive"
+REPLY_ACTIVE = "active"
+
+# 被动回复文本内容的最大字节数，超出时改为主动发送
+PASSIVE_REPLY_MAX_BYTES = 2048
+
+
+@dataclass
+class Reply:
+    """处理器返回的回复
+    
+    mode 为 auto 时由框架决定：内容足够短且在回调时间窗口内生成则被动回复，否则主动发送。
+    """
+    content: str
+    mode: str = REPLY_AUTO
+    
+    def __str__(self) -> str:
+        return self.content
+    
+    @classmethod
+    def coerce(cls, value: Union[str, "Reply", None], default_mode: str = REPLY_AUTO) -> Optional["Reply"]:
+        """把处理器返回值统一为Reply"""
+        if not value:
+            return None
+        if isinstance(value, Reply):
+            return value
+        return cls(str(value), default_mode)
+    
+    def allows_passive(self) -> bool:
+        """是否可以被动回复"""
+        if self.mode == REPLY_ACTIVE:
+            return False
+        return len(self.content.encode("utf-8")) <= PASSIVE_REPLY_MAX_BYTES
+
+
+def _cdata(text: str) -> str:
+    """包装CDATA，内容中的 ]]> 需要拆开"""
+    return "<![CDATA[" + text.replace("]]>", "]]]]><![CDATA[>") + "]]>"
+
+
+def build_text_reply_xml(to_user: str, from_user: str, content: str, create_time: Optional[int] = None) -> str:
+    """生成被动回复的文本消息XML（明文）"""
+    return (
+        "<xml>"
+        f"<ToUserName>{_cdata(to_user)}</ToUserName>"
+        f"<FromUserName>{_cdata(from_user)}</FromUserName>"
+        f"<CreateTime>{create_time or int(time.time())}</CreateTime>"
+        "<MsgType><![CDATA[text]]></MsgType>"
+        f"<Content>{_cdata(content)}</Content>"
+        "</xml>"
+    )
@@ -0,0 +1,154 @@
+"""
+技术分析报告
+根据行情和指标计算结果生成"信息更新"的回复文本
+"""
+
+from typing import Optional
+
+import numpy as np
+
+from .indicators import compute_indicators, latest
+from .market_data import Bars
+
+# 报告模板版本，修改报告格式时递增，使旧的缓存报告失效
+REPORT_TEMPLATE_VERSION = 1
+
+
+def _fmt(value: Optional[float], digits: int = 2, prefix: str = "") -> str:
+    return "--" if value is None else f"{prefix}{value:,.{digits}f}"
+
+
+def _pct(current: Optional[float], previous: Optional[float]) -> str:
+    if current is None or not previous:
+        return "--"
+    return f"{(current - previous) / previous * 100:+.1f}%"
+
+
+def _volume(value: Optional[float]) -> str:
+    if value is None:
+        return "--"
+    for unit, size in (("B", 1e9), ("M", 1e6), ("K", 1e3)):
+        if value >= size:
+            return f"{value / size:.1f}{unit}"
+    return f"{value:.0f}"
+
+
+def wr_zone(value: Optional[float]) -> str:
+    """WR区间（低于20超买，高于80超卖）"""
+    if value is None:
+        return "无数据"
+    if value <= 10:
+        return "强烈超买"
+    if value <= 20:
+        return "超买区域"
+    if value >= 90:
+        return "强烈超卖"
+    if value >= 80:
+        return "超卖区域"
+    return "中性区域"
+
+
+def kdj_level(value: Optional[float]) -> str:
+    if value is None:
+        return "无数据"
+    if value >= 80:
+        return "高位"
+    if value <= 20:
+        return "低位"
+    return "中位"
+
+
+def render_report(bars: Bars, indicators: Optional[dict] = None) -> str:
+    """生成技术分析报告"""
+    indicators = indicators or compute_indicators(bars.high, bars.low, bars.close)
+    close, prev_close = latest(bars.close), latest(bars.close, -2) if len(bars) > 1 else None
+    volume, prev_volume = latest(bars.volume), latest(bars.volume, -2) if len(bars) > 1 else None
+    wr14, wr21 = latest(indicators["wr14"]), latest(indicators["wr21"])
+    k, d, j = latest(indicators["k"]), latest(indicators["d"]), latest(indicators["j"])
+    sar = latest(indicators["sar"])
+    uptrend = int(indicators["sar_trend"][-1]) > 0
+    reversed_today = len(bars) > 1 and indicators["sar_trend"][-1] != indicators["sar_trend"][-2]
+    mas = {name: latest(values) for name, values in indicators.items() if name.startswith("ma")}
+    
+    # 信号
+    if wr14 is not None and wr14 <= 20:
+        wr_signal = "短期回调风险增加"
+    elif wr14 is not None and wr14 >= 80:
+        wr_signal = "短期存在反弹机会"
+    else:
+        wr_signal = "暂无明显信号"
+    
+    prev_k, prev_d = (latest(indicators["k"], -2), latest(indicators["d"], -2)) if len(bars) > 1 else (None, None)
+    if None not in (k, d, prev_k, prev_d) and prev_k <= prev_d and k > d:
+        kdj_signal = "金叉，短期转强"
+    elif None not in (k, d, prev_k, prev_d) and prev_k >= prev_d and k < d:
+        kdj_signal = "死叉，短期转弱"
+    elif j is not None and j >= 100:
+        kdj_signal = "J值超买，短期可能回调"
+    elif j is not None and j <= 0:
+        kdj_signal = "J值超卖，短期可能反弹"
+    else:
+        kdj_signal = "暂无明显信号"
+    
+    strengths, risks = [], []
+    if uptrend:
+        strengths.append("SAR显示上升趋势" + ("（今日转多）" if reversed_today else ""))
+    else:
+        risks.append("SAR显示下降趋势" + ("（今日转空）" if reversed_today else ""))
+    ma_values = [(name, value) for name, value in mas.items() if value is not None]
+    above = [name.upper() for name, value in ma_values if close is not None and close >= value]
+    below = [name.upper() for name, value in ma_values if close is not None and close < value]
+    if above:
+        strengths.append(f"价格位于 {'/'.join(above)} 之上")
+    if below:
+        risks.append(f"价格位于 {'/'.join(below)} 之下")
+    if wr14 is not None and wr14 <= 20:
+        risks.append("WR显示超买")
+    if wr14 is not None and wr14 >= 80:
+        strengths.append("WR显示超卖")
+    
+    lines = [
+        "📊 股票技术分析报告",
+        "",
+        f"🔍 **{bars.symbol} 技术指标分析**",
+        "",
+        "**📈 价格走势**",
+        f"- 当前价格: {_fmt(close, prefix='$')} ({_pct(close, prev_close)})",
+        f"- 日内高点: {_fmt(latest(bars.high), prefix='$')}",
+        f"- 日内低点: {_fmt(latest(bars.low), prefix='$')}",
+        f"- 成交量: {_volume(volume)} (较昨日{_pct(volume, prev_volume)})",
+        "",
+        "**📊 技术指标**",
+        "",
+        "**WR指标 (威廉指标)**",
+        f"- WR(14): {_fmt(wr14, 1)} ({wr_zone(wr14)})",
+        f"- WR(21): {_fmt(wr21, 1)} ({wr_zone(wr21)})",
+        f"- 信号: {wr_signal}",
+        "",
+        "**SAR指标 (抛物线转向)**",
+        f"- 当前SAR: {_fmt(sar, prefix='$')}",
+        f"- 趋势: {'上升趋势' if uptrend else '下降趋势'}{'（今日反转）' if reversed_today else '持续'}",
+        f"- {'止损位' if uptrend else '压力位'}: {_fmt(sar, prefix='$')}",
+        "",
+        "**KDJ指标**",
+        f"- K值: {_fmt(k, 1)} ({kdj_level(k)})",
+        f"- D值: {_fmt(d, 1)} ({kdj_level(d)})",
+        f"- J值: {_fmt(j, 1)}",
+        f"- 信号: {kdj_signal}",
+        "",
+        "**均线**",
+        *[f"- {name.upper()}: {_fmt(value, prefix='$')}" for name, value in mas.items()],
+        "",
+        "**📋 综合分析**",
+        "",
+    ]
+    if strengths:
+        lines += ["**优势因素:**", *[f"✅ {item}" for item in strengths], ""]
+    if risks:
+        lines += ["**风险提示:**", *[f"⚠️ {item}" for item in risks], ""]
+    lines += [
+        "---",
+        f"*数据日期: {np.datetime_as_string(bars.dates[-1], unit='D')}*",
+        "*仅供参考，投资有风险*",
+    ]
+    return "\n".join(lines)
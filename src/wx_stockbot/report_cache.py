@@ -0,0 +1,100 @@
+"""
+报告缓存
+按 (股票代码, 最新K线日期, 模板版本) 缓存生成好的报告文本，LRU + TTL 淘汰，限制总内存
+"""
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ReportCache:
+    """LRU + TTL 的报告缓存
+    
+    键的第一个元素为股票代码，按股票建立索引，新数据到达时可整只股票作废。
+    内存按缓存文本的UTF-8字节数估算，超过条目数或字节上限时从最久未使用的开始淘汰。
+    """
+    
+    def __init__(self, max_entries: int = 256, max_bytes: int = 4 * 1024 * 1024, ttl: float = 300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # 键 -> (报告, 字节数, 过期时间)
+        self._entries: OrderedDict[Hashable, tuple[str, int, float]] = OrderedDict()
+        self._by_symbol: dict[str, set] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+    
+    def _remove(self, key: Hashable):
+        """删除一个条目（调用方持有锁）"""
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+        keys = self._by_symbol.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_symbol[key[0]]
+    
+    def get(self, key: Hashable) -> Optional[str]:
+        """命中返回报告并移到最近使用，未命中或已过期返回None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            if entry[2] <= time.monotonic():
+                self._remove(key)
+                self.stats["expirations"] += 1
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[0]
+    
+    def put(self, key: Hashable, report: str):
+        """写入报告，超过上限时淘汰最久未使用的条目"""
+        size = len(report.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (report, size, time.monotonic() + self.ttl)
+            self._by_symbol.setdefault(key[0], set()).add(key)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+    
+    def invalidate(self, symbol: str) -> int:
+        """作废一只股票的全部缓存，返回作废的条目数"""
+        with self._lock:
+            keys = list(self._by_symbol.get(symbol, ()))
+            for key in keys:
+                self._remove(key)
+            self.stats["invalidations"] += len(keys)
+            return len(keys)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_symbol.clear()
+            self._bytes = 0
+    
+    def get_status(self) -> dict:
+        """条目数、内存占用与命中率"""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            **self.stats,
+            "hit_ratio": round(self.stats["hits"] / lookups, 4) if lookups else 0.0
+        }
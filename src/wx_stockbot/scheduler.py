@@ -0,0 +1,416 @@
+"""
+定时任务调度器
+单个调度线程用最小堆管理所有任务的单调时钟截止时间，到期任务交给线程池执行：
+周期按截止时间而不是执行结束时间推算，不会因发送耗时漂移；慢任务也不会推迟下一次触发
+"""
+
+import time
+import heapq
+import bisect
+import logging
+import threading
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from datetime import time as dtime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Optional, Union
+from zoneinfo import ZoneInfo
+
+logger = logging.getLogger(__name__)
+
+# 错过触发时间（超过宽限期）时的处理方式：
+#   catch_up  逐次补跑错过的触发（最多max_catch_up次）
+#   coalesce  只补跑一次，之后回到原来的节奏
+#   skip      不补跑，等待下一次触发
+MISFIRE_POLICIES = ("catch_up", "coalesce", "skip")
+
+
+class IntervalSchedule:
+    """固定间隔，按单调时钟推算
+    
+    指定 anchor（墙上时间戳）时触发时刻对齐到 anchor + k × 间隔，
+    不同进程按同一个 anchor 添加的任务节奏一致，主节点切换后不会错开相位。
+    """
+    
+    def __init__(self, seconds: float, anchor: Optional[float] = None):
+        if seconds <= 0:
+            raise ValueError("间隔必须大于0")
+        self.seconds = seconds
+        self.anchor = anchor
+    
+    def __repr__(self) -> str:
+        return f"every {self.seconds:g}s"
+
+
+class TradingCalendar:
+    """交易日历：交易所时区、交易日（默认周一至周五）和休市日"""
+    
+    def __init__(self, timezone: str = "America/New_York", holidays: Iterable[Union[str, date]] = (),
+                 weekdays: Iterable[int] = range(5)):
+        self.tz = ZoneInfo(timezone)
+        self.holidays = {date.fromisoformat(d) if isinstance(d, str) else d for d in holidays if d}
+        self.weekdays = frozenset(weekdays)
+    
+    def is_trading_day(self, day: date) -> bool:
+        return day.weekday() in self.weekdays and day not in self.holidays
+
+
+def _parse_field(spec: str, low: int, high: int) -> list[int]:
+    """解析cron的一个字段: *、*/n、a-b、a-b/n、a,b,c"""
+    values = set()
+    for part in spec.split(","):
+        base, _, step = part.partition("/")
+        step = int(step) if step else 1
+        if base == "*":
+            start, end = low, high
+        elif "-" in base:
+            start, end = (int(v) for v in base.split("-", 1))
+        else:
+            start = end = int(base)
+            if step > 1:
+                end = high
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f"cron字段超出范围: {spec}")
+        values.update(range(start, end + 1, step))
+    return sorted(values)
+
+
+class CronSchedule:
+    """cron表达式（分 时 日 月 周），按指定时区计算
+    
+    周字段0和7都表示周日；日和周都有限制时满足其一即可（与cron一致）。
+    指定交易日历时只在交易日触发，时区取日历的时区。
+    """
+    
+    def __init__(self, expr: str, timezone: Optional[str] = None, calendar: Optional[TradingCalendar] = None):
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron表达式需要5个字段: {expr}")
+        self.expr = expr
+        self.minutes = _parse_field(fields[0], 0, 59)
+        self.hours = _parse_field(fields[1], 0, 23)
+        self.days = set(_parse_field(fields[2], 1, 31))
+        self.months = set(_parse_field(fields[3], 1, 12))
+        # cron的周日为0，datetime.weekday()的周一为0
+        self.weekdays = {(d - 1) % 7 for d in _parse_field(fields[4], 0, 7)}
+        self.day_any, self.weekday_any = fields[2] == "*", fields[4] == "*"
+        self.calendar = calendar
+        self.tz = calendar.tz if calendar else ZoneInfo(timezone or "UTC")
+    
+    def __repr__(self) -> str:
+        return f"cron '{self.expr}' {self.tz.key}"
+    
+    def _day_matches(self, day: date) -> bool:
+        if day.month not in self.months:
+            return False
+        if self.calendar and not self.calendar.is_trading_day(day):
+            return False
+        in_days, in_weekdays = day.day in self.days, day.weekday() in self.weekdays
+        if self.day_any or self.weekday_any:
+            return in_days and in_weekdays
+        return in_days or in_weekdays
+    
+    def next_time(self, after: datetime) -> datetime:
+        """after之后的下一次触发时间（带时区）"""
+        local = after.astimezone(self.tz).replace(tzinfo=None, second=0, microsecond=0) + timedelta(minutes=1)
+        day, hour, minute = local.date(), local.hour, local.minute
+        for _ in range(366 * 5):
+            if self._day_matches(day):
+                for h in self.hours[bisect.bisect_left(self.hours, hour):]:
+                    i = bisect.bisect_left(self.minutes, minute if h == hour else 0)
+                    if i < len(self.minutes):
+                        return datetime.combine(day, dtime(h, self.minutes[i]), self.tz)
+            day, hour, minute = day + timedelta(days=1), 0, 0
+        raise ValueError(f"cron表达式在5年内不会触发: {self.expr}")
+
+
+class MarketSchedule:
+    """交易日的固定时刻（交易所时区），如收盘后的 16:05"""
+    
+    def __init__(self, times: Iterable[str], calendar: TradingCalendar):
+        self.times = sorted(dtime.fromisoformat(t.strip()) for t in times if t.strip())
+        if not self.times:
+            raise ValueError("至少需要一个触发时刻")
+        self.calendar = calendar
+    
+    def __repr__(self) -> str:
+        return f"trading days at {','.join(t.strftime('%H:%M') for t in self.times)} {self.calendar.tz.key}"
+    
+    def next_time(self, after: datetime) -> datetime:
+        day = after.astimezone(self.calendar.tz).date()
+        for _ in range(366):
+            if self.calendar.is_trading_day(day):
+                for t in self.times:
+                    candidate = datetime.combine(day, t, self.calendar.tz)
+                    if candidate > after:
+                        return candidate
+            day += timedelta(days=1)
+        raise ValueError("一年内没有交易日")
+
+
+Schedule = Union[IntervalSchedule, CronSchedule, MarketSchedule]
+
+
+@dataclass(eq=False)
+class Job:
+    """定时任务"""
+    job_id: str
+    func: Callable[[], Any]
+    schedule: Schedule
+    misfire: str = "coalesce"
+    # 晚于截止时间多少秒内仍视为准时
+    misfire_grace: float = 1.0
+    max_catch_up: int = 10
+    # 个人订阅任务所属的成员
+    user_id: Optional[str] = None
+    # 下一次触发的单调时钟截止时间；按日历触发的任务同时记录墙上时间
+    deadline: float = 0.0
+    due: Optional[datetime] = None
+    runs: int = 0
+    failures: int = 0
+    missed: int = 0
+    overlap_skipped: int = 0
+    active: int = 0
+    last_run: Optional[str] = None
+    last_error: Optional[str] = None
+    
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "schedule": repr(self.schedule),
+            "misfire": self.misfire,
+            "user_id": self.user_id,
+            "next_run": self.due.isoformat() if self.due else
+                        datetime.fromtimestamp(time.time() + self.deadline - time.monotonic()).isoformat(),
+            "runs": self.runs,
+            "failures": self.failures,
+            "missed": self.missed,
+            "overlap_skipped": self.overlap_skipped,
+            "last_run": self.last_run,
+            "last_error": self.last_error
+        }
+
+
+class Scheduler:
+    """最小堆定时调度器
+    
+    堆中按截止时间保存 (截止时间, 序号, 任务)；删除或改期的任务不从堆中查找删除，
+    出堆时发现截止时间已不一致直接丢弃。调度线程只负责计算触发和提交，任务在线程池中执行，
+    同一任务上一次还没执行完时跳过本次触发。按日历触发的任务在系统时间被调整后重新换算截止时间。
+    
+    gate 返回False时（如当前worker不是主节点）任务照常推算下一次触发但不执行，
+    接管后从原来的节奏继续，不会补跑待命期间的触发。
+    """
+    
+    def __init__(self, workers: int = 4, max_wait: float = 30.0, gate: Optional[Callable[[], bool]] = None):
+        self.workers = workers
+        self.max_wait = max_wait
+        self.gate = gate
+        self._heap: list[tuple[float, int, Job]] = []
+        self._jobs: dict[str, Job] = {}
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._running = False
+        # 调度线程最近一次循环的单调时钟时间，循环最长等待max_wait
+        self._beat = 0.0
+        self.stats = {"fired": 0, "runs": 0, "failures": 0, "missed": 0, "overlap_skipped": 0,
+                      "standby_skipped": 0, "clock_adjustments": 0, "max_lag_ms": 0.0}
+    
+    def start(self):
+        """启动调度线程"""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._beat = time.monotonic()
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scheduler")
+            self._thread = threading.Thread(target=self._loop, name="scheduler", daemon=True)
+            self._thread.start()
+        logger.info(f"启动定时调度器，工作线程数: {self.workers}")
+    
+    def stop(self, timeout: float = 5):
+        """停止调度，等待正在执行的任务结束"""
+        with self._cond:
+            if not self._running:
+                return
+            self._running = False
+            self._cond.notify()
+        self._thread.join(timeout=timeout)
+        self._executor.shutdown(wait=True)
+        logger.info("停止定时调度器")
+    
+    def add_job(self, job_id: str, func: Callable[[], Any], schedule: Schedule, misfire: str = "coalesce",
+                misfire_grace: float = 1.0, max_catch_up: int = 10, user_id: Optional[str] = None) -> Job:
+        """添加任务，同ID的任务被替换；调度器未启动时自动启动"""
+        if misfire not in MISFIRE_POLICIES:
+            raise ValueError(f"未知的错过处理方式: {misfire}")
+        job = Job(job_id, func, schedule, misfire, misfire_grace, max_catch_up, user_id)
+        now = time.monotonic()
+        if isinstance(schedule, IntervalSchedule):
+            if schedule.anchor is None:
+                job.deadline = now + schedule.seconds
+            else:
+                wall = time.time()
+                periods = max(0, int((wall - schedule.anchor) // schedule.seconds) + 1)
+                job.deadline = now + schedule.anchor + periods * schedule.seconds - wall
+        else:
+            job.due = schedule.next_time(datetime.now().astimezone())
+            job.deadline = self._to_deadline(job.due, now)
+        
+        with self._cond:
+            self._jobs[job_id] = job
+            self._push(job)
+        self.start()
+        logger.info(f"添加定时任务: {job_id} ({schedule!r})")
+        return job
+    
+    def remove_job(self, job_id: str) -> bool:
+        """删除任务（正在执行的那一次不受影响）"""
+        with self._cond:
+            job = self._jobs.pop(job_id, None)
+            self._cond.notify()
+        if job:
+            logger.info(f"删除定时任务: {job_id}")
+        return job is not None
+    
+    def has_job(self, job_id: str) -> bool:
+        return job_id in self._jobs
+    
+    def get_job(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+    
+    def jobs(self, user_id: Optional[str] = None) -> list[Job]:
+        """全部任务，或某个成员的订阅任务"""
+        with self._cond:
+            return [job for job in self._jobs.values() if user_id is None or job.user_id == user_id]
+    
+    def heartbeat_age(self) -> float:
+        """调度线程距最近一次循环的秒数，超过max_wait说明调度线程卡住；未启动时为0"""
+        if not self._running:
+            return 0.0
+        return time.monotonic() - self._beat
+    
+    @staticmethod
+    def _to_deadline(due: datetime, now: float) -> float:
+        """墙上时间换算为单调时钟截止时间"""
+        return now + (due.timestamp() - time.time())
+    
+    def _push(self, job: Job):
+        """入堆（调用方持有锁），截止时间早于堆顶时唤醒调度线程"""
+        self._seq += 1
+        heapq.heappush(self._heap, (job.deadline, self._seq, job))
+        if self._heap[0][2] is job:
+            self._cond.notify()
+    
+    def _loop(self):
+        skew = time.time() - time.monotonic()
+        with self._cond:
+            while self._running:
+                self._beat = time.monotonic()
+                current_skew = time.time() - time.monotonic()
+                if abs(current_skew - skew) > 1.0:
+                    self._remap_wall_jobs()
+                    skew = current_skew
+                
+                if not self._heap:
+                    self._cond.wait(self.max_wait)
+                    continue
+                deadline, _, job = self._heap[0]
+                if self._jobs.get(job.job_id) is not job or job.deadline != deadline:
+                    heapq.heappop(self._heap)
+                    continue
+                wait = deadline - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(min(wait, self.max_wait))
+                    continue
+                
+                heapq.heappop(self._heap)
+                self._fire(job, time.monotonic())
+                self._push(job)
+    
+    def _remap_wall_jobs(self):
+        """系统时间被调整：按墙上时间重新计算日历任务的截止时间（调用方持有锁）"""
+        self.stats["clock_adjustments"] += 1
+        now = time.monotonic()
+        for job in self._jobs.values():
+            if job.due is not None:
+                job.deadline = self._to_deadline(job.due, now)
+                self._push(job)
+        logger.warning("检测到系统时间调整，已重新计算定时任务的触发时间")
+    
+    def _fire(self, job: Job, now: float):
+        """处理一次到期：按错过策略决定执行次数，并推算下一次截止时间（调用方持有锁）"""
+        lateness = now - job.deadline
+        self.stats["fired"] += 1
+        self.stats["max_lag_ms"] = max(self.stats["max_lag_ms"], round(lateness * 1000, 3))
+        
+        # 统计截止时间到现在之间错过的触发，下一次截止时间始终落在原来的节奏上
+        missed = 0
+        if isinstance(job.schedule, IntervalSchedule):
+            missed = int(lateness // job.schedule.seconds)
+            job.deadline += (missed + 1) * job.schedule.seconds
+        else:
+            wall_now = datetime.now().astimezone()
+            due = job.schedule.next_time(job.due)
+            while due <= wall_now:
+                missed += 1
+                due = job.schedule.next_time(due)
+            job.due = due
+            job.deadline = self._to_deadline(due, now)
+        
+        if self.gate is not None and not self.gate():
+            self.stats["standby_skipped"] += 1
+            return
+        
+        runs = 1
+        if lateness > job.misfire_grace:
+            job.missed += missed + 1
+            self.stats["missed"] += missed + 1
+            if job.misfire == "skip":
+                logger.warning(f"定时任务 {job.job_id} 延迟 {lateness:.1f}s，跳过本次")
+                return
+            if job.misfire == "catch_up":
+                runs = 1 + min(missed, job.max_catch_up)
+            logger.warning(f"定时任务 {job.job_id} 延迟 {lateness:.1f}s，补跑 {runs} 次")
+        
+        if job.active > 0:
+            # 上一次还没执行完：跳过，不排队堆积
+            job.overlap_skipped += 1
+            self.stats["overlap_skipped"] += 1
+            logger.warning(f"定时任务 {job.job_id} 上一次尚未完成，跳过本次")
+            return
+        job.active += 1
+        self._executor.submit(self._run, job, runs)
+    
+    def _run(self, job: Job, runs: int):
+        """在线程池中执行任务"""
+        try:
+            for _ in range(runs):
+                try:
+                    job.func()
+                    job.runs += 1
+                    self.stats["runs"] += 1
+                except Exception as e:
+                    job.failures += 1
+                    job.last_error = str(e)
+                    self.stats["failures"] += 1
+                    logger.error(f"定时任务 {job.job_id} 执行异常: {e}")
+                job.last_run = datetime.now().isoformat()
+        finally:
+            with self._cond:
+                job.active -= 1
+    
+    def get_status(self) -> dict:
+        """调度器状态"""
+        with self._cond:
+            jobs = len(self._jobs)
+            subscriptions = sum(1 for job in self._jobs.values() if job.user_id)
+        return {
+            "running": self._running,
+            "workers": self.workers,
+            "jobs": jobs,
+            "subscriptions": subscriptions,
+            **self.stats
+        }
@@ -0,0 +1,84 @@
+"""
+并发请求合并（single-flight）
+同一时刻多个线程请求同一个键时只执行一次计算，其余线程等待并共享结果
+"""
+
+import logging
+import threading
+from typing import Any, Callable, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    """一次进行中的计算"""
+    
+    __slots__ = ("done", "result", "error", "waiters")
+    
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """按键合并并发调用
+    
+    第一个到达的线程执行计算，计算期间到达的同键调用等待其完成并得到同一结果
+    （计算抛出的异常同样传给所有等待者）。计算完成后立即移除，不缓存结果：
+    之后的调用会重新计算。等待超过 wait_timeout 秒时等待者放弃合并，自行计算。
+    """
+    
+    def __init__(self, wait_timeout: Optional[float] = 30):
+        self.wait_timeout = wait_timeout
+        self._calls: dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "executions": 0, "coalesced": 0, "errors": 0, "wait_timeouts": 0}
+    
+    def do(self, key: Hashable, func: Callable[[], Any]) -> tuple[Any, bool]:
+        """执行或加入同键的计算，返回 (结果, 是否与其他调用共享)"""
+        with self._lock:
+            self.stats["calls"] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.stats["executions"] += 1
+            else:
+                call.waiters += 1
+                self.stats["coalesced"] += 1
+        
+        if not leader:
+            if call.done.wait(self.wait_timeout):
+                if call.error is not None:
+                    raise call.error
+                return call.result, True
+            with self._lock:
+                self.stats["wait_timeouts"] += 1
+            logger.warning(f"等待合并的请求超时，单独执行: {key}")
+            return func(), False
+        
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                self.stats["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, call.waiters > 0
+    
+    def get_status(self) -> dict:
+        """合并统计"""
+        with self._lock:
+            in_flight = len(self._calls)
+        calls = self.stats["calls"]
+        return {
+            "in_flight": in_flight,
+            **self.stats,
+            "coalesced_ratio": round(self.stats["coalesced"] / calls, 4) if calls else 0.0
+        }
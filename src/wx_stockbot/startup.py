@@ -0,0 +1,120 @@
+"""
+启动预热
+worker启动时在后台线程中依次执行初始化步骤（创建机器人、获取访问令牌、预热加解密和报告缓存），
+请求不再承担初始化；必需步骤完成前 /ready 返回503，负载均衡器据此决定是否转发流量
+"""
+
+import time
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class WarmupStep:
+    """一个初始化步骤"""
+    name: str
+    func: Callable[[], Any]
+    # 必需步骤失败时退避重试，后续步骤等待；可选步骤失败只记录，不影响就绪
+    required: bool = True
+    # pending / running / done / failed
+    state: str = "pending"
+    attempts: int = 0
+    # 最近一次执行耗时（秒）
+    duration: float = 0.0
+    error: Optional[str] = None
+    # 步骤函数的返回值（用于状态展示）
+    result: Any = None
+    finished: threading.Event = field(default_factory=threading.Event, repr=False)
+    
+    def to_dict(self) -> dict:
+        return {
+            "state": self.state,
+            "required": self.required,
+            "attempts": self.attempts,
+            "duration_ms": round(self.duration * 1000, 1),
+            "error": self.error,
+            "result": self.result if isinstance(self.result, (str, int, float, bool, dict, list)) else None
+        }
+
+
+class Startup:
+    """按顺序执行初始化步骤的后台线程"""
+    
+    def __init__(self, retry_base: float = 1.0, retry_max: float = 60.0):
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self._steps: dict[str, WarmupStep] = {}
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._started_at: Optional[float] = None
+        self._ready_at: Optional[float] = None
+    
+    def add_step(self, name: str, func: Callable[[], Any], required: bool = True):
+        """添加步骤，按添加顺序执行"""
+        self._steps[name] = WarmupStep(name, func, required)
+    
+    def start(self):
+        """启动预热线程（已启动时不重复启动）"""
+        if self._thread is not None:
+            return
+        self._started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="startup-warmup", daemon=True)
+        self._thread.start()
+    
+    def wake(self):
+        """立即重试失败的必需步骤（如配置补全后）"""
+        self._wake.set()
+    
+    def _run(self):
+        for step in self._steps.values():
+            delay = self.retry_base
+            while not self._execute(step) and step.required:
+                logger.warning(f"启动步骤 {step.name} 失败，{delay:.0f}秒后重试: {step.error}")
+                self._wake.wait(delay)
+                self._wake.clear()
+                delay = min(self.retry_max, delay * 2)
+            step.finished.set()
+        self._ready_at = time.monotonic()
+        logger.info(f"启动预热完成，耗时 {(self._ready_at - self._started_at) * 1000:.0f} ms")
+    
+    def _execute(self, step: WarmupStep) -> bool:
+        step.state = "running"
+        step.attempts += 1
+        started = time.perf_counter()
+        try:
+            step.result = step.func()
+        except Exception as e:
+            step.state, step.error = "failed", str(e)
+            if not step.required:
+                logger.warning(f"可选启动步骤 {step.name} 失败: {e}")
+            return False
+        finally:
+            step.duration = time.perf_counter() - started
+        step.state, step.error = "done", None
+        logger.debug("启动步骤 %s 完成，耗时 %.1f ms", step.name, step.duration * 1000)
+        return True
+    
+    def wait(self, name: str, timeout: Optional[float] = None) -> bool:
+        """等待某个步骤结束，成功时返回True"""
+        step = self._steps[name]
+        step.finished.wait(timeout)
+        return step.state == "done"
+    
+    @property
+    def ready(self) -> bool:
+        """所有必需步骤都已成功，可选步骤都已结束"""
+        return all(step.finished.is_set() and (step.state == "done" or not step.required)
+                   for step in self._steps.values())
+    
+    def get_status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "started": self._started_at is not None,
+            "elapsed_ms": round(((self._ready_at or time.monotonic()) - self._started_at) * 1000, 1)
+            if self._started_at is not None else 0.0,
+            "steps": {name: step.to_dict() for name, step in self._steps.items()}
+        }
@@ -0,0 +1,425 @@
+"""
+增量技术指标
+每来一根K线只更新滚动状态，WR/KDJ/SAR/均线的单次更新为常数时间（均摊），
+结果与 indicators 模块对整段历史的计算一致；状态可快照/恢复
+"""
+
+import math
+import logging
+import itertools
+import threading
+from collections import deque
+from typing import Optional
+
+import numpy as np
+
+from .market_data import Bars
+
+logger = logging.getLogger(__name__)
+
+
+class RollingExtreme:
+    """单调队列维护的N周期最高/最低值
+    
+    队列中保存 (序号, 值)，值单调递减（最高值）或递增（最低值），队首即当前窗口的极值；
+    每个元素至多入队、出队各一次。
+    """
+    
+    def __init__(self, n: int, highest: bool = True):
+        self.n = n
+        self.highest = highest
+        self.index = -1
+        self.window: deque = deque()
+    
+    def _better(self, a: float, b: float) -> bool:
+        return a >= b if self.highest else a <= b
+    
+    def update(self, value: float) -> float:
+        """加入一个值，返回新窗口的极值"""
+        self.index += 1
+        window = self.window
+        while window and self._better(value, window[-1][1]):
+            window.pop()
+        window.append((self.index, value))
+        if window[0][0] <= self.index - self.n:
+            window.popleft()
+        return window[0][1]
+    
+    def peek(self, value: float) -> float:
+        """假设加入value后的极值，不修改状态"""
+        expired = self.index + 1 - self.n
+        # 序号连续，过期的至多是队首一个，此时第二个元素就是剩余窗口的极值
+        for index, current in itertools.islice(self.window, 2):
+            if index > expired:
+                return value if self._better(value, current) else current
+        return value
+    
+    def snapshot(self) -> dict:
+        return {"n": self.n, "highest": self.highest, "index": self.index, "window": [list(item) for item in self.window]}
+    
+    @classmethod
+    def restore(cls, state: dict) -> "RollingExtreme":
+        obj = cls(state["n"], state["highest"])
+        obj.index = state["index"]
+        obj.window = deque((int(i), float(v)) for i, v in state["window"])
+        return obj
+
+
+class StreamingWR:
+    """增量威廉指标"""
+    
+    def __init__(self, n: int = 14):
+        self.n = n
+        self.high = RollingExtreme(n, highest=True)
+        self.low = RollingExtreme(n, highest=False)
+    
+    @staticmethod
+    def _value(hhv: float, llv: float, close: float) -> float:
+        return 100.0 * (hhv - close) / (hhv - llv) if hhv > llv else math.nan
+    
+    def update(self, high: float, low: float, close: float) -> float:
+        return self._value(self.high.update(high), self.low.update(low), close)
+    
+    def peek(self, high: float, low: float, close: float) -> float:
+        return self._value(self.high.peek(high), self.low.peek(low), close)
+    
+    def snapshot(self) -> dict:
+        return {"n": self.n, "high": self.high.snapshot(), "low": self.low.snapshot()}
+    
+    @classmethod
+    def restore(cls, state: dict) -> "StreamingWR":
+        obj = cls(state["n"])
+        obj.high = RollingExtreme.restore(state["high"])
+        obj.low = RollingExtreme.restore(state["low"])
+        return obj
+
+
+class StreamingKDJ:
+    """增量KDJ(9,3,3)，K、D初值50"""
+    
+    def __init__(self, n: int = 9, m1: int = 3, m2: int = 3):
+        self.n, self.m1, self.m2 = n, m1, m2
+        self.high = RollingExtreme(n, highest=True)
+        self.low = RollingExtreme(n, highest=False)
+        self.k = 50.0
+        self.d = 50.0
+    
+    def _next(self, hhv: float, llv: float, close: float) -> tuple[float, float, float]:
+        rsv = 100.0 * (close - llv) / (hhv - llv) if hhv > llv else 50.0
+        k = ((self.m1 - 1) * self.k + rsv) / self.m1
+        d = ((self.m2 - 1) * self.d + k) / self.m2
+        return k, d, 3 * k - 2 * d
+    
+    def update(self, high: float, low: float, close: float) -> tuple[float, float, float]:
+        k, d, j = self._next(self.high.update(high), self.low.update(low), close)
+        self.k, self.d = k, d
+        return k, d, j
+    
+    def peek(self, high: float, low: float, close: float) -> tuple[float, float, float]:
+        return self._next(self.high.peek(high), self.low.peek(low), close)
+    
+    def snapshot(self) -> dict:
+        return {"n": self.n, "m1": self.m1, "m2": self.m2, "k": self.k, "d": self.d,
+                "high": self.high.snapshot(), "low": self.low.snapshot()}
+    
+    @classmethod
+    def restore(cls, state: dict) -> "StreamingKDJ":
+        obj = cls(state["n"], state["m1"], state["m2"])
+        obj.k, obj.d = state["k"], state["d"]
+        obj.high = RollingExtreme.restore(state["high"])
+        obj.low = RollingExtreme.restore(state["low"])
+        return obj
+
+
+class StreamingSAR:
+    """增量抛物线转向指标
+    
+    初始趋势由前两根K线决定，因此第一根K线的SAR要到第二根K线到达后才能确定：
+    update在第一根K线返回NaN（与只有一根K线时的整段计算一致），第二根K线到达后由first_bar补上。
+    """
+    
+    def __init__(self, step: float = 0.02, max_step: float = 0.2):
+        self.step = step
+        self.max_step = max_step
+        self.count = 0
+        self.up = True
+        self.sar = math.nan
+        self.ep = math.nan
+        self.af = step
+        # 最近两根K线的最高/最低价，最新的在后
+        self.highs: list[float] = []
+        self.lows: list[float] = []
+    
+    def _next(self, high: float, low: float) -> tuple[float, bool, float, float]:
+        """计算加入一根K线后的 (SAR, 是否上涨, 极值点, 加速因子)"""
+        if self.count == 1:
+            # 第二根K线：确定初始趋势，然后按正常步骤推进
+            up = high + low >= self.highs[0] + self.lows[0]
+            sar = self.lows[0] if up else self.highs[0]
+            ep = self.highs[0] if up else self.lows[0]
+            af = self.step
+        else:
+            up, sar, ep, af = self.up, self.sar, self.ep, self.af
+        
+        sar = sar + af * (ep - sar)
+        if up:
+            sar = min(sar, *self.lows)
+            if low < sar:
+                return ep, False, low, self.step
+            if high > ep:
+                ep, af = high, min(af + self.step, self.max_step)
+        else:
+            sar = max(sar, *self.highs)
+            if high > sar:
+                return ep, True, high, self.step
+            if low < ep:
+                ep, af = low, min(af + self.step, self.max_step)
+        return sar, up, ep, af
+    
+    def update(self, high: float, low: float) -> tuple[float, int]:
+        """返回 (SAR, 趋势)，趋势1为上涨、-1为下跌，第一根K线返回 (NaN, 0)"""
+        if self.count == 0:
+            self.count = 1
+            self.highs, self.lows = [high], [low]
+            return math.nan, 0
+        self.sar, self.up, self.ep, self.af = self._next(high, low)
+        self.count += 1
+        self.highs = self.highs[-1:] + [high]
+        self.lows = self.lows[-1:] + [low]
+        return self.sar, 1 if self.up else -1
+    
+    def peek(self, high: float, low: float) -> tuple[float, int]:
+        if self.count == 0:
+            return math.nan, 0
+        sar, up, _, _ = self._next(high, low)
+        return sar, 1 if up else -1
+    
+    def first_bar(self) -> tuple[float, int]:
+        """第一根K线的 (SAR, 趋势)，只在恰好加入了两根K线时可以确定，否则返回 (NaN, 0)"""
+        if self.count != 2:
+            return math.nan, 0
+        up = self.highs[1] + self.lows[1] >= self.highs[0] + self.lows[0]
+        return (self.lows[0], 1) if up else (self.highs[0], -1)
+    
+    def snapshot(self) -> dict:
+        return {"step": self.step, "max_step": self.max_step, "count": self.count, "up": self.up,
+                "sar": self.sar, "ep": self.ep, "af": self.af, "highs": self.highs, "lows": self.lows}
+    
+    @classmethod
+    def restore(cls, state: dict) -> "StreamingSAR":
+        obj = cls(state["step"], state["max_step"])
+        obj.count, obj.up, obj.af = state["count"], state["up"], state["af"]
+        obj.sar, obj.ep = float(state["sar"]), float(state["ep"])
+        obj.highs, obj.lows = list(state["highs"]), list(state["lows"])
+        return obj
+
+
+class StreamingMA:
+    """增量简单移动平均（维护窗口和），数据不足N个时为NaN"""
+    
+    def __init__(self, n: int):
+        self.n = n
+        self.window: deque = deque()
+        self.total = 0.0
+    
+    def update(self, value: float) -> float:
+        self.window.append(value)
+        self.total += value
+        if len(self.window) > self.n:
+            self.total -= self.window.popleft()
+        return self.total / self.n if len(self.window) == self.n else math.nan
+    
+    def peek(self, value: float) -> float:
+        if len(self.window) + 1 < self.n:
+            return math.nan
+        dropped = self.window[0] if len(self.window) == self.n else 0.0
+        return (self.total - dropped + value) / self.n
+    
+    def snapshot(self) -> dict:
+        return {"n": self.n, "window": list(self.window)}
+    
+    @classmethod
+    def restore(cls, state: dict) -> "StreamingMA":
+        obj = cls(state["n"])
+        obj.window = deque(float(v) for v in state["window"])
+        obj.total = math.fsum(obj.window)
+        return obj
+
+
+class IndicatorState:
+    """一只股票的全部增量指标，输出名称与 indicators.compute_indicators 一致
+    
+    update 用于收盘确认的K线；peek 用于盘中报价（当前K线尚未结束），
+    只计算假设该K线按当前价收盘时的指标，不修改状态。
+    """
+    
+    def __init__(self, symbol: str, ma_windows: tuple[int, ...] = (5, 10, 20, 60),
+                 wr_windows: tuple[int, ...] = (14, 21)):
+        self.symbol = symbol
+        self.wr = {n: StreamingWR(n) for n in wr_windows}
+        self.kdj = StreamingKDJ()
+        self.sar = StreamingSAR()
+        self.ma = {n: StreamingMA(n) for n in ma_windows}
+        # 最后一根K线的日期（numpy datetime64字符串），用于判断文件中哪些K线是新的
+        self.last_date: Optional[str] = None
+        self.bars = 0
+        self.current: dict[str, float] = {}
+        self.previous: dict[str, float] = {}
+    
+    def _collect(self, wr: dict, kdj: tuple, sar: tuple, ma: dict) -> dict[str, float]:
+        values = {f"wr{n}": v for n, v in wr.items()}
+        values["k"], values["d"], values["j"] = kdj
+        values["sar"], values["sar_trend"] = sar
+        values.update({f"ma{n}": v for n, v in ma.items()})
+        return values
+    
+    def update(self, high: float, low: float, close: float, date: Optional[str] = None) -> dict[str, float]:
+        """加入一根已收盘的K线，返回最新指标"""
+        values = self._collect(
+            {n: s.update(high, low, close) for n, s in self.wr.items()},
+            self.kdj.update(high, low, close),
+            self.sar.update(high, low),
+            {n: s.update(close) for n, s in self.ma.items()}
+        )
+        self.previous, self.current = self.current, values
+        if self.sar.count == 2:
+            # 第二根K线确定了第一根K线的SAR
+            self.previous = {**self.previous}
+            self.previous["sar"], self.previous["sar_trend"] = self.sar.first_bar()
+        self.bars += 1
+        if date is not None:
+            self.last_date = str(date)
+        return values
+    
+    def peek(self, high: float, low: float, close: float) -> dict[str, float]:
+        """盘中报价对应的指标（不修改状态）"""
+        return self._collect(
+            {n: s.peek(high, low, close) for n, s in self.wr.items()},
+            self.kdj.peek(high, low, close),
+            self.sar.peek(high, low),
+            {n: s.peek(close) for n, s in self.ma.items()}
+        )
+    
+    def as_arrays(self) -> dict[str, np.ndarray]:
+        """最近两根K线的指标，格式与 compute_indicators 的结果相同（供报告使用）"""
+        names = self.current.keys()
+        rows = [self.previous, self.current] if self.previous else [self.current]
+        return {name: np.array([row[name] for row in rows]) for name in names}
+    
+    def extend(self, bars: Bars, start: int = 0):
+        """依次加入 bars[start:]"""
+        high, low, close = bars.high.tolist(), bars.low.tolist(), bars.close.tolist()
+        for i in range(start, len(bars)):
+            self.update(high[i], low[i], close[i])
+        if len(bars) > start:
+            self.last_date = str(bars.dates[-1])
+    
+    @classmethod
+    def from_bars(cls, bars: Bars, **kwargs) -> "IndicatorState":
+        """用整段历史初始化"""
+        state = cls(bars.symbol, **kwargs)
+        state.extend(bars)
+        return state
+    
+    def snapshot(self) -> dict:
+        """可JSON序列化的完整状态"""
+        return {
+            "symbol": self.symbol,
+            "last_date": self.last_date,
+            "bars": self.bars,
+            "wr": {str(n): s.snapshot() for n, s in self.wr.items()},
+            "kdj": self.kdj.snapshot(),
+            "sar": self.sar.snapshot(),
+            "ma": {str(n): s.snapshot() for n, s in self.ma.items()},
+            "current": self.current,
+            "previous": self.previous
+        }
+    
+    @classmethod
+    def restore(cls, state: dict) -> "IndicatorState":
+        obj = cls(state["symbol"])
+        obj.last_date = state.get("last_date")
+        obj.bars = state.get("bars", 0)
+        obj.wr = {int(n): StreamingWR.restore(s) for n, s in state["wr"].items()}
+        obj.kdj = StreamingKDJ.restore(state["kdj"])
+        obj.sar = StreamingSAR.restore(state["sar"])
+        obj.ma = {int(n): StreamingMA.restore(s) for n, s in state["ma"].items()}
+        obj.current = dict(state.get("current") or {})
+        obj.previous = dict(state.get("previous") or {})
+        return obj
+
+
+class IndicatorStreams:
+    """按股票维护增量指标状态"""
+    
+    def __init__(self):
+        self._states: dict[str, IndicatorState] = {}
+        # 可重入：sync_arrays在持有锁时调用sync
+        self._lock = threading.RLock()
+        self.stats = {"full_builds": 0, "incremental": 0, "bars_applied": 0}
+    
+    def __len__(self) -> int:
+        return len(self._states)
+    
+    def get(self, symbol: str) -> Optional[IndicatorState]:
+        return self._states.get(symbol)
+    
+    def last_date(self, symbol: str) -> Optional[str]:
+        """已同步的最后一根K线日期，未知股票返回None"""
+        with self._lock:
+            state = self._states.get(symbol)
+            return state.last_date if state else None
+    
+    def update(self, symbol: str, high: float, low: float, close: float,
+               date: Optional[str] = None) -> dict[str, float]:
+        """加入一根已收盘的K线"""
+        with self._lock:
+            state = self._states.get(symbol)
+            if state is None:
+                state = self._states[symbol] = IndicatorState(symbol)
+            self.stats["bars_applied"] += 1
+            return state.update(high, low, close, date)
+    
+    def peek(self, symbol: str, high: float, low: float, close: float) -> Optional[dict[str, float]]:
+        """盘中报价对应的指标，未知股票返回None"""
+        with self._lock:
+            state = self._states.get(symbol)
+            return state.peek(high, low, close) if state else None
+    
+    def sync(self, bars: Bars) -> IndicatorState:
+        """与行情文件同步：只加入上次之后的新K线；历史被改写（找不到上次的最后日期）时整段重算"""
+        with self._lock:
+            state = self._states.get(bars.symbol)
+            start = None
+            if state is not None and state.last_date is not None:
+                position = int(np.searchsorted(bars.dates, np.datetime64(state.last_date)))
+                if position < len(bars) and str(bars.dates[position]) == state.last_date:
+                    start = position + 1
+            if start is None:
+                state = self._states[bars.symbol] = IndicatorState.from_bars(bars)
+                self.stats["full_builds"] += 1
+                self.stats["bars_applied"] += len(bars)
+            elif start < len(bars):
+                state.extend(bars, start)
+                self.stats["incremental"] += 1
+                self.stats["bars_applied"] += len(bars) - start
+            return state
+    
+    def sync_arrays(self, bars: Bars) -> tuple[Optional[str], dict[str, np.ndarray]]:
+        """同步后在锁内取出 (最后日期, 最近两根K线的指标)，不会读到其他线程更新到一半的状态"""
+        with self._lock:
+            state = self.sync(bars)
+            return state.last_date, state.as_arrays()
+    
+    def discard(self, symbol: str):
+        """丢弃状态，下次同步时整段重算"""
+        with self._lock:
+            self._states.pop(symbol, None)
+    
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {symbol: state.snapshot() for symbol, state in self._states.items()}
+    
+    def restore(self, snapshot: dict):
+        with self._lock:
+            self._states = {symbol: IndicatorState.restore(state) for symbol, state in snapshot.items()}
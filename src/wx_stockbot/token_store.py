@@ -0,0 +1,221 @@
+"""
+访问令牌缓存
+同一进程内单飞刷新，多个gunicorn worker通过加锁文件共享同一个令牌
+"""
+
+import os
+import json
+import random
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from .config import WeChatConfig
+
+logger = logging.getLogger(__name__)
+
+# fcntl仅在类Unix系统可用，不可用时退化为进程内缓存
+try:
+    import fcntl
+    FILE_LOCK_AVAILABLE = True
+except ImportError:
+    FILE_LOCK_AVAILABLE = False
+
+
+@dataclass
+class CachedToken:
+    """缓存的访问令牌"""
+    access_token: str
+    # 过期时间（墙钟时间戳，跨进程可比较）
+    expires_at: float
+    
+    def is_valid(self, now: Optional[float] = None, min_ttl: float = 0) -> bool:
+        """令牌是否仍可使用，且剩余有效期不少于min_ttl秒"""
+        return bool(self.access_token) and (now or time.time()) + min_ttl < self.expires_at
+
+
+class TokenStore:
+    """进程内令牌缓存，同一时刻只有一个线程刷新令牌"""
+    
+    def __init__(self):
+        self._token: Optional[CachedToken] = None
+        self._refresh_lock = threading.Lock()
+        self.stats = {"hits": 0, "refreshes": 0, "shared_hits": 0}
+    
+    def get(self) -> Optional[CachedToken]:
+        """返回当前缓存的令牌（可能已过期）"""
+        return self._token
+    
+    def get_or_refresh(self, fetch: Callable[[], CachedToken], min_ttl: float = 0) -> str:
+        """返回剩余有效期不少于min_ttl的令牌，需要刷新时由单个调用方刷新，其余调用方等待并复用结果"""
+        token = self._token
+        if token and token.is_valid(min_ttl=min_ttl):
+            self.stats["hits"] += 1
+            return token.access_token
+        
+        with self._refresh_lock:
+            # 等待期间可能已被其他线程刷新
+            token = self._token
+            if token and token.is_valid(min_ttl=min_ttl):
+                self.stats["hits"] += 1
+                return token.access_token
+            token = self._refresh(fetch, min_ttl)
+            self._token = token
+            return token.access_token
+    
+    def _refresh(self, fetch: Callable[[], CachedToken], min_ttl: float = 0) -> CachedToken:
+        """刷新令牌（调用方已持有进程内锁）"""
+        token = fetch()
+        self.stats["refreshes"] += 1
+        return token
+    
+    def invalidate(self, access_token: Optional[str] = None):
+        """作废令牌；指定access_token时仅当缓存的仍是该令牌才作废"""
+        with self._refresh_lock:
+            if self._token and (access_token is None or self._token.access_token == access_token):
+                self._token = None
+
+
+class FileTokenStore(TokenStore):
+    """基于文件的跨进程令牌缓存
+    
+    令牌写入JSON文件（原子替换），刷新时持有独占文件锁，
+    因此每个过期周期内所有worker只会调用一次gettoken。
+    """
+    
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self.lock_path = path + ".lock"
+    
+    def _read_file(self) -> Optional[CachedToken]:
+        """读取共享令牌文件"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return CachedToken(data["access_token"], float(data["expires_at"]))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"读取令牌缓存文件失败: {e}")
+            return None
+    
+    def _write_file(self, token: CachedToken):
+        """原子写入共享令牌文件"""
+        directory = os.path.dirname(self.path) or "."
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".token-")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"access_token": token.access_token, "expires_at": token.expires_at}, f)
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+    
+    def _refresh(self, fetch: Callable[[], CachedToken], min_ttl: float = 0) -> CachedToken:
+        """加文件锁后再刷新，其他进程已刷新时直接复用"""
+        # 无锁快速路径：文件是原子替换的，读到的一定是完整内容
+        token = self._read_file()
+        if token and token.is_valid(min_ttl=min_ttl):
+            self.stats["shared_hits"] += 1
+            return token
+        
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            token = self._read_file()
+            if token and token.is_valid(min_ttl=min_ttl):
+                self.stats["shared_hits"] += 1
+                return token
+            token = super()._refresh(fetch, min_ttl)
+            self._write_file(token)
+            return token
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+    
+    def invalidate(self, access_token: Optional[str] = None):
+        """作废令牌，同时作废共享文件中的同一令牌"""
+        super().invalidate(access_token)
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            token = self._read_file()
+            if token and (access_token is None or token.access_token == access_token):
+                os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+
+class TokenRefresher:
+    """后台令牌刷新线程
+    
+    在令牌到期前 refresh_ahead 秒（再减去随机抖动）主动刷新，
+    请求路径上只读取缓存，不再同步调用gettoken。
+    """
+    
+    def __init__(self, store: TokenStore, fetch: Callable[[], CachedToken],
+                 refresh_ahead: float = 600, jitter: float = 60, retry_interval: float = 30):
+        self.store = store
+        self.fetch = fetch
+        self.refresh_ahead = refresh_ahead
+        self.jitter = jitter
+        self.retry_interval = retry_interval
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"runs": 0, "errors": 0, "next_refresh_at": 0.0}
+    
+    def start(self):
+        """启动刷新线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name="token-refresher", daemon=True)
+        self._thread.start()
+        logger.info(f"启动令牌后台刷新，提前量: {self.refresh_ahead}秒")
+    
+    def stop(self, timeout: float = 5):
+        """停止刷新线程"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+    
+    def _loop(self):
+        """刷新循环"""
+        while not self._stop_event.is_set():
+            try:
+                # 确保缓存的令牌至少还能用 refresh_ahead 秒，否则刷新（其他worker已刷新时直接复用）
+                self.store.get_or_refresh(self.fetch, min_ttl=self.refresh_ahead)
+                self.stats["runs"] += 1
+                token = self.store.get()
+                delay = token.expires_at - self.refresh_ahead - random.uniform(0, self.jitter) - time.time()
+            except Exception as e:
+                logger.error(f"后台刷新令牌失败: {e}")
+                self.stats["errors"] += 1
+                delay = self.retry_interval
+            delay = max(delay, 1.0)
+            self.stats["next_refresh_at"] = time.time() + delay
+            self._stop_event.wait(delay)
+
+
+def default_token_cache_path(config: WeChatConfig) -> str:
+    """按企业ID/应用生成默认的缓存文件路径"""
+    key = hashlib.sha1(f"{config.corpid}:{config.agentid}:{config.corpsecret}".encode("utf-8")).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), f"wx_stockbot_token_{key}.json")
+
+
+def create_token_store(config: WeChatConfig) -> TokenStore:
+    """根据配置创建令牌缓存，token_cache_path为"memory"时只用进程内缓存"""
+    if config.token_cache_path == "memory" or not FILE_LOCK_AVAILABLE:
+        return TokenStore()
+    return FileTokenStore(config.token_cache_path or default_token_cache_path(config))
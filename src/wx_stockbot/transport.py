@@ -0,0 +1,113 @@
+"""
+企业微信HTTP传输层
+基于连接池的长连接会话，所有API调用共享同一个Session
+"""
+
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Optional, Any
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TransportConfig:
+    """传输层配置"""
+    # 连接池中缓存的主机数
+    pool_connections: int = 4
+    # 每个主机的最大连接数
+    pool_maxsize: int = 16
+    # 连接池满时是否阻塞等待空闲连接
+    pool_block: bool = False
+    # 连接超时（秒）
+    connect_timeout: float = 3.05
+    # 读取超时（秒）
+    read_timeout: float = 10.0
+    # 连接/读取失败时的重试次数
+    max_retries: int = 2
+    # 重试退避因子
+    backoff_factor: float = 0.3
+
+
+class HttpTransport:
+    """长连接HTTP传输层
+    
+    持有一个 requests.Session，连接在调用之间保持 keep-alive 复用，
+    避免每次调用都重新进行 TCP 与 TLS 握手。
+    """
+    
+    # 只对网络错误和网关错误重试，业务错误码由调用方处理
+    RETRY_STATUS = (502, 503, 504)
+    
+    def __init__(self, config: Optional[TransportConfig] = None):
+        self.config = config or TransportConfig()
+        self._session = None
+        self._lock = threading.Lock()
+    
+    @property
+    def timeout(self) -> tuple[float, float]:
+        """默认的 (连接超时, 读取超时)"""
+        return (self.config.connect_timeout, self.config.read_timeout)
+    
+    def _build_session(self) -> requests.Session:
+        """创建带连接池和重试策略的Session"""
+        retry = Retry(
+            total=self.config.max_retries,
+            connect=self.config.max_retries,
+            read=self.config.max_retries,
+            status=self.config.max_retries,
+            backoff_factor=self.config.backoff_factor,
+            status_forcelist=self.RETRY_STATUS,
+            # message/send 不是幂等接口，只在请求未发出时重试
+            allowed_methods=frozenset(["GET"]),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=self.config.pool_connections,
+            pool_maxsize=self.config.pool_maxsize,
+            pool_block=self.config.pool_block,
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({"Connection": "keep-alive"})
+        logger.info(
+            f"创建HTTP连接池: pool_connections={self.config.pool_connections}, "
+            f"pool_maxsize={self.config.pool_maxsize}"
+        )
+        return session
+    
+    @property
+    def session(self) -> requests.Session:
+        """惰性创建的共享Session"""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._build_session()
+        return self._session
+    
+    def request(self, method: str, url: str, timeout: Any = None, **kwargs) -> requests.Response:
+        """发送请求，未指定超时时使用默认超时"""
+        return self.session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+    
+    def get(self, url: str, params: Optional[dict] = None, timeout: Any = None) -> requests.Response:
+        """GET请求"""
+        return self.request("GET", url, params=params, timeout=timeout)
+    
+    def post(self, url: str, params: Optional[dict] = None, json: Any = None,
+             timeout: Any = None) -> requests.Response:
+        """POST请求"""
+        return self.request("POST", url, params=params, json=json, timeout=timeout)
+    
+    def close(self):
+        """关闭Session并释放连接池"""
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
@@ -0,0 +1,8 @@
+"""
+测试公共配置：从仓库根目录导入 src.wx_stockbot
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
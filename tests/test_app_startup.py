@@ -0,0 +1,150 @@
+"""
+应用启动与退出：机器人创建完成前到达的回调照常应答，消息在机器人创建后处理；无法解析的回调返回400；退出时先处理完已入队的回调，再停止发送队列、令牌刷新并关闭连接池
+"""
+
+import os
+import sys
+import json
+import time
+import importlib
+import threading
+
+import pytest
+
+from src.wx_stockbot import bot as bot_module
+from src.wx_stockbot.crypto import WeChatCrypto
+from src.wx_stockbot.dispatcher import DispatcherStopped
+
+TOKEN = "test_token"
+AES_KEY = "abcdefghijklmnopqrstuvwxyz0123456789ABCDEFG"
+CORPID = "ww_test"
+
+
+@pytest.fixture(scope="module")
+def blocked_app(tmp_path_factory):
+    """导入应用，机器人创建（启动步骤bot）一直阻塞到测试放行"""
+    env = {
+        "WECHAT_CORPID": CORPID, "WECHAT_CORPSECRET": "secret", "WECHAT_AGENTID": "1000001",
+        "WECHAT_USER_IDS": "user1", "WECHAT_TOKEN": TOKEN, "WECHAT_ENCODING_AES_KEY": AES_KEY,
+        "WECHAT_API_BASE": "http://127.0.0.1:9", "WECHAT_TOKEN_CACHE": "memory",
+        "WECHAT_RATE_LIMIT_PATH": "memory", "WECHAT_LEADER_LOCK": "memory", "WECHAT_JOB_STORE": "memory",
+        "WECHAT_OUTBOX": "memory", "WECHAT_METRICS_DIR": "memory", "WECHAT_LOG_ASYNC": "0",
+        "WECHAT_DATA_DIR": str(tmp_path_factory.mktemp("data"))
+    }
+    saved = {key: os.environ.get(key) for key in env}
+    os.environ.update(env)
+    
+    release = threading.Event()
+    original_init = bot_module.WeChatBot.__init__
+    
+    def blocked_init(self, config):
+        release.wait(10)
+        original_init(self, config)
+    
+    bot_module.WeChatBot.__init__ = blocked_init
+    sys.modules.pop("app", None)
+    app = importlib.import_module("app")
+    try:
+        yield app, release
+    finally:
+        release.set()
+        app.startup.wait("bot", timeout=10)
+        bot_module.WeChatBot.__init__ = original_init
+        app.shutdown()
+        sys.modules.pop("app", None)
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def signed_callback(content: str) -> tuple[str, bytes]:
+    """签名正确的加密文本消息回调：(查询字符串, 请求体)"""
+    crypto = WeChatCrypto(TOKEN, AES_KEY, CORPID)
+    plaintext = (f"<xml><ToUserName><![CDATA[{CORPID}]]></ToUserName><FromUserName><![CDATA[user1]]></FromUserName>"
+                 f"<CreateTime>{int(time.time())}</CreateTime><MsgType><![CDATA[text]]></MsgType>"
+                 f"<Content><![CDATA[{content}]]></Content><MsgId>{time.time_ns()}</MsgId>"
+                 "<AgentID>1000001</AgentID></xml>")
+    encrypted = crypto.encrypt(plaintext)
+    timestamp, nonce = str(int(time.time())), "1234567890"
+    query = f"msg_signature={crypto.sign(timestamp, nonce, encrypted)}&timestamp={timestamp}&nonce={nonce}"
+    body = f"<xml><ToUserName><![CDATA[{CORPID}]]></ToUserName><Encrypt><![CDATA[{encrypted}]]></Encrypt></xml>"
+    return query, body.encode("utf-8")
+
+
+def test_callback_before_bot_is_created_is_accepted(blocked_app):
+    app, release = blocked_app
+    client = app.app.test_client()
+    query, body = signed_callback("你好")
+    
+    started = time.monotonic()
+    response = client.post(f"/webhook?{query}", data=body)
+    assert app.bot is None
+    assert response.status_code == 200
+    assert response.get_json() == {"errcode": 0, "errmsg": "ok"}
+    # 机器人未创建时不等待被动回复
+    assert time.monotonic() - started < app.config_manager.config.passive_reply_window
+    
+    # 机器人创建后处理线程继续处理这条回调
+    release.set()
+    assert app.startup.wait("bot", timeout=10)
+    deadline = time.monotonic() + 10
+    while app.ingress.get_status()["processed"] < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert app.ingress.get_status()["processed"] == 1
+
+
+@pytest.mark.parametrize("body", [b"not json", b"[1, 2]", b"<notxml>"])
+def test_unparsable_callback_is_rejected(blocked_app, body):
+    app, _ = blocked_app
+    rejected = app.CALLBACKS.labels("bad_request").value
+    accepted = app.ingress.get_status()["accepted"]
+    response = app.app.test_client().post("/webhook", data=body)
+    assert response.status_code == 400
+    assert app.CALLBACKS.labels("bad_request").value == rejected + 1
+    # 不进入处理队列
+    assert app.ingress.get_status()["accepted"] == accepted
+
+
+def test_callback_queued_during_shutdown_is_sent_before_dispatcher_stops(blocked_app):
+    app, release = blocked_app
+    release.set()
+    assert app.startup.wait("bot", timeout=10)
+    bot = app.bot
+    client = bot.client
+    client.start_token_refresher()
+    assert client.transport.session is not None
+    
+    # 回调处理到一半时开始退出
+    handling, proceed = threading.Event(), threading.Event()
+    
+    def slow_handler(content, user_id):
+        handling.set()
+        proceed.wait(5)
+        return "收到"
+    
+    bot.handle_incoming_message = slow_handler
+    body = json.dumps({"MsgType": "text", "FromUserName": "user1", "Content": "你好", "MsgId": str(time.time_ns())})
+    assert app.app.test_client().post("/webhook", data=body).status_code == 200
+    assert handling.wait(5)
+    
+    stopper = threading.Thread(target=app.shutdown)
+    stopper.start()
+    time.sleep(0.1)
+    # 退出等待已入队的回调处理完，期间新回调不再接收
+    assert stopper.is_alive()
+    response = app.app.test_client().post("/webhook", data=body)
+    assert response.status_code == 503
+    
+    proceed.set()
+    stopper.join(10)
+    assert not stopper.is_alive()
+    assert bot.dispatcher.get_status()["submitted"] == 1
+    assert not bot.dispatcher.get_status()["running"]
+    with pytest.raises(DispatcherStopped):
+        bot.send_message_async("退出后提交")
+    assert not bot.dispatcher.get_status()["running"]
+    
+    assert client.token_refresher._thread is None
+    assert client.transport._session is None
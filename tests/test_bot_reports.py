@@ -0,0 +1,113 @@
+"""
+机器人报告：回调处理线程、调度线程并发生成报告时，行情追加后的报告与整段重算一致；
+盘中覆盖当天K线后报告随之更新；订阅推送与同一股票的"信息更新"消息共享一次计算
+"""
+
+import time
+import threading
+
+import numpy as np
+import pytest
+
+from src.wx_stockbot.bot import WeChatBot
+from src.wx_stockbot.config import WeChatConfig
+from src.wx_stockbot.market_data import Bars, FIELDS
+from src.wx_stockbot.market_store import MarketStore
+from src.wx_stockbot.report import render_report
+
+
+def make_bars(symbol: str, start: int, days: int, seed: int = 1) -> Bars:
+    rng = np.random.default_rng(seed)
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, start + days)))[start:]
+    dates = np.datetime64("2015-01-01") + np.arange(start, start + days)
+    return Bars(symbol, dates, close, close * 1.01, close * 0.99, close, np.full(days, 1e6))
+
+
+@pytest.fixture
+def bot(tmp_path):
+    config = WeChatConfig(
+        corpid="ww_test", corpsecret="secret", agentid="1", user_ids=["user1"], dept_ids=[], tag_ids=[],
+        api_base="http://127.0.0.1:9", token_cache_path="memory", rate_limit_path="memory",
+        leader_lock_path="memory", job_store_path="memory", outbox_path="memory",
+        data_dir=str(tmp_path), market_store_dir=str(tmp_path / "store")
+    )
+    bot = WeChatBot(config)
+    yield bot
+    bot.leader.stop()
+    bot.scheduler.stop()
+    bot.dispatcher.stop()
+    bot.client.close()
+
+
+def test_concurrent_reports_match_full_recompute(bot):
+    store = MarketStore(bot.config.market_store_dir)
+    history = 300
+    store.append(make_bars("NVDA", 0, history))
+    errors = []
+    
+    def reader():
+        try:
+            for _ in range(30):
+                assert not bot.build_report("NVDA").startswith("⚠️")
+        except Exception as e:
+            errors.append(e)
+    
+    threads = [threading.Thread(target=reader) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    # 读取的同时追加新K线
+    full = make_bars("NVDA", 0, history + 20)
+    for day in range(history, history + 20):
+        store.append(make_bars("NVDA", day, 1))
+    for thread in threads:
+        thread.join()
+    
+    assert errors == []
+    assert bot.build_report("NVDA") == render_report(full)
+
+
+def test_report_follows_overwritten_last_bar(bot):
+    store = MarketStore(bot.config.market_store_dir)
+    store.append(make_bars("NVDA", 0, 100))
+    assert bot.build_report("NVDA") == render_report(make_bars("NVDA", 0, 100))
+    
+    # 当天K线盘中更新：同一日期重新追加
+    original, updated = make_bars("NVDA", 0, 100), make_bars("NVDA", 0, 100, seed=2)
+    store.append(Bars("NVDA", updated.dates[-1:], *(getattr(updated, name)[-1:] for name in FIELDS)))
+    assert store.revision("NVDA") == 0
+    expected = Bars("NVDA", original.dates, *(np.concatenate([getattr(original, name)[:-1], getattr(updated, name)[-1:]])
+                                              for name in FIELDS))
+    assert bot.build_report("NVDA") == render_report(expected)
+
+
+def test_push_and_message_share_one_computation(bot, monkeypatch):
+    MarketStore(bot.config.market_store_dir).append(make_bars("NVDA", 0, 100))
+    started, release = threading.Event(), threading.Event()
+    calls = []
+    original = bot.build_report
+    
+    def slow_build(symbol):
+        calls.append(symbol)
+        started.set()
+        release.wait(5)
+        return original(symbol)
+    
+    monkeypatch.setattr(bot, "build_report", slow_build)
+    sent = []
+    monkeypatch.setattr(bot, "send_message_async", lambda content, user_ids: sent.append((content, user_ids)))
+    
+    push = threading.Thread(target=bot._push_report, args=("NVDA", "user2"))
+    push.start()
+    assert started.wait(5)
+    replies = []
+    message = threading.Thread(target=lambda: replies.append(bot.handle_incoming_message("信息更新 NVDA", "user1")))
+    message.start()
+    # 消息加入推送的计算后再让计算完成
+    while bot.singleflight.stats["coalesced"] < 1:
+        time.sleep(0.001)
+    release.set()
+    push.join()
+    message.join()
+    
+    assert calls == ["NVDA"]
+    assert sent == [(replies[0], ["user2"])]
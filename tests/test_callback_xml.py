@@ -0,0 +1,80 @@
+"""
+回调XML解析：快速路径与ElementTree结果一致，非扁平结构回退，大小和字段数限制
+"""
+
+import time
+
+import pytest
+
+from src.wx_stockbot import callback_xml
+from src.wx_stockbot.callback_xml import parse_callback_xml, CallbackXMLError, MAX_XML_BYTES, MAX_FIELDS
+
+
+def text_message(content: str) -> str:
+    return ("<xml><ToUserName><![CDATA[ww_corp]]></ToUserName><FromUserName><![CDATA[user1]]></FromUserName>"
+            "<CreateTime>1700000000</CreateTime><MsgType><![CDATA[text]]></MsgType>"
+            f"<Content><![CDATA[{content}]]></Content><MsgId>7291234567890</MsgId><AgentID>1000001</AgentID></xml>")
+
+
+# 快速路径能处理的形式
+FLAT = {
+    "外层包": "<xml><ToUserName><![CDATA[ww]]></ToUserName><Encrypt><![CDATA[" + "A" * 500 + "==]]></Encrypt></xml>",
+    "文本消息": text_message("信息更新 NVDA"),
+    "CDATA中的尖括号和]": text_message("a < b ] c ]] d"),
+    "空元素": "<xml><ToUserName>ww</ToUserName><Content></Content><EventKey><![CDATA[]]></EventKey></xml>",
+    "格式化": "<?xml version=\"1.0\"?>\n<xml>\n  <ToUserName><![CDATA[ww]]></ToUserName>\n  <MsgType>text</MsgType>\n</xml>\n",
+}
+
+# 需要回退到ElementTree的形式
+FALLBACK = {
+    "实体": "<xml><ToUserName>ww</ToUserName><Content>a &amp; b &lt; c</Content></xml>",
+    "嵌套元素": "<xml><MsgType>event</MsgType><SendPicsInfo><Count>1</Count></SendPicsInfo></xml>",
+    "自闭合元素": "<xml><ToUserName>ww</ToUserName><EventKey/></xml>",
+    "换行符": "<xml><ToUserName>ww</ToUserName><Content><![CDATA[第一行\r\n第二行]]></Content></xml>",
+    "CDATA拆分": "<xml><Content><![CDATA[a]]]]><![CDATA[>b]]></Content></xml>",
+    "末尾多余内容": text_message("hi") + "ww_corp",
+    "缺少根开始标签": text_message("hi")[5:],
+    "属性": "<xml><Content type=\"x\">hi</Content></xml>",
+}
+
+
+@pytest.mark.parametrize("name", FLAT)
+def test_fast_path_matches_elementtree(name):
+    data = FLAT[name].encode("utf-8")
+    fast = callback_xml._parse_fast(data)
+    assert fast is not None
+    assert fast == callback_xml._parse_elementtree(data)
+    assert parse_callback_xml(FLAT[name]) == fast
+
+
+@pytest.mark.parametrize("name", FALLBACK)
+def test_other_shapes_fall_back(name):
+    data = FALLBACK[name].encode("utf-8")
+    assert callback_xml._parse_fast(data) is None
+    assert parse_callback_xml(data) == callback_xml._parse_elementtree(data)
+
+
+def test_fallback_results():
+    assert parse_callback_xml(FALLBACK["实体"])["Content"] == "a & b < c"
+    assert parse_callback_xml(FALLBACK["CDATA拆分"])["Content"] == "a]]>b"
+    assert parse_callback_xml(FALLBACK["换行符"])["Content"] == "第一行\n第二行"
+    assert parse_callback_xml(FALLBACK["缺少根开始标签"])["Content"] == "hi"
+
+
+def test_rejects_doctype_and_oversized_input():
+    with pytest.raises(CallbackXMLError):
+        parse_callback_xml('<!DOCTYPE x [<!ENTITY a "b">]><xml><A>&a;</A></xml>')
+    with pytest.raises(CallbackXMLError):
+        parse_callback_xml("<xml><A>" + "a" * MAX_XML_BYTES + "</A></xml>")
+    with pytest.raises(CallbackXMLError):
+        parse_callback_xml("<xml>" + "<A>1</A>" * (MAX_FIELDS + 1) + "</xml>")
+    with pytest.raises(CallbackXMLError):
+        parse_callback_xml("<xml><A>")
+
+
+def test_hostile_cdata_is_linear():
+    data = b"<xml><Encrypt><![CDATA[" + b"]]>" * (MAX_XML_BYTES // 3 - 20)
+    started = time.perf_counter()
+    with pytest.raises(CallbackXMLError):
+        parse_callback_xml(data)
+    assert time.perf_counter() - started < 1
@@ -0,0 +1,80 @@
+"""
+消息加解密：加解密往返、PKCS7填充校验、签名和ReceiveId校验
+"""
+
+import base64
+
+import pytest
+
+from src.wx_stockbot import crypto
+from src.wx_stockbot.crypto import WeChatCrypto, WeChatCryptoError, pkcs7_pad, pkcs7_unpad
+
+AES_KEY = "abcdefghijklmnopqrstuvwxyz0123456789ABCDEFG"
+BACKENDS = [name for name, available in (("cryptography", crypto.OPENSSL_AVAILABLE),
+                                         ("pyaes", crypto.PYAES_AVAILABLE)) if available]
+
+
+@pytest.fixture(params=BACKENDS)
+def cipher(request):
+    return WeChatCrypto("token", AES_KEY, "ww_corp", backend=request.param)
+
+
+@pytest.mark.parametrize("message", ["", "信息更新", "x" * 31, "x" * 32, "行情" * 1000])
+def test_round_trip(cipher, message):
+    assert cipher.decrypt(cipher.encrypt(message)) == message.encode("utf-8")
+
+
+def test_backends_are_interchangeable():
+    if len(BACKENDS) < 2:
+        pytest.skip("只安装了一种AES实现")
+    a, b = (WeChatCrypto("token", AES_KEY, "ww_corp", backend=name) for name in BACKENDS)
+    random_bytes = b"0123456789abcdef"
+    assert a.encrypt("hello", random_bytes) == b.encrypt("hello", random_bytes)
+    assert b.decrypt(a.encrypt("你好")) == "你好".encode("utf-8")
+
+
+@pytest.mark.parametrize("length", range(0, 70, 7))
+def test_pkcs7_pads_to_32_bytes(length):
+    padded = pkcs7_pad(b"a" * length)
+    assert len(padded) % 32 == 0
+    assert pkcs7_unpad(padded) == length
+
+
+@pytest.mark.parametrize("data", [
+    b"",
+    b"a" * 31 + b"\x00",
+    b"a" * 31 + b"\x21",
+    # 最后一个字节在范围内，但其余填充字节不等于填充长度
+    b"a" * 28 + b"\x04\x04\x03\x04",
+    b"a" * 30 + b"\x01\x02",
+])
+def test_pkcs7_rejects_invalid_padding(data):
+    with pytest.raises(WeChatCryptoError):
+        pkcs7_unpad(data)
+
+
+def test_tampered_ciphertext_fails_cleanly(cipher):
+    ciphertext = bytearray(base64.b64decode(cipher.encrypt("信息更新")))
+    # 修改倒数第二个分组，最后一个分组解密后的填充随之改变
+    ciphertext[-17] ^= 0x01
+    with pytest.raises(WeChatCryptoError):
+        cipher.decrypt(base64.b64encode(bytes(ciphertext)))
+
+
+def test_receive_id_mismatch(cipher):
+    other = WeChatCrypto("token", AES_KEY, "ww_other", backend=cipher.backend)
+    with pytest.raises(WeChatCryptoError, match="ReceiveId"):
+        cipher.decrypt(other.encrypt("hi"))
+
+
+def test_signature(cipher):
+    encrypted = cipher.encrypt("hi")
+    signature = cipher.sign("1700000000", "nonce", encrypted)
+    assert cipher.decrypt_message(encrypted, signature, "1700000000", "nonce") == "hi"
+    with pytest.raises(WeChatCryptoError, match="签名"):
+        cipher.decrypt_message(encrypted, signature, "1700000001", "nonce")
+
+
+def test_invalid_key_length():
+    with pytest.raises(WeChatCryptoError):
+        WeChatCrypto("token", AES_KEY[:-1], "ww_corp")
@@ -0,0 +1,97 @@
+"""
+回调去重：TTL过期、处理中的租约、处理失败后释放，以及多个worker共享的文件去重表
+"""
+
+import time
+
+import pytest
+
+from src.wx_stockbot.dedup import DedupCache, FileDedupCache, FILE_LOCK_AVAILABLE, dedup_key
+
+
+@pytest.fixture(params=["memory", "file"])
+def make_cache(request, tmp_path):
+    def make(**kwargs):
+        if request.param == "memory":
+            return DedupCache(**kwargs)
+        if not FILE_LOCK_AVAILABLE:
+            pytest.skip("当前系统不支持文件锁")
+        return FileDedupCache(str(tmp_path / "dedup"), capacity=64, **kwargs)
+    return make
+
+
+def test_dedup_key():
+    assert dedup_key({"MsgId": "123", "FromUserName": "u"}) == "msg:123"
+    assert dedup_key({"FromUserName": "u", "CreateTime": "1", "Event": "subscribe"}) == "event:u:1:subscribe"
+    assert dedup_key({"Content": "hi"}) is None
+
+
+def test_seen_expires_after_ttl(make_cache):
+    cache = make_cache(ttl=0.05)
+    assert cache.seen("msg:1") is False
+    assert cache.seen("msg:1") is True
+    assert cache.seen("msg:2") is False
+    time.sleep(0.06)
+    assert cache.seen("msg:1") is False
+    assert cache.stats["duplicates"] == 1
+
+
+def test_claim_complete_release(make_cache):
+    cache = make_cache(ttl=60, lease=60)
+    assert cache.claim("msg:1")
+    # 处理中的重复回调被忽略
+    assert not cache.claim("msg:1")
+    # 处理失败后企业微信的重试会重新处理
+    cache.release("msg:1")
+    assert cache.claim("msg:1")
+    cache.complete("msg:1")
+    assert not cache.claim("msg:1")
+
+
+def test_lease_expires_when_worker_dies(make_cache):
+    cache = make_cache(ttl=60, lease=0.05)
+    assert cache.claim("msg:1")
+    time.sleep(0.06)
+    assert cache.claim("msg:1")
+    # 处理成功后按TTL去重，不再受租约影响
+    cache.complete("msg:1")
+    time.sleep(0.06)
+    assert not cache.claim("msg:1")
+
+
+@pytest.mark.skipif(not FILE_LOCK_AVAILABLE, reason="当前系统不支持文件锁")
+def test_file_cache_is_shared(tmp_path):
+    path = str(tmp_path / "dedup")
+    first, second = FileDedupCache(path, ttl=60), FileDedupCache(path, ttl=60)
+    assert first.claim("msg:1")
+    assert not second.claim("msg:1")
+    first.release("msg:1")
+    assert second.claim("msg:1")
+    first.close()
+    second.close()
+
+
+@pytest.mark.skipif(not FILE_LOCK_AVAILABLE, reason="当前系统不支持文件锁")
+def test_file_cache_overwrites_oldest_when_full(tmp_path):
+    cache = FileDedupCache(str(tmp_path / "dedup"), ttl=60, capacity=16)
+    for i in range(200):
+        assert cache.seen(f"msg:{i}") is False
+    # 表满后覆盖最早过期的槽，最近的条目仍然有效
+    assert cache.seen("msg:199") is True
+    cache.close()
+
+
+def test_expired_lease_behind_completed_entries_is_evicted():
+    cache = DedupCache(ttl=60, lease=0.05, max_entries=3)
+    assert cache.claim("msg:1")
+    cache.complete("msg:1")
+    assert cache.claim("msg:2")
+    cache.complete("msg:2")
+    # 已处理条目之后占用的租约过期
+    assert cache.claim("msg:3")
+    time.sleep(0.06)
+    # 达到容量时先淘汰过期的租约，而不是头部仍有效的已处理条目
+    assert cache.claim("msg:4")
+    assert not cache.claim("msg:1")
+    assert not cache.claim("msg:2")
+    assert cache.get_status()["entries"] + cache.get_status()["leases"] == 3
@@ -0,0 +1,122 @@
+"""
+发送队列：群发部分批次失败时只重试失败的批次，不可重试的错误直接放弃，
+尚未送达的接收者随发件箱持久化
+"""
+
+import json
+import time
+import sqlite3
+import threading
+
+from src.wx_stockbot.dispatcher import SendDispatcher
+from src.wx_stockbot.fanout import DeliveryReport, plan_batches
+from src.wx_stockbot.outbox import Outbox, DELIVERED, FAILED, PENDING
+
+
+class FakeClient:
+    """按批次返回预设结果的客户端，记录每次调用的接收者"""
+    
+    def __init__(self, result_for):
+        self.result_for = result_for
+        self.calls: list[list[list[str]]] = []
+        self._lock = threading.Lock()
+    
+    def send_message(self, msgtype, body, user_ids=None, dept_ids=None, tag_ids=None):
+        batches = plan_batches(user_ids, dept_ids, tag_ids)
+        with self._lock:
+            call = len(self.calls)
+            self.calls.append([batch.user_ids for batch in batches])
+        report = DeliveryReport()
+        for index, batch in enumerate(batches):
+            report.add_result(batch, self.result_for(call, index))
+        return report
+
+
+OK = {"errcode": 0, "errmsg": "ok"}
+
+
+def users(count: int) -> list[str]:
+    return [f"user{i}" for i in range(count)]
+
+
+def make_dispatcher(client, path: str, **kwargs) -> SendDispatcher:
+    outbox = Outbox(path, flush_interval=0)
+    return SendDispatcher(client, workers=1, outbox=outbox, retry_base=0.01, poll_interval=0.01, **kwargs)
+
+
+def test_only_failed_batch_is_retried(tmp_path):
+    # 第一次发送时第二个批次系统繁忙
+    client = FakeClient(lambda call, index: {"errcode": -1, "errmsg": "系统繁忙"} if (call, index) == (0, 1) else OK)
+    dispatcher = make_dispatcher(client, str(tmp_path / "outbox.db"))
+    try:
+        job = dispatcher.submit("报告", users(2500))
+        assert job.future.result(timeout=5) is True
+        assert job.attempts == 2
+        assert [len(batch) for batch in client.calls[0]] == [1000, 1000, 500]
+        assert client.calls[1] == [users(2000)[1000:]]
+        assert dispatcher.outbox.counts() == {DELIVERED: 1}
+    finally:
+        dispatcher.stop()
+
+
+def test_permanent_error_fails_without_retry(tmp_path):
+    client = FakeClient(lambda call, index: {"errcode": 40003, "errmsg": "invalid userid"})
+    dispatcher = make_dispatcher(client, str(tmp_path / "outbox.db"))
+    try:
+        job = dispatcher.submit("报告", ["nobody"])
+        assert job.future.result(timeout=5) is False
+        assert job.attempts == 1
+        assert len(client.calls) == 1
+        assert dispatcher.outbox.counts() == {FAILED: 1}
+        assert dispatcher.get_status()["retried"] == 0
+    finally:
+        dispatcher.stop()
+
+
+def test_permanent_batches_are_dropped_from_retry(tmp_path):
+    # 第一个批次接收者无效，第二个批次系统繁忙：只重试第二个批次
+    results = {(0, 0): {"errcode": 40003, "errmsg": "invalid userid"}, (0, 1): {"errcode": 45009, "errmsg": "频率超限"}}
+    client = FakeClient(lambda call, index: results.get((call, index), OK))
+    dispatcher = make_dispatcher(client, str(tmp_path / "outbox.db"))
+    try:
+        job = dispatcher.submit("报告", users(1500))
+        assert job.future.result(timeout=5) is True
+        assert client.calls[1] == [users(1500)[1000:]]
+    finally:
+        dispatcher.stop()
+
+
+def test_remaining_recipients_survive_restart(tmp_path):
+    path = str(tmp_path / "outbox.db")
+    client = FakeClient(lambda call, index: {"errcode": -1, "errmsg": "系统繁忙"} if index == 0 else OK)
+    dispatcher = make_dispatcher(client, path, retry_max=60)
+    dispatcher.retry_base = 60
+    job = dispatcher.submit("报告", users(1200))
+    deadline = time.monotonic() + 5
+    while dispatcher.get_status()["retried"] < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    dispatcher.stop()
+    
+    conn = sqlite3.connect(path)
+    try:
+        status, recipients = conn.execute("SELECT status, recipients FROM outbox").fetchone()
+        assert status == PENDING
+        assert json.loads(recipients)["user_ids"] == users(1000)
+        # 重启后立即到期：把重试时间提前
+        conn.execute("UPDATE outbox SET next_attempt = 0")
+        conn.commit()
+    finally:
+        conn.close()
+    
+    client = FakeClient(lambda call, index: OK)
+    dispatcher = make_dispatcher(client, path)
+    dispatcher.start()
+    try:
+        deadline = time.monotonic() + 5
+        while dispatcher.outbox.counts() != {DELIVERED: 1} and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert client.calls == [[users(1000)]]
+        assert dispatcher.get_job(job.job_id).status == "done"
+        assert dispatcher.get_status()["replayed"] == 1
+    finally:
+        dispatcher.stop()
@@ -0,0 +1,66 @@
+"""
+关键词索引：多模式匹配和命中排序规则
+"""
+
+import pytest
+
+from src.wx_stockbot.keyword_index import KeywordIndex
+
+
+def test_finds_overlapping_keywords():
+    index = KeywordIndex()
+    for keyword in ("he", "she", "his", "hers"):
+        index.add(keyword, keyword)
+    found = {m.entry.keyword: m.position for m in index.match("ushers")}
+    assert found == {"she": 1, "he": 2, "hers": 2}
+
+
+def test_priority_then_length_then_position():
+    index = KeywordIndex()
+    index.add("更新", "short")
+    index.add("信息更新", "long")
+    assert index.best("信息更新").entry.value == "long"
+    
+    index.add("更新", "short", priority=1)
+    assert index.best("信息更新").entry.value == "short"
+    
+    index.add("行情", "quote")
+    index.add("报告", "report")
+    # 优先级和长度相同时先出现的优先
+    assert index.best("报告和行情").entry.value == "report"
+
+
+def test_longer_keyword_beats_earlier_position():
+    index = KeywordIndex()
+    index.add("ab", "first")
+    index.add("b", "second")
+    index.add("xb", "third")
+    matches = index.match("ab xb")
+    assert [m.entry.value for m in matches] == ["first", "third", "second"]
+
+
+def test_re_add_updates_value_and_priority():
+    index = KeywordIndex()
+    index.add("帮助", "old")
+    index.add("帮助", "new", priority=5)
+    assert len(index) == 1
+    assert "帮助" in index
+    match = index.best("帮助")
+    assert (match.entry.value, match.entry.priority) == ("new", 5)
+
+
+def test_adding_after_match_rebuilds():
+    index = KeywordIndex()
+    index.add("a", 1)
+    assert index.best("cab").entry.value == 1
+    index.add("ca", 2)
+    assert index.best("cab").entry.value == 2
+
+
+def test_no_match_and_empty_keyword():
+    index = KeywordIndex()
+    index.add("信息更新", 1)
+    assert index.best("你好") is None
+    assert index.match("") == []
+    with pytest.raises(ValueError):
+        index.add("", 1)
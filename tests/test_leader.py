@@ -0,0 +1,83 @@
+"""
+主节点选举：卡住的主节点租约过期后由其他worker接管，恢复后让出；
+调度线程错过心跳时主节点让出；未配置路径时任务定义只在进程内保存
+"""
+
+import time
+import threading
+
+from src.wx_stockbot.config import WeChatConfig
+from src.wx_stockbot.job_store import JobStore, create_job_store
+from src.wx_stockbot.leader import FileLeaderElection
+from src.wx_stockbot.scheduler import Scheduler
+
+HEARTBEAT = 0.05
+
+
+def wait_until(predicate, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_hung_leader_is_taken_over(tmp_path):
+    path = str(tmp_path / "leader.lock")
+    first, second = FileLeaderElection(path, heartbeat=HEARTBEAT), FileLeaderElection(path, heartbeat=HEARTBEAT)
+    changes = []
+    first.add_listener(changes.append)
+    first.start()
+    assert first.is_leader
+    # 主节点卡住：心跳线程停止，锁仍然持有
+    first._stop.set()
+    first._thread.join()
+    second.start()
+    try:
+        assert not second.is_leader
+        assert wait_until(lambda: second.is_leader)
+        # 卡住的主节点租约已过期，不再执行任务
+        assert not first.is_leader
+        assert second.stats["takeovers"] == 1
+        
+        # 恢复后发现锁文件已被替换，让出且不覆盖新主节点的信息
+        first._tick()
+        assert first._fd is None
+        assert changes == [True, False]
+        assert first.stats["step_downs"] == 1
+        time.sleep(HEARTBEAT * 4)
+        assert second.is_leader and not first.is_leader
+        first.stop()
+        assert second.leader_info() is not None
+    finally:
+        second.stop()
+
+
+def test_leader_steps_down_when_scheduler_misses_heartbeat(tmp_path):
+    path = str(tmp_path / "leader.lock")
+    scheduler = Scheduler(workers=1, max_wait=HEARTBEAT)
+    first, second = FileLeaderElection(path, heartbeat=HEARTBEAT), FileLeaderElection(path, heartbeat=HEARTBEAT)
+    first.add_health_check(lambda: scheduler.heartbeat_age() < first.lease)
+    scheduler.start()
+    first.start()
+    second.start()
+    try:
+        assert first.is_leader
+        time.sleep(HEARTBEAT * 4)
+        assert first.is_leader and not second.is_leader
+        
+        # 调度线程卡住：主节点让出，恢复前不再参选
+        with scheduler._cond:
+            assert wait_until(lambda: second.is_leader)
+            assert not first.is_leader
+            assert first.stats["step_downs"] == 1
+        assert wait_until(lambda: scheduler.heartbeat_age() < HEARTBEAT)
+    finally:
+        second.stop()
+        first.stop()
+        scheduler.stop()
+
+
+def test_job_store_defaults_to_memory():
+    config = WeChatConfig(corpid="ww_test", corpsecret="secret", agentid="1", user_ids=["user1"],
+                          dept_ids=[], tag_ids=[])
+    assert type(create_job_store(config)) is JobStore
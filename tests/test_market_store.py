@@ -0,0 +1,47 @@
+"""
+列式行情存储：重新追加最后一天时原地覆盖最后一行，数据保持有序、不增加改写次数
+"""
+
+import numpy as np
+
+from src.wx_stockbot.market_data import Bars
+from src.wx_stockbot.market_store import MarketStore
+
+
+def make_bars(start: int, days: int, close: float = 10.0) -> Bars:
+    dates = np.datetime64("2024-01-01") + np.arange(start, start + days)
+    values = np.full(days, close)
+    return Bars("TEST", dates, values, values + 1, values - 1, values, np.full(days, 1e6))
+
+
+def test_reappending_last_day_overwrites_in_place(tmp_path):
+    store = MarketStore(str(tmp_path))
+    store.append(make_bars(0, 5))
+    assert store.append(make_bars(4, 1, close=12.0)) == 1
+    
+    meta = store.info("TEST")
+    assert (meta["rows"], meta["sorted"], meta["revision"], meta["amended"]) == (5, True, 0, 1)
+    bars = store.read("TEST")
+    assert list(bars.close) == [10.0] * 4 + [12.0]
+    assert store.last_date("TEST") == "2024-01-05"
+
+
+def test_reappending_last_day_with_next_day(tmp_path):
+    store = MarketStore(str(tmp_path))
+    store.append(make_bars(0, 5))
+    store.append(make_bars(4, 2, close=12.0))
+    
+    meta = store.info("TEST")
+    assert (meta["rows"], meta["sorted"], meta["revision"]) == (6, True, 0)
+    assert list(store.read("TEST", start="2024-01-05").close) == [12.0, 12.0]
+    assert store.last_date("TEST") == "2024-01-06"
+
+
+def test_earlier_day_still_marks_unsorted(tmp_path):
+    store = MarketStore(str(tmp_path))
+    store.append(make_bars(0, 5))
+    store.append(make_bars(3, 1, close=12.0))
+    
+    meta = store.info("TEST")
+    assert (meta["rows"], meta["sorted"], meta["revision"]) == (6, False, 1)
+    assert list(store.read("TEST").close) == [10.0, 10.0, 10.0, 12.0, 10.0]
@@ -0,0 +1,57 @@
+"""
+运行指标：多worker汇总只计入存活的worker，worker退出时删除自己的快照
+"""
+
+import os
+import json
+import subprocess
+import sys
+
+import pytest
+
+from src.wx_stockbot.metrics import MetricsRegistry, _LabeledMetric
+
+
+def make_registry(directory: str) -> MetricsRegistry:
+    registry = MetricsRegistry()
+    registry.counter("test_total", "测试计数", ("kind",)).labels("a").inc(2)
+    registry.enable_multiprocess(directory, flush_interval=60)
+    return registry
+
+
+def dead_pid() -> int:
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    return proc.pid
+
+
+def test_snapshots_of_dead_workers_are_skipped(tmp_path):
+    registry = make_registry(str(tmp_path))
+    try:
+        dead = tmp_path / f"{os.getppid()}_{dead_pid()}.json"
+        dead.write_text(json.dumps({"test_total": {"a": 5}}))
+        assert 'test_total{kind="a"} 2' in registry.render()
+        assert not dead.exists()
+    finally:
+        registry.close()
+
+
+def test_close_removes_own_snapshot(tmp_path):
+    registry = make_registry(str(tmp_path))
+    own = tmp_path / f"{os.getppid()}_{os.getpid()}.json"
+    registry.flush()
+    assert own.exists()
+    registry.close()
+    assert not own.exists()
+    # 退出后不再写入快照
+    registry.flush()
+    assert not own.exists()
+
+
+def test_labeled_metric_requires_new_child():
+    class Incomplete(_LabeledMetric):
+        def snapshot(self) -> dict:
+            return {}
+    
+    with pytest.raises(TypeError):
+        Incomplete("incomplete", "缺少_new_child")
@@ -0,0 +1,158 @@
+"""
+发件箱：写入即认领、确认、退避重试、放弃、放回，租约过期后由其他进程重新认领，
+事务失败时操作重新排队
+"""
+
+import time
+import sqlite3
+
+import pytest
+
+from src.wx_stockbot.outbox import Outbox, PENDING, CLAIMED, DELIVERED, FAILED, MAX_OP_ATTEMPTS
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    box = Outbox(str(tmp_path / "outbox.db"), lease=60, flush_interval=0)
+    box.start()
+    yield box
+    box.stop()
+
+
+def message(job_id: str) -> tuple:
+    return (job_id, "text", f"内容 {job_id}", ["user1"])
+
+
+def test_add_claims_for_current_process(outbox):
+    outbox.add([message("a"), message("b")])
+    assert outbox.counts() == {CLAIMED: 2}
+    # 已被本进程认领，租约未到期前不会再被认领
+    assert outbox.claim(10) == []
+
+
+def test_ack_retry_fail(outbox):
+    outbox.add([message("a"), message("b"), message("c")])
+    outbox.ack("a")
+    outbox.retry("b", delay=0, error="系统繁忙")
+    outbox.fail("c", error="无效用户")
+    assert outbox.counts() == {DELIVERED: 1, PENDING: 1, FAILED: 1}
+    
+    rows = outbox.claim(10)
+    assert [(row["job_id"], row["attempts"], row["user_ids"]) for row in rows] == [("b", 2, ["user1"])]
+
+
+def test_retry_waits_for_backoff(outbox):
+    outbox.add([message("a")])
+    outbox.retry("a", delay=0.2)
+    assert outbox.claim(10) == []
+    time.sleep(0.25)
+    assert [row["job_id"] for row in outbox.claim(10)] == ["a"]
+
+
+def test_release_does_not_count_as_attempt(outbox):
+    outbox.add([message("a")])
+    outbox.release("a")
+    assert outbox.counts() == {PENDING: 1}
+    assert outbox.claim(10)[0]["attempts"] == 1
+
+
+def test_duplicate_job_id_is_ignored(outbox):
+    outbox.add([message("a")])
+    outbox.ack("a")
+    outbox.add([message("a")])
+    assert outbox.counts() == {DELIVERED: 1}
+
+
+def test_expired_lease_is_claimed_by_another_process(tmp_path):
+    path = str(tmp_path / "outbox.db")
+    first, second = Outbox(path, lease=0.1), Outbox(path, lease=60)
+    first.start()
+    second.start()
+    try:
+        first.add([message("a")])
+        assert second.claim(10) == []
+        time.sleep(0.15)
+        rows = second.claim(10)
+        assert [(row["job_id"], row["attempts"]) for row in rows] == [("a", 2)]
+    finally:
+        first.stop()
+        second.stop()
+
+
+def test_restart_keeps_pending_messages(tmp_path):
+    path = str(tmp_path / "outbox.db")
+    box = Outbox(path)
+    box.start()
+    box.add([message("a")])
+    box.retry("a", delay=0)
+    box.stop()
+    
+    box = Outbox(path)
+    box.start()
+    try:
+        assert [row["content"] for row in box.claim(10)] == ["内容 a"]
+    finally:
+        box.stop()
+
+
+def test_purge_removes_old_finished_messages(tmp_path):
+    box = Outbox(str(tmp_path / "outbox.db"), retain=0, purge_interval=0)
+    box.start()
+    try:
+        box.add([message("a"), message("b")])
+        box.ack("a")
+        # 统计在清理之前执行，清理结果在下一个事务中可见
+        box.counts()
+        time.sleep(0.01)
+        box.counts()
+        assert box.counts() == {CLAIMED: 1}
+        assert box.stats["purged"] == 1
+    finally:
+        box.stop()
+
+
+def fail_transactions(box: Outbox, count: int):
+    """让接下来count个事务失败（模拟共享文件上的SQLITE_BUSY）"""
+    execute = box._execute
+    remaining = [count]
+    
+    def flaky(conn, ops, now):
+        if remaining[0] > 0:
+            remaining[0] -= 1
+            raise sqlite3.OperationalError("database is locked")
+        return execute(conn, ops, now)
+    
+    box._execute = flaky
+
+
+def test_failed_transaction_requeues_acks(tmp_path):
+    box = Outbox(str(tmp_path / "outbox.db"), flush_interval=0, retry_delay=0.01)
+    box.start()
+    try:
+        box.add([message("a"), message("b")])
+        fail_transactions(box, 2)
+        box.ack("a")
+        box.retry("b", delay=0)
+        deadline = time.monotonic() + 5
+        while box.stats["delivered"] < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert box.counts() == {DELIVERED: 1, PENDING: 1}
+        assert box.stats["requeued_ops"] >= 2
+        assert box.stats["dropped_ops"] == 0
+    finally:
+        box.stop()
+
+
+def test_waiting_caller_gets_error_after_repeated_failures(tmp_path):
+    box = Outbox(str(tmp_path / "outbox.db"), flush_interval=0, retry_delay=0.01)
+    box.start()
+    try:
+        fail_transactions(box, MAX_OP_ATTEMPTS)
+        with pytest.raises(sqlite3.OperationalError):
+            box.add([message("a")])
+        assert box.stats["dropped_ops"] == 1
+        # 恢复后正常提交
+        box.add([message("b")])
+        assert box.counts() == {CLAIMED: 1}
+    finally:
+        box.stop()
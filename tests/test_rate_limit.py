@@ -0,0 +1,66 @@
+"""
+接口限速：共享文件只保存按接口的桶，按成员的桶留在进程内；多个限速器实例共享接口配额
+"""
+
+import json
+import threading
+
+import pytest
+
+from src.wx_stockbot.rate_limit import BucketSpec, FileRateLimiter, RateLimiter, RateLimitExceeded
+
+
+def make_limiter(path: str, **kwargs) -> FileRateLimiter:
+    return FileRateLimiter(path, endpoint=BucketSpec(1.0, 3), recipient=BucketSpec(1.0, 1), max_wait=0, **kwargs)
+
+
+def test_file_holds_only_endpoint_buckets(tmp_path):
+    path = str(tmp_path / "ratelimit.json")
+    limiter = make_limiter(path)
+    users = [f"user{i}" for i in range(1000)]
+    limiter.acquire("message/send", users)
+    with open(path) as f:
+        assert list(json.load(f)) == ["message/send"]
+    # 成员配额在进程内生效
+    with pytest.raises(RateLimitExceeded):
+        limiter.acquire("message/send", users[:1])
+    assert limiter.get_status()["limited_recipients"] == 1000
+
+
+def test_endpoint_quota_is_shared_between_workers(tmp_path):
+    path = str(tmp_path / "ratelimit.json")
+    first, second = make_limiter(path), make_limiter(path)
+    first.acquire("message/send")
+    first.acquire("message/send")
+    second.acquire("message/send")
+    with pytest.raises(RateLimitExceeded):
+        second.acquire("message/send")
+    assert second.get_status()["endpoints"]["message/send"]["tokens"] < 1
+    assert (first.stats["acquired"], second.stats["acquired"], second.stats["rejected"]) == (2, 1, 1)
+
+
+def test_recipient_only_limiter_skips_shared_file(tmp_path):
+    path = tmp_path / "ratelimit.json"
+    limiter = FileRateLimiter(str(path), recipient=BucketSpec(1.0, 1), max_wait=0)
+    limiter.acquire("message/send", ["user1"])
+    assert not path.exists()
+
+
+def test_stats_are_consistent_under_concurrency():
+    limiter = RateLimiter(endpoint=BucketSpec(1.0, 400), max_wait=0)
+    
+    def run():
+        for _ in range(100):
+            try:
+                limiter.acquire("message/send")
+            except RateLimitExceeded:
+                pass
+    
+    threads = [threading.Thread(target=run) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = limiter.get_status()
+    assert stats["acquired"] + stats["rejected"] == 800
+    assert stats["acquired"] >= 400
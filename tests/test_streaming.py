@@ -0,0 +1,110 @@
+"""
+增量指标：逐根K线更新、盘中peek和快照恢复的结果与整段重算（compute_indicators）一致
+"""
+
+import json
+
+import numpy as np
+import pytest
+
+from src.wx_stockbot.indicators import compute_indicators
+from src.wx_stockbot.market_data import Bars
+from src.wx_stockbot.streaming import IndicatorState, IndicatorStreams
+
+
+def random_walk(days: int, seed: int):
+    rng = np.random.default_rng(seed)
+    close = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, days)))
+    high = close * (1 + rng.uniform(0, 0.02, days))
+    low = close * (1 - rng.uniform(0, 0.02, days))
+    # 价格持平的区间，覆盖最高价等于最低价的分支
+    high[100:120] = low[100:120] = close[100:120] = close[100]
+    return high, low, close
+
+
+def make_bars(symbol: str, high, low, close) -> Bars:
+    dates = np.datetime64("2015-01-01") + np.arange(len(close))
+    return Bars(symbol, dates, close.copy(), high, low, close, np.ones(len(close)))
+
+
+def assert_matches(values: dict, expected: dict, t: int):
+    for name, value in values.items():
+        # SAR第一根K线要等第二根到达才能确定
+        if t == 0 and name.startswith("sar"):
+            continue
+        np.testing.assert_allclose(value, expected[name][t], rtol=1e-9, atol=1e-9, err_msg=f"{name} t={t}")
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_update_matches_full_recompute(seed):
+    high, low, close = random_walk(400, seed)
+    expected = compute_indicators(high, low, close)
+    state = IndicatorState("S")
+    for t in range(len(close)):
+        assert_matches(state.update(high[t], low[t], close[t]), expected, t)
+
+
+def test_peek_matches_update_and_keeps_state():
+    high, low, close = random_walk(300, 4)
+    state = IndicatorState("S")
+    for t in range(len(close)):
+        # 盘中报价不影响状态：先用另一个价格peek，再peek真实价格
+        state.peek(high[t] * 1.05, low[t] * 0.95, close[t] * 1.01)
+        peeked = state.peek(high[t], low[t], close[t])
+        values = state.update(high[t], low[t], close[t])
+        np.testing.assert_allclose([peeked[k] for k in values], list(values.values()), rtol=1e-12)
+    assert state.bars == len(close)
+
+
+def test_every_prefix_matches_batch_from_first_bar():
+    high, low, close = random_walk(130, 8)
+    state = IndicatorState("S")
+    for t in range(len(close)):
+        if t == 1:
+            state = IndicatorState.restore(json.loads(json.dumps(state.snapshot())))
+        state.update(high[t], low[t], close[t])
+        expected = compute_indicators(high[:t + 1], low[:t + 1], close[:t + 1])
+        arrays = state.as_arrays()
+        assert arrays.keys() == expected.keys()
+        for name, values in arrays.items():
+            np.testing.assert_allclose(values, expected[name][-2:], rtol=1e-9, atol=1e-9, err_msg=f"{name} t={t}")
+
+
+def test_streams_sync_from_first_bar_matches_batch():
+    high, low, close = random_walk(130, 9)
+    streams = IndicatorStreams()
+    for t in range(len(close)):
+        _, arrays = streams.sync_arrays(make_bars("S", high[:t + 1], low[:t + 1], close[:t + 1]))
+        expected = compute_indicators(high[:t + 1], low[:t + 1], close[:t + 1])
+        for name, values in arrays.items():
+            np.testing.assert_allclose(values, expected[name][-2:], rtol=1e-9, atol=1e-9, err_msg=f"{name} t={t}")
+    assert streams.stats["full_builds"] == 1
+
+
+def test_snapshot_restore_through_json():
+    high, low, close = random_walk(300, 5)
+    expected = compute_indicators(high, low, close)
+    state = IndicatorState("S")
+    for t in range(len(close)):
+        if t in (30, 150):
+            state = IndicatorState.restore(json.loads(json.dumps(state.snapshot())))
+        assert_matches(state.update(high[t], low[t], close[t]), expected, t)
+
+
+def test_as_arrays_holds_last_two_bars():
+    high, low, close = random_walk(200, 6)
+    expected = compute_indicators(high, low, close)
+    arrays = IndicatorState.from_bars(make_bars("S", high, low, close)).as_arrays()
+    for name, values in arrays.items():
+        np.testing.assert_allclose(values, expected[name][-2:], rtol=1e-9, atol=1e-9)
+
+
+def test_streams_sync_only_adds_new_bars():
+    high, low, close = random_walk(300, 7)
+    expected = compute_indicators(high, low, close)
+    streams = IndicatorStreams()
+    streams.sync(make_bars("S", high[:-5], low[:-5], close[:-5]))
+    state = streams.sync(make_bars("S", high, low, close))
+    assert streams.stats["full_builds"] == 1
+    assert streams.stats["incremental"] == 1
+    assert_matches(state.current, expected, len(close) - 1)